@@ -1,3 +1,4 @@
+import io
 import json
 import os
 import logging
@@ -18,6 +19,13 @@ except ImportError as e:
     logging.error(f"Failed to import pandas/numpy from CoreDataScienceLayer: {e}")
     raise
 
+# Optional columnar input support
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
@@ -25,6 +33,16 @@ logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 s3_client = boto3.client('s3')
 processed_bucket = os.environ.get('PROCESSED_BUCKET')
 
+# Compressed CSVs are decompressed by read_csv as the object body streams in
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+
+# Only data artifacts are validated; run manifests and reports in processed/ are skipped
+DATA_ARTIFACT_SUFFIXES = ('.csv', '.parquet')
+
+# Repeated ID and name columns are read as categoricals to keep memory low
+CATEGORY_COLUMNS = ['CustomerID', 'FacilityID', 'ProductID', 'VendorID', 'ProductName', 'CategoryName',
+                    'VendorName', 'vendorName', 'ProductDescription', 'ProductCategory', 'CreateDate']
+
 def generate_data_distribution_analysis(df):
     """Generate comprehensive data distribution analysis matching notebook patterns"""
     distribution_analysis = {}
@@ -71,7 +89,7 @@ def analyze_categorical_distributions(df):
     """Analyze categorical column distributions matching notebook's approach"""
     categorical_analysis = {}
     
-    categorical_columns = df.select_dtypes(include=['object']).columns
+    categorical_columns = df.select_dtypes(include=['object', 'category']).columns
     for col in categorical_columns:
         if col in df.columns:
             try:
@@ -256,11 +274,11 @@ def validate_data_quality(df):
     
     # Data type validation
     expected_dtypes = {
-        'CustomerID': ['int64', 'int32', 'object'],
-        'FacilityID': ['int64', 'int32', 'object'], 
+        'CustomerID': ['int64', 'int32', 'object', 'category'],
+        'FacilityID': ['int64', 'int32', 'object', 'category'], 
         'OrderID': ['int64', 'int32', 'object'],
-        'ProductID': ['int64', 'int32', 'object'],
-        'VendorID': ['int64', 'int32', 'object'],
+        'ProductID': ['int64', 'int32', 'object', 'category'],
+        'VendorID': ['int64', 'int32', 'object', 'category'],
         'OrderUnits': ['float64', 'int64', 'int32'],
         'Price': ['float64', 'int64', 'int32']
     }
@@ -366,7 +384,7 @@ def validate_data_quality(df):
         'columns_info': {
             'total_columns': len(df.columns),
             'numeric_columns': len(df.select_dtypes(include=['number']).columns),
-            'text_columns': len(df.select_dtypes(include=['object']).columns),
+            'text_columns': len(df.select_dtypes(include=['object', 'category']).columns),
             'datetime_columns': len(df.select_dtypes(include=['datetime']).columns)
         }
     }
@@ -396,21 +414,50 @@ def validate_data_quality(df):
     
     return validation_results
 
+def artifact_compression(key):
+    """'gzip' or 'zstd' for a compressed artifact key, None otherwise"""
+    return COMPRESSION_SUFFIXES.get(os.path.splitext(key)[1].lower())
+
+def artifact_base_key(key):
+    """Key without its compression and format suffixes"""
+    if artifact_compression(key):
+        key = os.path.splitext(key)[0]
+    return os.path.splitext(key)[0]
+
+def is_data_artifact(key):
+    """True for CSV (plain or compressed) and Parquet artifact keys"""
+    if artifact_compression(key):
+        key = os.path.splitext(key)[0]
+    return key.lower().endswith(DATA_ARTIFACT_SUFFIXES)
+
+def read_artifact(body, key):
+    """Read a CSV (plain, gzip or zstd) or Parquet artifact from an S3 object body"""
+    if key.endswith('.parquet'):
+        if pyarrow is None:
+            raise ValueError(f"Cannot read {key}: pyarrow is not installed")
+        return pd.read_parquet(io.BytesIO(body.read()))
+    # Columns not present in the file are ignored by read_csv
+    return pd.read_csv(body, dtype={col: 'category' for col in CATEGORY_COLUMNS}, compression=artifact_compression(key))
+
 def lambda_handler(event, context):
     """Lambda handler for data validation"""
     try:
         logger.info("Starting data validation process")
         
         # Parse S3 event
+        validation_results = None
         for record in event['Records']:
             bucket = record['s3']['bucket']['name']
             key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+            if not is_data_artifact(key):
+                logger.info(f"Skipping s3://{bucket}/{key}, not a data artifact")
+                continue
             
             logger.info(f"Processing file: s3://{bucket}/{key}")
             
             # Read the processed data
             response = s3_client.get_object(Bucket=bucket, Key=key)
-            df = pd.read_csv(response['Body'])
+            df = read_artifact(response['Body'], key)
             
             # Validate data quality
             validation_results = validate_data_quality(df)
@@ -431,7 +478,8 @@ def lambda_handler(event, context):
             validation_results['comprehensive_report'] = generate_comprehensive_report(df)
             
             # Save validation results
-            validation_key = key.replace('processed/', 'validation/').replace('.csv', '_validation.json')
+            artifact_base = artifact_base_key(key.replace('processed/', 'validation/'))
+            validation_key = f"{artifact_base}_validation.json"
             
             s3_client.put_object(
                 Bucket=processed_bucket,
@@ -443,7 +491,7 @@ def lambda_handler(event, context):
             logger.info(f"Validation results saved to: s3://{processed_bucket}/{validation_key}")
             
             # Save summary report separately for easy access
-            summary_key = key.replace('processed/', 'validation/').replace('.csv', '_summary.json')
+            summary_key = f"{artifact_base}_summary.json"
             summary_report = {
                 'validation_summary': validation_results.get('validation_summary', 'UNKNOWN'),
                 'data_quality_score': validation_results['comprehensive_report'].get('data_quality_score', 0),
@@ -5,26 +5,151 @@ import logging
 import urllib.parse
 import gc
 import time
+import traceback
+import multiprocessing
+import io
+import gzip
+import hashlib
+import random
+import shutil
+import pickle
+import tempfile
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, date
 
 # Import dependencies with error handling
 try:
     import boto3
+    from boto3.dynamodb.types import TypeSerializer
     import pandas as pd
     import numpy as np
 except ImportError as e:
     logging.error(f"Failed to import required dependencies: {e}")
     raise
 
+# Optional columnar output and CSV parsing support
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Optional zstd support for compressed uploads (gzip is in the standard library)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
 s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb')
+lambda_client = boto3.client('lambda')
+# Low-level clients are thread-safe (resources are not), so the bulk writer's workers share this one
+dynamodb_client = boto3.client('dynamodb')
 processed_bucket = os.environ.get('PROCESSED_BUCKET')
 product_lookup_table = os.environ.get('PRODUCT_LOOKUP_TABLE', 'product-lookup')
 
+# Output artifact format: 'csv' (default) or 'parquet'
+output_format = os.environ.get('OUTPUT_FORMAT', 'csv').lower()
+parquet_compression = os.environ.get('PARQUET_COMPRESSION', 'zstd')
+OUTPUT_DATE_COLUMNS = ['FirstOrderDate', 'LastOrderDate', 'CreateDate', 'timestamp']
+
+# Artifacts stream to S3 from memory: parts of UPLOAD_PART_MB (S3 minimum 5 MB)
+# upload on a pool of UPLOAD_WORKERS threads shared by all artifacts
+UPLOAD_PART_BYTES = max(5, int(os.environ.get('UPLOAD_PART_MB', '8'))) * 1024 * 1024
+upload_workers = int(os.environ.get('UPLOAD_WORKERS', '8'))
+_upload_pool = None
+
+# Lookup tables are written by DYNAMODB_WRITERS parallel workers, each owning a
+# hash segment of the keys; unprocessed items are retried with backoff
+DYNAMODB_BATCH_SIZE = 25
+DYNAMODB_BASE_BACKOFF = 0.05
+DYNAMODB_MAX_BACKOFF = 5.0
+dynamodb_writers = int(os.environ.get('DYNAMODB_WRITERS', '8'))
+dynamodb_max_retries = int(os.environ.get('DYNAMODB_MAX_RETRIES', '8'))
+
+# Incremental mode folds each upload into a persisted state snapshot, split
+# into STATE_PARTITIONS customer-hash partitions (fixed by the first snapshot).
+# Manifest swaps that lose a race are re-merged up to STATE_COMMIT_ATTEMPTS
+# times, and replaced tables are kept STATE_RETAIN_SECONDS for readers of the
+# previous manifest.
+incremental_mode = os.environ.get('INCREMENTAL_MODE', 'false').lower() == 'true'
+state_prefix = os.environ.get('STATE_PREFIX', 'state')
+state_partitions = int(os.environ.get('STATE_PARTITIONS', '32'))
+STATE_COMMIT_ATTEMPTS = int(os.environ.get('STATE_COMMIT_ATTEMPTS', '5'))
+STATE_RETAIN_SECONDS = int(os.environ.get('STATE_RETAIN_SECONDS', '1800'))
+
+# Duplicate uploads: 'etag' fingerprints by ETag and size, 'content' by a
+# SHA-256 of the bytes, 'off' processes every upload
+idempotency_mode = os.environ.get('IDEMPOTENCY_MODE', 'etag').lower()
+registry_prefix = os.environ.get('REGISTRY_PREFIX', 'registry')
+
+# CSV parsing: 'pandas' uses pandas' C parser, 'arrow' pyarrow's multi-threaded
+# columnar reader (pandas when pyarrow is missing). Arrow parses blocks of
+# CSV_BLOCK_MB and its streaming reader queues up to 32 of them ahead.
+csv_engine = os.environ.get('CSV_ENGINE', 'pandas').lower()
+CSV_ARROW_BLOCK_BYTES = int(float(os.environ.get('CSV_BLOCK_MB', '1')) * 1024 * 1024)
+
+# Worker processes for chunked files: 'auto' sizes to cores and memory
+chunk_workers_setting = os.environ.get('CHUNK_WORKERS', 'auto')
+
+# Input: 'download' stages the upload in /tmp, 'stream' parses the S3 object
+# as it arrives, 'auto' streams uploads above the threshold or too big for /tmp
+input_mode = os.environ.get('INPUT_MODE', 'auto').lower()
+stream_threshold_mb = float(os.environ.get('STREAM_THRESHOLD_MB', '50'))
+STREAM_PART_BYTES = int(os.environ.get('STREAM_PART_MB', '8')) * 1024 * 1024
+STREAM_PREFETCH_PARTS = int(os.environ.get('STREAM_PREFETCH_PARTS', '4'))
+
+# Compressed uploads (.gz, .zst or their magic bytes) are decompressed as a
+# stream into the readers; their size is extrapolated from the ratio of the
+# first DECOMPRESS_SAMPLE_MB of compressed bytes
+UPLOAD_COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+UPLOAD_COMPRESSION_MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+DECOMPRESS_SAMPLE_BYTES = int(float(os.environ.get('DECOMPRESS_SAMPLE_MB', '2')) * 1024 * 1024)
+
+# Trend slope: 'ols' fits quantity against order day by least squares,
+# 'theil_sen' takes the median pairwise slope over a per-series point sample
+trend_method = os.environ.get('TREND_METHOD', 'ols').lower()
+
+# Fan-out: 'lambda' splits uploads of at least FANOUT_MIN_MB into byte ranges
+# summarised by asynchronous invocations of this function and merged by a
+# final reduce invocation; 'off' processes every upload in one invocation
+fanout_mode = os.environ.get('FANOUT_MODE', 'off').lower()
+fanout_min_mb = float(os.environ.get('FANOUT_MIN_MB', '1024'))
+fanout_prefix = os.environ.get('FANOUT_PREFIX', 'fanout')
+FANOUT_PART_BYTES = int(os.environ.get('FANOUT_PART_MB', '512')) * 1024 * 1024
+FANOUT_MAX_PARTS = int(os.environ.get('FANOUT_MAX_PARTS', '200'))
+
+# DeepAR train/test channels are written next to the forecast data
+deepar_output = os.environ.get('DEEPAR_OUTPUT', 'true').lower() == 'true'
+deepar_prefix = os.environ.get('DEEPAR_PREFIX', 'deepar')
+DEEPAR_PREDICTION_LENGTH = int(os.environ.get('PREDICTION_LENGTH', '14'))
+DEEPAR_CONTEXT_LENGTH = int(os.environ.get('CONTEXT_LENGTH', '28'))
+
+# Deadline: stages are planned against the invocation's remaining time, keeping
+# DEADLINE_SAVE_RESERVE_S (plus time per series) for the saves. Scans that
+# would not finish read the upload in DEADLINE_SEGMENT_MB segments across
+# invocations, checkpointing their state under RESUME_PREFIX in between
+DEADLINE_SAVE_RESERVE_S = float(os.environ.get('DEADLINE_SAVE_RESERVE_S', '30'))
+DEADLINE_SAVE_SERIES_PER_S = 5000  # Series written to S3 and DynamoDB per second
+DEADLINE_SCAN_MB_PER_S = float(os.environ.get('DEADLINE_SCAN_MB_PER_S', '20'))
+DEADLINE_SEGMENT_BYTES = int(os.environ.get('DEADLINE_SEGMENT_MB', '256')) * 1024 * 1024
+resume_prefix = os.environ.get('RESUME_PREFIX', 'resume')
+
+# Run manifest: invocations that write outputs record the wall and CPU time,
+# rows in and out and peak memory of every stage in
+# processed/<timestamp>/run_manifest.json. RUN_MANIFEST_TRACEMALLOC also traces
+# Python allocations per stage, which slows allocation-heavy stages down.
+run_manifest_enabled = os.environ.get('RUN_MANIFEST', 'true').lower() == 'true'
+run_manifest_tracemalloc = os.environ.get('RUN_MANIFEST_TRACEMALLOC', 'false').lower() == 'true'
+RUN_MANIFEST_NAME = 'run_manifest.json'
+
 def get_us_holidays(year):
     """Get US federal holidays for a given year with proper date calculations"""
     holidays = {}
@@ -83,305 +208,767 @@ def get_us_holidays(year):
     
     return holidays
 
-def extract_temporal_features(df):
-    """Extract time-based features from the CreateDate"""
-    logger.info("Extracting temporal features...")
-    
-    # Convert date strings to datetime objects with flexible parsing
-    if df['CreateDate'].dtype == 'object':
-        # Try multiple date formats
-        try:
-            df['CreateDate'] = pd.to_datetime(df['CreateDate'], infer_datetime_format=True)
-        except:
-            # Fallback to common formats
-            for fmt in ['%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y']:
-                try:
-                    df['CreateDate'] = pd.to_datetime(df['CreateDate'], format=fmt)
-                    logger.info(f"Successfully parsed dates using format: {fmt}")
-                    break
-                except:
-                    continue
-            else:
-                # If all formats fail, use pandas' flexible parser
-                df['CreateDate'] = pd.to_datetime(df['CreateDate'], errors='coerce')
-    
-    # Basic date components
-    df['OrderYear'] = df['CreateDate'].dt.year
-    df['OrderMonth'] = df['CreateDate'].dt.month
-    df['OrderDay'] = df['CreateDate'].dt.day
-    df['OrderDayOfWeek'] = df['CreateDate'].dt.dayofweek  # Monday=0, Sunday=6
-    df['OrderHour'] = df['CreateDate'].dt.hour
+# Calendar dimension: one row per day with every calendar, cyclical and
+# holiday attribute, covering whole years around the data. Order rows pick up
+# their attributes with a vectorised take on the integer day number, and the
+# table is cached at module level so warm invocations reuse it.
+HOLIDAY_WINDOW_DAYS = int(os.environ.get('HOLIDAY_WINDOW_DAYS', '3'))
+CALENDAR_COLUMNS = ['OrderYear', 'OrderMonth', 'OrderDay', 'OrderDayOfWeek',
+                    'DayOfWeek_sin', 'DayOfWeek_cos', 'DayOfMonth_sin', 'DayOfMonth_cos',
+                    'MonthOfYear_sin', 'MonthOfYear_cos', 'OrderQuarter', 'IsWeekend', 'Date',
+                    'IsHoliday', 'HolidayName', 'IsPreHoliday', 'IsPostHoliday',
+                    'DaysToHoliday', 'DaysSinceHoliday']
+# Values for rows whose CreateDate could not be parsed
+CALENDAR_MISSING_VALUES = {'IsWeekend': 0, 'IsHoliday': 0, 'HolidayName': '', 'IsPreHoliday': 0, 'IsPostHoliday': 0}
+_calendar_cache = {'first_day': None, 'last_day': None, 'table': None}
+
+def build_calendar_dimension(first_year, last_year):
+    """Build the calendar table for whole years, indexed from day number of 1 January first_year"""
+    days = pd.date_range(f'{first_year}-01-01', f'{last_year}-12-31', freq='D')
+    calendar = pd.DataFrame({
+        'OrderYear': days.year.to_numpy(np.int64),
+        'OrderMonth': days.month.to_numpy(np.int64),
+        'OrderDay': days.day.to_numpy(np.int64),
+        'OrderDayOfWeek': days.dayofweek.to_numpy(np.int64)  # Monday=0, Sunday=6
+    })
     
     # Cyclical encoding of time features - matching notebook implementation exactly
-    df['DayOfWeek_sin'] = np.sin(df['OrderDayOfWeek'] * (2 * np.pi / 7))
-    df['DayOfWeek_cos'] = np.cos(df['OrderDayOfWeek'] * (2 * np.pi / 7))
+    calendar['DayOfWeek_sin'] = np.sin(calendar['OrderDayOfWeek'] * (2 * np.pi / 7))
+    calendar['DayOfWeek_cos'] = np.cos(calendar['OrderDayOfWeek'] * (2 * np.pi / 7))
+    calendar['DayOfMonth_sin'] = np.sin((calendar['OrderDay'] - 1) * (2 * np.pi / 31))
+    calendar['DayOfMonth_cos'] = np.cos((calendar['OrderDay'] - 1) * (2 * np.pi / 31))
+    calendar['MonthOfYear_sin'] = np.sin((calendar['OrderMonth'] - 1) * (2 * np.pi / 12))
+    calendar['MonthOfYear_cos'] = np.cos((calendar['OrderMonth'] - 1) * (2 * np.pi / 12))
+    calendar['OrderQuarter'] = (calendar['OrderMonth'] - 1) // 3 + 1
+    calendar['IsWeekend'] = (calendar['OrderDayOfWeek'] >= 5).astype(np.int64)
+    calendar['Date'] = days.strftime('%Y-%m-%d')
+    
+    # Holidays from the neighbouring years too, so windows work across New Year
+    holidays = {}
+    for year in range(first_year - 1, last_year + 2):
+        holidays.update(get_us_holidays(year))
+    calendar['HolidayName'] = calendar['Date'].map(holidays).fillna('')
+    calendar['IsHoliday'] = (calendar['HolidayName'] != '').astype(np.int64)
+    
+    day_numbers = days.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    holiday_days = np.sort(pd.to_datetime(list(holidays)).to_numpy(dtype='datetime64[D]').astype(np.int64))
+    next_holiday = holiday_days[np.searchsorted(holiday_days, day_numbers, side='left')]
+    previous_holiday = holiday_days[np.searchsorted(holiday_days, day_numbers, side='right') - 1]
+    calendar['DaysToHoliday'] = next_holiday - day_numbers
+    calendar['DaysSinceHoliday'] = day_numbers - previous_holiday
+    calendar['IsPreHoliday'] = calendar['DaysToHoliday'].between(1, HOLIDAY_WINDOW_DAYS).astype(np.int64)
+    calendar['IsPostHoliday'] = calendar['DaysSinceHoliday'].between(1, HOLIDAY_WINDOW_DAYS).astype(np.int64)
+    return calendar[CALENDAR_COLUMNS]
+
+def get_calendar_dimension(first_day, last_day):
+    """Return (first day number, calendar table) covering the given day numbers, reusing the cache"""
+    cache = _calendar_cache
+    if cache['table'] is None or first_day < cache['first_day'] or last_day > cache['last_day']:
+        first_year = int(np.datetime64(int(first_day), 'D').astype('datetime64[Y]').astype(np.int64)) + 1970
+        last_year = int(np.datetime64(int(last_day), 'D').astype('datetime64[Y]').astype(np.int64)) + 1970
+        if cache['table'] is not None:
+            first_year = min(first_year, int(cache['table']['OrderYear'].iloc[0]))
+            last_year = max(last_year, int(cache['table']['OrderYear'].iloc[-1]))
+        logger.info(f"Building calendar dimension for {first_year}-{last_year}")
+        cache['table'] = build_calendar_dimension(first_year, last_year)
+        cache['first_day'] = int(np.datetime64(f'{first_year}-01-01', 'D').astype(np.int64))
+        cache['last_day'] = int(np.datetime64(f'{last_year}-12-31', 'D').astype(np.int64))
+    return cache['first_day'], cache['table']
+
+def calendar_features(dates, columns=None):
+    """Look up calendar attributes for a datetime Series by integer day number"""
+    columns = columns or CALENDAR_COLUMNS
+    day_numbers = pd.Series(dates).to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+    valid = ~np.isnat(day_numbers)
+    day_numbers = day_numbers.astype(np.int64)
+    
+    features = pd.DataFrame(index=pd.Series(dates).index)
+    if not valid.any():
+        for col in columns:
+            features[col] = CALENDAR_MISSING_VALUES.get(col, np.nan)
+        return features
+    
+    first_day, calendar = get_calendar_dimension(day_numbers[valid].min(), day_numbers[valid].max())
+    positions = np.where(valid, day_numbers - first_day, 0)
+    for col in columns:
+        values = calendar[col].to_numpy()[positions]
+        if not valid.all():
+            values = np.where(valid, values, CALENDAR_MISSING_VALUES.get(col, np.nan))
+        features[col] = values
+    return features
+
+# CreateDate parsing. Order files repeat a few thousand distinct date strings
+# across millions of rows, so only the unique strings are parsed and the
+# result is mapped back through their codes. The format is detected once
+# from a sample and cached in the parse state, which is shared by all the
+# chunks of a file.
+DATE_FORMATS = ['%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y', '%Y/%m/%d',
+                '%Y-%m-%d %H:%M:%S', '%m/%d/%Y %H:%M', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M:%S']
+DATE_SAMPLE_SIZE = 1000
+
+def new_date_parse_state():
+    """Per-file date parsing state: detected format and unparseable row counts"""
+    return {'format': None, 'detected': False, 'rows': 0, 'unparseable_rows': 0, 'unparseable_examples': []}
+
+def detect_date_format(values):
+    """Pick the first known format that parses every sampled string (None if none does)"""
+    sample = pd.Series(values).dropna().astype(str).str.strip()
+    sample = pd.Series(sample.unique()[:DATE_SAMPLE_SIZE])
+    if sample.empty:
+        return None
+    
+    best_format, best_parsed = None, 0
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if parsed == len(sample):
+            return fmt
+        if parsed > best_parsed:
+            best_format, best_parsed = fmt, parsed
+    # A format that handles most of the sample still beats the flexible parser
+    return best_format if best_parsed >= len(sample) / 2 else None
+
+def _parse_unique_dates(strings, fmt):
+    """Parse distinct date strings with the cached format, retrying misses with the other formats"""
+    if fmt is not None:
+        parsed = pd.to_datetime(strings, format=fmt, errors='coerce')
+    else:
+        parsed = pd.to_datetime(strings, errors='coerce')
+    parsed = pd.Series(parsed)
+    
+    missing = parsed.isna().to_numpy()
+    for retry_fmt in [None] + DATE_FORMATS:
+        if not missing.any():
+            break
+        if retry_fmt == fmt:
+            continue
+        if retry_fmt is None:
+            retried = pd.Series(strings[missing]).map(lambda value: pd.to_datetime(value, errors='coerce'))
+        else:
+            retried = pd.to_datetime(pd.Series(strings[missing]), format=retry_fmt, errors='coerce')
+        parsed.iloc[np.flatnonzero(missing)] = pd.to_datetime(retried).to_numpy()
+        missing = parsed.isna().to_numpy()
+    return pd.to_datetime(parsed).to_numpy(dtype='datetime64[ns]')
+
+def parse_create_dates(values, parse_state=None):
+    """Parse a CreateDate column, touching each distinct string only once
     
-    df['DayOfMonth_sin'] = np.sin((df['OrderDay'] - 1) * (2 * np.pi / 31))
-    df['DayOfMonth_cos'] = np.cos((df['OrderDay'] - 1) * (2 * np.pi / 31))
+    Rows that cannot be parsed become NaT and are counted in parse_state.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    if parse_state is None:
+        parse_state = new_date_parse_state()
+    
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        uniques = values.cat.categories.astype(str).str.strip()
+    else:
+        codes, uniques = pd.factorize(values)
+        uniques = pd.Index(uniques).astype(str).str.strip()
     
-    df['MonthOfYear_sin'] = np.sin((df['OrderMonth'] - 1) * (2 * np.pi / 12))
-    df['MonthOfYear_cos'] = np.cos((df['OrderMonth'] - 1) * (2 * np.pi / 12))
+    if not parse_state['detected']:
+        parse_state['format'] = detect_date_format(uniques)
+        parse_state['detected'] = True
+        logger.info(f"Detected CreateDate format: {parse_state['format'] or 'flexible parser'}")
     
-    # Quarter - matching notebook implementation exactly
-    df['OrderQuarter'] = df['OrderMonth'].apply(lambda x: (x-1)//3 + 1)
+    # Code -1 (missing) picks the trailing NaT
+    parsed_uniques = np.append(_parse_unique_dates(uniques.to_numpy(dtype=object), parse_state['format']),
+                               np.datetime64('NaT', 'ns'))
+    result = pd.Series(parsed_uniques[codes], index=values.index, name=values.name)
     
-    # Is weekend - matching notebook implementation exactly
-    df['IsWeekend'] = df['OrderDayOfWeek'].apply(lambda x: 1 if x >= 5 else 0)
+    unparseable = result.isna() & values.notna()
+    parse_state['rows'] += len(values)
+    if unparseable.any():
+        parse_state['unparseable_rows'] += int(unparseable.sum())
+        examples = parse_state['unparseable_examples']
+        for value in values[unparseable].astype(str).unique():
+            if len(examples) < 5 and value not in examples:
+                examples.append(value)
+        logger.warning(f"{int(unparseable.sum())} rows with unparseable CreateDate values, e.g. {examples}")
+    return result
+
+def extract_temporal_features(df, date_parse_state=None):
+    """Extract time-based features from the CreateDate"""
+    logger.info("Extracting temporal features...")
     
-    # Get dynamic US holidays for the years present in the data
-    years_in_data = df['OrderYear'].unique()
-    all_holidays = {}
-    for year in years_in_data:
-        year_holidays = get_us_holidays(year)
-        all_holidays.update(year_holidays)
+    # Convert date strings to datetime objects, parsing each distinct string once
+    if not pd.api.types.is_datetime64_any_dtype(df['CreateDate']):
+        df['CreateDate'] = parse_create_dates(df['CreateDate'], date_parse_state)
     
-    df['Date'] = df['CreateDate'].dt.strftime('%Y-%m-%d')
-    df['IsHoliday'] = df['Date'].apply(lambda x: 1 if x in all_holidays else 0)
-    df['HolidayName'] = df['Date'].apply(lambda x: all_holidays.get(x, ''))
+    # Calendar, cyclical and holiday attributes come from the cached calendar table
+    calendar = calendar_features(df['CreateDate'])
+    for col in ['OrderYear', 'OrderMonth', 'OrderDay', 'OrderDayOfWeek']:
+        df[col] = calendar[col]
+    df['OrderHour'] = df['CreateDate'].dt.hour
+    for col in CALENDAR_COLUMNS[4:]:
+        df[col] = calendar[col]
     
     return df
 
-def calculate_product_demand_patterns(df, max_products=None, batch_size=1000, timeout_seconds=300):
-    """Calculate product-specific demand patterns for individual products with batching"""
+def _plain_columns(frame):
+    """Replace categorical columns with plain values so state tables merge and round-trip alike"""
+    for col in frame.columns:
+        if isinstance(frame[col].dtype, pd.CategoricalDtype):
+            frame[col] = np.asarray(frame[col])
+    return frame
+
+def _series_segments(frame, key_cols):
+    """Return start offsets and lengths of contiguous key runs in a key-sorted frame"""
+    if frame.empty:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    
+    group_ids = frame.groupby(key_cols, sort=False, observed=True).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, group_ids[1:] != group_ids[:-1]])
+    counts = np.diff(np.r_[starts, len(frame)])
+    return starts, counts
+
+def _segmented_median(values, starts, counts):
+    """Median of each contiguous segment of values (matches np.median per segment)"""
+    segment_ids = np.repeat(np.arange(len(starts)), counts)
+    ordered = values[np.lexsort((values, segment_ids))]
+    lower = ordered[starts + (counts - 1) // 2]
+    upper = ordered[starts + counts // 2]
+    return (lower + upper) / 2.0
+
+def _segmented_quantile(values, starts, counts, q):
+    """Linear-interpolated quantile of each segment (matches np.quantile per segment)"""
+    segment_ids = np.repeat(np.arange(len(starts)), counts)
+    ordered = values[np.lexsort((values, segment_ids))]
+    position = q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    lower_values = ordered[starts + lower]
+    return lower_values + (ordered[starts + upper] - lower_values) * (position - lower)
+
+def calculate_product_demand_patterns(df, max_products=None):
+    """Calculate product-specific demand patterns for individual products
+    
+    All (CustomerID, FacilityID, ProductID) series are summarised in a single
+    pass: the daily quantities are sorted once by series and date and every
+    statistic is computed with segmented numpy reductions over the sorted
+    arrays, so the cost is O(rows log rows) regardless of the series count.
+    """
     start_time = time.time()
     logger.info("Calculating product demand patterns...")
     
     # Group by customer, facility, product, and date to get daily quantities
     # Use OrderUnits if available, otherwise count occurrences
     if 'OrderUnits' in df.columns:
-        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'])['OrderUnits'].sum().reset_index(name='Quantity')
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'], observed=True)['OrderUnits'].sum().reset_index(name='Quantity')
     else:
-        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date']).size().reset_index(name='Quantity')
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'], observed=True).size().reset_index(name='Quantity')
     
     # Add product information back - handle different column names
     product_cols = ['ProductID']
+    product_name_col = None
+    category_name_col = None
+    vendor_name_col = None
     if 'ProductDescription' in df.columns:
-        product_cols.append('ProductDescription')
+        product_name_col = 'ProductDescription'
     elif 'ProductName' in df.columns:
-        product_cols.append('ProductName')
+        product_name_col = 'ProductName'
     
     if 'ProductCategory' in df.columns:
-        product_cols.append('ProductCategory')
+        category_name_col = 'ProductCategory'
     elif 'CategoryName' in df.columns:
-        product_cols.append('CategoryName')
+        category_name_col = 'CategoryName'
     
     if 'VendorName' in df.columns:
-        product_cols.append('VendorName')
+        vendor_name_col = 'VendorName'
+    
+    product_cols += [col for col in (product_name_col, category_name_col, vendor_name_col) if col]
     
     product_info = df[product_cols].drop_duplicates()
     product_daily = product_daily.merge(product_info, on='ProductID', how='left')
     
-    # Get unique product combinations
-    unique_combinations = product_daily[['CustomerID', 'FacilityID', 'ProductID']].drop_duplicates()
-    total_combinations = len(unique_combinations)
+    if product_daily.empty:
+        logger.info("Completed processing 0 product patterns")
+        return pd.DataFrame()
+    
+    # Sort once by series and date; every series becomes a contiguous segment
+    key_cols = ['CustomerID', 'FacilityID', 'ProductID']
+    product_daily = product_daily.sort_values(key_cols + ['Date'], kind='mergesort').reset_index(drop=True)
+    starts, counts = _series_segments(product_daily, key_cols)
     
     # Apply limits for large datasets
+    total_combinations = len(starts)
     if max_products and total_combinations > max_products:
         logger.warning(f"Dataset has {total_combinations} product combinations, limiting to {max_products}")
-        unique_combinations = unique_combinations.head(max_products)
+        starts, counts = starts[:max_products], counts[:max_products]
+        product_daily = product_daily.iloc[:starts[-1] + counts[-1]]
     
-    logger.info(f"Processing {len(unique_combinations)} product combinations in batches of {batch_size}")
+    logger.info(f"Processing {len(starts)} product combinations")
     
-    # Use vectorized operations where possible
-    product_features = []
+    quantities = product_daily['Quantity'].to_numpy()
+    values = quantities.astype(np.float64)
+    ends = starts + counts - 1
     
-    # Process in batches to avoid memory issues
-    for i in range(0, len(unique_combinations), batch_size):
-        batch_combinations = unique_combinations.iloc[i:i+batch_size]
-        batch_num = i//batch_size + 1
-        total_batches = (len(unique_combinations)-1)//batch_size + 1
-        logger.info(f"Processing batch {batch_num}/{total_batches} ({len(batch_combinations)} combinations)")
-        
-        for _, row in batch_combinations.iterrows():
-            # Check for timeout
-            if time.time() - start_time > timeout_seconds:
-                logger.warning(f"Timeout reached after {timeout_seconds} seconds, processed {len(product_features)} patterns")
-                break
-                
-            customer_id, facility_id, product_id = row['CustomerID'], row['FacilityID'], row['ProductID']
-            
-            # Filter data for this specific combination
-            group = product_daily[
-                (product_daily['CustomerID'] == customer_id) & 
-                (product_daily['FacilityID'] == facility_id) & 
-                (product_daily['ProductID'] == product_id)
-            ].copy()
-            
-            if group.empty:
-                continue
-                
-            # Sort by date once
-            group = group.sort_values('Date')
-            quantities = group['Quantity'].values
-            
-            # Safety check for quantities
-            if quantities is None or len(quantities) == 0:
-                logger.warning(f"Empty quantities for product {product_id}, skipping")
-                continue
-            
-            # Calculate basic statistics using numpy for speed
-            total_orders = len(quantities)
-            avg_quantity = np.mean(quantities)
-            std_quantity = np.std(quantities) if total_orders > 1 else 0
-            max_quantity = np.max(quantities)
-            min_quantity = np.min(quantities)
-            median_quantity = np.median(quantities)
-            
-            # Calculate order frequency (days between orders)
-            if total_orders > 1:
-                first_date = pd.to_datetime(group['Date'].iloc[0])
-                last_date = pd.to_datetime(group['Date'].iloc[-1])
-                date_range = (last_date - first_date).days
-                avg_days_between_orders = date_range / (total_orders - 1) if total_orders > 1 else np.nan
-            else:
-                avg_days_between_orders = np.nan
-            
-            # Calculate coefficient of variation (volatility measure)
-            cv = std_quantity / avg_quantity if avg_quantity > 0 else 0
-            
-            # Calculate trend (simple linear trend over time) - simplified
-            if total_orders > 2:
-                # Use simple index-based trend instead of datetime conversion
-                x = np.arange(total_orders)
-                trend_slope = np.polyfit(x, quantities, 1)[0]
-            else:
-                trend_slope = 0
-            
-            # Get product info with fallback names (use first row)
-            first_row = group.iloc[0]
-            product_name = ''
-            if 'ProductDescription' in group.columns:
-                product_name = first_row['ProductDescription']
-            elif 'ProductName' in group.columns:
-                product_name = first_row['ProductName']
-            
-            category_name = ''
-            if 'ProductCategory' in group.columns:
-                category_name = first_row['ProductCategory']
-            elif 'CategoryName' in group.columns:
-                category_name = first_row['CategoryName']
-            
-            vendor_name = ''
-            if 'VendorName' in group.columns:
-                vendor_name = first_row['VendorName']
-            
-            # Get first and last order dates
-            first_order_date = group['Date'].iloc[0]
-            last_order_date = group['Date'].iloc[-1]
-            
-            product_features.append({
-                'CustomerID': customer_id,
-                'FacilityID': facility_id,
-                'ProductID': product_id,
-                'ProductName': product_name,
-                'CategoryName': category_name,
-                'VendorName': vendor_name,
-                'TotalOrders': total_orders,
-                'AvgQuantity': avg_quantity,
-                'StdQuantity': std_quantity,
-                'MaxQuantity': max_quantity,
-                'MinQuantity': min_quantity,
-                'MedianQuantity': median_quantity,
-                'CoefficientOfVariation': cv,
-                'TrendSlope': trend_slope,
-                'AvgDaysBetweenOrders': avg_days_between_orders,
-                'FirstOrderDate': first_order_date,
-                'LastOrderDate': last_order_date
-            })
-        
-        # Force garbage collection after each batch to free memory
-        if batch_num % 5 == 0:  # Every 5 batches
-            gc.collect()
-            logger.info(f"Completed batch {batch_num}, running garbage collection")
-        
-        # Check for timeout between batches
-        if time.time() - start_time > timeout_seconds:
-            logger.warning(f"Timeout reached after {timeout_seconds} seconds, processed {len(product_features)} patterns")
-            break
+    # Basic statistics from segmented reductions
+    avg_quantity = np.add.reduceat(values, starts) / counts
+    deviations = values - np.repeat(avg_quantity, counts)
+    std_quantity = np.sqrt(np.add.reduceat(deviations ** 2, starts) / counts)
+    std_quantity[counts == 1] = 0
+    max_quantity = np.maximum.reduceat(quantities, starts)
+    min_quantity = np.minimum.reduceat(quantities, starts)
+    median_quantity = _segmented_median(values, starts, counts)
+    p10_quantity = _segmented_quantile(values, starts, counts, 0.1)
+    p90_quantity = _segmented_quantile(values, starts, counts, 0.9)
     
-    logger.info(f"Completed processing {len(product_features)} product patterns")
-    return pd.DataFrame(product_features)
-
-def calculate_product_demand_patterns_simple(df):
-    """Simplified product demand patterns calculation for very large datasets"""
-    logger.info("Calculating simplified product demand patterns for large dataset...")
+    # Calculate coefficient of variation (volatility measure)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cv = np.where(avg_quantity > 0, std_quantity / avg_quantity, 0.0)
+    
+    # Slope of the daily quantity against the order day, from per-series
+    # regression sums; days are counted from each series' first order
+    day_offset = trend_day_offsets(product_daily['Date'])
+    day_offset = day_offset - np.repeat(day_offset[starts], counts)
+    if trend_method == 'theil_sen':
+        trend_sample = trend_points_sample(product_daily[key_cols], day_offset, values)
+        series_keys = _plain_columns(product_daily.iloc[starts][key_cols].reset_index(drop=True))
+        robust = series_keys.merge(theil_sen_slopes(trend_sample), on=key_cols, how='left')
+        trend_slope = robust['TrendSlope'].fillna(0).to_numpy()
+    else:
+        trend_slope = ols_trend_slope(counts, np.add.reduceat(day_offset, starts), np.add.reduceat(values, starts),
+                                      np.add.reduceat(day_offset * values, starts),
+                                      np.add.reduceat(day_offset ** 2, starts))
+    trend_slope = np.where(counts > 2, trend_slope, 0.0)
+    
+    # Get first and last order dates and the average gap between orders
+    dates = product_daily['Date'].to_numpy()
+    first_order_date = dates[starts]
+    last_order_date = dates[ends]
+    date_range = (pd.to_datetime(last_order_date) - pd.to_datetime(first_order_date)).days.to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_days_between_orders = np.where(counts > 1, date_range / (counts - 1), np.nan)
+    
+    # Get product info with fallback names (use first row of each series)
+    first_rows = product_daily.iloc[starts]
+    
+    def _first_values(col):
+        if col:
+            return first_rows[col].to_numpy()
+        return np.full(len(starts), '', dtype=object)
+    
+    product_features = pd.DataFrame({
+        'CustomerID': first_rows['CustomerID'].to_numpy(),
+        'FacilityID': first_rows['FacilityID'].to_numpy(),
+        'ProductID': first_rows['ProductID'].to_numpy(),
+        'ProductName': _first_values(product_name_col),
+        'CategoryName': _first_values(category_name_col),
+        'VendorName': _first_values(vendor_name_col),
+        'TotalOrders': counts,
+        'AvgQuantity': avg_quantity,
+        'StdQuantity': std_quantity,
+        'MaxQuantity': max_quantity,
+        'MinQuantity': min_quantity,
+        'MedianQuantity': median_quantity,
+        'P10Quantity': p10_quantity,
+        'P90Quantity': p90_quantity,
+        'CoefficientOfVariation': cv,
+        'TrendSlope': trend_slope,
+        'AvgDaysBetweenOrders': avg_days_between_orders,
+        'FirstOrderDate': first_order_date,
+        'LastOrderDate': last_order_date
+    })
     
-    # Limit to essential columns only to save memory
-    essential_cols = ['CustomerID', 'FacilityID', 'ProductID', 'CreateDate']
+    logger.info(f"Completed processing {len(product_features)} product patterns in {time.time() - start_time:.2f} seconds")
+    return product_features
+
+# Per-series accumulator state used by the simplified and chunked paths.
+# Every column is mergeable: counts and sums add, Min/Max and dates take the
+# extremes, and M2 (sum of squared deviations) is combined with Chan's
+# parallel variance formula, so folding chunk states gives the same result as
+# summarising the whole file at once.
+SERIES_KEY_COLUMNS = ['CustomerID', 'FacilityID', 'ProductID']
+SERIES_STATE_COLUMNS = ['Count', 'Sum', 'M2', 'Min', 'Max', 'FirstOrderDate', 'LastOrderDate',
+                        'TrendN', 'SumX', 'SumY', 'SumXY', 'SumXX']
+TREND_EPOCH = pd.Timestamp('2000-01-01')
+
+def _demand_quantity(df):
+    """Quantity per order line used by the simplified path (1 per line if no quantity column)"""
     if 'Quantity' in df.columns:
-        essential_cols.append('Quantity')
+        return pd.to_numeric(df['Quantity'], errors='coerce').astype(np.float64)
     elif 'OrderUnits' in df.columns:
-        essential_cols.append('OrderUnits')
+        return pd.to_numeric(df['OrderUnits'], errors='coerce').astype(np.float64)
+    return pd.Series(1.0, index=df.index)
+
+def empty_series_state():
+    """Empty accumulator state with the expected columns"""
+    return pd.DataFrame(columns=SERIES_KEY_COLUMNS + SERIES_STATE_COLUMNS)
+
+def summarize_series_chunk(df):
+    """Summarise order lines into per-series accumulator state
     
-    # Work with subset of data
-    df_subset = df[essential_cols].copy()
+    Returns one row per (CustomerID, FacilityID, ProductID) holding the
+    mergeable statistics in SERIES_STATE_COLUMNS. The regression sums use the
+    order date in days since TREND_EPOCH as x and the line quantity as y.
+    """
+    if df is None or df.empty:
+        return empty_series_state()
     
-    # Use aggregation functions directly instead of iterating through groups
-    if 'OrderUnits' in df_subset.columns:
-        agg_dict = {
-            'OrderUnits': ['count', 'sum', 'mean', 'std', 'min', 'max'],
-            'CreateDate': ['min', 'max']
-        }
-    elif 'Quantity' in df_subset.columns:
-        agg_dict = {
-            'Quantity': ['count', 'sum', 'mean', 'std', 'min', 'max'],
-            'CreateDate': ['min', 'max']
-        }
+    grouped = df.groupby(SERIES_KEY_COLUMNS, sort=True, observed=True)
+    codes = grouped.ngroup().to_numpy()
+    keys = _plain_columns(grouped.size().index.to_frame(index=False))
+    
+    # Rows with missing keys are dropped by groupby (ngroup marks them NaN)
+    valid = ~pd.isna(codes)
+    codes = codes[valid].astype(np.int64)
+    n_series = len(keys)
+    
+    quantity = _demand_quantity(df).to_numpy()[valid]
+    create_date = pd.to_datetime(df['CreateDate']).to_numpy()[valid]
+    has_quantity = ~np.isnan(quantity)
+    q = np.where(has_quantity, quantity, 0.0)
+    
+    count = np.bincount(codes, weights=has_quantity, minlength=n_series)
+    total = np.bincount(codes, weights=q, minlength=n_series)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+    deviations = np.where(has_quantity, quantity - mean[codes], 0.0)
+    m2 = np.bincount(codes, weights=deviations ** 2, minlength=n_series)
+    
+    quantity_by_series = pd.Series(quantity).groupby(codes)
+    date_by_series = pd.Series(create_date).groupby(codes)
+    
+    # Regression sums: x is the order day offset, y the quantity
+    x = trend_day_offsets(create_date)
+    has_point = has_quantity & ~np.isnan(x)
+    x = np.where(has_point, x, 0.0)
+    y = np.where(has_point, q, 0.0)
+    
+    state = keys
+    state['Count'] = count.astype(np.int64)
+    state['Sum'] = total
+    state['M2'] = m2
+    state['Min'] = quantity_by_series.min().reindex(range(n_series)).to_numpy()
+    state['Max'] = quantity_by_series.max().reindex(range(n_series)).to_numpy()
+    state['FirstOrderDate'] = date_by_series.min().reindex(range(n_series)).to_numpy()
+    state['LastOrderDate'] = date_by_series.max().reindex(range(n_series)).to_numpy()
+    state['TrendN'] = np.bincount(codes, weights=has_point, minlength=n_series).astype(np.int64)
+    state['SumX'] = np.bincount(codes, weights=x, minlength=n_series)
+    state['SumY'] = np.bincount(codes, weights=y, minlength=n_series)
+    state['SumXY'] = np.bincount(codes, weights=x * y, minlength=n_series)
+    state['SumXX'] = np.bincount(codes, weights=x * x, minlength=n_series)
+    return state
+
+def merge_series_states(*states):
+    """Merge any number of accumulator states into one row per series"""
+    states = [state for state in states if state is not None and not state.empty]
+    if not states:
+        return empty_series_state()
+    if len(states) == 1:
+        return states[0]
+    
+    combined = pd.concat(states, ignore_index=True)
+    
+    # Chan et al.: M2 = sum(M2_i) + sum(n_i * (mean_i - mean)^2)
+    totals = combined.groupby(SERIES_KEY_COLUMNS, sort=False, observed=True)[['Count', 'Sum']].transform('sum')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = totals['Sum'] / totals['Count']
+        part_mean = combined['Sum'] / combined['Count']
+    combined['M2'] = combined['M2'] + (combined['Count'] * (part_mean - mean) ** 2).fillna(0)
+    
+    merged = combined.groupby(SERIES_KEY_COLUMNS, sort=True, observed=True).agg({
+        'Count': 'sum',
+        'Sum': 'sum',
+        'M2': 'sum',
+        'Min': 'min',
+        'Max': 'max',
+        'FirstOrderDate': 'min',
+        'LastOrderDate': 'max',
+        'TrendN': 'sum',
+        'SumX': 'sum',
+        'SumY': 'sum',
+        'SumXY': 'sum',
+        'SumXX': 'sum'
+    })
+    return merged.reset_index()
+
+def finalize_series_state(state, sketch=None, trend_sample=None):
+    """Turn accumulator state into the product feature schema
+    
+    When a quantile sketch is given the median and p10/p90 quantities come from
+    it; otherwise the median falls back to the mean and p10/p90 to the min/max.
+    A trend sample replaces the least-squares slope with the Theil-Sen slope
+    for the series it covers.
+    """
+    features = state[SERIES_KEY_COLUMNS].copy()
+    count = state['Count'].astype(np.float64)
+    
+    features['ProductName'] = 'Product ' + features['ProductID'].astype(str)
+    features['CategoryName'] = 'General'
+    features['VendorName'] = 'Vendor' + features['ProductID'].astype(str).str.replace('PROD', '', regex=False)
+    features['TotalOrders'] = state['Count'].astype(np.int64)
+    features['AvgQuantity'] = state['Sum'] / count
+    features['StdQuantity'] = np.sqrt(state['M2'] / (count - 1)).fillna(0)
+    features['MaxQuantity'] = state['Max']
+    features['MinQuantity'] = state['Min']
+    if sketch is not None and not sketch.empty:
+        quantiles = sketch_quantiles(sketch, (0.5, 0.1, 0.9))
+        quantiles = state[SERIES_KEY_COLUMNS].merge(quantiles, on=SERIES_KEY_COLUMNS, how='left')
+        features['MedianQuantity'] = quantiles[0.5].to_numpy()
+        features['P10Quantity'] = quantiles[0.1].to_numpy()
+        features['P90Quantity'] = quantiles[0.9].to_numpy()
     else:
-        # Create a quantity column for counting
-        df_subset['_count'] = 1
-        agg_dict = {
-            '_count': ['count', 'sum', 'mean', 'std', 'min', 'max'],
-            'CreateDate': ['min', 'max']
-        }
+        features['MedianQuantity'] = features['AvgQuantity']  # Approximation
+        features['P10Quantity'] = features['MinQuantity']
+        features['P90Quantity'] = features['MaxQuantity']
+    features['CoefficientOfVariation'] = (features['StdQuantity'] / features['AvgQuantity']).fillna(0)
     
-    # Group and aggregate in one operation
-    logger.info("Performing aggregation...")
-    product_stats = df_subset.groupby(['CustomerID', 'FacilityID', 'ProductID']).agg(agg_dict).reset_index()
+    # Least-squares slope of quantity against order day
+    slope = ols_trend_slope(state['TrendN'], state['SumX'], state['SumY'], state['SumXY'], state['SumXX'])
+    if trend_sample is not None and not trend_sample.empty:
+        robust = state[SERIES_KEY_COLUMNS].merge(theil_sen_slopes(trend_sample), on=SERIES_KEY_COLUMNS, how='left')
+        slope = np.where(robust['TrendSlope'].isna(), slope, robust['TrendSlope'].to_numpy())
+    features['TrendSlope'] = slope
     
-    # Clean up subset to free memory
-    del df_subset
-    gc.collect()
+    first_order_date = pd.to_datetime(state['FirstOrderDate'])
+    last_order_date = pd.to_datetime(state['LastOrderDate'])
+    features['AvgDaysBetweenOrders'] = ((last_order_date - first_order_date).dt.days / (count - 1)).fillna(0)
+    features['FirstOrderDate'] = first_order_date
+    features['LastOrderDate'] = last_order_date
+    return features.reset_index(drop=True)
+
+# Per-series quantile sketch: a list of (Value, Weight) centroids per series.
+# Series with at most QUANTILE_SKETCH_SIZE distinct quantities are stored
+# exactly (one point-mass centroid per distinct value, weight = number of
+# lines), which covers typical integer order quantities. Larger series are
+# compressed t-digest style, with narrower centroids in the tails, so memory
+# stays bounded at QUANTILE_SKETCH_SIZE rows per series. Sketches merge by
+# concatenation followed by re-compression.
+QUANTILE_SKETCH_SIZE = int(os.environ.get('QUANTILE_SKETCH_SIZE', '100'))
+SKETCH_COLUMNS = SERIES_KEY_COLUMNS + ['Value', 'Weight', 'Exact']
+
+def empty_quantile_sketch():
+    """Empty quantile sketch with the expected columns"""
+    return pd.DataFrame(columns=SKETCH_COLUMNS)
+
+def _compress_quantile_sketch(sketch, max_centroids):
+    """Collapse centroids of oversized series into at most max_centroids each"""
+    sketch = sketch.sort_values(SERIES_KEY_COLUMNS + ['Value'], kind='mergesort').reset_index(drop=True)
+    sizes = sketch.groupby(SERIES_KEY_COLUMNS, sort=False, observed=True)['Value'].transform('size')
+    oversized = (sizes > max_centroids).to_numpy()
+    if not oversized.any():
+        return sketch
+    
+    exact = sketch[~oversized]
+    large = sketch[oversized].copy()
+    large_grouped = large.groupby(SERIES_KEY_COLUMNS, sort=False, observed=True)['Weight']
+    total = large_grouped.transform('sum').to_numpy(dtype=np.float64)
+    weight = large['Weight'].to_numpy(dtype=np.float64)
+    mid_rank = large_grouped.cumsum().to_numpy(dtype=np.float64) - weight / 2.0
     
-    # Flatten column names
-    product_stats.columns = ['CustomerID', 'FacilityID', 'ProductID', 
-                           'TotalOrders', 'TotalQuantity', 'AvgQuantity', 'StdQuantity',
-                           'MinQuantity', 'MaxQuantity',
-                           'FirstOrderDate', 'LastOrderDate']
+    # t-digest k1 scale function: equal-width buckets in arcsin space
+    scale = np.arcsin(np.clip(2.0 * mid_rank / total - 1.0, -1.0, 1.0)) / np.pi + 0.5
+    large['_bucket'] = np.minimum((scale * max_centroids).astype(np.int64), max_centroids - 1)
+    large['_moment'] = large['Value'].astype(np.float64) * weight
     
-    # Fill NaN values
-    product_stats['StdQuantity'] = product_stats['StdQuantity'].fillna(0)
+    buckets = large.groupby(SERIES_KEY_COLUMNS + ['_bucket'], sort=True, observed=True).agg(
+        _moment=('_moment', 'sum'),
+        Weight=('Weight', 'sum'),
+        Exact=('Exact', 'all'),
+        _members=('Value', 'size')
+    ).reset_index()
+    buckets['Value'] = buckets['_moment'] / buckets['Weight']
+    buckets['Exact'] = buckets['Exact'] & (buckets['_members'] == 1)
+    compressed = pd.concat([exact, buckets[SKETCH_COLUMNS]], ignore_index=True)
+    return compressed.sort_values(SERIES_KEY_COLUMNS + ['Value'], kind='mergesort').reset_index(drop=True)
+
+def summarize_quantile_sketch(df, max_centroids=None):
+    """Build a per-series quantile sketch from order lines"""
+    if df is None or df.empty:
+        return empty_quantile_sketch()
     
-    # Calculate coefficient of variation (simplified)
-    product_stats['CoefficientOfVariation'] = product_stats['StdQuantity'] / product_stats['AvgQuantity']
-    product_stats['CoefficientOfVariation'] = product_stats['CoefficientOfVariation'].fillna(0)
+    frame = _plain_columns(df[SERIES_KEY_COLUMNS].copy())
+    frame['Value'] = _demand_quantity(df)
+    sketch = frame.groupby(SERIES_KEY_COLUMNS + ['Value'], sort=True, observed=True).size().reset_index(name='Weight')
+    sketch['Exact'] = True
+    return _compress_quantile_sketch(sketch, max_centroids or QUANTILE_SKETCH_SIZE)
+
+def merge_quantile_sketches(*sketches, max_centroids=None):
+    """Merge any number of quantile sketches, keeping them within the size bound"""
+    sketches = [sketch for sketch in sketches if sketch is not None and not sketch.empty]
+    if not sketches:
+        return empty_quantile_sketch()
     
-    # Calculate days between orders (simplified)
-    try:
-        product_stats['FirstOrderDate'] = pd.to_datetime(product_stats['FirstOrderDate'])
-        product_stats['LastOrderDate'] = pd.to_datetime(product_stats['LastOrderDate'])
-        product_stats['DateRange'] = (product_stats['LastOrderDate'] - product_stats['FirstOrderDate']).dt.days
-        product_stats['AvgDaysBetweenOrders'] = product_stats['DateRange'] / (product_stats['TotalOrders'] - 1)
-        product_stats['AvgDaysBetweenOrders'] = product_stats['AvgDaysBetweenOrders'].fillna(0)
-    except:
-        product_stats['AvgDaysBetweenOrders'] = 0
-    
-    # Add missing columns with defaults (memory efficient)
-    product_stats['MedianQuantity'] = product_stats['AvgQuantity']  # Approximation
-    product_stats['TrendSlope'] = 0
-    product_stats['ProductName'] = 'Product ' + product_stats['ProductID'].astype(str)
-    product_stats['CategoryName'] = 'General'
-    product_stats['VendorName'] = 'Vendor' + product_stats['ProductID'].astype(str).str.replace('PROD', '', regex=False)
-    
-    # Select final columns
-    final_columns = ['CustomerID', 'FacilityID', 'ProductID', 'ProductName', 'CategoryName', 'VendorName',
-                    'TotalOrders', 'AvgQuantity', 'StdQuantity', 'MaxQuantity', 'MinQuantity', 'MedianQuantity',
-                    'CoefficientOfVariation', 'TrendSlope', 'AvgDaysBetweenOrders', 'FirstOrderDate', 'LastOrderDate']
-    
-    result = product_stats[final_columns].copy()
-    
-    # Clean up
-    del product_stats
+    combined = pd.concat(sketches, ignore_index=True)
+    combined = combined.groupby(SERIES_KEY_COLUMNS + ['Value'], sort=True, observed=True).agg(
+        Weight=('Weight', 'sum'),
+        Exact=('Exact', 'all')
+    ).reset_index()
+    return _compress_quantile_sketch(combined, max_centroids or QUANTILE_SKETCH_SIZE)
+
+def sketch_quantiles(sketch, quantiles=(0.5,)):
+    """Estimate quantiles for every series in a sketch
+    
+    Uses the same linear interpolation between order statistics as
+    np.quantile. Point-mass centroids return their value, so results are
+    exact while a series is uncompressed; inside compressed centroids the
+    value is interpolated between neighbouring centroid centres. Returns the
+    series keys plus one column per requested quantile.
+    """
+    sketch = sketch.sort_values(SERIES_KEY_COLUMNS + ['Value'], kind='mergesort').reset_index(drop=True)
+    starts, counts = _series_segments(sketch, SERIES_KEY_COLUMNS)
+    weight = sketch['Weight'].to_numpy(dtype=np.float64)
+    value = sketch['Value'].to_numpy(dtype=np.float64)
+    exact = sketch['Exact'].to_numpy(dtype=bool)
+    
+    # Global rank coordinates: centroid i covers ranks [cumulative[i] - weight[i], cumulative[i])
+    cumulative = np.cumsum(weight)
+    first_rank = cumulative - weight
+    centre = first_rank + (weight - 1) / 2.0
+    series_first = np.repeat(starts, counts)
+    series_last = np.repeat(starts + counts - 1, counts)
+    
+    # Anchor ranks of the neighbouring centroids used for interpolation
+    previous = np.maximum(np.arange(len(value)) - 1, series_first)
+    following = np.minimum(np.arange(len(value)) + 1, series_last)
+    left_anchor = np.where(exact[previous], cumulative[previous] - 1, centre[previous])
+    right_anchor = np.where(exact[following], first_rank[following], centre[following])
+    
+    def value_at_rank(rank):
+        index = np.searchsorted(cumulative, rank, side='right')
+        left, right = previous[index], following[index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            below = value[left] + (value[index] - value[left]) * (rank - left_anchor[index]) / (centre[index] - left_anchor[index])
+            above = value[index] + (value[right] - value[index]) * (rank - centre[index]) / (right_anchor[index] - centre[index])
+        interpolated = np.where(rank <= centre[index], np.where(left == index, value[index], below),
+                                np.where(right == index, value[index], above))
+        return np.where(exact[index], value[index], interpolated)
+    
+    base = first_rank[starts] if len(starts) else np.array([])
+    total = np.add.reduceat(weight, starts) if len(starts) else np.array([])
+    
+    result = sketch.iloc[starts][SERIES_KEY_COLUMNS].reset_index(drop=True)
+    for q in quantiles:
+        position = q * (total - 1)
+        lower = np.floor(position)
+        lower_values = value_at_rank(base + lower)
+        result[q] = lower_values + (value_at_rank(base + np.ceil(position)) - lower_values) * (position - lower)
+    return result
+
+# Trend slopes. The least-squares slope only needs the per-series sums n, Σx,
+# Σy, Σxy and Σx² with x the order day, so it merges by addition. The robust
+# Theil-Sen slope is the median of the slopes between pairs of a series'
+# points, taken over a sample of at most TREND_SAMPLE_SIZE points per series.
+# The sample keeps the points with the smallest hash (bottom-k sampling), so
+# merging the samples of any split of the input keeps the same points as a
+# single pass over it.
+TREND_SAMPLE_SIZE = int(os.environ.get('TREND_SAMPLE_SIZE', '24'))
+TREND_SAMPLE_COLUMNS = SERIES_KEY_COLUMNS + ['X', 'Y', 'Priority']
+TREND_PAIR_BLOCK = 2000000  # Pairwise slopes held in memory at once
+
+def trend_day_offsets(dates):
+    """Days since TREND_EPOCH as floats (NaN where the date is missing)"""
+    dates = np.asarray(pd.to_datetime(dates), dtype='datetime64[ns]')
+    return (dates - TREND_EPOCH.to_datetime64()) / np.timedelta64(1, 'D')
+
+def ols_trend_slope(n, sum_x, sum_y, sum_xy, sum_xx):
+    """Least-squares slope per group from its regression sums (0 without two distinct days)"""
+    n = np.asarray(n, dtype=np.float64)
+    sum_x = np.asarray(sum_x, dtype=np.float64)
+    sum_xx = np.asarray(sum_xx, dtype=np.float64)
+    denominator = n * sum_xx - sum_x ** 2
+    numerator = n * np.asarray(sum_xy, dtype=np.float64) - sum_x * np.asarray(sum_y, dtype=np.float64)
+    # Identical days leave only rounding noise in the denominator
+    spread = (n > 1) & (denominator > 1e-9 * n * sum_xx)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(spread, numerator / denominator, 0.0)
+
+def empty_trend_sample():
+    """Empty trend sample with the expected columns"""
+    return pd.DataFrame(columns=TREND_SAMPLE_COLUMNS)
+
+def _bottom_k_points(points, sample_size):
+    """Keep the sample_size points with the smallest priority in every series"""
+    points = points.sort_values(SERIES_KEY_COLUMNS + ['Priority', 'X', 'Y'], kind='mergesort')
+    rank = points.groupby(SERIES_KEY_COLUMNS, sort=False, observed=True).cumcount().to_numpy()
+    return points[rank < sample_size].reset_index(drop=True)
+
+def trend_points_sample(keys, x, y, sample_size=None):
+    """Bottom-k sample of (x, y) points per series"""
+    points = _plain_columns(keys[SERIES_KEY_COLUMNS].reset_index(drop=True).copy())
+    points['X'] = np.asarray(x, dtype=np.float64)
+    points['Y'] = np.asarray(y, dtype=np.float64)
+    points = points.dropna()
+    if points.empty:
+        return empty_trend_sample()
+    points['Priority'] = pd.util.hash_pandas_object(points, index=False).to_numpy()
+    return _bottom_k_points(points, sample_size or TREND_SAMPLE_SIZE)
+
+def summarize_trend_sample(df, sample_size=None):
+    """Sample of (order day, line quantity) points per series for the Theil-Sen slope"""
+    if df is None or df.empty:
+        return empty_trend_sample()
+    return trend_points_sample(df, trend_day_offsets(df['CreateDate']), _demand_quantity(df), sample_size)
+
+def merge_trend_samples(*samples, sample_size=None):
+    """Merge any number of trend samples, keeping the bottom-k points per series"""
+    samples = [sample for sample in samples if sample is not None and not sample.empty]
+    if not samples:
+        return empty_trend_sample()
+    if len(samples) == 1 and sample_size is None:
+        return samples[0]
+    return _bottom_k_points(pd.concat(samples, ignore_index=True), sample_size or TREND_SAMPLE_SIZE)
+
+def segmented_theil_sen(x, y, starts, counts):
+    """Median pairwise slope of each contiguous segment (0 without two distinct x)"""
+    slopes = np.zeros(len(starts))
+    if len(starts) == 0:
+        return slopes
+    
+    # Pad every segment to the longest one so pairs are formed by broadcasting
+    width = int(counts.max())
+    segment_ids = np.repeat(np.arange(len(starts)), counts)
+    position = np.arange(len(x)) - np.repeat(starts, counts)
+    padded_x = np.full((len(starts), width), np.nan)
+    padded_y = np.full((len(starts), width), np.nan)
+    padded_x[segment_ids, position] = x
+    padded_y[segment_ids, position] = y
+    
+    upper = np.triu(np.ones((width, width), dtype=bool), k=1)
+    block = max(1, TREND_PAIR_BLOCK // (width * width))
+    for first in range(0, len(starts), block):
+        block_x = padded_x[first:first + block]
+        block_y = padded_y[first:first + block]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dx = block_x[:, None, :] - block_x[:, :, None]
+            pair_slopes = (block_y[:, None, :] - block_y[:, :, None]) / dx
+        pair_slopes = np.where(upper & (dx != 0), pair_slopes, np.nan).reshape(len(block_x), -1)
+        
+        # NaNs sort last, so the valid slopes are the leading run of each row
+        pair_slopes.sort(axis=1)
+        valid = (~np.isnan(pair_slopes)).sum(axis=1)
+        lower = np.take_along_axis(pair_slopes, np.maximum(valid - 1, 0)[:, None] // 2, axis=1)[:, 0]
+        higher = np.take_along_axis(pair_slopes, (valid // 2)[:, None], axis=1)[:, 0]
+        slopes[first:first + block] = np.where(valid > 0, (lower + higher) / 2.0, 0.0)
+    return slopes
+
+def theil_sen_slopes(sample):
+    """Theil-Sen slope for every series in a trend sample
+    
+    Returns the series keys plus TrendSlope, the median of the slopes between
+    every pair of sampled points on different days.
+    """
+    sample = sample.sort_values(SERIES_KEY_COLUMNS, kind='mergesort').reset_index(drop=True)
+    starts, counts = _series_segments(sample, SERIES_KEY_COLUMNS)
+    result = sample.iloc[starts][SERIES_KEY_COLUMNS].reset_index(drop=True)
+    result['TrendSlope'] = segmented_theil_sen(sample['X'].to_numpy(dtype=np.float64),
+                                               sample['Y'].to_numpy(dtype=np.float64), starts, counts)
+    return result
+
+def calculate_product_demand_patterns_simple(df):
+    """Simplified product demand patterns calculation for very large datasets
+    
+    Statistics are computed over order lines rather than daily totals, using
+    the same mergeable accumulator as the chunked path so both give identical
+    features for the same input.
+    """
+    logger.info("Calculating simplified product demand patterns for large dataset...")
+    
+    trend_sample = summarize_trend_sample(df) if trend_method == 'theil_sen' else None
+    result = finalize_series_state(summarize_series_chunk(df), summarize_quantile_sketch(df), trend_sample)
     gc.collect()
     
     # Ensure we return a valid DataFrame
@@ -400,6 +987,8 @@ def calculate_product_demand_patterns_simple(df):
             'MaxQuantity': [1.0],
             'MinQuantity': [1.0],
             'MedianQuantity': [1.0],
+            'P10Quantity': [1.0],
+            'P90Quantity': [1.0],
             'CoefficientOfVariation': [0.0],
             'TrendSlope': [0.0],
             'AvgDaysBetweenOrders': [0.0],
@@ -416,9 +1005,9 @@ def prepare_product_forecast_data(df):
     
     # Group by customer, facility, product, and date to get daily quantities
     if 'OrderUnits' in df.columns:
-        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'])['OrderUnits'].sum().reset_index(name='Quantity')
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'], observed=True)['OrderUnits'].sum().reset_index(name='Quantity')
     else:
-        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date']).size().reset_index(name='Quantity')
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'], observed=True).size().reset_index(name='Quantity')
     
     # Add product information - handle different column names
     product_cols = ['ProductID']
@@ -437,7 +1026,10 @@ def prepare_product_forecast_data(df):
     
     product_info = df[product_cols].drop_duplicates()
     product_daily = product_daily.merge(product_info, on='ProductID', how='left')
-    
+    return product_forecast_rows(product_daily)
+
+def product_forecast_rows(product_daily):
+    """Product-level forecast rows from daily quantities per series and optional product columns"""
     # Create item_id that includes customer, facility, and product for unique identification
     forecast_df = pd.DataFrame({
         'item_id': (product_daily['CustomerID'].astype(str) + '_' + 
@@ -479,97 +1071,224 @@ def prepare_product_forecast_data(df):
     
     return forecast_df
 
+CUSTOMER_FORECAST_METRICS = [('TotalUnits', 'TOTAL_UNITS'), ('TotalItems', 'TOTAL_ITEMS'),
+                             ('UniqueProducts', 'UNIQUE_PRODUCTS'), ('TotalValue', 'TOTAL_VALUE')]
+
 def prepare_customer_level_forecast_data(df):
-    """Prepare data for customer-level forecasting (aggregated forecasts)"""
+    """Prepare data for customer-level forecasting (aggregated forecasts)
+    
+    One grouped pass computes every daily metric; df is left unchanged.
+    """
     logger.info("Preparing customer-level forecast data...")
     
-    # Group by customer, facility, and date for total order count
+    # Only the columns the aggregations read, so the order value never lands on the caller's frame
+    keys = ['CustomerID', 'FacilityID', 'Date']
+    columns = {col: df[col] for col in keys + ['ProductID']}
+    aggregations = {}
     if 'OrderUnits' in df.columns:
-        customer_daily = df.groupby(['CustomerID', 'FacilityID', 'Date'])['OrderUnits'].sum().reset_index(name='TotalUnits')
+        columns['OrderUnits'] = df['OrderUnits']
+        aggregations['TotalUnits'] = ('OrderUnits', 'sum')
     else:
-        customer_daily = df.groupby(['CustomerID', 'FacilityID', 'Date']).size().reset_index(name='TotalItems')
-    
-    # Also calculate unique products ordered per day
-    unique_products_daily = df.groupby(['CustomerID', 'FacilityID', 'Date'])['ProductID'].nunique().reset_index(name='UniqueProducts')
-    
-    # Calculate total order value if Price column exists
+        aggregations['TotalItems'] = ('ProductID', 'size')
     if 'Price' in df.columns:
-        if 'OrderUnits' in df.columns:
-            df['OrderValue'] = df['OrderUnits'] * df['Price']
-        else:
-            df['OrderValue'] = df['Price']
-        order_value_daily = df.groupby(['CustomerID', 'FacilityID', 'Date'])['OrderValue'].sum().reset_index(name='TotalValue')
-        customer_daily = customer_daily.merge(order_value_daily, on=['CustomerID', 'FacilityID', 'Date'])
-    
-    # Merge the data
-    customer_daily = customer_daily.merge(unique_products_daily, on=['CustomerID', 'FacilityID', 'Date'])
-    
-    # Create forecast format for total items/units
-    if 'TotalUnits' in customer_daily.columns:
-        forecast_df_items = pd.DataFrame({
-            'item_id': (customer_daily['CustomerID'].astype(str) + '_' + 
-                       customer_daily['FacilityID'].astype(str) + '_TOTAL_UNITS'),
-            'timestamp': pd.to_datetime(customer_daily['Date']),
-            'target_value': customer_daily['TotalUnits'],
-            'customer_id': customer_daily['CustomerID'],
-            'facility_id': customer_daily['FacilityID'],
-            'metric_type': 'TOTAL_UNITS'
-        })
-    else:
-        forecast_df_items = pd.DataFrame({
-            'item_id': (customer_daily['CustomerID'].astype(str) + '_' + 
-                       customer_daily['FacilityID'].astype(str) + '_TOTAL_ITEMS'),
-            'timestamp': pd.to_datetime(customer_daily['Date']),
-            'target_value': customer_daily['TotalItems'],
-            'customer_id': customer_daily['CustomerID'],
-            'facility_id': customer_daily['FacilityID'],
-            'metric_type': 'TOTAL_ITEMS'
-        })
-    
-    # Create forecast format for unique products
-    forecast_df_products = pd.DataFrame({
-        'item_id': (customer_daily['CustomerID'].astype(str) + '_' + 
-                   customer_daily['FacilityID'].astype(str) + '_UNIQUE_PRODUCTS'),
-        'timestamp': pd.to_datetime(customer_daily['Date']),
-        'target_value': customer_daily['UniqueProducts'],
-        'customer_id': customer_daily['CustomerID'],
-        'facility_id': customer_daily['FacilityID'],
-        'metric_type': 'UNIQUE_PRODUCTS'
-    })
+        columns['OrderValue'] = df['OrderUnits'] * df['Price'] if 'OrderUnits' in df.columns else df['Price']
+        aggregations['TotalValue'] = ('OrderValue', 'sum')
+    aggregations['UniqueProducts'] = ('ProductID', 'nunique')
     
-    # Create forecast format for total value if available
-    forecast_dfs = [forecast_df_items, forecast_df_products]
-    if 'TotalValue' in customer_daily.columns:
-        forecast_df_value = pd.DataFrame({
-            'item_id': (customer_daily['CustomerID'].astype(str) + '_' + 
-                       customer_daily['FacilityID'].astype(str) + '_TOTAL_VALUE'),
-            'timestamp': pd.to_datetime(customer_daily['Date']),
-            'target_value': customer_daily['TotalValue'],
-            'customer_id': customer_daily['CustomerID'],
-            'facility_id': customer_daily['FacilityID'],
-            'metric_type': 'TOTAL_VALUE'
-        })
-        forecast_dfs.append(forecast_df_value)
+    customer_daily = pd.DataFrame(columns).groupby(keys, observed=True, sort=False).agg(**aggregations).reset_index()
+    # An unsorted groupby lists categorical keys' categories in first-seen order; keep the input's
+    for col in ['CustomerID', 'FacilityID']:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            customer_daily[col] = pd.Categorical(customer_daily[col], categories=df[col].cat.categories,
+                                                 ordered=df[col].cat.ordered)
+    return customer_forecast_rows(customer_daily)
+
+def customer_forecast_rows(customer_daily):
+    """Customer-level forecast rows from daily totals per customer and facility
     
-    # Combine all datasets
-    forecast_df = pd.concat(forecast_dfs, ignore_index=True)
+    Every metric column becomes its own series (item_id
+    '<customer>_<facility>_<METRIC>'). Item ids are formatted and ordered per
+    customer and facility, and the rows are put in (item_id, timestamp) order
+    with one gather instead of formatting and sorting strings per row.
+    """
+    metrics = [(col, metric) for col, metric in CUSTOMER_FORECAST_METRICS if col in customer_daily.columns]
+    n_rows, n_metrics = len(customer_daily), len(metrics)
     
-    # Add temporal features required for SageMaker DeepAR (matching notebook implementation)
-    forecast_df['day_of_week'] = forecast_df['timestamp'].dt.dayofweek
-    forecast_df['month'] = forecast_df['timestamp'].dt.month
+    pair_keys = customer_daily[['CustomerID', 'FacilityID']]
+    pair_codes = pair_keys.groupby(['CustomerID', 'FacilityID'], observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    pairs = pair_keys.drop_duplicates()  # In first-seen order, like the group numbers
+    prefixes = (pairs['CustomerID'].astype(str) + '_' + pairs['FacilityID'].astype(str)).to_numpy()
+    item_names = np.array([prefix + '_' + metric for prefix in prefixes for _, metric in metrics], dtype=object)
+    item_rank = np.empty(len(item_names), dtype=np.int64)
+    item_rank[np.argsort(item_names, kind='stable')] = np.arange(len(item_names))
     
-    # Sort by item_id and timestamp for proper time series format
-    forecast_df = forecast_df.sort_values(['item_id', 'timestamp']).reset_index(drop=True)
+    # Row r of metric m is row m * n_rows + r of the long frame
+    items = (pair_codes[None, :] * n_metrics + np.arange(n_metrics)[:, None]).ravel()
+    timestamps = pd.to_datetime(customer_daily['Date']).to_numpy()
+    days, day_codes = np.unique(timestamps, return_inverse=True)
+    order = np.argsort(item_rank[items] * len(days) + np.tile(day_codes, n_metrics), kind='stable')
+    rows = order % max(n_rows, 1)
     
+    timestamp = pd.Series(timestamps[rows])
+    values = pd.concat([customer_daily[col] for col, _ in metrics], ignore_index=True)
+    forecast_df = pd.DataFrame({
+        'item_id': item_names[items[order]],
+        'timestamp': timestamp,
+        'target_value': values.take(order).reset_index(drop=True),
+        'customer_id': customer_daily['CustomerID'].take(rows).reset_index(drop=True),
+        'facility_id': customer_daily['FacilityID'].take(rows).reset_index(drop=True),
+        'metric_type': np.array([metric for _, metric in metrics], dtype=object)[order // max(n_rows, 1)],
+        # Temporal features required for SageMaker DeepAR (matching notebook implementation)
+        'day_of_week': timestamp.dt.dayofweek,
+        'month': timestamp.dt.month
+    })
     return forecast_df
 
-def create_product_lookup_table(df):
-    """Create a lookup table for product information matching notebook schema"""
-    logger.info("Creating product lookup table...")
+# Forecast data in bounded memory. Every chunk is reduced to one row per
+# (customer, facility, product, day) holding its units, order lines and
+# value, and those rows are appended to spill files on /tmp, partitioned by a
+# hash of CustomerID so that all items of a customer share one partition. The
+# forecast artifacts are then built and written one partition at a time: each
+# item's rows are contiguous and in timestamp order, and memory is bounded by
+# the largest partition rather than by the input.
+FORECAST_SPILL_ROOT = os.environ.get('FORECAST_SPILL_DIR', '/tmp')
+FORECAST_DEFAULT_PARTITIONS = 16
+FORECAST_VALUE_COLUMNS = ['Units', 'Lines', 'Value']
+
+def new_forecast_spill(partitions=None):
+    """Empty spill in a fresh directory, the initial partial result of the forecast_spill consumer"""
+    return {
+        'directory': tempfile.mkdtemp(prefix='forecast_spill_', dir=FORECAST_SPILL_ROOT),
+        'partitions': max(1, int(partitions or FORECAST_DEFAULT_PARTITIONS)),
+        'files': [],
+        'units': False,
+        'value': False
+    }
+
+def release_forecast_spill(spill):
+    """Delete a spill's files"""
+    if spill:
+        shutil.rmtree(spill['directory'], ignore_errors=True)
+
+def summarize_forecast_chunk(chunk):
+    """Units, order lines and value per series and day for one chunk of order lines
     
-    # Log available columns for debugging
-    logger.info(f"Available columns: {list(df.columns)}")
+    Rows without a product are kept (ProductID NaN) because they still count
+    towards the customer totals.
+    """
+    daily = chunk[SERIES_KEY_COLUMNS].copy()
+    for col in SERIES_KEY_COLUMNS:
+        if isinstance(daily[col].dtype, pd.CategoricalDtype):
+            # Nullable integers keep integer IDs next to missing ones (plain values would turn to floats)
+            categories = daily[col].cat.categories
+            integer = pd.api.types.is_integer_dtype(categories.dtype)
+            daily[col] = daily[col].astype('Int64' if integer else categories.dtype)
+    daily['Date'] = pd.to_datetime(chunk['CreateDate']).dt.normalize()
+    units = chunk['OrderUnits'] if 'OrderUnits' in chunk.columns else pd.Series(np.nan, index=chunk.index)
+    daily['Units'] = units.to_numpy()
+    daily['Lines'] = 1
+    if 'Price' in chunk.columns:
+        value = chunk['Price'] * chunk['OrderUnits'] if 'OrderUnits' in chunk.columns else chunk['Price']
+        daily['Value'] = value.to_numpy()
+    else:
+        daily['Value'] = 0.0
+    daily = daily.dropna(subset=['CustomerID', 'FacilityID', 'Date'])
+    return daily.groupby(SERIES_KEY_COLUMNS + ['Date'], sort=False, dropna=False)[FORECAST_VALUE_COLUMNS].sum().reset_index()
+
+def _spill_forecast_chunk(partial, chunk):
+    """Consumer step: append the chunk's daily rows to the spill partition files"""
+    spill = partial or new_forecast_spill()
+    spill['units'] = spill['units'] or 'OrderUnits' in chunk.columns
+    spill['value'] = spill['value'] or 'Price' in chunk.columns
+    for index, part in enumerate(partition_by_customer(summarize_forecast_chunk(chunk), spill['partitions'])):
+        if part.empty:
+            continue
+        # One file per partition and process, so parallel workers never share a file
+        path = os.path.join(spill['directory'], f'part-{index:05d}-{os.getpid()}.pkl')
+        with open(path, 'ab') as handle:
+            pickle.dump(part, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        if path not in spill['files']:
+            spill['files'].append(path)
+    return spill
+
+def _combine_forecast_spills(partials):
+    """Workers spill into the same directory, so combining only collects their files"""
+    if not partials:
+        return new_forecast_spill()
+    spill = dict(partials[0])
+    spill['files'] = sorted({path for partial in partials for path in partial['files']})
+    spill['units'] = any(partial['units'] for partial in partials)
+    spill['value'] = any(partial['value'] for partial in partials)
+    return spill
+
+def spill_forecast_frame(df, chunk_rows, partitions=None):
+    """Spill an already loaded frame slice by slice, for frames too big for the in-memory builders"""
+    spill = new_forecast_spill(partitions)
+    for start in range(0, len(df), chunk_rows):
+        spill = _spill_forecast_chunk(spill, df.iloc[start:start + chunk_rows])
+    return spill
+
+def load_forecast_partition(spill, index):
+    """Daily rows of one spill partition, merged across the chunks that wrote them"""
+    prefix = f'part-{index:05d}-'
+    frames = []
+    for path in spill['files']:
+        if not os.path.basename(path).startswith(prefix):
+            continue
+        with open(path, 'rb') as handle:
+            while True:
+                try:
+                    frames.append(pickle.load(handle))
+                except EOFError:
+                    break
+    if not frames:
+        return pd.DataFrame(columns=SERIES_KEY_COLUMNS + ['Date'] + FORECAST_VALUE_COLUMNS)
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby(SERIES_KEY_COLUMNS + ['Date'], sort=False, dropna=False)[FORECAST_VALUE_COLUMNS].sum().reset_index()
+
+def iter_product_forecast_parts(spill, product_info=None):
+    """Product-level forecast rows, one spill partition at a time"""
+    info = None
+    if product_info is not None and not product_info.empty:
+        # Columns the file never had fall back to the generated names, as in the in-memory builder
+        info = product_info.rename(columns={'vendorName': 'VendorName'})
+        info = info[[col for col in info.columns if col == 'ProductID' or info[col].notna().any()]]
+    
+    for index in range(spill['partitions']):
+        daily = load_forecast_partition(spill, index)
+        daily = daily[daily['ProductID'].notna()]
+        if daily.empty:
+            continue
+        product_daily = daily[SERIES_KEY_COLUMNS + ['Date']].copy()
+        product_daily['Quantity'] = daily['Units'] if spill['units'] else daily['Lines']
+        if info is not None:
+            if info['ProductID'].dtype != product_daily['ProductID'].dtype:
+                info = info.astype({'ProductID': product_daily['ProductID'].dtype})
+            product_daily = product_daily.merge(info, on='ProductID', how='left')
+        yield product_forecast_rows(product_daily)
+
+def iter_customer_forecast_parts(spill):
+    """Customer-level forecast rows, one spill partition at a time"""
+    for index in range(spill['partitions']):
+        daily = load_forecast_partition(spill, index)
+        if daily.empty:
+            continue
+        grouped = daily.groupby(['CustomerID', 'FacilityID', 'Date'], sort=False)
+        customer_daily = grouped[FORECAST_VALUE_COLUMNS].sum()
+        if spill['units']:
+            customer_daily = customer_daily.rename(columns={'Units': 'TotalUnits'})
+        else:
+            customer_daily = customer_daily.rename(columns={'Lines': 'TotalItems'})
+        if spill['value']:
+            customer_daily = customer_daily.rename(columns={'Value': 'TotalValue'})
+        customer_daily['UniqueProducts'] = grouped['ProductID'].count()
+        yield customer_forecast_rows(customer_daily.reset_index())
+
+def product_lookup_columns(columns):
+    """Product columns of an order frame and their renames to the lookup schema
     
+    Returns (columns to read, rename dict). Raises ValueError without a ProductID column.
+    """
     # Handle different column names for product information
     product_cols = ['ProductID']
     product_name_col = None
@@ -578,30 +1297,30 @@ def create_product_lookup_table(df):
     
     # Check for product name columns
     for col_name in ['ProductDescription', 'ProductName', 'Productdescription', 'Productname']:
-        if col_name in df.columns:
+        if col_name in columns:
             product_cols.append(col_name)
             product_name_col = col_name
             break
     
     # Check for category columns
     for col_name in ['ProductCategory', 'CategoryName', 'Productcategory', 'Categoryname']:
-        if col_name in df.columns:
+        if col_name in columns:
             product_cols.append(col_name)
             category_name_col = col_name
             break
     
     # Check for vendor columns
     for col_name in ['VendorName', 'Vendorname']:
-        if col_name in df.columns:
+        if col_name in columns:
             product_cols.append(col_name)
             vendor_name_col = col_name
             break
     
     # Ensure we have at least ProductID
-    if 'ProductID' not in df.columns:
+    if 'ProductID' not in columns:
         # Try alternative names
         for col_name in ['Productid', 'ProductId', 'PRODUCTID']:
-            if col_name in df.columns:
+            if col_name in columns:
                 product_cols = [col_name] + [col for col in product_cols if col != 'ProductID']
                 break
         else:
@@ -609,17 +1328,14 @@ def create_product_lookup_table(df):
             raise ValueError("ProductID column is required")
     
     # Create basic product lookup with available columns only
-    available_cols = [col for col in product_cols if col in df.columns]
-    logger.info(f"Using columns for product lookup: {available_cols}")
-    
-    product_lookup = df[available_cols].drop_duplicates()
+    available_cols = [col for col in product_cols if col in columns]
     
     # Standardize column names to match notebook schema
     rename_dict = {}
     
     # Find the actual ProductID column name
     product_id_col = 'ProductID'
-    for col in product_lookup.columns:
+    for col in available_cols:
         if col.lower().replace('_', '') == 'productid':
             product_id_col = col
             break
@@ -627,13 +1343,17 @@ def create_product_lookup_table(df):
     if product_id_col != 'ProductID':
         rename_dict[product_id_col] = 'ProductID'
     
-    if product_name_col and product_name_col in product_lookup.columns:
+    if product_name_col and product_name_col in available_cols:
         rename_dict[product_name_col] = 'ProductName'
-    if category_name_col and category_name_col in product_lookup.columns:
+    if category_name_col and category_name_col in available_cols:
         rename_dict[category_name_col] = 'CategoryName'
-    if vendor_name_col and vendor_name_col in product_lookup.columns:
+    if vendor_name_col and vendor_name_col in available_cols:
         rename_dict[vendor_name_col] = 'vendorName'
     
+    return available_cols, rename_dict
+
+def finish_product_lookup(product_lookup, rename_dict):
+    """Rename distinct product rows to the lookup schema and fill the columns the file lacks"""
     if rename_dict:
         product_lookup = product_lookup.rename(columns=rename_dict)
     
@@ -644,34 +1364,50 @@ def create_product_lookup_table(df):
         product_lookup['CategoryName'] = 'General'
     if 'vendorName' not in product_lookup.columns:
         product_lookup['vendorName'] = 'Vendor' + product_lookup['ProductID'].astype(str).str.replace('PROD', '', regex=False)
+    return product_lookup
+
+def finish_customer_product_lookup(customer_products, product_lookup):
+    """Join per-series order counts and dates to the product details, in the lookup schema"""
+    # Merge with product info to create customer-product lookup matching notebook schema
+    customer_product_lookup = customer_products.merge(product_lookup, on='ProductID', how='left')
+    
+    # Ensure proper data types for dates
+    customer_product_lookup['FirstOrderDate'] = pd.to_datetime(customer_product_lookup['FirstOrderDate'])
+    customer_product_lookup['LastOrderDate'] = pd.to_datetime(customer_product_lookup['LastOrderDate'])
+    
+    # Reorder columns to match notebook schema exactly
+    # Schema: ProductID, ProductName, CategoryName, vendorName, CustomerID, FacilityID, OrderCount, FirstOrderDate, LastOrderDate
+    return customer_product_lookup[[
+        'ProductID', 'ProductName', 'CategoryName', 'vendorName', 
+        'CustomerID', 'FacilityID', 'OrderCount', 'FirstOrderDate', 'LastOrderDate'
+    ]]
+
+def create_product_lookup_table(df):
+    """Create a lookup table for product information matching notebook schema"""
+    logger.info("Creating product lookup table...")
+    
+    # Log available columns for debugging
+    logger.info(f"Available columns: {list(df.columns)}")
+    
+    available_cols, rename_dict = product_lookup_columns(df.columns)
+    logger.info(f"Using columns for product lookup: {available_cols}")
+    product_lookup = finish_product_lookup(df[available_cols].drop_duplicates(), rename_dict)
     
     # Create customer-product relationships matching notebook schema
     # Use OrderUnits if available, otherwise count occurrences
     if 'OrderUnits' in df.columns:
-        customer_products = df.groupby(['CustomerID', 'FacilityID', 'ProductID']).agg({
+        customer_products = df.groupby(['CustomerID', 'FacilityID', 'ProductID'], observed=True).agg({
             'OrderUnits': 'count',  # Number of order lines
             'CreateDate': ['min', 'max']  # First and last order dates
         }).reset_index()
         customer_products.columns = ['CustomerID', 'FacilityID', 'ProductID', 'OrderCount', 'FirstOrderDate', 'LastOrderDate']
     else:
-        customer_products = df.groupby(['CustomerID', 'FacilityID', 'ProductID']).agg({
+        customer_products = df.groupby(['CustomerID', 'FacilityID', 'ProductID'], observed=True).agg({
             'CreateDate': ['count', 'min', 'max']  # Count, first and last order dates
         }).reset_index()
         customer_products.columns = ['CustomerID', 'FacilityID', 'ProductID', 'OrderCount', 'FirstOrderDate', 'LastOrderDate']
     
-    # Merge with product info to create customer-product lookup matching notebook schema
-    customer_product_lookup = customer_products.merge(product_lookup, on='ProductID', how='left')
-    
-    # Ensure proper data types for dates
-    customer_product_lookup['FirstOrderDate'] = pd.to_datetime(customer_product_lookup['FirstOrderDate'])
-    customer_product_lookup['LastOrderDate'] = pd.to_datetime(customer_product_lookup['LastOrderDate'])
-    
-    # Reorder columns to match notebook schema exactly
-    # Schema: ProductID, ProductName, CategoryName, vendorName, CustomerID, FacilityID, OrderCount, FirstOrderDate, LastOrderDate
-    customer_product_lookup = customer_product_lookup[[
-        'ProductID', 'ProductName', 'CategoryName', 'vendorName', 
-        'CustomerID', 'FacilityID', 'OrderCount', 'FirstOrderDate', 'LastOrderDate'
-    ]]
+    customer_product_lookup = finish_customer_product_lookup(customer_products, product_lookup)
     
     logger.info(f"Created product lookup with {len(product_lookup)} unique products")
     logger.info(f"Created customer-product lookup with {len(customer_product_lookup)} relationships")
@@ -698,79 +1434,134 @@ def process_csv_data(file_path):
     
     return processed_data
 
-def save_lookup_tables_to_dynamodb(product_lookup, customer_product_lookup):
-    """Save lookup tables to DynamoDB"""
-    logger.info("Saving lookup tables to DynamoDB...")
-    
-    try:
-        # Use the single ProductLookupTable for all data
-        product_table = dynamodb.Table(product_lookup_table)
-        
-        # Ensure product_lookup is deduplicated by ProductID
-        product_lookup_dedup = product_lookup.drop_duplicates(subset=['ProductID'])
-        logger.info(f"Deduplicated product lookup: {len(product_lookup)} -> {len(product_lookup_dedup)} records")
-        
-        # Save product lookup data with correct key names
-        saved_product_ids = set()
-        with product_table.batch_writer() as batch:
-            for _, row in product_lookup_dedup.iterrows():
-                product_id = str(row['ProductID'])
-                
-                # Skip if we've already processed this product_id
-                if product_id in saved_product_ids:
-                    continue
-                    
-                item = {
-                    'product_id': product_id,  # Match DynamoDB schema
-                    'record_type': 'PRODUCT',  # Distinguish record types
-                    'product_name': str(row['ProductName']),
-                    'category_name': str(row['CategoryName']),
-                    'vendor_name': str(row['vendorName'])
-                }
-                batch.put_item(Item=item)
-                saved_product_ids.add(product_id)
-        
-        logger.info(f"Saved {len(saved_product_ids)} unique product records to DynamoDB")
-        
-        # Ensure customer_product_lookup is deduplicated by composite key
-        customer_product_lookup_dedup = customer_product_lookup.drop_duplicates(subset=['CustomerID', 'FacilityID', 'ProductID'])
-        logger.info(f"Deduplicated customer-product lookup: {len(customer_product_lookup)} -> {len(customer_product_lookup_dedup)} records")
-        
-        # Save customer-product lookup data with correct key names
-        saved_composite_keys = set()
-        with product_table.batch_writer() as batch:
-            for _, row in customer_product_lookup_dedup.iterrows():
-                # Create composite key for customer-product relationships
-                customer_facility_key = f"{row['CustomerID']}#{row['FacilityID']}"
-                product_customer_key = f"{row['ProductID']}#{customer_facility_key}"
-                
-                # Skip if we've already processed this composite key
-                if product_customer_key in saved_composite_keys:
-                    continue
-                
-                item = {
-                    'product_id': product_customer_key,  # Composite key for uniqueness
-                    'customer_facility': customer_facility_key,  # GSI key
-                    'record_type': 'CUSTOMER_PRODUCT',  # Distinguish record types
-                    'customer_id': str(row['CustomerID']),
-                    'facility_id': str(row['FacilityID']),
-                    'base_product_id': str(row['ProductID']),
-                    'product_name': str(row['ProductName']),
-                    'category_name': str(row['CategoryName']),
-                    'vendor_name': str(row['vendorName']),
-                    'order_count': int(row['OrderCount']),
-                    'first_order_date': row['FirstOrderDate'].isoformat(),
-                    'last_order_date': row['LastOrderDate'].isoformat()
-                }
-                batch.put_item(Item=item)
-                saved_composite_keys.add(product_customer_key)
-        
-        logger.info(f"Saved {len(saved_composite_keys)} unique customer-product records to DynamoDB")
+def _isoformat_column(values):
+    """Vectorised Timestamp.isoformat() for a column of dates (NaT stays 'NaT')"""
+    dates = pd.to_datetime(pd.Series(values), errors='coerce').to_numpy(dtype='datetime64[us]')
+    text = np.datetime_as_string(dates.astype('datetime64[s]'), unit='s').astype(object)
+    # isoformat only shows microseconds when there are some
+    fractional = ~np.isnat(dates) & (dates != dates.astype('datetime64[s]'))
+    text[fractional] = np.datetime_as_string(dates[fractional], unit='us')
+    return text
+
+def _items_from_columns(columns):
+    """Zip column lists (native Python values) into DynamoDB items"""
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*(columns[name] for name in names))]
+
+def build_product_items(product_lookup):
+    """PRODUCT items for the lookup table, one per ProductID, built column-wise"""
+    product_ids = product_lookup['ProductID'].astype(str)
+    keep = ~product_ids.duplicated().to_numpy()
+    frame = product_lookup[keep]
+    return _items_from_columns({
+        'product_id': product_ids[keep].tolist(),
+        'record_type': ['PRODUCT'] * len(frame),
+        'product_name': frame['ProductName'].astype(str).tolist(),
+        'category_name': frame['CategoryName'].astype(str).tolist(),
+        'vendor_name': frame['vendorName'].astype(str).tolist()
+    })
+
+def build_customer_product_items(customer_product_lookup):
+    """CUSTOMER_PRODUCT items keyed by ProductID#CustomerID#FacilityID, built column-wise"""
+    customer_ids = customer_product_lookup['CustomerID'].astype(str)
+    facility_ids = customer_product_lookup['FacilityID'].astype(str)
+    product_ids = customer_product_lookup['ProductID'].astype(str)
+    customer_facility = customer_ids + '#' + facility_ids
+    keys = product_ids + '#' + customer_facility
+    keep = ~keys.duplicated().to_numpy()
+    frame = customer_product_lookup[keep]
+    return _items_from_columns({
+        'product_id': keys[keep].tolist(),
+        'customer_facility': customer_facility[keep].tolist(),
+        'record_type': ['CUSTOMER_PRODUCT'] * len(frame),
+        'customer_id': customer_ids[keep].tolist(),
+        'facility_id': facility_ids[keep].tolist(),
+        'base_product_id': product_ids[keep].tolist(),
+        'product_name': frame['ProductName'].astype(str).tolist(),
+        'category_name': frame['CategoryName'].astype(str).tolist(),
+        'vendor_name': frame['vendorName'].astype(str).tolist(),
+        'order_count': pd.to_numeric(frame['OrderCount'], errors='coerce').fillna(0).astype(np.int64).tolist(),
+        'first_order_date': _isoformat_column(frame['FirstOrderDate']).tolist(),
+        'last_order_date': _isoformat_column(frame['LastOrderDate']).tolist()
+    })
+
+def _write_item_segment(table_name, items):
+    """Write one key segment in batches of 25, retrying unprocessed items with backoff"""
+    report = {'written': 0, 'failed': 0, 'retries': 0, 'requests': 0}
+    serializer = TypeSerializer()
+    for start in range(0, len(items), DYNAMODB_BATCH_SIZE):
+        requests = [{'PutRequest': {'Item': {name: serializer.serialize(value) for name, value in item.items()}}}
+                    for item in items[start:start + DYNAMODB_BATCH_SIZE]]
+        attempt = 0
+        while requests:
+            try:
+                report['requests'] += 1
+                response = dynamodb_client.batch_write_item(RequestItems={table_name: requests})
+                unprocessed = response.get('UnprocessedItems', {}).get(table_name, [])
+            except Exception as e:
+                logger.warning(f"Batch write to {table_name} failed: {str(e)}")
+                unprocessed = requests
+            report['written'] += len(requests) - len(unprocessed)
+            requests = unprocessed
+            if not requests:
+                break
+            if attempt >= dynamodb_max_retries:
+                report['failed'] += len(requests)
+                break
+            # Exponential backoff with full jitter
+            attempt += 1
+            report['retries'] += 1
+            time.sleep(random.uniform(0, min(DYNAMODB_MAX_BACKOFF, DYNAMODB_BASE_BACKOFF * 2 ** attempt)))
+    return report
+
+def bulk_write_items(table_name, items, writers=None):
+    """Write items from parallel workers, each owning a hash segment of the key space"""
+    writers = max(1, min(writers or dynamodb_writers, -(-len(items) // DYNAMODB_BATCH_SIZE) or 1))
+    start = time.time()
+    keys = np.array([item['product_id'] for item in items], dtype=object)
+    segment_of = pd.util.hash_array(keys) % np.uint64(writers) if len(items) else np.array([], dtype=np.uint64)
+    segments = [[items[i] for i in np.flatnonzero(segment_of == segment)] for segment in range(writers)]
+    
+    with ThreadPoolExecutor(max_workers=writers) as pool:
+        reports = list(pool.map(lambda segment: _write_item_segment(table_name, segment), segments))
+    elapsed = max(time.time() - start, 1e-6)
+    
+    report = {name: sum(segment[name] for segment in reports) for name in ('written', 'failed', 'retries', 'requests')}
+    report.update({
+        'items': len(items),
+        'segments': writers,
+        'seconds': round(elapsed, 3),
+        'items_per_second': round(report['written'] / elapsed, 1)
+    })
+    return report
+
+def save_lookup_tables_to_dynamodb(product_lookup, customer_product_lookup):
+    """Save lookup tables to DynamoDB and return a write report per record type"""
+    logger.info("Saving lookup tables to DynamoDB...")
+    report = {}
+    
+    try:
+        # Use the single ProductLookupTable for all data
+        for record_type, build_items, lookup in (('PRODUCT', build_product_items, product_lookup),
+                                                 ('CUSTOMER_PRODUCT', build_customer_product_items, customer_product_lookup)):
+            if lookup is None or lookup.empty:
+                logger.warning(f"No {record_type} records to save to DynamoDB")
+                continue
+            items = build_items(lookup)
+            logger.info(f"Deduplicated {record_type} records: {len(lookup)} -> {len(items)}")
+            report[record_type] = bulk_write_items(product_lookup_table, items)
+            result = report[record_type]
+            logger.info(f"Saved {result['written']} {record_type} records to DynamoDB in {result['seconds']}s "
+                        f"({result['items_per_second']} items/s, {result['segments']} writers, {result['retries']} retries)")
+            if result['failed']:
+                logger.error(f"{result['failed']} {record_type} records could not be written to DynamoDB")
         
     except Exception as e:
         logger.error(f"Error saving to DynamoDB: {str(e)}")
         # Don't fail the entire process if DynamoDB save fails
-        pass
+        report['error'] = str(e)
+    
+    return report
 
 def create_lookup_files(df):
     """Create product and customer-product lookup files"""
@@ -780,7 +1571,7 @@ def create_lookup_files(df):
     product_lookup['vendorName'] = 'Vendor' + product_lookup['ProductID'].astype(str).str.replace('PROD', '')
 
     # Customer-Product Lookup
-    customer_product_lookup = df.groupby(['CustomerID', 'FacilityID', 'ProductID']).agg(
+    customer_product_lookup = df.groupby(['CustomerID', 'FacilityID', 'ProductID'], observed=True).agg(
         OrderCount=('Quantity', 'count'),
         FirstOrderDate=('CreateDate', 'min'),
         LastOrderDate=('CreateDate', 'max')
@@ -791,377 +1582,2588 @@ def create_lookup_files(df):
     
     return product_lookup, customer_product_lookup
 
+def resolve_output_format(requested=None):
+    """Return the artifact format to write, falling back to CSV if Parquet is unavailable"""
+    fmt = (requested or output_format or 'csv').lower()
+    if fmt not in ('csv', 'parquet'):
+        logger.warning(f"Unknown output format '{fmt}', writing CSV")
+        return 'csv'
+    if fmt == 'parquet' and pyarrow is None:
+        logger.warning("Parquet output requested but pyarrow is not installed, writing CSV")
+        return 'csv'
+    return fmt
+
+def prepare_columnar_frame(frame):
+    """Give artifact columns explicit types so Parquet readers need no re-parsing"""
+    frame = frame.copy()
+    for col in frame.columns:
+        if col in OUTPUT_DATE_COLUMNS and not pd.api.types.is_datetime64_any_dtype(frame[col]):
+            frame[col] = pd.to_datetime(frame[col], errors='coerce')
+        elif frame[col].dtype == 'object':
+            # Parquet needs one physical type per column; mixed IDs become strings
+            inferred = pd.api.types.infer_dtype(frame[col], skipna=True)
+            if inferred not in ('string', 'empty'):
+                frame[col] = frame[col].astype(str).where(frame[col].notna())
+    return frame
+
+class S3MultipartWriter(io.RawIOBase):
+    """Writable file that streams into an S3 object as multipart-upload parts
+    
+    Serialised bytes are cut into UPLOAD_PART_BYTES parts that upload on the
+    shared upload pool while serialisation continues. At most
+    max_pending_parts parts wait per artifact, so memory stays bounded. An
+    artifact smaller than one part is sent with a single put_object.
+    """
+    
+    def __init__(self, bucket, key, part_bytes=None, max_pending_parts=2):
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.part_bytes = part_bytes or UPLOAD_PART_BYTES
+        self.max_pending_parts = max_pending_parts
+        self.bytes_written = 0
+        self.parts_uploaded = 0
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._pending = []
+        self._parts = []
+    
+    def writable(self):
+        return True
+    
+    def tell(self):
+        return self.bytes_written
+    
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_bytes:
+            self._send_part(bytes(self._buffer[:self.part_bytes]))
+            del self._buffer[:self.part_bytes]
+        return len(data)
+    
+    def _upload_part(self, number, data):
+        response = s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                         PartNumber=number, Body=data)
+        return {'PartNumber': number, 'ETag': response['ETag']}
+    
+    def _send_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        while len(self._pending) >= self.max_pending_parts:
+            self._parts.append(self._pending.pop(0).result())
+        number = len(self._parts) + len(self._pending) + 1
+        self._pending.append(get_upload_pool().submit(self._upload_part, number, data))
+        self.parts_uploaded += 1
+    
+    def close(self):
+        """Upload what is left and complete the object"""
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._send_part(bytes(self._buffer))
+                self._parts.extend(future.result() for future in self._pending)
+                s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                    MultipartUpload={'Parts': self._parts})
+        except Exception:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        super().close()
+    
+    def abort(self):
+        """Drop the upload without creating the object"""
+        if self.closed:
+            return
+        for future in self._pending:
+            future.cancel()
+        if self._upload_id is not None:
+            try:
+                s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.warning(f"Could not abort multipart upload of {self.key}: {str(e)}")
+        self._pending = []
+        self._buffer = bytearray()
+        io.RawIOBase.close(self)
+
+def get_upload_pool():
+    """Thread pool shared by the part uploads of every artifact"""
+    global _upload_pool
+    if _upload_pool is None:
+        _upload_pool = ThreadPoolExecutor(max_workers=upload_workers)
+    return _upload_pool
+
+def write_output_artifact(frame, local_path, fmt):
+    """Serialise an output artifact to a local file or writable stream in the given format"""
+    if fmt == 'parquet':
+        prepare_columnar_frame(frame).to_parquet(local_path, index=False, compression=parquet_compression)
+    else:
+        frame.to_csv(local_path, index=False)
+    return local_path
+
+def write_output_parts(parts, local_path, fmt):
+    """Serialise frames one after another into a single artifact and return the rows written
+    
+    CSV parts after the first are written without a header; Parquet parts
+    become row groups of one file with the first part's schema.
+    """
+    rows = 0
+    parquet_writer = None
+    try:
+        for part in parts:
+            if part is None or part.empty:
+                continue
+            if fmt == 'parquet':
+                table = pyarrow.Table.from_pandas(prepare_columnar_frame(part), preserve_index=False,
+                                                  schema=parquet_writer.schema if parquet_writer else None)
+                if parquet_writer is None:
+                    parquet_writer = pyarrow.parquet.ParquetWriter(local_path, table.schema,
+                                                                   compression=parquet_compression)
+                parquet_writer.write_table(table)
+            else:
+                part.to_csv(local_path, index=False, header=rows == 0)
+            rows += len(part)
+    finally:
+        if parquet_writer is not None:
+            parquet_writer.close()
+    return rows
+
+def upload_output_artifact(frame, name, prefix, timestamp, fmt, label):
+    """Stream an artifact to the processed bucket and return its upload report (None if empty)
+    
+    frame may also be an iterator of frames (e.g. forecast partitions), which
+    are written into the artifact as they are produced.
+    """
+    partitioned = frame is not None and not isinstance(frame, pd.DataFrame)
+    if frame is None or (not partitioned and frame.empty):
+        logger.warning(f"{label} is None or empty, skipping save")
+        return None
+    
+    key = f'{prefix}/{timestamp}/{name}.{fmt}'
+    start, cpu_start = time.time(), time.thread_time()
+    writer = S3MultipartWriter(processed_bucket, key)
+    try:
+        if partitioned:
+            rows = write_output_parts(frame, writer, fmt)
+            if not rows:
+                writer.abort()
+                logger.warning(f"{label} is empty, skipping save")
+                return None
+        else:
+            write_output_artifact(frame, writer, fmt)
+            rows = len(frame)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    elapsed = max(time.time() - start, 1e-6)
+    
+    size_mb = writer.bytes_written / (1024 * 1024)
+    logger.info(f"Uploaded {label.lower()} ({size_mb:.2f} MB in {max(writer.parts_uploaded, 1)} parts, "
+                f"{elapsed:.2f}s, {size_mb / elapsed:.1f} MB/s) to {key}")
+    return {
+        'artifact': name,
+        'key': key,
+        'bytes': writer.bytes_written,
+        'parts': max(writer.parts_uploaded, 1),
+        'rows': int(rows),
+        'seconds': round(elapsed, 3),
+        'cpu_seconds': round(time.thread_time() - cpu_start, 3),  # Serialising thread only
+        'mb_per_second': round(size_mb / elapsed, 2)
+    }
+
+def save_output_artifact(frame, name, prefix, timestamp, fmt, label):
+    """Stream an artifact to the processed bucket and return its key"""
+    report = upload_output_artifact(frame, name, prefix, timestamp, fmt, label)
+    return report['key'] if report else None
+
+def save_output_artifacts(artifacts, timestamp, fmt):
+    """Serialise and upload all artifacts concurrently
+    
+    artifacts is a list of (frame, name, prefix, label). Returns a dict of
+    artifact name -> key (None when skipped) and the list of upload reports.
+    """
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, len(artifacts))) as pool:
+        futures = [(name, pool.submit(upload_output_artifact, frame, name, prefix, timestamp, fmt, label))
+                   for frame, name, prefix, label in artifacts]
+        reports = [(name, future.result()) for name, future in futures]
+    elapsed = max(time.time() - start, 1e-6)
+    
+    keys = {name: report['key'] if report else None for name, report in reports}
+    reports = [report for _, report in reports if report]
+    total_mb = sum(report['bytes'] for report in reports) / (1024 * 1024)
+    logger.info(f"Saved {len(reports)} artifacts ({total_mb:.2f} MB) in {elapsed:.2f}s "
+                f"({total_mb / elapsed:.1f} MB/s overall)")
+    return keys, reports
+
+DEEPAR_CAT_COLUMNS = ['customer_id', 'facility_id', 'category_name']
+# Normalised day of week and month as the notebook feeds them to DeepAR, pre-rendered as JSON
+DEEPAR_DAY_OF_WEEK_TEXT = np.array([json.dumps(day / 6) for day in range(7)], dtype=object)
+DEEPAR_MONTH_TEXT = np.array([json.dumps(month / 11) for month in range(12)], dtype=object)
+
+def new_deepar_encoders():
+    """Empty value -> code mappings for the DeepAR categorical features"""
+    return {col: {} for col in DEEPAR_CAT_COLUMNS}
+
+def _encode_deepar_column(values, mapping):
+    """Integer codes for values, giving unseen values the next code in order of appearance"""
+    values = pd.Series(values).astype(str)
+    for value in values.unique():
+        if value not in mapping:
+            mapping[value] = len(mapping)
+    return values.map(mapping).to_numpy()
+
+def _joined_json_values(codes, table):
+    """One ', '-joined string of table[codes] and the character offset where each value starts"""
+    lengths = np.array([len(text) for text in table], dtype=np.int64) + 2
+    return ', '.join(table[codes].tolist()) + ', ', np.r_[0, np.cumsum(lengths[codes])]
+
+def deepar_lines(forecast, encoders, end_date=None, prediction_length=None, context_length=None):
+    """DeepAR train and test JSON Lines from product forecast rows
+    
+    Each item becomes a dense daily series from its first order to end_date
+    (or its own last order), with days without orders as zero. The test line
+    holds the whole series and the train line drops the last
+    prediction_length days. Items shorter than context_length +
+    prediction_length days are skipped. Returns (train_lines, test_lines,
+    skipped_items).
+    """
+    prediction_length = prediction_length or DEEPAR_PREDICTION_LENGTH
+    context_length = context_length or DEEPAR_CONTEXT_LENGTH
+    if forecast is None or forecast.empty:
+        return [], [], 0
+    if not forecast['item_id'].is_monotonic_increasing:
+        forecast = forecast.sort_values('item_id', kind='mergesort')
+    
+    days = pd.to_datetime(forecast['timestamp']).to_numpy().astype('datetime64[D]').astype(np.int64)
+    values = np.nan_to_num(pd.to_numeric(forecast['target_value'], errors='coerce').to_numpy(dtype=np.float64))
+    starts, counts = _series_segments(forecast, ['item_id'])
+    row_item = np.repeat(np.arange(len(starts)), counts)
+    first = np.minimum.reduceat(days, starts)
+    last = np.maximum.reduceat(days, starts)
+    if end_date is not None:
+        last = np.maximum(last, np.datetime64(pd.Timestamp(end_date).normalize().date(), 'D').astype(np.int64))
+    lengths = last - first + 1
+    keep = lengths >= context_length + prediction_length
+    if not keep.any():
+        return [], [], len(starts)
+    
+    # Scatter the order days of every kept item into one flat zero-filled array
+    lengths = lengths[keep]
+    offsets = np.r_[0, np.cumsum(lengths)]
+    kept_position = np.cumsum(keep) - 1
+    rows = keep[row_item]
+    positions = offsets[kept_position[row_item[rows]]] + days[rows] - first[row_item[rows]]
+    target = np.zeros(offsets[-1])
+    np.add.at(target, positions, values[rows])
+    dense_days = np.repeat(first[keep] - offsets[:-1], lengths) + np.arange(offsets[-1])
+    # Each value array is rendered as one comma-separated string; items take character slices of it
+    target_codes, target_values = pd.factorize(target)
+    months = dense_days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12
+    texts = [_joined_json_values(target_codes, np.array([json.dumps(float(value)) for value in target_values],
+                                                        dtype=object)),
+             _joined_json_values((dense_days + 3) % 7, DEEPAR_DAY_OF_WEEK_TEXT),  # 1970-01-01 was a Thursday
+             _joined_json_values(months, DEEPAR_MONTH_TEXT)]
+    
+    heads = forecast.iloc[starts[keep]]
+    codes = np.column_stack([_encode_deepar_column(heads[col], encoders[col]) for col in DEEPAR_CAT_COLUMNS])
+    start_text = first[keep].astype('datetime64[D]').astype(str)
+    
+    train_lines, test_lines = [], []
+    for index, item_id in enumerate(heads['item_id'].astype(str)):
+        begin, end = offsets[index], offsets[index + 1]
+        cat = ', '.join(str(code) for code in codes[index])
+        for lines, stop in ((train_lines, end - prediction_length), (test_lines, end)):
+            target_json, day_json, month_json = (text[bounds[begin]:bounds[stop] - 2] for text, bounds in texts)
+            lines.append(f'{{"start": "{start_text[index]}", "target": [{target_json}], "cat": [{cat}], '
+                         f'"dynamic_feat": [[{day_json}], [{month_json}]], "item_id": {json.dumps(item_id)}}}')
+    return train_lines, test_lines, int((~keep).sum())
+
+def save_deepar_dataset(parts, timestamp, end_date=None):
+    """Stream DeepAR train/test JSON Lines and their metadata to the processed bucket
+    
+    parts is the product forecast data as one frame or an iterator of
+    item-contiguous frames. Returns a dict of keys and counts, or None when
+    no item is long enough.
+    """
+    if isinstance(parts, pd.DataFrame):
+        if end_date is None and not parts.empty:
+            end_date = parts['timestamp'].max()
+        parts = [parts]
+    
+    start = time.time()
+    keys = {channel: f'{deepar_prefix}/{timestamp}/{channel}/{channel}.jsonl' for channel in ('train', 'test')}
+    writers = {channel: S3MultipartWriter(processed_bucket, key) for channel, key in keys.items()}
+    encoders = new_deepar_encoders()
+    series = skipped = 0
+    try:
+        for part in parts:
+            train_lines, test_lines, short = deepar_lines(part, encoders, end_date)
+            skipped += short
+            if not train_lines:
+                continue
+            writers['train'].write(('\n'.join(train_lines) + '\n').encode('utf-8'))
+            writers['test'].write(('\n'.join(test_lines) + '\n').encode('utf-8'))
+            series += len(train_lines)
+        if not series:
+            for writer in writers.values():
+                writer.abort()
+            logger.warning(f"No item has {DEEPAR_CONTEXT_LENGTH + DEEPAR_PREDICTION_LENGTH} days of history, "
+                           f"skipping DeepAR dataset")
+            return None
+        for writer in writers.values():
+            writer.close()
+    except Exception:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    
+    # Cardinality and code mappings are what the training job and the predictors need
+    metadata = {
+        'prediction_length': DEEPAR_PREDICTION_LENGTH,
+        'context_length': DEEPAR_CONTEXT_LENGTH,
+        'num_dynamic_feat': 2,
+        'cat_features': DEEPAR_CAT_COLUMNS,
+        'cardinality': [len(encoders[col]) for col in DEEPAR_CAT_COLUMNS],
+        'mappings': encoders,
+        'series': series,
+        'skipped_short_series': skipped
+    }
+    keys['metadata'] = f'{deepar_prefix}/{timestamp}/metadata.json'
+    s3_client.put_object(Bucket=processed_bucket, Key=keys['metadata'], Body=json.dumps(metadata, indent=2))
+    logger.info(f"Wrote DeepAR dataset of {series} series ({skipped} too short) in {time.time() - start:.2f}s "
+                f"to {deepar_prefix}/{timestamp}/")
+    return dict(keys, series=series, skipped=skipped)
+
 def get_file_size_mb(file_path):
     """Get file size in MB"""
     return os.path.getsize(file_path) / (1024 * 1024)
 
-def split_large_file_and_process(file_path, max_chunk_rows=50000):
-    """Split very large files into smaller files and process them separately"""
-    logger.info(f"Splitting large file into chunks of max {max_chunk_rows} rows")
+class S3RangeReader(io.RawIOBase):
+    """Seekable read-only file over an S3 object fetched as byte ranges
     
-    # Get total rows
-    total_rows = sum(1 for _ in open(file_path)) - 1  # Subtract header
-    logger.info(f"Total rows to process: {total_rows}")
+    The next STREAM_PREFETCH_PARTS ranges are requested on a thread pool while
+    the parser works on the current one, so network transfer overlaps parsing
+    and at most that many parts are held in memory.
+    """
     
-    if total_rows <= max_chunk_rows:
-        # File is small enough to process normally
-        return process_large_file_in_chunks(file_path, chunk_size=10000)
+    def __init__(self, bucket, key, size, part_bytes=None, prefetch_parts=None):
+        super().__init__()
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.part_bytes = part_bytes or STREAM_PART_BYTES
+        self.prefetch_parts = max(1, prefetch_parts or STREAM_PREFETCH_PARTS)
+        self.position = 0
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._executor = ThreadPoolExecutor(max_workers=self.prefetch_parts)
+        self._pending = {}
+        self._current_index = None
+        self._current_data = b''
     
-    # Split into multiple files and process each
-    chunk_results = []
-    chunk_number = 0
+    def readable(self):
+        return True
     
-    # Read header
-    with open(file_path, 'r') as f:
-        header = f.readline().strip()
+    def seekable(self):
+        return True
     
-    # Process in chunks
-    for chunk in pd.read_csv(file_path, chunksize=max_chunk_rows):
-        chunk_number += 1
-        logger.info(f"Processing chunk {chunk_number} with {len(chunk)} rows")
-        
-        # Normalize column names
-        chunk.columns = [col.strip().replace(' ', '').replace('_', '').title() for col in chunk.columns]
-        col_map = {
-            'Customerid': 'CustomerID',
-            'Facilityid': 'FacilityID', 
-            'Productid': 'ProductID',
-            'Productdescription': 'ProductDescription',
-            'Productcategory': 'ProductCategory',
-            'Createdate': 'CreateDate',
-            'Quantity': 'Quantity',
-            'ProductName': 'ProductDescription',
-            'CategoryName': 'ProductCategory',
-            'Price': 'UnitPrice',
-            'VendorName': 'VendorName'
-        }
-        chunk.rename(columns={k: v for k, v in col_map.items() if k in chunk.columns}, inplace=True)
-        
-        # Basic date parsing
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = max(0, base + offset)
+        return self.position
+    
+    def _fetch_part(self, index):
+        start = index * self.part_bytes
+        end = min(self.size, start + self.part_bytes) - 1
+        body = s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end}')['Body'].read()
+        self.bytes_fetched += len(body)
+        self.requests += 1
+        return body
+    
+    def _load_part(self, index):
+        last_index = (self.size - 1) // self.part_bytes
+        for ahead in range(index, min(index + self.prefetch_parts, last_index + 1)):
+            if ahead not in self._pending and ahead != self._current_index:
+                self._pending[ahead] = self._executor.submit(self._fetch_part, ahead)
+        # Parts behind the read position are only needed again after a seek
+        for stale in [i for i in self._pending if i < index]:
+            self._pending.pop(stale).cancel()
+        self._current_data = self._pending.pop(index).result()
+        self._current_index = index
+    
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index, offset = divmod(self.position, self.part_bytes)
+        if index != self._current_index:
+            self._load_part(index)
+        count = min(len(buffer), len(self._current_data) - offset)
+        buffer[:count] = self._current_data[offset:offset + count]
+        self.position += count
+        return count
+    
+    def close(self):
+        if not self.closed:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._pending = {}
+            self._current_data = b''
+        super().close()
+
+def open_s3_input(bucket, key, size):
+    """Open an S3 object as a buffered, seekable stream for the CSV readers"""
+    return io.BufferedReader(S3RangeReader(bucket, key, size), buffer_size=1024 * 1024)
+
+def should_stream_input(size_bytes):
+    """Whether to parse the upload straight from S3 instead of staging it in /tmp"""
+    if input_mode == 'stream':
+        return True
+    if input_mode != 'auto' or size_bytes is None:
+        return False
+    # Leave /tmp room for the output artifacts written after processing
+    tmp_free = shutil.disk_usage('/tmp').free
+    return size_bytes > stream_threshold_mb * 1024 * 1024 or size_bytes > tmp_free * 0.5
+
+class DecompressedReader(io.RawIOBase):
+    """Readable stream of the decompressed bytes of a gzip or zstd upload
+    
+    The readers rewind their input to read it again, so seeking back restarts
+    decompression from the start of the compressed stream and seeking forward
+    decompresses and discards. The decompressed size is not known, so seeks
+    relative to the end are not supported.
+    """
+    
+    def __init__(self, compressed, compression, path=None):
+        super().__init__()
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd-compressed uploads need the zstandard package")
+        self.compressed = compressed
+        self.compression = compression
+        self.path = path  # Downloaded file to delete on release, if any
+        self.position = 0
+        self._decoder = None
+        self._restart()
+    
+    def _restart(self):
+        if self._decoder is not None:
+            self._decoder.close()
+        self.compressed.seek(0)
+        if self.compression == 'gzip':
+            self._decoder = gzip.GzipFile(fileobj=self.compressed, mode='rb')
+        else:
+            self._decoder = zstandard.ZstdDecompressor().stream_reader(self.compressed, read_across_frames=True,
+                                                                      closefd=False)
+        self.position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("the decompressed size of the upload is not known")
+        if offset < self.position:
+            self._restart()
+        while self.position < offset:
+            skipped = len(self._decoder.read(min(offset - self.position, 1024 * 1024)))
+            if not skipped:
+                break
+            self.position += skipped
+        return self.position
+    
+    def readinto(self, buffer):
+        count = self._decoder.readinto(buffer)
+        self.position += count
+        return count
+    
+    def close(self):
+        if not self.closed:
+            self._decoder.close()
+            self.compressed.close()
+        super().close()
+
+def upload_compression(key, source=None):
+    """'gzip' or 'zstd' from the key's suffix or the source's first bytes, None for plain CSV"""
+    compression = UPLOAD_COMPRESSION_SUFFIXES.get(os.path.splitext(key)[1].lower())
+    if compression is None and source is not None:
+        head = _read_head(source, 4)
+        compression = next((name for magic, name in UPLOAD_COMPRESSION_MAGIC.items() if head.startswith(magic)), None)
+    return compression
+
+def open_decompressed(compressed, compression, path=None):
+    """Open a compressed binary stream as a buffered stream of its decompressed bytes"""
+    return io.BufferedReader(DecompressedReader(compressed, compression, path), buffer_size=1024 * 1024)
+
+def is_compressed_input(source):
+    """Whether an order input is the decompressed stream of a compressed upload"""
+    return isinstance(getattr(source, 'raw', None), DecompressedReader)
+
+def estimate_decompressed_bytes(source, compressed_bytes, sample_bytes=None):
+    """Decompressed size of a compressed input, extrapolated from its first sample_bytes of compressed data
+    
+    Exact when the sample reaches the end of the stream. Leaves the source at its start.
+    """
+    sample_bytes = sample_bytes or DECOMPRESS_SAMPLE_BYTES
+    compressed = source.raw.compressed
+    _rewind(source)
+    decompressed = 0
+    while compressed.tell() < sample_bytes:
+        block = source.read(1024 * 1024)
+        if not block:
+            _rewind(source)
+            return decompressed
+        decompressed += len(block)
+    ratio = decompressed / compressed.tell()
+    _rewind(source)
+    return int(compressed_bytes * ratio)
+
+def open_order_input(bucket, key, size_bytes=None):
+    """Stream or download the upload, returning (source for the readers, size in MB)
+    
+    The source is a local path when the file was downloaded, otherwise a
+    seekable stream over the S3 object. Compressed uploads are returned as a
+    stream of their decompressed bytes, with the estimated decompressed size.
+    """
+    if size_bytes is None and input_mode == 'stream':
+        size_bytes = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+    
+    if should_stream_input(size_bytes):
+        logger.info(f"Streaming {key} from S3 in {STREAM_PART_BYTES // (1024 * 1024)} MB parts "
+                    f"({STREAM_PREFETCH_PARTS} in flight)")
+        source, compressed_bytes = open_s3_input(bucket, key, int(size_bytes)), int(size_bytes)
+    else:
+        source = f'/tmp/{os.path.basename(key)}'
+        s3_client.download_file(bucket, key, source)
+        compressed_bytes = os.path.getsize(source)
+    
+    compression = upload_compression(key, source)
+    if compression is None:
+        return source, compressed_bytes / (1024 * 1024)
+    
+    order_input = open_decompressed(open(source, 'rb') if isinstance(source, str) else source, compression,
+                                    path=source if isinstance(source, str) else None)
+    decompressed_bytes = estimate_decompressed_bytes(order_input, compressed_bytes)
+    logger.info(f"{key} is {compression}-compressed: {compressed_bytes / (1024 * 1024):.1f} MB, about "
+                f"{decompressed_bytes / (1024 * 1024):.1f} MB decompressed "
+                f"({decompressed_bytes / max(compressed_bytes, 1):.1f}x)")
+    return order_input, decompressed_bytes / (1024 * 1024)
+
+def release_order_input(source):
+    """Delete a downloaded upload or close its stream"""
+    if isinstance(source, str):
+        _remove_order_file(source)
+        return
+    raw = source.raw
+    source.close()
+    if isinstance(raw, DecompressedReader):
+        if raw.path:
+            _remove_order_file(raw.path)
+            return
+        raw = raw.compressed.raw
+    if isinstance(raw, S3RangeReader):
+        logger.info(f"Streamed {raw.bytes_fetched / (1024 * 1024):.1f} MB in {raw.requests} range requests")
+
+def _remove_order_file(path):
+    """Delete a staged upload, warning when /tmp cannot be cleaned up"""
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Could not remove {path}: {str(e)}")
+
+def _rewind(source):
+    """Move a stream back to its start so it can be read again (paths are left alone)"""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+# Raw order file schema: normalised header name -> (column name used by the
+# stages, dtype it is read with). Only these columns are read. Repeated
+# strings (IDs, names and the CreateDate text) are read as categoricals;
+# quantities are coerced to float64 after reading so stray text becomes NaN.
+ORDER_SCHEMA = {
+    'customerid': ('CustomerID', 'category'),
+    'facilityid': ('FacilityID', 'category'),
+    'productid': ('ProductID', 'category'),
+    'productdescription': ('ProductDescription', 'category'),
+    'productname': ('ProductDescription', 'category'),
+    'productcategory': ('ProductCategory', 'category'),
+    'categoryname': ('ProductCategory', 'category'),
+    'vendorname': ('VendorName', 'category'),
+    'createdate': ('CreateDate', 'category'),
+    'quantity': ('Quantity', 'float64'),
+    'orderunits': ('OrderUnits', 'float64')
+}
+REQUIRED_ORDER_COLUMNS = ['CustomerID', 'FacilityID', 'ProductID', 'CreateDate']
+ID_COLUMNS = ['CustomerID', 'FacilityID', 'ProductID']
+ORDER_COLUMN_NAMES = sorted({name for name, _ in ORDER_SCHEMA.values()})
+
+def resolve_read_plan(file_path):
+    """Resolve a raw file's header once into usecols, dtypes and column names"""
+    _rewind(file_path)
+    header = pd.read_csv(file_path, nrows=0).columns
+    plan = {'usecols': [], 'dtype': {}, 'rename': {}, 'numeric': []}
+    for raw_name in header:
+        normalized = str(raw_name).strip().replace(' ', '').replace('_', '').lower()
+        if normalized not in ORDER_SCHEMA:
+            continue
+        name, dtype = ORDER_SCHEMA[normalized]
+        if name in plan['rename'].values():
+            continue  # e.g. ProductName when ProductDescription is also present
+        plan['usecols'].append(raw_name)
+        plan['rename'][raw_name] = name
+        if dtype == 'category':
+            plan['dtype'][raw_name] = 'category'
+        else:
+            plan['numeric'].append(name)
+    
+    missing = [name for name in REQUIRED_ORDER_COLUMNS if name not in plan['rename'].values()]
+    if missing:
+        logger.warning(f"Order file is missing expected columns: {missing}")
+    logger.info(f"Read plan: {plan['rename']} (skipping {len(header) - len(plan['usecols'])} columns)")
+    return plan
+
+def _apply_read_plan(frame, plan):
+    """Rename a frame read with a plan and coerce its numeric columns"""
+    frame = frame.rename(columns=plan['rename'])
+    for name in ID_COLUMNS:
+        # Categorical reads keep categories as text; numeric IDs stay numbers as before
+        if name in frame.columns and isinstance(frame[name].dtype, pd.CategoricalDtype):
+            numeric_categories = pd.to_numeric(frame[name].cat.categories, errors='coerce')
+            if len(numeric_categories) and not numeric_categories.isna().any() and numeric_categories.is_unique:
+                frame[name] = frame[name].cat.rename_categories(numeric_categories)
+    for name in plan['numeric']:
+        values = frame[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Text from the Arrow engine: parse each distinct value once, missing codes pick the NaN
+            numbers = pd.to_numeric(values.cat.categories, errors='coerce').to_numpy(dtype=np.float64)
+            frame[name] = np.append(numbers, np.nan)[values.cat.codes.to_numpy()]
+        else:
+            frame[name] = pd.to_numeric(values, errors='coerce').astype(np.float64)
+    return frame
+
+def resolve_csv_engine(requested=None):
+    """CSV engine to parse with, falling back to pandas when pyarrow is not installed"""
+    engine = (requested or csv_engine).lower()
+    if engine == 'arrow' and pyarrow is None:
+        logger.warning("CSV_ENGINE=arrow needs pyarrow, parsing with pandas")
+        return 'pandas'
+    return 'arrow' if engine == 'arrow' else 'pandas'
+
+def _arrow_csv_options(plan):
+    """Read every planned column as dictionary-encoded text, like pandas' category reads
+    
+    Numeric columns are parsed from their distinct values afterwards, so bad
+    values become NaN as with pandas instead of failing the whole block.
+    """
+    text = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    read_options = pyarrow.csv.ReadOptions(use_threads=True, block_size=CSV_ARROW_BLOCK_BYTES)
+    convert_options = pyarrow.csv.ConvertOptions(include_columns=plan['usecols'], strings_can_be_null=True,
+                                                 column_types={col: text for col in plan['usecols']})
+    return read_options, convert_options
+
+def _sorted_used_categories(values):
+    """Categorical holding only the categories its rows use, sorted as pandas' reads sort them"""
+    codes = values.cat.codes.to_numpy()
+    categories = values.cat.categories
+    used = np.flatnonzero(np.bincount(codes[codes >= 0], minlength=len(categories)))
+    order = categories[used].argsort()
+    # One slot past the end stays -1 so missing codes remain missing
+    remap = np.full(len(categories) + 1, -1, dtype=codes.dtype)
+    remap[used[order]] = np.arange(len(used))
+    return pd.Categorical.from_codes(remap[codes], categories[used[order]])
+
+def _arrow_to_frame(table, plan, start=0):
+    """Typed order frame from an Arrow table, indexed from start like pandas' chunks"""
+    frame = table.to_pandas(split_blocks=True)
+    frame.index = pd.RangeIndex(start, start + len(frame))
+    for col in plan['dtype']:
+        # pandas sorts the categories it reads, Arrow keeps a batch's dictionary in first-seen order
+        frame[col] = _sorted_used_categories(frame[col])
+    return _apply_read_plan(frame, plan)
+
+def _iter_arrow_chunks(file_path, plan, chunksize):
+    """Chunks of chunksize rows (the last may be shorter) from Arrow's streaming reader"""
+    read_options, convert_options = _arrow_csv_options(plan)
+    reader = pyarrow.csv.open_csv(file_path, read_options=read_options, convert_options=convert_options)
+    batches, rows, start = [], 0, 0
+    for batch in reader:
+        batches.append(batch)
+        rows += batch.num_rows
+        while rows >= chunksize:
+            table = pyarrow.Table.from_batches(batches)
+            yield _arrow_to_frame(table.slice(0, chunksize), plan, start)
+            start += chunksize
+            rest = table.slice(chunksize)
+            batches, rows = rest.to_batches(), rest.num_rows
+    if rows or not start:
+        # A header-only file still gives one empty chunk, as pandas does
+        yield _arrow_to_frame(pyarrow.Table.from_batches(batches, schema=reader.schema), plan, start)
+
+def read_orders(file_path, read_plan=None, **read_kwargs):
+    """Read an order file (or iterate its chunks when chunksize is given) using its read plan"""
+    plan = read_plan or resolve_read_plan(file_path)
+    _rewind(file_path)
+    if resolve_csv_engine() == 'arrow' and set(read_kwargs) <= {'chunksize'}:
+        if read_kwargs.get('chunksize'):
+            return _iter_arrow_chunks(file_path, plan, read_kwargs['chunksize'])
+        read_options, convert_options = _arrow_csv_options(plan)
+        return _arrow_to_frame(pyarrow.csv.read_csv(file_path, read_options=read_options,
+                                                    convert_options=convert_options), plan)
+    reader = pd.read_csv(file_path, usecols=plan['usecols'], dtype=plan['dtype'], **read_kwargs)
+    if read_kwargs.get('chunksize'):
+        return (_apply_read_plan(chunk, plan) for chunk in reader)
+    return _apply_read_plan(reader, plan)
+
+def concat_order_chunks(frames, **concat_kwargs):
+    """Concatenate chunks, unioning categorical columns so they stay categorical"""
+    frames = list(frames)
+    for col in frames[0].columns:
+        if all(col in frame.columns and isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            try:
+                categories = pd.api.types.union_categoricals([frame[col] for frame in frames], sort_categories=True).categories
+            except TypeError:
+                # Numeric IDs in some chunks, text in others
+                for frame in frames:
+                    frame[col] = frame[col].astype(object)
+                continue
+            for frame in frames:
+                frame[col] = frame[col].cat.set_categories(categories)
+    return pd.concat(frames, **concat_kwargs)
+
+def parse_order_dates(chunk, date_parse_state=None):
+    """Parse CreateDate for one chunk of order lines, reusing the file's detected format"""
+    chunk['CreateDate'] = parse_create_dates(chunk['CreateDate'], date_parse_state)
+    return chunk
+
+def add_basic_temporal_features(chunk):
+    """Date string and the few calendar columns the chunked path keeps"""
+    calendar = calendar_features(chunk['CreateDate'], ['Date', 'OrderYear', 'OrderMonth', 'OrderDayOfWeek'])
+    for col in calendar.columns:
+        chunk[col] = calendar[col]
+    return chunk
+
+# Parallel chunk execution. Lambda has no /dev/shm, so multiprocessing.Pool
+# and Queue cannot be used; workers are plain Processes fed over Pipes. Rows
+# are routed to workers by a hash of CustomerID, so every series lives in
+# exactly one worker and the partial results are concatenated, not merged.
+# Each worker acknowledges every chunk, which bounds the chunks in flight.
+CHUNK_ROW_BYTES = 600  # Rough in-memory size of one parsed order line
+
+def plan_chunk_workers(chunk_rows, max_in_flight=2, row_bytes=None, memory_mb=None):
+    """Number of worker processes for the available cores and memory (1 means serial)"""
+    if chunk_workers_setting != 'auto':
+        return max(1, int(chunk_workers_setting))
+    
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    
+    # Keep half of the function memory for the parent and the final outputs
+    memory_mb = memory_mb or int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', '0'))
+    if memory_mb:
+        per_worker_mb = max(1.0, chunk_rows * (row_bytes or CHUNK_ROW_BYTES) * (max_in_flight + 1) / (1024 * 1024))
+        cores = min(cores, int(memory_mb * 0.5 // per_worker_mb))
+    return max(1, cores)
+
+# Execution planning: the strategy for an upload is sized from a sample of its
+# head rather than from fixed file-size cut-offs. The sample is parsed with the
+# read plan and given its temporal features, which gives the in-memory bytes
+# per row; the file size then gives the row count and the sample's series
+# frequencies the number of distinct series. Each path is chosen only if its
+# working set, as a multiple of the parsed frame, fits the memory budget:
+#   in_memory     whole-file read, peak of PLAN_READ_FACTOR frames
+#   chunked_read  frame assembled from chunks, peak of PLAN_CHUNKED_READ_FACTOR frames
+#   scan          single pass into mergeable state, one chunk per worker in memory
+# The exact daily features and in-memory forecast data need
+# PLAN_EXACT_STAGE_FACTOR frames; otherwise features come from the line-level
+# accumulator and forecast data from the partitioned builders, with enough
+# partitions for one partition to fit that working set.
+PLAN_SAMPLE_BYTES = int(os.environ.get('PLAN_SAMPLE_MB', '2')) * 1024 * 1024
+PLAN_MEMORY_FRACTION = float(os.environ.get('PLAN_MEMORY_FRACTION', '0.6'))
+PLAN_DEFAULT_MEMORY_MB = 3008
+PLAN_RUNTIME_MB = 200  # Interpreter, pandas and numpy before any data is loaded
+PLAN_READ_FACTOR = 3.0
+PLAN_CHUNKED_READ_FACTOR = 2.0
+PLAN_EXACT_STAGE_FACTOR = 4.0
+PLAN_CHUNK_MB = 64
+PLAN_MIN_CHUNK_ROWS = 5000
+PLAN_MAX_CHUNK_ROWS = 250000
+PLAN_MAX_FORECAST_PARTITIONS = 1024
+
+def available_memory_mb(context=None):
+    """Memory configured for the function, from the invocation context when there is one"""
+    for value in (getattr(context, 'memory_limit_in_mb', None), os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')):
         try:
-            chunk['CreateDate'] = pd.to_datetime(chunk['CreateDate'], infer_datetime_format=True, errors='coerce')
-        except:
-            chunk['CreateDate'] = pd.to_datetime(chunk['CreateDate'], format='%m/%d/%y', errors='coerce')
-        
-        # Add basic temporal features
-        chunk['Date'] = chunk['CreateDate'].dt.strftime('%Y-%m-%d')
-        chunk['OrderYear'] = chunk['CreateDate'].dt.year
-        chunk['OrderMonth'] = chunk['CreateDate'].dt.month
-        chunk['OrderDayOfWeek'] = chunk['CreateDate'].dt.dayofweek
-        
-        # Process this chunk using simplified calculation
-        chunk_product_features = calculate_product_demand_patterns_simple(chunk)
-        chunk_results.append(chunk_product_features)
-        
-        # Clean up chunk to free memory
-        del chunk
-        gc.collect()
-        
-        logger.info(f"Completed chunk {chunk_number}, generated {len(chunk_product_features)} product patterns")
+            if value is not None and int(value) > 0:
+                return int(value)
+        except (TypeError, ValueError):
+            pass
+    return PLAN_DEFAULT_MEMORY_MB
+
+def _read_head(source, n_bytes):
+    """First n_bytes of a path or stream, leaving a stream at its start"""
+    _rewind(source)
+    if hasattr(source, 'read'):
+        head = source.read(n_bytes)
+        _rewind(source)
+        return head
+    with open(source, 'rb') as handle:
+        return handle.read(n_bytes)
+
+def estimate_distinct_series(series_sizes, total_rows):
+    """Estimate the distinct series of a file from the series sizes seen in a sample of it
     
-    # Combine results from all chunks
-    logger.info("Combining results from all chunks...")
-    if chunk_results:
-        # Combine all chunk results
-        combined_features = pd.concat(chunk_results, ignore_index=True)
-        
-        # Aggregate duplicate product combinations across chunks
-        logger.info("Aggregating duplicate products across chunks...")
-        final_features = aggregate_chunk_results(combined_features)
-        
-        # Clean up
-        del chunk_results, combined_features
-        gc.collect()
-        
-        logger.info(f"Final combined result: {len(final_features)} unique product patterns")
-        return final_features
+    Uses the GEE estimator (Charikar et al.): series seen more than once are
+    counted as they are, series seen once are scaled by sqrt(total / sample).
+    """
+    series_sizes = np.asarray(series_sizes)
+    sample_rows = series_sizes.sum()
+    if sample_rows == 0:
+        return 0
+    singletons = int((series_sizes == 1).sum())
+    estimate = np.sqrt(max(total_rows, sample_rows) / sample_rows) * singletons + (len(series_sizes) - singletons)
+    return int(min(max(estimate, len(series_sizes)), max(total_rows, sample_rows)))
+
+def plan_stages(frame_mb, budget_mb):
+    """Exact or approximate stages for a loaded frame of frame_mb"""
+    exact = frame_mb * PLAN_EXACT_STAGE_FACTOR <= budget_mb
+    return {
+        'features': 'exact' if exact else 'approximate',
+        'lookups': 'exact',
+        'forecasts': 'exact' if exact else 'partitioned'
+    }
+
+def plan_execution(order_input, file_size_mb, read_plan, context=None):
+    """Choose the processing strategy, chunk size, parallelism and stage accuracy for an upload
+    
+    Returns the plan with the estimates it was based on. When the head cannot
+    be sampled the plan falls back to CHUNK_ROW_BYTES per row and one row per
+    series.
+    """
+    memory_mb = available_memory_mb(context)
+    budget_mb = max(memory_mb * PLAN_MEMORY_FRACTION - PLAN_RUNTIME_MB, memory_mb * 0.1)
+    estimates = {'memory_mb': memory_mb, 'budget_mb': round(budget_mb, 1), 'file_mb': round(file_size_mb, 2)}
+    
+    try:
+        head = _read_head(order_input, PLAN_SAMPLE_BYTES)
+        complete = len(head) < PLAN_SAMPLE_BYTES
+        if not complete:
+            head = head[:head.rfind(b'\n') + 1]
+        sample = _apply_read_plan(pd.read_csv(io.BytesIO(head), usecols=read_plan['usecols'],
+                                              dtype=read_plan['dtype']), read_plan)
+        sample = extract_temporal_features(sample)
+        sample_rows = max(len(sample), 1)
+        rows = len(sample) if complete else int(file_size_mb * 1024 * 1024 / (len(head) / sample_rows))
+        row_bytes = sample.memory_usage(deep=True).sum() / sample_rows
+        sizes = sample.groupby(SERIES_KEY_COLUMNS, observed=True).size().to_numpy()
+        series = len(sizes) if complete else estimate_distinct_series(sizes, rows)
+        state = summarize_series_chunk(sample)
+        series_bytes = ((state.memory_usage(deep=True).sum() +
+                         summarize_quantile_sketch(sample).memory_usage(deep=True).sum()) / max(len(state), 1))
+        estimates.update({'sample_rows': len(sample), 'sample_complete': complete})
+    except Exception as e:
+        logger.warning(f"Could not sample the upload for planning, using defaults: {str(e)}")
+        row_bytes = CHUNK_ROW_BYTES
+        rows = int(file_size_mb * 1024 * 1024 / 100)
+        series = rows
+        series_bytes = 1024
+    
+    frame_mb = rows * row_bytes / (1024 * 1024)
+    state_mb = series * series_bytes / (1024 * 1024)
+    estimates.update({
+        'rows': int(rows),
+        'bytes_per_row': round(float(row_bytes), 1),
+        'frame_mb': round(frame_mb, 1),
+        'series': int(series),
+        'state_mb': round(state_mb, 1)
+    })
+    
+    # Chunks are sized in memory, not rows, so wide files get shorter chunks
+    chunk_mb = min(PLAN_CHUNK_MB, max(budget_mb - state_mb, budget_mb * 0.25) / 8)
+    chunk_rows = int(np.clip(chunk_mb * 1024 * 1024 / row_bytes, PLAN_MIN_CHUNK_ROWS, PLAN_MAX_CHUNK_ROWS))
+    
+    if frame_mb * PLAN_READ_FACTOR <= budget_mb:
+        strategy = 'in_memory'
+    elif frame_mb * PLAN_CHUNKED_READ_FACTOR <= budget_mb:
+        strategy = 'chunked_read'
     else:
-        logger.warning("No chunk results found, returning empty DataFrame")
+        strategy = 'scan'
+    
+    if strategy == 'scan':
+        stages = {'features': 'approximate', 'lookups': 'exact', 'forecasts': 'partitioned'}
+    else:
+        stages = plan_stages(frame_mb, budget_mb)
+    
+    plan = {
+        'strategy': strategy,
+        'chunk_rows': chunk_rows,
+        'workers': plan_chunk_workers(chunk_rows, row_bytes=row_bytes, memory_mb=memory_mb),
+        'forecast_partitions': int(np.clip(np.ceil(frame_mb * PLAN_EXACT_STAGE_FACTOR / budget_mb),
+                                           1, PLAN_MAX_FORECAST_PARTITIONS)),
+        'stages': stages,
+        'estimates': estimates
+    }
+    logger.info(f"Execution plan: {plan['strategy']} (chunk_rows={plan['chunk_rows']}, workers={plan['workers']}, "
+                f"forecast_partitions={plan['forecast_partitions']}, stages={plan['stages']})")
+    logger.info(f"Plan estimates: {estimates}")
+    return plan
+
+# Time each stage takes relative to reading and parsing the upload
+DEADLINE_STAGE_COST = {
+    ('features', 'exact'): 1.5,
+    ('features', 'approximate'): 0.3,
+    ('lookups', 'exact'): 0.5,
+    ('forecasts', 'exact'): 1.0,
+    ('forecasts', 'partitioned'): 1.5,
+    ('forecasts', 'skipped'): 0.0,
+    ('deepar', 'exact'): 0.5,
+    ('deepar', 'skipped'): 0.0
+}
+# Degradations applied in order until the stages fit: the DeepAR channels go
+# first, the lookups served from DynamoDB are never dropped
+DEADLINE_DEGRADATIONS = [('deepar', 'skipped'), ('features', 'approximate'), ('forecasts', 'skipped')]
+
+class Deadline:
+    """Time left in the invocation, less a reserve kept for saving the results
+    
+    Without a Lambda context (local runs, tests) there is no deadline.
+    """
+    
+    def __init__(self, context=None, reserve_seconds=None):
+        self.context = context if hasattr(context, 'get_remaining_time_in_millis') else None
+        self.reserve_seconds = DEADLINE_SAVE_RESERVE_S if reserve_seconds is None else reserve_seconds
+    
+    def remaining(self):
+        """Seconds until the invocation times out, or None without a deadline"""
+        if self.context is None:
+            return None
+        return self.context.get_remaining_time_in_millis() / 1000
+    
+    def available(self):
+        """Seconds that can still be spent before the save reserve"""
+        remaining = self.remaining()
+        return float('inf') if remaining is None else remaining - self.reserve_seconds
+    
+    def allows(self, seconds):
+        return seconds <= self.available()
+    
+    def reserve_for_save(self, series):
+        """Size the reserve for writing the outputs of this many series"""
+        self.reserve_seconds = DEADLINE_SAVE_RESERVE_S + series / DEADLINE_SAVE_SERIES_PER_S
+        return self.reserve_seconds
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter so the next reading covers one stage (False when not allowed)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as handle:
+            handle.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident memory since the last reset (VmHWM), or over the process lifetime"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _cpu_seconds():
+    """CPU time of this process and of the worker processes it has waited for"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+class RunManifest:
+    """Per-stage wall time, CPU time, rows and peak memory of one invocation
+    
+    Stages are measured with `with manifest.stage(name, rows_in) as stage:`,
+    setting stage['rows_out'] and any details inside the block. Peak RSS is
+    per stage where the kernel lets the counter be reset ('peak_rss_scope'
+    is 'stage'), otherwise the process peak so far.
+    """
+    
+    def __init__(self, source=None, context=None):
+        self.started = time.time()
+        self.cpu_started = _cpu_seconds()
+        self.stages = []
+        self.run = {
+            'source': source,
+            'request_id': getattr(context, 'aws_request_id', None),
+            'memory_mb': available_memory_mb(context),
+            'csv_engine': resolve_csv_engine(),
+            'peak_rss_scope': 'stage' if _reset_peak_rss() else 'process'
+        }
+        self.tracing = run_manifest_tracemalloc and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start()
+    
+    @contextmanager
+    def stage(self, name, rows_in=None, **details):
+        entry = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        entry.update(details)
+        if self.run['peak_rss_scope'] == 'stage':
+            _reset_peak_rss()
+        if self.tracing:
+            tracemalloc.reset_peak()
+        wall, cpu = time.time(), _cpu_seconds()
+        try:
+            yield entry
+        except Exception:
+            entry['failed'] = True
+            raise
+        finally:
+            entry['wall_seconds'] = round(time.time() - wall, 3)
+            entry['cpu_seconds'] = round(_cpu_seconds() - cpu, 3)
+            entry['peak_rss_mb'] = round(peak_rss_mb(), 1)
+            if self.tracing:
+                entry['tracemalloc_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+            self.stages.append(entry)
+    
+    def record(self, name, **fields):
+        """Add a stage measured elsewhere"""
+        self.stages.append(dict({'stage': name}, **fields))
+    
+    def record_uploads(self, reports):
+        """One stage per artifact upload; they run concurrently, so no per-upload peak memory"""
+        for report in reports:
+            self.record(f"upload:{report['artifact']}", rows_in=report['rows'], rows_out=report['rows'],
+                        wall_seconds=report['seconds'], cpu_seconds=report['cpu_seconds'], bytes=report['bytes'])
+    
+    def to_dict(self, **summary):
+        manifest = dict(self.run, **summary)
+        manifest.update({
+            'wall_seconds': round(time.time() - self.started, 3),
+            'cpu_seconds': round(_cpu_seconds() - self.cpu_started, 3),
+            'stages': self.stages
+        })
+        return manifest
+    
+    def save(self, timestamp, **summary):
+        """Write the manifest next to the run's outputs and return its key (None when off or on failure)"""
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+        if not run_manifest_enabled:
+            return None
+        key = f'processed/{timestamp}/{RUN_MANIFEST_NAME}'
+        try:
+            s3_client.put_object(Bucket=processed_bucket, Key=key,
+                                 Body=json.dumps(self.to_dict(**summary), indent=2, default=str))
+        except Exception as e:
+            logger.warning(f"Could not write the run manifest: {str(e)}")
+            return None
+        logger.info(f"Run manifest written to {key}")
+        return key
+
+def projected_stage_seconds(stages, read_seconds):
+    return read_seconds * sum(DEADLINE_STAGE_COST.get(item, 1.0) for item in stages.items())
+
+def plan_stage_deadline(stages, deadline, read_seconds):
+    """Degrade stages in priority order until they fit in the deadline
+    
+    read_seconds is the measured time of reading and parsing the upload, the
+    unit of DEADLINE_STAGE_COST. Returns the (possibly) degraded stages.
+    """
+    stages = dict(stages)
+    for stage, mode in DEADLINE_DEGRADATIONS:
+        if deadline.allows(projected_stage_seconds(stages, read_seconds)):
+            break
+        if stages.get(stage, mode) != mode:
+            logger.warning(f"Stage {stage} is {mode} to finish before the deadline "
+                           f"({deadline.available():.1f}s left for processing)")
+            stages[stage] = mode
+    return stages
+
+def partition_by_customer(chunk, n_partitions):
+    """Split a chunk into n_partitions frames by a stable hash of CustomerID"""
+    # Hash the string form so 5 and '5' land together whatever dtype a chunk inferred
+    hashes = pd.util.hash_pandas_object(chunk['CustomerID'].astype(str), index=False).to_numpy()
+    partitions = hashes % np.uint64(n_partitions)
+    return [chunk[partitions == partition] for partition in range(n_partitions)]
+
+# Chunk consumers: every chunk of a scan is parsed once and handed to each
+# registered consumer. A consumer is a step folding one parsed chunk into its
+# partial result and a combine turning the partial results of every worker
+# (disjoint customers) into the final result.
+def _fold_series_chunk(partial, chunk):
+    """Consumer step: fold the chunk into (series state, quantile sketch, trend sample)"""
+    if partial is None:
+        partial = (empty_series_state(), empty_quantile_sketch(), empty_trend_sample())
+    state, sketch, trend_sample = partial
+    if trend_method == 'theil_sen':
+        trend_sample = merge_trend_samples(trend_sample, summarize_trend_sample(chunk))
+    return (merge_series_states(state, summarize_series_chunk(chunk)),
+            merge_quantile_sketches(sketch, summarize_quantile_sketch(chunk)),
+            trend_sample)
+
+def _combine_series_partials(partials):
+    """Workers own disjoint customers, so their states only need concatenating"""
+    if not partials:
+        return empty_series_state(), empty_quantile_sketch(), empty_trend_sample()
+    if len(partials) == 1:
+        return partials[0]
+    series_state = pd.concat([state for state, _, _ in partials], ignore_index=True)
+    series_state = series_state.sort_values(SERIES_KEY_COLUMNS, kind='mergesort').reset_index(drop=True)
+    quantile_sketch = pd.concat([sketch for _, sketch, _ in partials], ignore_index=True)
+    trend_sample = merge_trend_samples(*[sample for _, _, sample in partials])
+    return series_state, quantile_sketch, trend_sample
+
+def _collect_temporal_chunk(partial, chunk):
+    """Consumer step: add temporal columns and keep the rows"""
+    frames = (partial or []) + [add_basic_temporal_features(chunk)]
+    # Memory management - don't let chunks accumulate too much
+    if len(frames) >= 3:
+        frames = [concat_order_chunks(frames)]
+    return frames
+
+def _combine_temporal_partials(partials):
+    """Chunk indexes continue across the file, so sorting restores the row order"""
+    frames = [frame for partial in partials for frame in partial]
+    if not frames:
         return pd.DataFrame()
+    return concat_order_chunks(frames).sort_index().reset_index(drop=True)
 
-def aggregate_chunk_results(combined_features):
-    """Aggregate product features from multiple chunks"""
-    logger.info("Aggregating product features across chunks...")
-    
-    # Group by product combination and aggregate
-    groupby_cols = ['CustomerID', 'FacilityID', 'ProductID']
-    
-    # Aggregate numeric columns
-    agg_dict = {
-        'TotalOrders': 'sum',
-        'AvgQuantity': 'mean',
-        'StdQuantity': 'mean',
-        'MaxQuantity': 'max',
-        'MinQuantity': 'min',
-        'MedianQuantity': 'mean',
-        'CoefficientOfVariation': 'mean',
-        'TrendSlope': 'mean',
-        'AvgDaysBetweenOrders': 'mean',
-        'FirstOrderDate': 'min',
-        'LastOrderDate': 'max'
+# Exact lookups in bounded memory. Each ID column is dictionary-encoded as the
+# chunks arrive and the three codes are packed into one int64 series key, each
+# field as wide as its dictionary needs; when a dictionary outgrows its field the
+# stored keys are re-packed with wider fields (which keeps them sorted). Order
+# counts and first/last order dates are numpy arrays kept sorted by that key and
+# grown chunk by chunk, so the accumulator holds 32 bytes per series plus the
+# distinct IDs and product rows.
+LOOKUP_KEY_BITS = 63
+LOOKUP_NO_FIRST_DATE = np.iinfo(np.int64).max  # NaT (int64 min) already loses every maximum
+
+def new_lookup_accumulator():
+    return {
+        'dictionaries': {col: pd.Index([], dtype=object) for col in SERIES_KEY_COLUMNS},
+        'bits': (1, 1, 1),
+        'keys': np.empty(0, dtype=np.int64),
+        'count': np.empty(0, dtype=np.int64),
+        'first': np.empty(0, dtype=np.int64),
+        'last': np.empty(0, dtype=np.int64),
+        'products': None,
+        'product_columns': None
     }
+
+def _encode_lookup_ids(values, dictionary):
+    """Dictionary codes of values (-1 when missing), extending dictionary with unseen values
     
-    # Aggregate
-    aggregated = combined_features.groupby(groupby_cols).agg(agg_dict).reset_index()
-    
-    # Add back non-numeric columns (take first occurrence)
-    text_cols = ['ProductName', 'CategoryName', 'VendorName']
-    for col in text_cols:
-        if col in combined_features.columns:
-            text_data = combined_features.groupby(groupby_cols)[col].first().reset_index()
-            aggregated = aggregated.merge(text_data, on=groupby_cols, how='left')
-    
-    # Reorder columns to match expected format
-    final_columns = ['CustomerID', 'FacilityID', 'ProductID', 'ProductName', 'CategoryName', 'VendorName',
-                    'TotalOrders', 'AvgQuantity', 'StdQuantity', 'MaxQuantity', 'MinQuantity', 'MedianQuantity',
-                    'CoefficientOfVariation', 'TrendSlope', 'AvgDaysBetweenOrders', 'FirstOrderDate', 'LastOrderDate']
-    
-    return aggregated[final_columns]
-
-def create_minimal_lookup_from_file(file_path):
-    """Create minimal lookup tables by reading file in chunks"""
-    logger.info("Creating minimal lookup tables from file chunks...")
-    
-    product_data = set()
-    customer_product_data = []
-    
-    # Column mapping
-    col_map = {
-        'Customerid': 'CustomerID',
-        'Facilityid': 'FacilityID', 
-        'Productid': 'ProductID',
-        'Productdescription': 'ProductDescription',
-        'Productcategory': 'ProductCategory',
-        'Createdate': 'CreateDate',
-        'Quantity': 'Quantity',
-        'ProductName': 'ProductDescription',
-        'CategoryName': 'ProductCategory',
-        'Price': 'UnitPrice',
-        'VendorName': 'VendorName'
-    }
+    Returns (codes, dictionary).
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        value_codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        value_codes, uniques = pd.factorize(values)
+    positions = dictionary.get_indexer(uniques) if len(dictionary) else np.full(len(uniques), -1)
+    unseen = positions < 0
+    if unseen.any():
+        positions[unseen] = np.arange(len(dictionary), len(dictionary) + int(unseen.sum()))
+        dictionary = dictionary.append(pd.Index(uniques[unseen], dtype=object))
+    codes = np.where(value_codes >= 0, positions[np.maximum(value_codes, 0)] if len(positions) else -1, -1)
+    return codes.astype(np.int64), dictionary
+
+def _pack_lookup_keys(codes, bits):
+    """One int64 key per row from the customer, facility and product codes, in that significance"""
+    return (codes[0] << (bits[1] + bits[2])) | (codes[1] << bits[2]) | codes[2]
+
+def _unpack_lookup_keys(keys, bits):
+    """Customer, facility and product codes of packed keys"""
+    return [keys >> (bits[1] + bits[2]), (keys >> bits[2]) & ((1 << bits[1]) - 1), keys & ((1 << bits[2]) - 1)]
+
+def _widen_lookup_keys(partial):
+    """Re-pack the stored keys when a dictionary has outgrown its field of the key"""
+    # Doubling the capacity on growth keeps the number of re-packs logarithmic
+    bits = tuple(max(old, len(partial['dictionaries'][col]).bit_length())
+                 for old, col in zip(partial['bits'], SERIES_KEY_COLUMNS))
+    if bits == partial['bits']:
+        return
+    if sum(bits) > LOOKUP_KEY_BITS:
+        sizes = ', '.join(f"{len(partial['dictionaries'][col])} {col}" for col in SERIES_KEY_COLUMNS)
+        raise ValueError(f"Lookup keys of {sizes} values do not fit in {LOOKUP_KEY_BITS} bits")
+    partial['keys'] = _pack_lookup_keys(_unpack_lookup_keys(partial['keys'], partial['bits']), bits)
+    partial['bits'] = bits
+
+def _merge_lookup_series(partial, keys, count, first, last):
+    """Fold per-series values (keys sorted and distinct) into the accumulator arrays"""
+    pos = np.searchsorted(partial['keys'], keys)
+    found = pos < len(partial['keys'])
+    found[found] = partial['keys'][pos[found]] == keys[found]
+    existing = pos[found]
+    partial['count'][existing] += count[found]
+    partial['first'][existing] = np.minimum(partial['first'][existing], first[found])
+    partial['last'][existing] = np.maximum(partial['last'][existing], last[found])
     
-    # Process file in small chunks to extract lookup data
-    for chunk in pd.read_csv(file_path, chunksize=10000):
-        # Normalize column names
-        chunk.columns = [col.strip().replace(' ', '').replace('_', '').title() for col in chunk.columns]
-        chunk.rename(columns={k: v for k, v in col_map.items() if k in chunk.columns}, inplace=True)
-        
-        # Extract unique products - handle different column names
-        product_cols_for_lookup = ['ProductID']
-        product_name_col_lookup = None
-        category_col_lookup = None
-        
-        # Find product name column
-        for col_name in ['ProductDescription', 'ProductName', 'Productdescription', 'Productname']:
-            if col_name in chunk.columns:
-                product_cols_for_lookup.append(col_name)
-                product_name_col_lookup = col_name
-                break
-        
-        # Find category column
-        for col_name in ['ProductCategory', 'CategoryName', 'Productcategory', 'Categoryname']:
-            if col_name in chunk.columns:
-                product_cols_for_lookup.append(col_name)
-                category_col_lookup = col_name
+    new = ~found
+    if new.any():
+        # Insert positions come from the old array, so the new keys keep it sorted
+        for name, values in (('keys', keys), ('count', count), ('first', first), ('last', last)):
+            partial[name] = np.insert(partial[name], pos[new], values[new])
+
+def _collect_lookup_chunk(partial, chunk):
+    """Consumer step: fold the chunk's order counts, order dates and products into the lookup accumulator"""
+    partial = partial or new_lookup_accumulator()
+    
+    # Distinct product rows, in first-seen order like drop_duplicates over the whole file
+    columns, rename = product_lookup_columns(chunk.columns)
+    products = _plain_columns(chunk[columns].drop_duplicates().reset_index(drop=True))
+    if partial['products'] is not None:
+        products = pd.concat([partial['products'], products], ignore_index=True).drop_duplicates(ignore_index=True)
+    partial['products'], partial['product_columns'] = products, (columns, rename)
+    
+    codes = []
+    for col in SERIES_KEY_COLUMNS:
+        col_codes, partial['dictionaries'][col] = _encode_lookup_ids(chunk[col], partial['dictionaries'][col])
+        codes.append(col_codes)
+    _widen_lookup_keys(partial)
+    valid = (codes[0] >= 0) & (codes[1] >= 0) & (codes[2] >= 0)  # groupby drops missing keys
+    if not valid.any():
+        return partial
+    keys = _pack_lookup_keys([col_codes[valid] for col_codes in codes], partial['bits'])
+    dates = pd.to_datetime(chunk['CreateDate']).to_numpy().view(np.int64)[valid]
+    if 'OrderUnits' in chunk.columns:
+        counted = chunk['OrderUnits'].notna().to_numpy()[valid]
+    else:
+        counted = dates != np.iinfo(np.int64).min
+    
+    # One entry per series of the chunk, then one sorted merge into the accumulator
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    dates = dates[order]
+    _merge_lookup_series(
+        partial, keys[starts],
+        np.add.reduceat(counted[order].astype(np.int64), starts),
+        np.minimum.reduceat(np.where(dates == np.iinfo(np.int64).min, LOOKUP_NO_FIRST_DATE, dates), starts),
+        np.maximum.reduceat(dates, starts)
+    )
+    return partial
+
+def lookup_series_frame(partial):
+    """Decode an accumulator into one row per series with its order count and dates"""
+    keys = partial['keys']
+    first = partial['first'].copy()
+    first[first == LOOKUP_NO_FIRST_DATE] = np.iinfo(np.int64).min
+    dictionaries = partial['dictionaries']
+    customer_codes, facility_codes, product_codes = _unpack_lookup_keys(keys, partial['bits'])
+    return pd.DataFrame({
+        'CustomerID': pd.Series(dictionaries['CustomerID'].take(customer_codes)).infer_objects(),
+        'FacilityID': pd.Series(dictionaries['FacilityID'].take(facility_codes)).infer_objects(),
+        'ProductID': pd.Series(dictionaries['ProductID'].take(product_codes)).infer_objects(),
+        'OrderCount': partial['count'],
+        'FirstOrderDate': first.view('datetime64[ns]'),
+        'LastOrderDate': partial['last'].view('datetime64[ns]')
+    })
+
+def _combine_lookup_partials(partials):
+    """Build (product_lookup, customer_product_lookup) with create_product_lookup_table's schema"""
+    series = [lookup_series_frame(partial) for partial in partials]
+    if not series:
+        customer_products = lookup_series_frame(new_lookup_accumulator())
+    elif len(series) == 1:
+        customer_products = series[0]
+    else:
+        customer_products = pd.concat(series, ignore_index=True).groupby(SERIES_KEY_COLUMNS, as_index=False).agg(
+            OrderCount=('OrderCount', 'sum'), FirstOrderDate=('FirstOrderDate', 'min'),
+            LastOrderDate=('LastOrderDate', 'max'))
+    customer_products = customer_products.sort_values(SERIES_KEY_COLUMNS, kind='mergesort', ignore_index=True)
+    
+    product_partials = [partial for partial in partials if partial['products'] is not None]
+    if product_partials:
+        columns, rename = product_partials[0]['product_columns']
+        products = pd.concat([partial['products'] for partial in product_partials],
+                             ignore_index=True).drop_duplicates(ignore_index=True)
+    else:
+        columns, rename = ['ProductID'], {}
+        products = pd.DataFrame({'ProductID': pd.Series(dtype=object)})
+    product_lookup = finish_product_lookup(products[columns], rename)
+    customer_product_lookup = finish_customer_product_lookup(customer_products, product_lookup)
+    
+    logger.info(f"Created exact lookup with {len(product_lookup)} products and "
+                f"{len(customer_product_lookup)} relationships")
+    return product_lookup, customer_product_lookup
+
+def _collect_order_stats(partial, chunk):
+    """Consumer step: row count, missing values and CreateDate range"""
+    stats = partial or {'rows': 0, 'null_counts': {}, 'first_date': None, 'last_date': None}
+    stats['rows'] += len(chunk)
+    columns = [col for col in chunk.columns if col in ORDER_COLUMN_NAMES]
+    for col, nulls in chunk[columns].isna().sum().items():
+        stats['null_counts'][col] = stats['null_counts'].get(col, 0) + int(nulls)
+    dates = chunk['CreateDate'].dropna()
+    if len(dates):
+        first, last = dates.min(), dates.max()
+        stats['first_date'] = first if stats['first_date'] is None else min(stats['first_date'], first)
+        stats['last_date'] = last if stats['last_date'] is None else max(stats['last_date'], last)
+    return stats
+
+def _combine_order_stats(partials):
+    """Add up the statistics of every worker"""
+    combined = None
+    for stats in partials:
+        if combined is None:
+            combined = stats
+            continue
+        combined['rows'] += stats['rows']
+        for col, nulls in stats['null_counts'].items():
+            combined['null_counts'][col] = combined['null_counts'].get(col, 0) + nulls
+        for key, pick in (('first_date', min), ('last_date', max)):
+            values = [value for value in (combined[key], stats[key]) if value is not None]
+            combined[key] = pick(values) if values else None
+    return combined or {'rows': 0, 'null_counts': {}, 'first_date': None, 'last_date': None}
+
+def _collect_daily_chunk(partial, chunk):
+    """Consumer step: daily quantity per series"""
+    return merge_daily_series(partial, summarize_daily_chunk(chunk))
+
+def _combine_daily_partials(partials):
+    """Merge the daily series of every worker"""
+    return merge_daily_series(*partials)
+
+def _collect_product_info_chunk(partial, chunk):
+    """Consumer step: latest descriptive columns per product"""
+    return merge_product_info(partial, summarize_product_info(chunk))
+
+def _combine_product_info_partials(partials):
+    """Merge the product info of every worker"""
+    return merge_product_info(*partials)
+
+CHUNK_CONSUMERS = {
+    'series_state': (_fold_series_chunk, _combine_series_partials),
+    'temporal_frame': (_collect_temporal_chunk, _combine_temporal_partials),
+    'lookups': (_collect_lookup_chunk, _combine_lookup_partials),
+    'order_stats': (_collect_order_stats, _combine_order_stats),
+    'daily_series': (_collect_daily_chunk, _combine_daily_partials),
+    'product_info': (_collect_product_info_chunk, _combine_product_info_partials),
+    'forecast_spill': (_spill_forecast_chunk, _combine_forecast_spills)
+}
+
+def feed_chunk_consumers(partials, chunk):
+    """Pass one parsed chunk to every consumer in partials, updating their partial results"""
+    for name in partials:
+        partials[name] = CHUNK_CONSUMERS[name][0](partials[name], chunk)
+    return partials
+
+def _chunk_worker(conn, consumers):
+    """Worker process loop: parse and consume each chunk received, send the partial results on None"""
+    partials = dict(consumers)
+    date_parse_state = new_date_parse_state()
+    try:
+        while True:
+            chunk = conn.recv()
+            if chunk is None:
                 break
+            feed_chunk_consumers(partials, parse_order_dates(chunk, date_parse_state))
+            conn.send(('ack', len(chunk)))
+        conn.send(('result', (partials, date_parse_state)))
+    except Exception:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+def _receive_from_worker(conn):
+    """Receive one message from a worker, raising if the worker failed"""
+    kind, payload = conn.recv()
+    if kind == 'error':
+        raise RuntimeError(f"Chunk worker failed:\n{payload}")
+    return kind, payload
+
+def execute_partitioned_chunks(file_path, consumers, chunk_rows, workers, max_in_flight=2, read_plan=None):
+    """Stream a CSV through worker processes partitioned by CustomerID
+    
+    Returns one dict of consumer partial results per worker.
+    """
+    processes = []
+    connections = []
+    for _ in range(workers):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_chunk_worker, args=(child_conn, _initial_partials(consumers)),
+                                          daemon=True)
+        process.start()
+        child_conn.close()
+        processes.append(process)
+        connections.append(parent_conn)
+    
+    in_flight = [0] * workers
+    rows_sent = 0
+    try:
+        for chunk in read_orders(file_path, read_plan, chunksize=chunk_rows):
+            for worker, part in enumerate(partition_by_customer(chunk, workers)):
+                if part.empty:
+                    continue
+                while in_flight[worker] >= max_in_flight:
+                    _receive_from_worker(connections[worker])
+                    in_flight[worker] -= 1
+                connections[worker].send(part)
+                in_flight[worker] += 1
+            rows_sent += len(chunk)
+            logger.info(f"Dispatched {rows_sent} rows to {workers} chunk workers")
         
-        # Extract unique products with available columns
-        available_product_cols = [col for col in product_cols_for_lookup if col in chunk.columns]
-        if len(available_product_cols) > 0:
-            for _, row in chunk[available_product_cols].drop_duplicates().iterrows():
-                product_data.add((
-                    row.get('ProductID', ''),
-                    row.get(product_name_col_lookup, f"Product {row.get('ProductID', '')}") if product_name_col_lookup else f"Product {row.get('ProductID', '')}",
-                    row.get(category_col_lookup, 'General') if category_col_lookup else 'General'
-                ))
-        
-        # Extract customer-product relationships (sample only to save memory)
-        sample_size = min(1000, len(chunk))
-        chunk_sample = chunk.sample(n=sample_size) if len(chunk) > sample_size else chunk
-        
-        for _, row in chunk_sample.iterrows():
-            customer_product_data.append({
-                'CustomerID': row.get('CustomerID', ''),
-                'FacilityID': row.get('FacilityID', ''),
-                'ProductID': row.get('ProductID', ''),
-                'ProductName': row.get(product_name_col_lookup, f"Product {row.get('ProductID', '')}") if product_name_col_lookup else f"Product {row.get('ProductID', '')}",
-                'CategoryName': row.get(category_col_lookup, 'General') if category_col_lookup else 'General',
-                'vendorName': f"Vendor{str(row.get('ProductID', '')).replace('PROD', '')}",
-                'OrderCount': 1,
-                'FirstOrderDate': pd.Timestamp.now(),
-                'LastOrderDate': pd.Timestamp.now()
-            })
-        
-        # Clean up chunk
-        del chunk
-        gc.collect()
+        for conn in connections:
+            conn.send(None)
+        results = []
+        unparseable_rows = 0
+        for conn in connections:
+            kind, payload = _receive_from_worker(conn)
+            while kind != 'result':
+                kind, payload = _receive_from_worker(conn)
+            partials, date_parse_state = payload
+            unparseable_rows += date_parse_state['unparseable_rows']
+            results.append(partials)
+        if unparseable_rows:
+            logger.warning(f"Chunk workers found {unparseable_rows} rows with unparseable CreateDate values")
+        return results
+    finally:
+        for conn in connections:
+            conn.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+def _initial_partials(consumers):
+    """Consumer name -> initial partial result (None unless consumers is a dict giving one)"""
+    return dict(consumers) if isinstance(consumers, dict) else dict.fromkeys(consumers)
+
+def scan_orders(file_path, consumers, chunk_rows=50000, read_plan=None, workers=1):
+    """Read and parse an order file exactly once, feeding every chunk to each consumer
     
-    # Create product lookup DataFrame
-    product_lookup = pd.DataFrame(list(product_data), columns=['ProductID', 'ProductName', 'CategoryName'])
-    product_lookup['vendorName'] = 'Vendor' + product_lookup['ProductID'].astype(str).str.replace('PROD', '', regex=False)
-    
-    # Create customer-product lookup DataFrame
-    customer_product_lookup = pd.DataFrame(customer_product_data)
-    
-    # Remove duplicates and aggregate
-    if not customer_product_lookup.empty:
-        customer_product_lookup = customer_product_lookup.groupby(['CustomerID', 'FacilityID', 'ProductID']).agg({
-            'ProductName': 'first',
-            'CategoryName': 'first',
-            'vendorName': 'first',
-            'OrderCount': 'sum',
-            'FirstOrderDate': 'min',
-            'LastOrderDate': 'max'
-        }).reset_index()
+    consumers names entries of CHUNK_CONSUMERS, or maps them to the initial
+    partial result their first step receives. With more than one worker the
+    chunks are partitioned by CustomerID across worker processes. Returns a
+    dict with the combined result of each consumer.
+    """
+    read_plan = read_plan or resolve_read_plan(file_path)
+    logger.info(f"Scanning file once for: {', '.join(consumers)}")
     
-    # Ensure we return valid DataFrames
-    if product_lookup is None or product_lookup.empty:
-        logger.warning("product_lookup is empty, creating minimal placeholder")
-        product_lookup = pd.DataFrame({
-            'ProductID': ['PLACEHOLDER'],
-            'ProductName': ['Placeholder Product'],
-            'CategoryName': ['General'],
-            'vendorName': ['Placeholder Vendor']
-        })
+    results = None
+    if workers > 1:
+        logger.info(f"Processing chunks on {workers} worker processes")
+        try:
+            results = execute_partitioned_chunks(file_path, consumers, chunk_rows, workers, read_plan=read_plan)
+        except Exception as e:
+            logger.warning(f"Parallel chunk processing failed, processing serially: {str(e)}")
     
-    if customer_product_lookup is None or customer_product_lookup.empty:
-        logger.warning("customer_product_lookup is empty, creating minimal placeholder")
-        customer_product_lookup = pd.DataFrame({
-            'CustomerID': ['PLACEHOLDER'],
-            'FacilityID': ['PLACEHOLDER'],
-            'ProductID': ['PLACEHOLDER'],
-            'ProductName': ['Placeholder Product'],
-            'CategoryName': ['General'],
-            'vendorName': ['Placeholder Vendor'],
-            'OrderCount': [1],
-            'FirstOrderDate': [pd.Timestamp.now()],
-            'LastOrderDate': [pd.Timestamp.now()]
-        })
+    if results is None:
+        # Process in chunks, detecting the date format once for the whole file
+        partials = _initial_partials(consumers)
+        date_parse_state = new_date_parse_state()
+        rows = 0
+        for chunk_number, chunk in enumerate(read_orders(file_path, read_plan, chunksize=chunk_rows), 1):
+            feed_chunk_consumers(partials, parse_order_dates(chunk, date_parse_state))
+            rows += len(chunk)
+            logger.info(f"Processed chunk {chunk_number} ({rows} rows so far)")
+            
+            # Clean up chunk to free memory
+            del chunk
+            gc.collect()
+        results = [partials]
     
-    logger.info(f"Created minimal lookup with {len(product_lookup)} products and {len(customer_product_lookup)} relationships")
+    return {name: CHUNK_CONSUMERS[name][1]([partials[name] for partials in results if partials[name] is not None])
+            for name in consumers}
+
+def log_order_stats(stats):
+    """Log the statistics gathered while scanning a file"""
+    missing = {col: nulls for col, nulls in stats['null_counts'].items() if nulls}
+    logger.info(f"Scanned {stats['rows']} rows, CreateDate range {stats['first_date']} to {stats['last_date']}")
+    if missing:
+        logger.warning(f"Missing values per column: {missing}")
+
+def finalize_scanned_series(partial):
+    """Product features from a scanned (series state, quantile sketch, trend sample) triple"""
+    series_state, quantile_sketch, trend_sample = partial
+    if series_state.empty:
+        logger.warning("No chunk results found, returning empty DataFrame")
+        return pd.DataFrame()
     
-    return product_lookup, customer_product_lookup
+    final_features = finalize_series_state(series_state, quantile_sketch, trend_sample)
+    logger.info(f"Final combined result: {len(final_features)} unique product patterns")
+    return final_features
 
-def process_large_file_in_chunks(file_path, chunk_size=10000):
+def split_large_file_and_process(file_path, max_chunk_rows=50000, read_plan=None):
+    """Process very large files chunk by chunk, folding each chunk into per-series state
+    
+    Only the accumulator state (one row per series) is kept between chunks, so
+    memory is bounded by the number of series rather than the file size.
+    """
+    logger.info(f"Splitting large file into chunks of max {max_chunk_rows} rows")
+    results = scan_orders(file_path, ['series_state'], max_chunk_rows, read_plan,
+                          workers=plan_chunk_workers(max_chunk_rows))
+    return finalize_scanned_series(results['series_state'])
+
+def create_minimal_lookup_from_file(file_path, read_plan=None):
+    """Create exact lookup tables by reading the file in chunks"""
+    logger.info("Creating lookup tables from file chunks...")
+    return scan_orders(file_path, ['lookups'], 10000, read_plan)['lookups']
+
+def process_large_file_in_chunks(file_path, chunk_size=10000, read_plan=None, workers=None):
     """Process large CSV files in chunks to avoid memory issues"""
     logger.info(f"Processing file in chunks of {chunk_size} rows")
+    results = scan_orders(file_path, ['temporal_frame'], chunk_size, read_plan,
+                          workers=workers or plan_chunk_workers(chunk_size))
+    final_df = results['temporal_frame']
+    logger.info(f"Final dataset size: {len(final_df)} rows")
+    return final_df
+
+# Incremental state: everything needed to rebuild the outputs without the raw
+# history. Series statistics, quantile sketches and trend samples are the
+# mergeable accumulators above, daily_series keeps one row per series and day for the
+# forecast files, and product_info the latest descriptive columns per product.
+# The persisted state splits the per-series tables into customer-hash partitions,
+# each stored with the features and forecast rows built from it, so an upload
+# only loads, merges and rewrites the partitions its customers fall in. Rewritten
+# tables go under a new generation folder, and the manifest (which carries the
+# other partitions' keys forward) is swapped only if it is still the one that was
+# loaded, so neither a failed nor a concurrent save loses a snapshot.
+STATE_TABLES = ['series_state', 'quantile_sketch', 'trend_sample', 'daily_series', 'product_info']
+STATE_PARTITION_TABLES = ['series_state', 'quantile_sketch', 'trend_sample', 'daily_series']
+STATE_OUTPUT_TABLES = ['product_features', 'customer_products', 'product_forecast', 'customer_forecast']
+DAILY_SERIES_COLUMNS = SERIES_KEY_COLUMNS + ['Date', 'Quantity']
+PRODUCT_INFO_COLUMNS = ['ProductID', 'ProductName', 'CategoryName', 'vendorName']
+CUSTOMER_PRODUCT_COLUMNS = SERIES_KEY_COLUMNS + ['OrderCount', 'FirstOrderDate', 'LastOrderDate']
+
+def empty_incremental_state():
+    """State with no history"""
+    return {
+        'series_state': empty_series_state(),
+        'quantile_sketch': empty_quantile_sketch(),
+        'trend_sample': empty_trend_sample(),
+        'daily_series': pd.DataFrame(columns=DAILY_SERIES_COLUMNS),
+        'product_info': pd.DataFrame(columns=PRODUCT_INFO_COLUMNS)
+    }
+
+def summarize_daily_chunk(df):
+    """Daily quantity per series for one chunk of order lines"""
+    if df is None or df.empty:
+        return pd.DataFrame(columns=DAILY_SERIES_COLUMNS)
+    
+    daily = _plain_columns(df[SERIES_KEY_COLUMNS].copy())
+    daily['Date'] = pd.to_datetime(df['CreateDate']).dt.normalize()
+    daily['Quantity'] = _demand_quantity(df).to_numpy()
+    return daily.groupby(SERIES_KEY_COLUMNS + ['Date'], sort=False, observed=True)['Quantity'].sum().reset_index()
+
+def merge_daily_series(*frames):
+    """Merge daily series frames, summing quantities that fall on the same day"""
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=DAILY_SERIES_COLUMNS)
+    
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby(SERIES_KEY_COLUMNS + ['Date'], sort=True, observed=True)['Quantity'].sum().reset_index()
+
+def summarize_product_info(df):
+    """Latest product name, category and vendor seen in a chunk (NaN where the file has none)"""
+    info = pd.DataFrame({'ProductID': df['ProductID'].to_numpy()})
+    candidates = {
+        'ProductName': ['ProductDescription', 'ProductName', 'Productdescription', 'Productname'],
+        'CategoryName': ['ProductCategory', 'CategoryName', 'Productcategory', 'Categoryname'],
+        'vendorName': ['VendorName', 'Vendorname']
+    }
+    for target, names in candidates.items():
+        source = next((name for name in names if name in df.columns), None)
+        info[target] = np.asarray(df[source]) if source else np.nan
+    return merge_product_info(_plain_columns(info))
+
+def merge_product_info(*frames):
+    """Merge product info frames, keeping the last non-null value per column"""
+    frames = [frame for frame in frames if frame is not None and not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=PRODUCT_INFO_COLUMNS)
     
-    # First pass: get basic info and determine processing strategy
-    first_chunk = pd.read_csv(file_path, nrows=1000)
-    logger.info(f"Sample columns: {list(first_chunk.columns)}")
-    
-    # Normalize column names for the sample
-    first_chunk.columns = [col.strip().replace(' ', '').replace('_', '').title() for col in first_chunk.columns]
-    col_map = {
-        'Customerid': 'CustomerID',
-        'Facilityid': 'FacilityID', 
-        'Productid': 'ProductID',
-        'Productdescription': 'ProductDescription',
-        'Productcategory': 'ProductCategory',
-        'Createdate': 'CreateDate',
-        'Quantity': 'Quantity',
-        'ProductName': 'ProductDescription',
-        'CategoryName': 'ProductCategory',
-        'Price': 'UnitPrice',
-        'VendorName': 'VendorName'
+    combined = pd.concat(frames, ignore_index=True)
+    return combined.groupby('ProductID', sort=True, observed=True).last().reset_index()[PRODUCT_INFO_COLUMNS]
+
+def summarize_orders(file_path, chunk_rows=50000, read_plan=None):
+    """Delta state of an order file: the state tables of its rows alone, plus the row count"""
+    # Read serially so product_info keeps the last value per product in file order
+    delta = scan_orders(file_path, ['series_state', 'daily_series', 'product_info', 'order_stats'],
+                        chunk_rows, read_plan)
+    series_state, quantile_sketch, trend_sample = delta['series_state']
+    return {
+        'series_state': series_state,
+        'quantile_sketch': quantile_sketch,
+        'trend_sample': trend_sample,
+        'daily_series': delta['daily_series'],
+        'product_info': delta['product_info'],
+        'rows': delta['order_stats']['rows'] if delta['order_stats'] else 0
+    }
+
+def merge_partition_delta(partition, delta):
+    """Merge the per-series tables of a delta into those of a state (missing tables are empty)"""
+    partition = dict(empty_incremental_state(), **partition)
+    delta = dict(empty_incremental_state(), **delta)
+    return {
+        'series_state': merge_series_states(partition['series_state'], delta['series_state']),
+        'quantile_sketch': merge_quantile_sketches(partition['quantile_sketch'], delta['quantile_sketch']),
+        'trend_sample': merge_trend_samples(partition['trend_sample'], delta['trend_sample']),
+        'daily_series': merge_daily_series(partition['daily_series'], delta['daily_series'])
     }
-    first_chunk.rename(columns={k: v for k, v in col_map.items() if k in first_chunk.columns}, inplace=True)
+
+def merge_state_delta(state, delta):
+    """Fold a delta state into state (deltas must be merged in file order for product_info)"""
+    state.update(merge_partition_delta(state, delta))
+    state['product_info'] = merge_product_info(state['product_info'], delta['product_info'])
+    return state
+
+def fold_orders_into_state(file_path, state, chunk_rows=50000, read_plan=None):
+    """Fold a new order file into the incremental state and return the number of rows read
+    
+    The file is first summarised into its own delta state so the history is
+    only merged once, keeping the cost proportional to the new file.
+    """
+    delta = summarize_orders(file_path, chunk_rows, read_plan)
+    logger.info(f"Delta of {delta['rows']} rows touches {len(delta['series_state'])} of "
+                f"{len(state['series_state'])} known product series")
+    merge_state_delta(state, delta)
+    return delta['rows']
+
+def fill_product_lookup(product_info):
+    """Product lookup from product info, filling descriptive columns the source files never provided"""
+    product_lookup = product_info.copy()
+    product_lookup['ProductName'] = product_lookup['ProductName'].fillna('Product ' + product_lookup['ProductID'].astype(str))
+    product_lookup['CategoryName'] = product_lookup['CategoryName'].fillna('General')
+    product_lookup['vendorName'] = product_lookup['vendorName'].fillna(
+        'Vendor' + product_lookup['ProductID'].astype(str).str.replace('PROD', '', regex=False))
+    return product_lookup
+
+def series_customer_products(series_state):
+    """Order count and first and last order date per series"""
+    return series_state[SERIES_KEY_COLUMNS + ['Count', 'FirstOrderDate', 'LastOrderDate']].rename(
+        columns={'Count': 'OrderCount'})
+
+def customer_product_rows(customer_products, product_lookup):
+    """Customer product lookup rows from per-series order counts and the product lookup"""
+    customer_product_lookup = customer_products.merge(product_lookup, on='ProductID', how='left')
+    customer_product_lookup['FirstOrderDate'] = pd.to_datetime(customer_product_lookup['FirstOrderDate'])
+    customer_product_lookup['LastOrderDate'] = pd.to_datetime(customer_product_lookup['LastOrderDate'])
+    return customer_product_lookup[[
+        'ProductID', 'ProductName', 'CategoryName', 'vendorName',
+        'CustomerID', 'FacilityID', 'OrderCount', 'FirstOrderDate', 'LastOrderDate'
+    ]]
+
+def build_outputs_from_state(state):
+    """Rebuild product features, lookups and forecast data from the incremental state"""
+    series_state = state['series_state']
+    if series_state.empty:
+        empty = pd.DataFrame()
+        return empty, empty, empty, empty, empty
     
-    # Determine total rows
-    total_rows = sum(1 for _ in open(file_path)) - 1  # Subtract header
-    logger.info(f"Total rows to process: {total_rows}")
+    product_features = finalize_series_state(series_state, state['quantile_sketch'], state['trend_sample'])
+    product_lookup = fill_product_lookup(state['product_info'])
+    customer_product_lookup = customer_product_rows(series_customer_products(series_state), product_lookup)
     
-    # Process in chunks and aggregate results
-    all_chunks = []
-    processed_rows = 0
+    # The forecast builders only need daily rows, so feed them the daily history
+    daily = state['daily_series'].rename(columns={'Quantity': 'OrderUnits'}).merge(
+        product_lookup.rename(columns={'vendorName': 'VendorName'}), on='ProductID', how='left')
+    product_forecast_df = prepare_product_forecast_data(daily)
+    customer_forecast_df = prepare_customer_level_forecast_data(daily)
     
-    for chunk in pd.read_csv(file_path, chunksize=chunk_size):
-        # Normalize column names
-        chunk.columns = [col.strip().replace(' ', '').replace('_', '').title() for col in chunk.columns]
-        chunk.rename(columns={k: v for k, v in col_map.items() if k in chunk.columns}, inplace=True)
-        
-        # Basic date parsing (simplified)
+    return product_features, product_lookup, customer_product_lookup, product_forecast_df, customer_forecast_df
+
+def split_state_tables(state, n_partitions):
+    """Per-series tables of a state split by customer hash (partition -> table name -> frame)
+    
+    Only partitions with rows in some table are returned.
+    """
+    partitions = {}
+    for name in STATE_PARTITION_TABLES:
+        if state[name].empty:
+            continue
+        for index, part in enumerate(partition_by_customer(state[name], n_partitions)):
+            if not part.empty:
+                partitions.setdefault(index, {})[name] = part.reset_index(drop=True)
+    return partitions
+
+def build_partition_outputs(partition):
+    """Product features, customer products and forecast rows of one state partition
+    
+    Product forecast rows keep generated product names; the current ones are
+    joined in by name_product_forecast when the outputs are published.
+    """
+    series_state = partition['series_state']
+    if series_state.empty:
+        return {name: pd.DataFrame() for name in STATE_OUTPUT_TABLES}
+    
+    daily = partition['daily_series']
+    return {
+        'product_features': finalize_series_state(series_state, partition['quantile_sketch'],
+                                                  partition['trend_sample']),
+        'customer_products': series_customer_products(series_state),
+        'product_forecast': product_forecast_rows(daily),
+        'customer_forecast': prepare_customer_level_forecast_data(daily.rename(columns={'Quantity': 'OrderUnits'}))
+    }
+
+def name_product_forecast(rows, product_lookup):
+    """Product forecast rows with the names, categories and vendors of the product lookup"""
+    names = product_lookup.rename(columns={'ProductID': 'product_id', 'ProductName': 'product_name',
+                                           'CategoryName': 'category_name', 'vendorName': 'vendor_name'})
+    if names['product_id'].dtype != rows['product_id'].dtype:
+        names = names.astype({'product_id': rows['product_id'].dtype})
+    named = rows.drop(columns=['product_name', 'category_name', 'vendor_name']).merge(
+        names, on='product_id', how='left')
+    return named[rows.columns]
+
+def source_already_folded(manifest, source):
+    """Manifest entry of an upload (key and ETag) already folded into the state, or None"""
+    return next((entry for entry in manifest.get('sources', [])
+                 if entry.get('key') == source.get('key') and entry.get('etag') == source.get('etag')), None)
+
+def write_state_tables(state, key_prefix, names=STATE_TABLES):
+    """Upload the named state tables as Parquet under key_prefix and return table name -> key"""
+    tables = {}
+    for name in names:
+        local_path = write_output_artifact(state[name], f'/tmp/{name}_state.parquet', 'parquet')
+        key = f'{key_prefix}/{name}.parquet'
+        s3_client.upload_file(local_path, processed_bucket, key)
+        os.remove(local_path)
+        tables[name] = key
+    return tables
+
+def read_state_tables(state, tables, names=STATE_TABLES):
+    """Download the named state tables listed in tables (name -> key) into state"""
+    for name in names:
+        if name not in tables:
+            continue  # Table added after this snapshot was written
+        local_path = f'/tmp/{name}_state.parquet'
+        s3_client.download_file(processed_bucket, tables[name], local_path)
+        state[name] = pd.read_parquet(local_path)
+        os.remove(local_path)
+    return state
+
+def empty_state_manifest():
+    """Manifest of a state with no history"""
+    return {'generation': None, 'partitions': state_partitions, 'tables': {}, 'partition_tables': {},
+            'sources': [], 'total_rows': 0, 'series': 0, 'retired': []}
+
+def load_state_manifest():
+    """Latest state manifest and its ETag, or an empty manifest and None"""
+    try:
+        response = s3_client.get_object(Bucket=processed_bucket, Key=f'{state_prefix}/manifest.json')
+    except s3_client.exceptions.NoSuchKey:
+        logger.info("No incremental state found, starting from an empty history")
+        return empty_state_manifest(), None
+    return json.loads(response['Body'].read()), response.get('ETag')
+
+def read_state_product_info(manifest):
+    """Product info table of a state"""
+    state = {'product_info': pd.DataFrame(columns=PRODUCT_INFO_COLUMNS)}
+    return read_state_tables(state, manifest.get('tables', {}), ['product_info'])['product_info']
+
+def read_state_partitions(manifest, indexes):
+    """Stored per-series tables of the given partitions (partition -> table name -> frame)"""
+    if 'partition_tables' not in manifest:
+        # Snapshot from before partitioning: split it once, so every partition gets rewritten
+        legacy = read_state_tables(empty_incremental_state(), manifest.get('tables', {}))
+        return split_state_tables(legacy, manifest.get('partitions', state_partitions))
+    
+    partitions = {}
+    for index in indexes:
+        entry = manifest['partition_tables'].get(str(index))
+        if entry:
+            partitions[index] = read_state_tables({}, entry['tables'], STATE_PARTITION_TABLES)
+    return partitions
+
+def _put_state_manifest(manifest, etag):
+    """Swap in manifest if the stored one still has etag (or none exists yet); False when another swap won"""
+    conditions = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    try:
+        s3_client.put_object(Bucket=processed_bucket, Key=f'{state_prefix}/manifest.json',
+                             Body=json.dumps(manifest, indent=2), ContentType='application/json', **conditions)
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('PreconditionFailed',
+                                                                       'ConditionalRequestConflict'):
+            return False
+        raise
+    return True
+
+def _delete_state_objects(keys):
+    """Best-effort removal of state tables no manifest points at"""
+    for key in keys:
         try:
-            chunk['CreateDate'] = pd.to_datetime(chunk['CreateDate'], infer_datetime_format=True, errors='coerce')
-        except:
-            chunk['CreateDate'] = pd.to_datetime(chunk['CreateDate'], format='%m/%d/%y', errors='coerce')
-        
-        # Add basic temporal features only
-        chunk['Date'] = chunk['CreateDate'].dt.strftime('%Y-%m-%d')
-        chunk['OrderYear'] = chunk['CreateDate'].dt.year
-        chunk['OrderMonth'] = chunk['CreateDate'].dt.month
-        chunk['OrderDayOfWeek'] = chunk['CreateDate'].dt.dayofweek
+            s3_client.delete_object(Bucket=processed_bucket, Key=key)
+        except Exception as e:
+            logger.warning(f"Could not remove state table {key}: {str(e)}")
+
+def fold_delta_into_state(delta, source):
+    """Fold a summarised upload into the persisted state and commit it
+    
+    Only the partitions the delta's customers fall in are loaded, merged and
+    rewritten (with their features and forecast rows) under a new generation;
+    the manifest carries the keys of the other partitions forward. When
+    another invocation swapped the manifest first, the new tables are dropped
+    and the delta is merged into the state it committed instead. Tables the
+    new generation replaces are deleted by a later fold once no invocation
+    can still be reading them. Returns the committed manifest and the
+    partitions rewritten (none when the upload was already folded).
+    """
+    for attempt in range(1, STATE_COMMIT_ATTEMPTS + 1):
+        manifest, etag = load_state_manifest()
+        if source_already_folded(manifest, source):
+            logger.info(f"{source['key']} is already part of state generation {manifest['generation']}")
+            return {'manifest': manifest, 'partitions': []}
         
-        all_chunks.append(chunk)
-        processed_rows += len(chunk)
+        n_partitions = manifest.get('partitions', state_partitions)
+        deltas = split_state_tables(delta, n_partitions)
+        stored = read_state_partitions(manifest, deltas)
+        generation = f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S-%f')}-{os.urandom(4).hex()}"
+        partition_tables = dict(manifest.get('partition_tables', {}))
+        replaced = list(manifest.get('tables', {}).values())  # Product info, or a whole unpartitioned snapshot
+        written = []
+        try:
+            for index in sorted(set(stored) | set(deltas)):
+                partition = merge_partition_delta(stored.get(index, {}), deltas.get(index, {}))
+                partition.update(build_partition_outputs(partition))
+                tables = write_state_tables(partition, f'{state_prefix}/{generation}/part-{index:05d}',
+                                            STATE_PARTITION_TABLES + STATE_OUTPUT_TABLES)
+                written.extend(tables.values())
+                if str(index) in partition_tables:
+                    replaced.extend(partition_tables[str(index)]['tables'].values())
+                partition_tables[str(index)] = {'tables': tables, 'series': len(partition['series_state'])}
+            product_info = merge_product_info(read_state_product_info(manifest), delta['product_info'])
+            tables = write_state_tables({'product_info': product_info}, f'{state_prefix}/{generation}',
+                                        ['product_info'])
+            written.extend(tables.values())
+        except Exception:
+            _delete_state_objects(written)
+            raise
         
-        logger.info(f"Processed {processed_rows}/{total_rows} rows ({processed_rows/total_rows*100:.1f}%)")
+        now = time.time()
+        retired = manifest.get('retired', [])
+        expired = {entry['key'] for entry in retired if now - entry['retired_at'] > STATE_RETAIN_SECONDS}
+        committed = dict(
+            manifest,
+            generation=generation,
+            partitions=n_partitions,
+            tables=tables,
+            partition_tables=partition_tables,
+            sources=manifest.get('sources', []) + [dict(source, rows=delta['rows'], published=False,
+                                                        folded_at=datetime.now().isoformat())],
+            total_rows=manifest.get('total_rows', 0) + delta['rows'],
+            series=sum(entry['series'] for entry in partition_tables.values()),
+            retired=([entry for entry in retired if entry['key'] not in expired] +
+                     [{'key': key, 'retired_at': now} for key in replaced])
+        )
+        if _put_state_manifest(committed, etag):
+            logger.info(f"Saved incremental state generation {generation}: rewrote {len(deltas)} of "
+                        f"{n_partitions} partitions ({committed['series']} product series)")
+            _delete_state_objects(expired)
+            return {'manifest': committed, 'partitions': sorted(set(stored) | set(deltas))}
         
-        # Memory management - don't let chunks accumulate too much
-        if len(all_chunks) >= 3:  # Reduced from 5 to 3
-            combined = pd.concat(all_chunks, ignore_index=True)
-            all_chunks = [combined]
-            gc.collect()
+        logger.warning(f"State manifest changed while folding {source['key']} (attempt {attempt}), merging again")
+        _delete_state_objects(written)
+    raise RuntimeError(f"Could not commit the incremental state after {STATE_COMMIT_ATTEMPTS} attempts")
+
+def mark_state_published(source):
+    """Record that outputs including an upload were published, so a redelivery is skipped"""
+    for _ in range(STATE_COMMIT_ATTEMPTS):
+        manifest, etag = load_state_manifest()
+        folded = source_already_folded(manifest, source)
+        sources = [dict(entry, published=True) if entry is folded else entry for entry in manifest.get('sources', [])]
+        if _put_state_manifest(dict(manifest, sources=sources), etag):
+            return
+    # A redelivery then publishes again, which is harmless
+    logger.warning(f"Could not mark {source['key']} as published in the incremental state")
+
+def iter_state_table(manifest, name):
+    """One table of every state partition, a partition at a time"""
+    for index in sorted(manifest.get('partition_tables', {}), key=int):
+        frame = read_state_tables({}, manifest['partition_tables'][index]['tables'], [name]).get(name)
+        if frame is not None and not frame.empty:
+            yield frame
+
+def iter_state_product_forecast(manifest, product_lookup):
+    """Product forecast rows of every state partition with the current product names"""
+    for rows in iter_state_table(manifest, 'product_forecast'):
+        yield name_product_forecast(rows, product_lookup)
+
+def state_output_parts(manifest):
+    """Product features, lookups and forecast data of a committed state
     
-    # Final combination
-    if len(all_chunks) > 1:
-        final_df = pd.concat(all_chunks, ignore_index=True)
+    The product lookup is a frame; the other outputs are iterators reading one
+    partition's tables at a time.
+    """
+    product_lookup = fill_product_lookup(read_state_product_info(manifest))
+    customer_product_lookup = (customer_product_rows(part, product_lookup)
+                               for part in iter_state_table(manifest, 'customer_products'))
+    return (iter_state_table(manifest, 'product_features'), product_lookup, customer_product_lookup,
+            iter_state_product_forecast(manifest, product_lookup), iter_state_table(manifest, 'customer_forecast'))
+
+def delta_lookup_tables(manifest, delta, product_lookup):
+    """Product and customer product lookup rows of the products and series an upload touched"""
+    products = product_lookup[product_lookup['ProductID'].isin(delta['product_info']['ProductID'])]
+    customer_products = []
+    n_partitions = manifest.get('partitions', state_partitions)
+    for index, part in enumerate(partition_by_customer(delta['series_state'], n_partitions)):
+        entry = manifest.get('partition_tables', {}).get(str(index))
+        if part.empty or not entry:
+            continue
+        stored = read_state_tables({}, entry['tables'], ['customer_products'])['customer_products']
+        touched = pd.MultiIndex.from_frame(stored[SERIES_KEY_COLUMNS]).isin(
+            pd.MultiIndex.from_frame(part[SERIES_KEY_COLUMNS]))
+        customer_products.append(stored[touched])
+    if customer_products:
+        customer_products = pd.concat(customer_products, ignore_index=True)
     else:
-        final_df = all_chunks[0] if all_chunks else pd.DataFrame()
+        customer_products = pd.DataFrame(columns=CUSTOMER_PRODUCT_COLUMNS)
+    return products.reset_index(drop=True), customer_product_rows(customer_products, product_lookup)
+
+def upload_fingerprint(bucket, key, s3_object, order_input=None):
+    """Fingerprint of an upload's content, or None when it cannot be determined
     
-    logger.info(f"Final dataset size: {len(final_df)} rows")
-    return final_df
+    'etag' mode uses the object's ETag and size (from the event, else a HEAD
+    request); 'content' mode hashes the bytes of the opened input.
+    """
+    if idempotency_mode == 'content':
+        if order_input is None:
+            return None
+        digest = hashlib.sha256()
+        handle = open(order_input, 'rb') if isinstance(order_input, str) else order_input
+        try:
+            _rewind(handle)
+            for block in iter(lambda: handle.read(8 * 1024 * 1024), b''):
+                digest.update(block)
+        finally:
+            if isinstance(order_input, str):
+                handle.close()
+            else:
+                _rewind(handle)
+        return f'sha256:{digest.hexdigest()}'
+    
+    if idempotency_mode != 'etag':
+        return None
+    etag, size = s3_object.get('eTag'), s3_object.get('size')
+    if etag is None or size is None:
+        try:
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+            etag, size = head['ETag'], head['ContentLength']
+        except Exception as e:
+            logger.warning(f"Could not read the ETag of {key}, not checking for duplicates: {str(e)}")
+            return None
+    etag = str(etag).strip('"')
+    return f'etag:{etag}:{int(size)}'
+
+def _fingerprint_key(fingerprint):
+    return f"{registry_prefix}/{hashlib.sha256(fingerprint.encode()).hexdigest()}.json"
+
+def find_processed_upload(fingerprint):
+    """Registry entry of an earlier run over the same content, or None"""
+    try:
+        response = s3_client.get_object(Bucket=processed_bucket, Key=_fingerprint_key(fingerprint))
+    except s3_client.exceptions.NoSuchKey:
+        return None
+    except Exception as e:
+        logger.warning(f"Could not read the processed-files registry: {str(e)}")
+        return None
+    return json.loads(response['Body'].read())
+
+def record_processed_upload(fingerprint, source, response_body):
+    """Register the outputs produced for an upload's content"""
+    entry = {
+        'fingerprint': fingerprint,
+        'source': source,
+        'processed_at': datetime.now().isoformat(),
+        'response': response_body
+    }
+    try:
+        s3_client.put_object(Bucket=processed_bucket, Key=_fingerprint_key(fingerprint),
+                             Body=json.dumps(entry, default=str), ContentType='application/json')
+    except Exception as e:
+        logger.warning(f"Could not record {source['key']} in the processed-files registry: {str(e)}")
+
+def duplicate_upload_response(key, entry):
+    """Response pointing a duplicate upload at the outputs of the earlier run"""
+    body = dict(entry['response'])
+    body['message'] = (f"{key} has the same content as {entry['source']['key']}, which was already processed "
+                       f"at {entry['processed_at']}; returning the existing outputs")
+    body['duplicate_of'] = entry['source']['key']
+    return {
+        'statusCode': 200,
+        'body': json.dumps(body)
+    }
+
+# Fan-out map/reduce. The coordinator cuts the upload into byte ranges and
+# invokes one map task per range; each summarises the lines starting in its
+# range into a delta state (the incremental state tables of those rows) and
+# stores it under fanout/<run>/. The map task that completes the set claims
+# the reduce, which merges the deltas in file order and writes the same
+# artifacts as a single invocation would.
+def plan_byte_ranges(size_bytes, parts=None):
+    """Split [0, size_bytes) into contiguous (start, end) ranges of roughly equal size"""
+    if parts is None:
+        parts = min(FANOUT_MAX_PARTS, max(1, -(-size_bytes // FANOUT_PART_BYTES)))
+    parts = max(1, min(parts, size_bytes or 1))
+    bounds = [size_bytes * index // parts for index in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+class OrderRangeReader(io.RawIOBase):
+    """Readable CSV made of an order file's header and the lines starting in [start, end)
+    
+    Adjacent ranges therefore split the file's lines between them exactly.
+    Splitting by bytes assumes no quoted field spans a line break.
+    """
+    
+    def __init__(self, raw, start, end):
+        super().__init__()
+        self.raw = raw
+        raw.seek(0)
+        self.header = raw.readline()
+        self.begin = self._line_start(max(start, len(self.header)))
+        self.stop = max(self.begin, self._line_start(max(end, len(self.header))))
+        self.position = 0
+    
+    def _line_start(self, offset):
+        """Offset of the first line starting at or after offset"""
+        if offset <= len(self.header):
+            return len(self.header)
+        self.raw.seek(offset - 1)
+        self.raw.readline()
+        return self.raw.tell()
+    
+    @property
+    def size(self):
+        return len(self.header) + self.stop - self.begin
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self.position
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        self.position = min(max(0, base + offset), self.size)
+        return self.position
+    
+    def readinto(self, buffer):
+        if self.position < len(self.header):
+            data = self.header[self.position:self.position + len(buffer)]
+        else:
+            self.raw.seek(self.begin + self.position - len(self.header))
+            data = self.raw.read(min(len(buffer), self.size - self.position))
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+def open_order_range(source, start, end):
+    """Open the lines of an order file (local path or {'bucket', 'key', 'size'}) starting in [start, end)"""
+    raw = open(source, 'rb') if isinstance(source, str) else open_s3_input(source['bucket'], source['key'],
+                                                                           int(source['size']))
+    return io.BufferedReader(OrderRangeReader(raw, start, end), buffer_size=1024 * 1024)
+
+def summarize_order_range(source, start, end, chunk_rows=50000):
+    """Map step: delta state of the order lines starting in [start, end)"""
+    reader = open_order_range(source, start, end)
+    try:
+        return summarize_orders(reader, chunk_rows)
+    finally:
+        raw = reader.raw.raw
+        reader.close()
+        raw.close()
+
+def reduce_state_deltas(deltas):
+    """Reduce step: merge map deltas (in file order) and build the output frames"""
+    state = empty_incremental_state()
+    rows = 0
+    for delta in deltas:
+        merge_state_delta(state, delta)
+        rows += delta['rows']
+    logger.info(f"Reduced {len(deltas)} partial states: {rows} rows, {len(state['series_state'])} product series")
+    return build_outputs_from_state(state), rows
+
+def _summarize_range_task(task):
+    return summarize_order_range(*task)
+
+def run_fanout_locally(file_path, parts=4, workers=None, chunk_rows=50000):
+    """Run the whole map/reduce over a local file with a process pool (for testing)
+    
+    Returns the reduce result: (output frames, rows).
+    """
+    ranges = plan_byte_ranges(os.path.getsize(file_path), parts)
+    tasks = [(file_path, start, end, chunk_rows) for start, end in ranges]
+    with ProcessPoolExecutor(max_workers=workers or min(len(tasks), os.cpu_count() or 1)) as pool:
+        deltas = list(pool.map(_summarize_range_task, tasks))
+    return reduce_state_deltas(deltas)
+
+def should_fan_out(size_bytes):
+    """Whether an upload is split across map invocations"""
+    if fanout_mode != 'lambda' or size_bytes is None:
+        return False
+    if pyarrow is None or incremental_mode:
+        return False  # Partial states are Parquet tables; incremental runs fold one state instead
+    return size_bytes >= fanout_min_mb * 1024 * 1024
+
+def invoke_async(function, payload):
+    """Invoke a function (normally this one) asynchronously with a JSON event"""
+    lambda_client.invoke(FunctionName=function, InvocationType='Event', Payload=json.dumps(payload).encode('utf-8'))
+
+def new_run_id(key):
+    return f"{datetime.now().strftime('%Y-%m-%d-%H-%M-%S')}-{hashlib.sha256(key.encode()).hexdigest()[:8]}"
+
+def invoked_function(context):
+    """ARN (or name) of the running function, for invoking it again"""
+    return getattr(context, 'invoked_function_arn', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+
+def dispatch_fanout_task(task):
+    """Invoke this function asynchronously for one map or reduce task"""
+    invoke_async(task['function'], {'fanout': task})
+
+def start_fanout(bucket, key, size_bytes, fingerprint, context):
+    """Coordinator: record the run's plan and invoke one map task per byte range"""
+    run_id = new_run_id(key)
+    ranges = plan_byte_ranges(int(size_bytes))
+    function = invoked_function(context)
+    task = {'run_id': run_id, 'bucket': bucket, 'key': key, 'size': int(size_bytes), 'parts': len(ranges),
+            'function': function, 'fingerprint': fingerprint}
+    s3_client.put_object(Bucket=processed_bucket, Key=f'{fanout_prefix}/{run_id}/plan.json',
+                         Body=json.dumps(dict(task, ranges=ranges), indent=2))
+    for index, (start, end) in enumerate(ranges):
+        dispatch_fanout_task(dict(task, role='map', index=index, start=start, end=end))
+    logger.info(f"Fanned {key} out to {len(ranges)} map tasks as run {run_id}")
+    return {
+        'statusCode': 202,
+        'body': json.dumps({'message': f'Processing {key} in {len(ranges)} parts', 'fanout_run': run_id,
+                            'parts': len(ranges)})
+    }
+
+def _fanout_done_key(task, index):
+    return f"{fanout_prefix}/{task['run_id']}/done/part-{index:05d}.json"
+
+def _claim_object(key, claimant):
+    """Create key only if it does not exist yet; False when someone else created it first"""
+    try:
+        s3_client.put_object(Bucket=processed_bucket, Key=key, Body=json.dumps({'claimed_by': claimant}),
+                             IfNoneMatch='*')
+    except Exception as e:
+        if getattr(e, 'response', {}).get('Error', {}).get('Code') in ('PreconditionFailed',
+                                                                       'ConditionalRequestConflict'):
+            return False
+        raise
+    return True
+
+def _claim_fanout_reduce(task):
+    """Create the run's reduce claim; False when another map task created it first"""
+    return _claim_object(f"{fanout_prefix}/{task['run_id']}/reduce.json", task['index'])
+
+def run_fanout_map(task):
+    """Map task: summarise one byte range and store its delta state"""
+    source = {'bucket': task['bucket'], 'key': task['key'], 'size': task['size']}
+    delta = summarize_order_range(source, task['start'], task['end'])
+    tables = write_state_tables(delta, f"{fanout_prefix}/{task['run_id']}/part-{task['index']:05d}")
+    s3_client.put_object(Bucket=processed_bucket, Key=_fanout_done_key(task, task['index']),
+                         Body=json.dumps({'tables': tables, 'rows': delta['rows']}))
+    logger.info(f"Map task {task['index'] + 1}/{task['parts']} summarised {delta['rows']} rows")
+    
+    listing = s3_client.list_objects_v2(Bucket=processed_bucket, Prefix=f"{fanout_prefix}/{task['run_id']}/done/")
+    if listing.get('KeyCount', 0) >= task['parts'] and _claim_fanout_reduce(task):
+        logger.info(f"All {task['parts']} map tasks done, starting the reduce")
+        dispatch_fanout_task(dict(task, role='reduce'))
+    return {'statusCode': 200, 'body': json.dumps({'message': f"Map task {task['index']} done",
+                                                   'rows': delta['rows']})}
+
+def run_fanout_reduce(task):
+    """Reduce task: merge the stored deltas and write the run's artifacts"""
+    manifest = RunManifest({'bucket': task['bucket'], 'key': task['key'], 'size': task['size']})
+    deltas = []
+    with manifest.stage('load_states', parts=task['parts']) as stage:
+        for index in range(task['parts']):
+            done = json.loads(s3_client.get_object(Bucket=processed_bucket,
+                                                   Key=_fanout_done_key(task, index))['Body'].read())
+            deltas.append(read_state_tables({'rows': done['rows']}, done['tables']))
+        stage['rows_out'] = sum(delta['rows'] for delta in deltas)
+    with manifest.stage('build_outputs', stage['rows_out']) as stage:
+        outputs, rows = reduce_state_deltas(deltas)
+        stage['rows_out'] = len(outputs[0])
+    response_body = publish_state_outputs(outputs, rows, task, {'fanout_run': task['run_id'],
+                                                                'parts': task['parts']},
+                                          manifest=manifest, strategy='fanout_reduce')
+    s3_client.put_object(Bucket=processed_bucket, Key=f"{fanout_prefix}/{task['run_id']}/result.json",
+                         Body=json.dumps(response_body, indent=2))
+    
+    # Partial states are only needed until the artifacts exist
+    for index in range(task['parts']):
+        for name in STATE_TABLES:
+            try:
+                s3_client.delete_object(Bucket=processed_bucket,
+                                        Key=f"{fanout_prefix}/{task['run_id']}/part-{index:05d}/{name}.parquet")
+            except Exception as e:
+                logger.warning(f"Could not remove partial state of part {index}: {str(e)}")
+    return {'statusCode': 200, 'body': json.dumps(response_body)}
+
+def publish_state_outputs(outputs, rows, task, extra=None, manifest=None, strategy=None):
+    """Write the artifacts, DynamoDB lookups and DeepAR channels built from a merged state
+    
+    task describes the upload ('bucket', 'key', 'size' and its 'fingerprint').
+    The stages are added to manifest (a RunManifest) and saved with strategy.
+    Returns the response body, which is also registered for the fingerprint.
+    """
+    product_features, product_lookup, customer_product_lookup, product_forecast_df, customer_forecast_df = outputs
+    if manifest is None:
+        manifest = RunManifest({'bucket': task['bucket'], 'key': task['key'], 'size': task['size']})
+    
+    timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    fmt = resolve_output_format()
+    with manifest.stage('upload', format=fmt) as stage:
+        output_keys, upload_report = save_output_artifacts([
+            (product_features, 'product_features', 'processed', 'Product features'),
+            (product_lookup, 'product_lookup', 'lookup', 'Product lookup'),
+            (customer_product_lookup, 'customer_product_lookup', 'lookup', 'Customer product lookup'),
+            (product_forecast_df, 'product_forecast_data', 'forecast_format', 'Product forecast data'),
+            (customer_forecast_df, 'customer_forecast_data', 'forecast_format', 'Customer forecast data')
+        ], timestamp, fmt)
+        stage['rows_out'] = sum(report['rows'] for report in upload_report)
+        stage['bytes'] = sum(report['bytes'] for report in upload_report)
+    manifest.record_uploads(upload_report)
+    with manifest.stage('dynamodb_write', len(product_lookup) + len(customer_product_lookup)) as stage:
+        dynamodb_report = save_lookup_tables_to_dynamodb(product_lookup, customer_product_lookup)
+        if isinstance(dynamodb_report, dict):
+            stage['rows_out'] = sum(result['written'] for result in dynamodb_report.values()
+                                    if isinstance(result, dict))
+    
+    response_body = {
+        'message': f'Successfully processed {rows} records',
+        'total_unique_products': len(product_lookup),
+        'total_customer_product_combinations': len(customer_product_lookup),
+    }
+    response_body.update(extra or {})
+    locations = {'product_features': 'product_features_location', 'product_lookup': 'product_lookup_location',
+                 'customer_product_lookup': 'customer_product_lookup_location',
+                 'product_forecast_data': 'product_forecast_location',
+                 'customer_forecast_data': 'customer_forecast_location'}
+    for name, field in locations.items():
+        if output_keys.get(name):
+            response_body[field] = f's3://{processed_bucket}/{output_keys[name]}'
+    if deepar_output:
+        try:
+            with manifest.stage('deepar') as stage:
+                deepar_keys = save_deepar_dataset(product_forecast_df, timestamp)
+                stage['rows_out'] = deepar_keys['series'] if deepar_keys else 0
+            if deepar_keys:
+                response_body['deepar_train_location'] = f"s3://{processed_bucket}/{deepar_keys['train']}"
+                response_body['deepar_test_location'] = f"s3://{processed_bucket}/{deepar_keys['test']}"
+        except Exception as e:
+            logger.error(f"Error writing DeepAR dataset: {str(e)}")
+    
+    manifest_key = manifest.save(timestamp, strategy=strategy, output_format=fmt, rows_in=rows, artifacts=output_keys)
+    if manifest_key:
+        response_body['run_manifest_location'] = f's3://{processed_bucket}/{manifest_key}'
+    
+    failed = isinstance(dynamodb_report, dict) and ('error' in dynamodb_report or any(
+        result.get('failed') for result in dynamodb_report.values() if isinstance(result, dict)))
+    if task.get('fingerprint') and not failed and output_keys.get('product_features') and output_keys.get('product_lookup'):
+        record_processed_upload(task['fingerprint'], {'bucket': task['bucket'], 'key': task['key'],
+                                                      'size': task['size']}, response_body)
+    return response_body
+
+def handle_fanout_task(task):
+    """Entry point of map and reduce invocations"""
+    try:
+        if task['role'] == 'map':
+            return run_fanout_map(task)
+        return run_fanout_reduce(task)
+    except Exception as e:
+        logger.error(f"Fan-out {task['role']} task of run {task['run_id']} failed: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise  # Let Lambda's asynchronous retries run the task again
+
+# Resumable scans: an upload the scan cannot finish before the deadline is
+# read in segments of DEADLINE_SEGMENT_BYTES, folded into one delta state.
+# When the next segment would not fit, the state is checkpointed under
+# resume/<run>/ and this function re-invokes itself to continue from there;
+# the invocation that reads the last segment publishes the outputs.
+# A checkpoint is deleted by the invocation after the one it was written for,
+# once that has loaded its own, so a retried invocation still finds its input.
+# Each step claims its continuation, so retries and duplicate deliveries of a
+# step that already handed over do nothing.
+def should_resume_scan(size_bytes, deadline):
+    """Whether a scan of size_bytes would run past the deadline and can be segmented instead"""
+    if deadline.remaining() is None or not size_bytes or pyarrow is None or incremental_mode:
+        return False
+    return not deadline.allows(size_bytes / (1024 * 1024) / DEADLINE_SCAN_MB_PER_S)
+
+def start_resumable_run(bucket, key, size_bytes, fingerprint, context):
+    """Start a segmented scan and run its first segments in this invocation"""
+    task = {'run_id': new_run_id(key), 'bucket': bucket, 'key': key, 'size': int(size_bytes),
+            'function': invoked_function(context), 'fingerprint': fingerprint,
+            'offset': 0, 'rows': 0, 'segments': 0, 'checkpoint': None}
+    logger.info(f"{key} cannot be scanned before the deadline, reading it in segments as run {task['run_id']}")
+    return continue_resumable_run(task, context)
+
+def _discard_checkpoint(tables):
+    _delete_resume_objects((tables or {}).values())
+
+def _delete_resume_objects(keys):
+    for key in keys:
+        try:
+            s3_client.delete_object(Bucket=processed_bucket, Key=key)
+        except Exception as e:
+            logger.warning(f"Could not remove {key}: {str(e)}")
+
+def _resume_claim_key(task):
+    return f"{resume_prefix}/{task['run_id']}/continued-{task['segments']:05d}.json"
+
+def _resume_step_continued(task):
+    """Whether this step (run and segment count) already handed over to its continuation"""
+    try:
+        s3_client.get_object(Bucket=processed_bucket, Key=_resume_claim_key(task))
+    except s3_client.exceptions.NoSuchKey:
+        return False
+    return True
+
+def continue_resumable_run(task, context):
+    """Read segments from the task's offset until the deadline, then checkpoint or publish
+    
+    At least one segment is read per invocation so every invocation makes progress.
+    """
+    deadline = Deadline(context)
+    if task['segments'] and _resume_step_continued(task):
+        logger.info(f"Step {task['segments']} of run {task['run_id']} was already continued, nothing to do")
+        return {'statusCode': 200, 'body': json.dumps({'message': 'Step already continued',
+                                                       'resumed_run': task['run_id'], 'segments': task['segments']})}
+    state = empty_incremental_state()
+    if task.get('checkpoint'):
+        read_state_tables(state, task['checkpoint'])
+    # The previous step's input is only needed until this step has loaded its own
+    _discard_checkpoint(task.get('previous_checkpoint'))
+    source = {'bucket': task['bucket'], 'key': task['key'], 'size': task['size']}
+    offset, rows, segments = task['offset'], task['rows'], task['segments']
+    seconds_per_byte = 1 / (DEADLINE_SCAN_MB_PER_S * 1024 * 1024)
+    manifest = RunManifest(source, context)
+    scan_started, scan_cpu = time.time(), _cpu_seconds()
+    
+    while offset < task['size']:
+        end = min(offset + DEADLINE_SEGMENT_BYTES, task['size'])
+        deadline.reserve_for_save(len(state['series_state']))
+        if segments > task['segments'] and not deadline.allows((end - offset) * seconds_per_byte):
+            break
+        start = time.time()
+        delta = summarize_order_range(source, offset, end)
+        merge_state_delta(state, delta)
+        seconds_per_byte = (time.time() - start) / (end - offset)
+        rows += delta['rows']
+        offset = end
+        segments += 1
+        logger.info(f"Segment {segments} of run {task['run_id']}: {offset}/{task['size']} bytes, {rows} rows")
+    # Only this invocation's segments; total_rows includes the checkpointed ones
+    manifest.record('parse', rows_in=None, rows_out=rows - task['rows'], total_rows=rows,
+                    segments=segments - task['segments'],
+                    wall_seconds=round(time.time() - scan_started, 3),
+                    cpu_seconds=round(_cpu_seconds() - scan_cpu, 3), peak_rss_mb=round(peak_rss_mb(), 1))
+    
+    if offset < task['size']:
+        checkpoint = write_state_tables(state, f"{resume_prefix}/{task['run_id']}/checkpoint-{segments:05d}")
+        claim_key = _resume_claim_key(task)
+        if _claim_object(claim_key, getattr(context, 'aws_request_id', None)):
+            try:
+                invoke_async(task['function'], {'resume': dict(task, offset=offset, rows=rows, segments=segments,
+                                                               checkpoint=checkpoint,
+                                                               previous_checkpoint=task.get('checkpoint'),
+                                                               claims=task.get('claims', []) + [claim_key])})
+            except Exception:
+                # Let the retry of this step claim it again
+                s3_client.delete_object(Bucket=processed_bucket, Key=claim_key)
+                raise
+        else:
+            logger.info(f"Step {task['segments']} of run {task['run_id']} was continued by another delivery")
+        return {
+            'statusCode': 202,
+            'body': json.dumps({'message': f"Read {offset} of {task['size']} bytes, continuing in a new invocation",
+                                'resumed_run': task['run_id'], 'segments': segments, 'rows': rows})
+        }
+    
+    with manifest.stage('build_outputs', rows) as stage:
+        outputs = build_outputs_from_state(state)
+        stage['rows_out'] = len(outputs[0])
+    response_body = publish_state_outputs(outputs, rows, task, {'resumed_run': task['run_id'], 'segments': segments},
+                                          manifest=manifest, strategy='resumable_scan')
+    _discard_checkpoint(task.get('checkpoint'))
+    _delete_resume_objects(task.get('claims', []))
+    return {'statusCode': 200, 'body': json.dumps(response_body)}
+
+def handle_resume_task(task, context):
+    """Entry point of the invocations continuing a segmented scan"""
+    try:
+        return continue_resumable_run(task, context)
+    except Exception as e:
+        logger.error(f"Resumed run {task['run_id']} failed at byte {task['offset']}: {str(e)}")
+        logger.error(traceback.format_exc())
+        raise  # Retried from the same checkpoint
 
 def lambda_handler(event, context):
     """Lambda function handler to process S3 data and create lookups"""
+    if 'fanout' in event:
+        return handle_fanout_task(event['fanout'])
+    if 'resume' in event:
+        return handle_resume_task(event['resume'], context)
+    
+    forecast_spill = None
     try:
         bucket = event['Records'][0]['s3']['bucket']['name']
         key = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'])
         
         logger.info(f"Processing file {key} from bucket {bucket}")
+        s3_object = event['Records'][0]['s3']['object']
+        manifest = RunManifest({'bucket': bucket, 'key': key, 'size': s3_object.get('size')}, context)
+        
+        # Identical content that was already processed goes straight to the existing outputs
+        fingerprint = upload_fingerprint(bucket, key, s3_object) if idempotency_mode == 'etag' else None
+        previous_run = find_processed_upload(fingerprint) if fingerprint else None
+        if previous_run:
+            logger.info(f"{key} matches already processed upload {previous_run['source']['key']}, skipping")
+            return duplicate_upload_response(key, previous_run)
         
-        download_path = f'/tmp/{os.path.basename(key)}'
-        s3_client.download_file(bucket, key, download_path)
+        # Uploads above the fan-out threshold are split across map invocations
+        if fanout_mode == 'lambda':
+            size_bytes = s3_object.get('size') or s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+            # Byte ranges cannot split a compressed stream, so compressed uploads run in one invocation
+            if should_fan_out(size_bytes) and upload_compression(key) is None:
+                return start_fanout(bucket, key, size_bytes, fingerprint, context)
         
-        # Check file size to determine processing strategy
-        file_size_mb = get_file_size_mb(download_path)
+        # Stage the upload in /tmp or stream it from S3, and size the processing strategy on it
+        with manifest.stage('download') as stage:
+            order_input, file_size_mb = open_order_input(bucket, key, s3_object.get('size'))
+            stage.update(input='stream' if not isinstance(order_input, str) else 'download',
+                         compressed=is_compressed_input(order_input), file_mb=round(file_size_mb, 2))
         logger.info(f"File size: {file_size_mb:.2f} MB")
         
+        if idempotency_mode == 'content':
+            fingerprint = upload_fingerprint(bucket, key, s3_object, order_input)
+            previous_run = find_processed_upload(fingerprint) if fingerprint else None
+            if previous_run:
+                logger.info(f"{key} matches already processed upload {previous_run['source']['key']}, skipping")
+                release_order_input(order_input)
+                return duplicate_upload_response(key, previous_run)
+        
+        with manifest.stage('plan') as stage:
+            # Resolve columns and dtypes from the header once for every reader below
+            read_plan = resolve_read_plan(order_input)
+            
+            # Size the strategy on a sample of the upload and the function's memory
+            execution_plan = plan_execution(order_input, file_size_mb, read_plan, context)
+            stage['strategy'] = execution_plan['strategy']
+        chunk_rows = execution_plan['chunk_rows']
+        
+        # Keep enough of the invocation's time to save the outputs of the planned series
+        deadline = Deadline(context)
+        deadline.reserve_for_save(execution_plan['estimates']['series'])
+        
         # Initialize variables to avoid NoneType errors
         product_features = None
         product_lookup = None
         customer_product_lookup = None
         product_forecast_df = None
         customer_forecast_df = None
+        incremental_state = None
+        incremental_rows = None
+        incremental_lookups = None
+        order_stats = None
+        processing_error = None
+        forecast_product_info = None
+        stages = dict(execution_plan['stages'], deepar='exact')
+        degraded_stages = {}
+        
+        use_incremental = incremental_mode and pyarrow is not None
+        if incremental_mode and pyarrow is None:
+            logger.warning("Incremental mode needs pyarrow for state snapshots, processing the file on its own")
         
-        # Process data based on file size with more aggressive chunking
-        if file_size_mb > 100:  # Very large files - split and process separately
-            logger.info("Very large file detected, using split processing")
+        # Scans that would run past the deadline continue across invocations from checkpoints
+        # (segments are byte ranges, so not for compressed uploads)
+        if (execution_plan['strategy'] == 'scan' and not use_incremental and not is_compressed_input(order_input)
+                and should_resume_scan(file_size_mb * 1024 * 1024, deadline)):
+            release_order_input(order_input)
+            size_bytes = s3_object.get('size') or s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+            return start_resumable_run(bucket, key, size_bytes, fingerprint, context)
+        
+        # Process data with the planned strategy
+        read_started = time.time()
+        if use_incremental:  # Fold the new file into the persisted history
+            source = {
+                'bucket': bucket,
+                'key': key,
+                'etag': s3_object.get('eTag'),
+                'size': s3_object.get('size')
+            }
+            # An upload folded by an invocation that failed before publishing is published again
+            folded = source_already_folded(load_state_manifest()[0], source)
+            if folded and folded.get('published', True):
+                logger.info(f"{key} is already part of the incremental state, skipping")
+                release_order_input(order_input)
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({'message': f'{key} was already processed incrementally'})
+                }
+            
+            logger.info("Incremental mode, folding new orders into persisted series state")
+            with manifest.stage('parse') as stage:
+                state_delta = summarize_orders(order_input, chunk_rows, read_plan)
+                incremental_rows = state_delta['rows']
+                stage['rows_out'] = incremental_rows
+            # Only the partitions of the upload's customers are merged and rebuilt
+            with manifest.stage('build_outputs', len(state_delta['series_state'])) as stage:
+                incremental_state = fold_delta_into_state(state_delta, source)
+                stage['partitions'] = len(incremental_state['partitions'])
+                stage['rows_out'] = incremental_state['manifest']['series']
+            # Publish the latest committed state, which includes concurrent folds that finished first
+            state_manifest = load_state_manifest()[0]
+            (product_features, product_lookup, customer_product_lookup,
+             product_forecast_df, customer_forecast_df) = state_output_parts(state_manifest)
+            # DynamoDB only needs the items of the products and series this upload changed
+            incremental_lookups = delta_lookup_tables(state_manifest, state_delta, product_lookup)
+            df = None
+        elif execution_plan['strategy'] == 'scan':  # Too big to hold - split and process separately
+            logger.info("File does not fit in memory, using split processing")
             try:
-                # For very large files, skip normal DataFrame loading and use split processing
-                product_features = split_large_file_and_process(download_path, max_chunk_rows=30000)
+                # Skip normal DataFrame loading and build features, lookups and
+                # file statistics from a single pass over the file
+                forecast_spill = new_forecast_spill(execution_plan['forecast_partitions'])
+                # One pass parses the file and feeds the features, lookups and forecast spill
+                with manifest.stage('parse', workers=execution_plan['workers']) as stage:
+                    scan = scan_orders(order_input, {'series_state': None, 'lookups': None, 'order_stats': None,
+                                                     'product_info': None, 'forecast_spill': forecast_spill},
+                                       chunk_rows, read_plan, workers=execution_plan['workers'])
+                    order_stats = scan['order_stats']
+                    stage['rows_out'] = order_stats['rows']
+                log_order_stats(order_stats)
+                with manifest.stage('demand_patterns', order_stats['rows']) as stage:
+                    product_features = finalize_scanned_series(scan['series_state'])
+                    stage['rows_out'] = len(product_features) if product_features is not None else 0
                 logger.info(f"Split processing completed, got {len(product_features) if product_features is not None else 0} product features")
                 
-                # Create minimal lookup tables directly from file
-                product_lookup, customer_product_lookup = create_minimal_lookup_from_file(download_path)
+                product_lookup, customer_product_lookup = scan['lookups']
                 logger.info(f"Created lookup tables: {len(product_lookup) if product_lookup is not None else 0} products, {len(customer_product_lookup) if customer_product_lookup is not None else 0} relationships")
                 
-                # Skip forecast data for very large files
-                product_forecast_df = pd.DataFrame({
-                    'item_id': ['PLACEHOLDER'],
-                    'timestamp': [pd.Timestamp.now()],
-                    'target_value': [0]
-                })
-                customer_forecast_df = pd.DataFrame({
-                    'item_id': ['PLACEHOLDER'],
-                    'timestamp': [pd.Timestamp.now()],
-                    'target_value': [0]
-                })
+                # Forecast data is written partition by partition from the spilled daily rows
+                forecast_spill = scan['forecast_spill']
+                forecast_product_info = scan['product_info']
+                product_forecast_df = iter_product_forecast_parts(forecast_spill, forecast_product_info)
+                customer_forecast_df = iter_customer_forecast_parts(forecast_spill)
                 
                 # Skip to saving results
                 df = None  # Don't load full dataset
             except Exception as e:
                 logger.error(f"Error in split processing: {str(e)}")
+                processing_error = f"Split processing failed: {str(e)}"
                 # Initialize with empty DataFrames to avoid None errors
                 product_features = pd.DataFrame()
                 product_lookup = pd.DataFrame()
@@ -1170,129 +4172,91 @@ def lambda_handler(event, context):
                 customer_forecast_df = pd.DataFrame()
                 df = None
             
-        elif file_size_mb > 50:  # Large files - use chunked processing
+        elif execution_plan['strategy'] == 'chunked_read':  # Frame fits but a whole-file read would not
             logger.info("Large file detected, using chunked processing")
-            df = process_large_file_in_chunks(download_path, chunk_size=5000)
-        elif file_size_mb > 20:  # Medium files - smaller chunks
-            logger.info("Medium file detected, using smaller chunks")
-            df = process_large_file_in_chunks(download_path, chunk_size=10000)
-        else:  # Small files - normal processing
-            df = pd.read_csv(download_path)
-            logger.info(f"Loaded {len(df)} rows of data")
-            
-            # Normalize column names: strip spaces, make consistent case
-            df.columns = [col.strip().replace(' ', '').replace('_', '').title() for col in df.columns]
-            col_map = {
-                'Customerid': 'CustomerID',
-                'Facilityid': 'FacilityID',
-                'Productid': 'ProductID',
-                'Productdescription': 'ProductDescription',
-                'Productcategory': 'ProductCategory',
-                'Createdate': 'CreateDate',
-                'Quantity': 'Quantity',
-                'ProductName': 'ProductDescription',
-                'CategoryName': 'ProductCategory',
-                'Price': 'UnitPrice',
-                'VendorName': 'VendorName'
-            }
-            df.rename(columns={k: v for k, v in col_map.items() if k in df.columns}, inplace=True)
-
-            # Flexible date parsing with detailed logging
-            logger.info(f"Sample CreateDate values: {df['CreateDate'].head().tolist()}")
-            try:
-                df['CreateDate'] = pd.to_datetime(df['CreateDate'], infer_datetime_format=True)
-                logger.info("Successfully parsed dates using infer_datetime_format")
-            except Exception as e:
-                logger.warning(f"infer_datetime_format failed: {str(e)}")
-                # Try multiple date formats
-                date_formats = ['%m/%d/%Y', '%m/%d/%y', '%Y-%m-%d', '%d/%m/%Y', '%d/%m/%y', '%Y/%m/%d']
-                parsed = False
-                for fmt in date_formats:
-                    try:
-                        df['CreateDate'] = pd.to_datetime(df['CreateDate'], format=fmt)
-                        logger.info(f"Successfully parsed dates using format: {fmt}")
-                        parsed = True
-                        break
-                    except Exception as fmt_error:
-                        logger.debug(f"Format {fmt} failed: {str(fmt_error)}")
-                        continue
+            # Chunks get their dates parsed and basic calendar columns as they are read
+            with manifest.stage('parse', workers=execution_plan['workers']) as stage:
+                df = process_large_file_in_chunks(order_input, chunk_size=chunk_rows, read_plan=read_plan,
+                                                  workers=execution_plan['workers'])
+                stage['rows_out'] = len(df)
+        else:  # Fits in memory - normal processing
+            with manifest.stage('parse') as stage:
+                df = read_orders(order_input, read_plan)
+                logger.info(f"Loaded {len(df)} rows of data ({df.memory_usage(deep=True).sum() / (1024 * 1024):.1f} MB in memory)")
                 
-                if not parsed:
-                    # If all formats fail, use pandas' flexible parser
-                    logger.warning("All specific formats failed, using flexible parser")
-                    df['CreateDate'] = pd.to_datetime(df['CreateDate'], errors='coerce')
-                    
+                # Date parsing with format detection, parsing each distinct string once
+                logger.info(f"Sample CreateDate values: {df['CreateDate'].head().tolist()}")
+                date_parse_state = new_date_parse_state()
+                df['CreateDate'] = parse_create_dates(df['CreateDate'], date_parse_state)
+                stage['rows_out'] = len(df)
+            
             # Check for any failed date conversions
             null_dates = df['CreateDate'].isnull().sum()
             if null_dates > 0:
                 logger.warning(f"Found {null_dates} rows with unparseable dates")
 
             # Feature engineering for small files only
-            df = extract_temporal_features(df)
+            with manifest.stage('temporal_features', len(df)) as stage:
+                df = extract_temporal_features(df)
+                stage['rows_out'] = len(df)
         
-        # Clean up download file immediately
-        try:
-            os.remove(download_path)
-        except:
-            pass
+        # Clean up download file (or close the input stream) immediately
+        release_order_input(order_input)
         
         # Force garbage collection
         gc.collect()
         
         # Process data based on whether we have a DataFrame or used split processing
         if df is not None:
-            # Normal processing path
-            data_size = len(df)
-            if data_size > 100000:  # For large datasets, use simplified calculation only
-                logger.info(f"Large dataset detected ({data_size} rows), using simplified calculation")
-                product_features = calculate_product_demand_patterns_simple(df)
-            elif data_size > 50000:  # For medium datasets, very limited processing
-                max_products = 2000  # Reduced from 5000
-                batch_size = 200    # Reduced from 500
-                timeout_seconds = 180  # 3 minutes
-                logger.info(f"Medium dataset detected ({data_size} rows), limiting to {max_products} products")
-                product_features = calculate_product_demand_patterns(df, max_products=max_products, batch_size=batch_size, timeout_seconds=timeout_seconds)
-            elif data_size > 20000:  # For smaller medium datasets
-                max_products = 5000
-                batch_size = 500
-                timeout_seconds = 240  # 4 minutes
-                product_features = calculate_product_demand_patterns(df, max_products=max_products, batch_size=batch_size, timeout_seconds=timeout_seconds)
-            else:  # For smaller datasets
-                max_products = None
-                batch_size = 1000
-                timeout_seconds = 300  # 5 minutes
-                product_features = calculate_product_demand_patterns(df, max_products=max_products, batch_size=batch_size, timeout_seconds=timeout_seconds)
+            # Normal processing path; re-check the planned stages against the loaded frame
+            stages = plan_stages(df.memory_usage(deep=True).sum() / (1024 * 1024),
+                                 execution_plan['estimates']['budget_mb'])
+            if stages != execution_plan['stages']:
+                logger.info(f"Loaded frame changes the planned stages to {stages}")
+            
+            # Degrade the stages that would not finish in the time left, measured in load times
+            stages['deepar'] = 'exact'
+            deadline_stages = plan_stage_deadline(stages, deadline, time.time() - read_started)
+            degraded_stages = {stage: mode for stage, mode in deadline_stages.items() if stages[stage] != mode}
+            stages = deadline_stages
+            with manifest.stage('demand_patterns', len(df), mode=stages['features']) as stage:
+                if stages['features'] == 'approximate':  # Daily features would not fit, use simplified calculation only
+                    logger.info(f"Large dataset detected ({len(df)} rows), using simplified calculation")
+                    product_features = calculate_product_demand_patterns_simple(df)
+                else:
+                    product_features = calculate_product_demand_patterns(df)
+                stage['rows_out'] = len(product_features)
             
             # Force garbage collection after heavy processing
             gc.collect()
             
             # Create lookup tables with memory management
             logger.info("Creating lookup tables...")
-            product_lookup, customer_product_lookup = create_product_lookup_table(df)
+            with manifest.stage('lookups', len(df)) as stage:
+                product_lookup, customer_product_lookup = create_product_lookup_table(df)
+                stage['rows_out'] = len(product_lookup) + len(customer_product_lookup)
             
             # Force garbage collection
             gc.collect()
             
-            # Prepare forecast data at different levels (skip for very large datasets)
-            if data_size <= 100000:
-                logger.info("Preparing forecast data...")
-                product_forecast_df = prepare_product_forecast_data(df)
-                customer_forecast_df = prepare_customer_level_forecast_data(df)
-            else:
-                logger.info("Skipping forecast data preparation for large dataset")
-                # Create minimal forecast data
-                product_forecast_df = pd.DataFrame({
-                    'item_id': ['PLACEHOLDER'],
-                    'timestamp': [pd.Timestamp.now()],
-                    'target_value': [0]
-                })
-                customer_forecast_df = pd.DataFrame({
-                    'item_id': ['PLACEHOLDER'],
-                    'timestamp': [pd.Timestamp.now()],
-                    'target_value': [0]
-                })
+            # Prepare forecast data at different levels (partitioned when it would not fit)
+            with manifest.stage('forecast_prep', len(df), mode=stages['forecasts']) as stage:
+                if stages['forecasts'] == 'skipped':
+                    logger.info("Skipping forecast data to finish before the deadline")
+                elif stages['forecasts'] == 'exact':
+                    logger.info("Preparing forecast data...")
+                    product_forecast_df = prepare_product_forecast_data(df)
+                    customer_forecast_df = prepare_customer_level_forecast_data(df)
+                    stage['rows_out'] = len(product_forecast_df) + len(customer_forecast_df)
+                else:
+                    # Rows are produced partition by partition while uploading
+                    logger.info(f"Preparing forecast data in {execution_plan['forecast_partitions']} partitions")
+                    forecast_spill = spill_forecast_frame(df, chunk_rows, execution_plan['forecast_partitions'])
+                    forecast_product_info = summarize_product_info(df)
+                    product_forecast_df = iter_product_forecast_parts(forecast_spill, forecast_product_info)
+                    customer_forecast_df = iter_customer_forecast_parts(forecast_spill)
         else:
-            # Split processing was used - product_features, product_lookup, customer_product_lookup, 
+            # Split or incremental processing was used - product_features, product_lookup, customer_product_lookup, 
             # product_forecast_df, and customer_forecast_df are already created
             logger.info("Using results from split processing")
             
@@ -1318,61 +4282,60 @@ def lambda_handler(event, context):
         
         # Save all the processed data
         timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+        fmt = resolve_output_format()
+        logger.info(f"Writing output artifacts as {fmt}")
         
+        # Save product features, lookups and forecast data, uploading them concurrently
+        with manifest.stage('upload', format=fmt) as stage:
+            output_keys, upload_report = save_output_artifacts([
+                (product_features, 'product_features', 'processed', 'Product features'),
+                (product_lookup, 'product_lookup', 'lookup', 'Product lookup'),
+                (customer_product_lookup, 'customer_product_lookup', 'lookup', 'Customer product lookup'),
+                (product_forecast_df, 'product_forecast_data', 'forecast_format', 'Product forecast data'),
+                (customer_forecast_df, 'customer_forecast_data', 'forecast_format', 'Customer forecast data')
+            ], timestamp, fmt)
+            stage['rows_out'] = sum(report['rows'] for report in upload_report)
+            stage['bytes'] = sum(report['bytes'] for report in upload_report)
+        manifest.record_uploads(upload_report)
+        product_features_key = output_keys['product_features']
+        product_lookup_key = output_keys['product_lookup']
+        customer_product_lookup_key = output_keys['customer_product_lookup']
+        product_forecast_key = output_keys['product_forecast_data']
+        customer_forecast_key = output_keys['customer_forecast_data']
         
-        # Save product features
-        if product_features is not None and not product_features.empty:
-            product_features_file = f'/tmp/product_features_{timestamp}.csv'
-            product_features.to_csv(product_features_file, index=False)
-            product_features_key = f'processed/{timestamp}/product_features.csv'
-            s3_client.upload_file(product_features_file, processed_bucket, product_features_key)
-        else:
-            logger.warning("Product features is None or empty, skipping save")
-            product_features_key = None
-        
-        # Save product lookup
-        if product_lookup is not None and not product_lookup.empty:
-            product_lookup_file = f'/tmp/product_lookup_{timestamp}.csv'
-            product_lookup.to_csv(product_lookup_file, index=False)
-            product_lookup_key = f'lookup/{timestamp}/product_lookup.csv'
-            s3_client.upload_file(product_lookup_file, processed_bucket, product_lookup_key)
-        else:
-            logger.warning("Product lookup is None or empty, skipping save")
-            product_lookup_key = None
-        
-        # Save customer-product lookup
-        if customer_product_lookup is not None and not customer_product_lookup.empty:
-            customer_product_lookup_file = f'/tmp/customer_product_lookup_{timestamp}.csv'
-            customer_product_lookup.to_csv(customer_product_lookup_file, index=False)
-            customer_product_lookup_key = f'lookup/{timestamp}/customer_product_lookup.csv'
-            s3_client.upload_file(customer_product_lookup_file, processed_bucket, customer_product_lookup_key)
-        else:
-            logger.warning("Customer product lookup is None or empty, skipping save")
-            customer_product_lookup_key = None
-        
-        # Save product-level forecast data
-        if product_forecast_df is not None and not product_forecast_df.empty:
-            product_forecast_file = f'/tmp/product_forecast_data_{timestamp}.csv'
-            product_forecast_df.to_csv(product_forecast_file, index=False)
-            product_forecast_key = f'forecast_format/{timestamp}/product_forecast_data.csv'
-            s3_client.upload_file(product_forecast_file, processed_bucket, product_forecast_key)
-        else:
-            logger.warning("Product forecast data is None or empty, skipping save")
-            product_forecast_key = None
+        # DeepAR channels from the product forecast rows (re-read from the spill when partitioned)
+        deepar_keys = None
+        if deepar_output and stages['deepar'] != 'skipped':
+            try:
+                if forecast_spill is not None and not isinstance(product_forecast_df, pd.DataFrame):
+                    deepar_parts = iter_product_forecast_parts(forecast_spill, forecast_product_info)
+                elif incremental_state is not None:
+                    deepar_parts = iter_state_product_forecast(state_manifest, product_lookup)
+                else:
+                    deepar_parts = product_forecast_df
+                if df is not None:
+                    deepar_end = df['CreateDate'].max()
+                else:
+                    deepar_end = order_stats['last_date'] if order_stats is not None else None
+                with manifest.stage('deepar') as stage:
+                    deepar_keys = save_deepar_dataset(deepar_parts, timestamp, deepar_end)
+                    stage['rows_out'] = deepar_keys['series'] if deepar_keys else 0
+            except Exception as e:
+                logger.error(f"Error writing DeepAR dataset: {str(e)}")
+        release_forecast_spill(forecast_spill)
         
-        # Save customer-level forecast data
-        if customer_forecast_df is not None and not customer_forecast_df.empty:
-            customer_forecast_file = f'/tmp/customer_forecast_data_{timestamp}.csv'
-            customer_forecast_df.to_csv(customer_forecast_file, index=False)
-            customer_forecast_key = f'forecast_format/{timestamp}/customer_forecast_data.csv'
-            s3_client.upload_file(customer_forecast_file, processed_bucket, customer_forecast_key)
-        else:
-            logger.warning("Customer forecast data is None or empty, skipping save")
-            customer_forecast_key = None
+        # Redeliveries are skipped only once the outputs built from the state are uploaded
+        if incremental_state is not None:
+            mark_state_published(source)
         
         # Save lookup tables to DynamoDB as well
-        if product_lookup is not None and customer_product_lookup is not None:
-            save_lookup_tables_to_dynamodb(product_lookup, customer_product_lookup)
+        dynamodb_report = None
+        lookup_tables = incremental_lookups or (product_lookup, customer_product_lookup)
+        if lookup_tables[0] is not None and lookup_tables[1] is not None:
+            with manifest.stage('dynamodb_write', len(lookup_tables[0]) + len(lookup_tables[1])) as stage:
+                dynamodb_report = save_lookup_tables_to_dynamodb(*lookup_tables)
+                stage['rows_out'] = sum(result['written'] for result in dynamodb_report.values()
+                                        if isinstance(result, dict))
         else:
             logger.warning("Skipping DynamoDB save due to missing lookup tables")
         
@@ -1383,6 +4346,12 @@ def lambda_handler(event, context):
             if df is not None:
                 records_processed = len(df)
                 logger.info(f"Records processed from df: {records_processed}")
+            elif incremental_rows is not None:
+                records_processed = incremental_rows
+                logger.info(f"Records folded into incremental state: {records_processed}")
+            elif order_stats is not None:
+                records_processed = order_stats['rows']
+                logger.info(f"Records scanned by split processing: {records_processed}")
             else:
                 # For split processing, use the number of product patterns as a proxy
                 if product_features is not None:
@@ -1404,7 +4373,10 @@ def lambda_handler(event, context):
             total_products = 0
             
         try:
-            total_combinations = len(customer_product_lookup) if customer_product_lookup is not None else 0
+            if incremental_state is not None:
+                total_combinations = state_manifest['series']
+            else:
+                total_combinations = len(customer_product_lookup) if customer_product_lookup is not None else 0
             logger.info(f"Total customer-product combinations: {total_combinations}")
         except Exception as e:
             logger.error(f"Error getting customer_product_lookup length: {str(e)}")
@@ -1416,6 +4388,14 @@ def lambda_handler(event, context):
             'total_customer_product_combinations': total_combinations
         }
         
+        if dynamodb_report:
+            response_body['dynamodb_items_written'] = sum(
+                result['written'] for result in dynamodb_report.values() if isinstance(result, dict))
+            response_body['dynamodb_failed_items'] = sum(
+                result['failed'] for result in dynamodb_report.values() if isinstance(result, dict))
+            if 'error' in dynamodb_report:
+                response_body['dynamodb_error'] = dynamodb_report['error']
+        
         # Only add S3 locations if files were actually saved
         if product_features_key:
             response_body['product_features_location'] = f's3://{processed_bucket}/{product_features_key}'
@@ -1427,6 +4407,29 @@ def lambda_handler(event, context):
             response_body['product_forecast_location'] = f's3://{processed_bucket}/{product_forecast_key}'
         if customer_forecast_key:
             response_body['customer_forecast_location'] = f's3://{processed_bucket}/{customer_forecast_key}'
+        if deepar_keys:
+            response_body['deepar_train_location'] = f"s3://{processed_bucket}/{deepar_keys['train']}"
+            response_body['deepar_test_location'] = f"s3://{processed_bucket}/{deepar_keys['test']}"
+        if degraded_stages:
+            response_body['degraded_stages'] = degraded_stages
+        if processing_error:
+            response_body['processing_error'] = processing_error
+        
+        # Stage measurements of this run, next to its outputs
+        manifest_key = manifest.save(timestamp, strategy='incremental' if use_incremental else execution_plan['strategy'],
+                                     stage_modes=stages, degraded_stages=degraded_stages,
+                                     plan_estimates=execution_plan['estimates'], output_format=fmt,
+                                     rows_in=records_processed, artifacts=output_keys)
+        if manifest_key:
+            response_body['run_manifest_location'] = f's3://{processed_bucket}/{manifest_key}'
+        
+        # Register the content so a re-upload reuses these outputs (unless a failed scan, DynamoDB
+        # or the deadline left them empty or incomplete and a re-upload deserves another try)
+        outputs_written = bool(output_keys.get('product_features') and output_keys.get('product_lookup'))
+        if (fingerprint and outputs_written and not processing_error and not response_body.get('dynamodb_failed_items')
+                and 'dynamodb_error' not in response_body and not degraded_stages):
+            record_processed_upload(fingerprint, {'bucket': bucket, 'key': key, 'etag': s3_object.get('eTag'),
+                                                  'size': s3_object.get('size')}, response_body)
         
         return {
             'statusCode': 200,
@@ -1436,6 +4439,7 @@ def lambda_handler(event, context):
 
     except Exception as e:
         logger.error(f"Error processing file: {str(e)}")
+        release_forecast_spill(forecast_spill)
         return {
             'statusCode': 500,
             'body': json.dumps({
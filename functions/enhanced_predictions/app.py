@@ -18,6 +18,13 @@ except ImportError as e:
     logging.error(f"Failed to import pandas/numpy from CoreDataScienceLayer: {e}")
     raise
 
+# Optional columnar lookup support
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
@@ -34,6 +41,26 @@ feedback_table_name = os.environ.get('FEEDBACK_TABLE')
 processed_bucket = os.environ.get('PROCESSED_BUCKET')
 sagemaker_endpoint_name = os.environ.get('SAGEMAKER_ENDPOINT_NAME')
 
+# Lookup CSV columns read as categoricals (repeated IDs and names) and dates.
+# ProductID keeps its inferred type because it is returned in the API response.
+LOOKUP_CATEGORY_COLUMNS = ['ProductName', 'CategoryName', 'vendorName', 'CustomerID', 'FacilityID']
+LOOKUP_DATE_COLUMNS = ['FirstOrderDate', 'LastOrderDate']
+
+def read_lookup_artifact(folder, name, available_keys):
+    """Download and read one lookup artifact, preferring Parquet over CSV"""
+    parquet_key = f"{folder}{name}.parquet"
+    if parquet_key in available_keys and pyarrow is not None:
+        local_path = f'/tmp/{name}.parquet'
+        s3_client.download_file(processed_bucket, parquet_key, local_path)
+        return pd.read_parquet(local_path)
+    
+    local_path = f'/tmp/{name}.csv'
+    s3_client.download_file(processed_bucket, f"{folder}{name}.csv", local_path)
+    header = pd.read_csv(local_path, nrows=0).columns
+    return pd.read_csv(local_path,
+                       dtype={col: 'category' for col in LOOKUP_CATEGORY_COLUMNS if col in header},
+                       parse_dates=[col for col in LOOKUP_DATE_COLUMNS if col in header])
+
 def get_product_lookup_data():
     """Get product lookup data from S3"""
     try:
@@ -50,17 +77,12 @@ def get_product_lookup_data():
         # Get the latest timestamp folder
         latest_folder = sorted([prefix['Prefix'] for prefix in response['CommonPrefixes']])[-1]
         
-        # Download product lookup
-        product_lookup_key = f"{latest_folder}product_lookup.csv"
-        product_lookup_path = '/tmp/product_lookup.csv'
-        s3_client.download_file(processed_bucket, product_lookup_key, product_lookup_path)
-        product_lookup_df = pd.read_csv(product_lookup_path)
-        
-        # Download customer-product lookup
-        customer_product_lookup_key = f"{latest_folder}customer_product_lookup.csv"
-        customer_product_lookup_path = '/tmp/customer_product_lookup.csv'
-        s3_client.download_file(processed_bucket, customer_product_lookup_key, customer_product_lookup_path)
-        customer_product_lookup_df = pd.read_csv(customer_product_lookup_path)
+        # Prefer typed Parquet artifacts when the feature engineering run wrote them
+        folder_listing = s3_client.list_objects_v2(Bucket=processed_bucket, Prefix=latest_folder)
+        available_keys = {obj['Key'] for obj in folder_listing.get('Contents', [])}
+        
+        product_lookup_df = read_lookup_artifact(latest_folder, 'product_lookup', available_keys)
+        customer_product_lookup_df = read_lookup_artifact(latest_folder, 'customer_product_lookup', available_keys)
         
         return product_lookup_df, customer_product_lookup_df
         
@@ -15,6 +15,17 @@ logger.setLevel(logging.INFO)
 
 s3_client = boto3.client('s3')
 
+# Raw uploads that trigger feature engineering, one notification rule per suffix.
+# The compressed suffixes are the ones feature engineering decompresses
+# (UPLOAD_COMPRESSION_SUFFIXES there); S3 matches suffixes case-sensitively.
+RAW_UPLOAD_TRIGGERS = [
+    ('FeatureEngineeringTrigger', '.csv'),
+    ('FeatureEngineeringGzipTrigger', '.csv.gz'),
+    ('FeatureEngineeringGzipLongTrigger', '.csv.gzip'),
+    ('FeatureEngineeringZstdTrigger', '.csv.zst'),
+    ('FeatureEngineeringZstdLongTrigger', '.csv.zstd')
+]
+
 def send_response(event, context, response_status, response_data=None):
     """Send response to CloudFormation"""
     if response_data is None:
@@ -66,7 +77,7 @@ def lambda_handler(event, context):
                 NotificationConfiguration={
                     'LambdaConfigurations': [
                         {
-                            'Id': 'FeatureEngineeringTrigger',
+                            'Id': trigger_id,
                             'LambdaFunctionArn': feature_function,
                             'Events': ['s3:ObjectCreated:*'],
                             'Filter': {
@@ -74,12 +85,13 @@ def lambda_handler(event, context):
                                     'FilterRules': [
                                         {
                                             'Name': 'suffix',
-                                            'Value': '.csv'
+                                            'Value': suffix
                                         }
                                     ]
                                 }
                             }
                         }
+                        for trigger_id, suffix in RAW_UPLOAD_TRIGGERS
                     ]
                 }
             )
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+CSV Ingest Benchmark
+Times reading synthetic order files of several sizes with the pandas and
+Arrow CSV engines, whole and in chunks, reporting throughput and peak RSS
+of each read (run in its own process) and checking the engines agree
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# The Lambda module creates boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, str(Path(__file__).parent.parent / "functions" / "enhanced_feature_engineering"))
+
+import app  # noqa: E402
+
+ENGINES = ['pandas', 'arrow']
+
+
+def generate_order_file(path, target_mb, customers, seed, batch_rows=1_000_000):
+    """Append synthetic order lines until the file reaches target_mb"""
+    rng = np.random.default_rng(seed)
+    header = True
+    while not os.path.exists(path) or os.path.getsize(path) < target_mb * 1024 * 1024:
+        product_ids = rng.integers(0, 2000, batch_rows)
+        frame = pd.DataFrame({
+            'CustomerID': rng.integers(0, customers, batch_rows),
+            'FacilityID': rng.integers(0, 20, batch_rows),
+            'ProductID': product_ids,
+            'ProductName': ['Product ' + str(p) for p in product_ids],
+            'CreateDate': (pd.Timestamp('2024-01-01') +
+                           pd.to_timedelta(rng.integers(0, 365, batch_rows), unit='D')).strftime('%m/%d/%Y'),
+            'OrderUnits': rng.integers(1, 24, batch_rows)
+        })
+        frame.to_csv(path, index=False, header=header, mode='w' if header else 'a')
+        header = False
+
+
+def peak_rss_mb():
+    """Peak RSS of this process image
+    
+    ru_maxrss survives exec on Linux, so it would report the parent's peak
+    from generating the file; VmHWM belongs to the current image alone.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_read(path, engine, chunk_rows):
+    """Read the file once with one engine and report time, rows, peak RSS and a checksum"""
+    app.csv_engine = engine
+    plan = app.resolve_read_plan(path)
+    start = time.time()
+    if chunk_rows:
+        rows, units = 0, 0.0
+        for chunk in app.read_orders(path, plan, chunksize=chunk_rows):
+            rows += len(chunk)
+            units += chunk['OrderUnits'].sum()
+    else:
+        frame = app.read_orders(path, plan)
+        rows, units = len(frame), frame['OrderUnits'].sum()
+    seconds = time.time() - start
+    return {'seconds': seconds, 'rows': rows, 'units': float(units), 'peak_rss_mb': peak_rss_mb()}
+
+
+def run_isolated(path, engine, chunk_rows):
+    """Measure one read in a fresh interpreter so peak RSS belongs to that read alone"""
+    output = subprocess.run([sys.executable, __file__, '--measure', path, engine, str(chunk_rows)],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pandas and Arrow CSV engines")
+    parser.add_argument("--sizes-mb", type=int, nargs="+", default=[100, 1000], help="File sizes to generate")
+    parser.add_argument("--customers", type=int, default=5_000, help="Distinct customers")
+    parser.add_argument("--chunk-rows", type=int, default=500_000, help="Rows per chunk for chunked reads")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--measure", nargs=3, metavar=('PATH', 'ENGINE', 'CHUNK_ROWS'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        path, engine, chunk_rows = args.measure
+        print(json.dumps(measure_read(path, engine, int(chunk_rows))))
+        return
+
+    report = {'timestamp': datetime.now().isoformat(), 'cores': os.cpu_count(),
+              'chunk_rows': args.chunk_rows, 'results': []}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size_mb in args.sizes_mb:
+            path = os.path.join(workdir, f'orders_{size_mb}mb.csv')
+            print(f"Generating a {size_mb} MB order file...")
+            generate_order_file(path, size_mb, args.customers, args.seed)
+            file_mb = os.path.getsize(path) / (1024 * 1024)
+
+            for mode, chunk_rows in (('whole', 0), ('chunked', args.chunk_rows)):
+                measured = {engine: run_isolated(path, engine, chunk_rows) for engine in ENGINES}
+                baseline = measured['pandas']
+                for engine in ENGINES:
+                    run = measured[engine]
+                    entry = {
+                        'file_size_mb': round(file_mb, 1),
+                        'mode': mode,
+                        'engine': engine,
+                        'rows': run['rows'],
+                        'seconds': round(run['seconds'], 2),
+                        'throughput_mb_s': round(file_mb / run['seconds'], 1),
+                        'peak_rss_mb': round(run['peak_rss_mb'], 1),
+                        'speedup': round(baseline['seconds'] / run['seconds'], 2),
+                        'matches_pandas': (run['rows'] == baseline['rows'] and
+                                           np.isclose(run['units'], baseline['units']))
+                    }
+                    report['results'].append(entry)
+                    print(f"{file_mb:7.0f} MB {mode:<7} {engine:<6}: {run['seconds']:.1f}s "
+                          f"({entry['throughput_mb_s']} MB/s), peak RSS {entry['peak_rss_mb']:.0f} MB, "
+                          f"speedup {entry['speedup']}x, matches pandas: {entry['matches_pandas']}")
+            os.remove(path)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2, default=bool)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2, default=bool))
+
+
+if __name__ == "__main__":
+    main()
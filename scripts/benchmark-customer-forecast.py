@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Customer Forecast Benchmark
+Times the single-pass customer-level forecast builder against the previous
+builder (one groupby per metric, merged and concatenated) on synthetic order
+lines, and checks both give the same rows without changing their input
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# The Lambda module creates boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, str(Path(__file__).parent.parent / "functions" / "enhanced_feature_engineering"))
+
+import app  # noqa: E402
+
+
+def previous_customer_forecast_data(df):
+    """The builder this benchmark replaces: a groupby per metric, merges and one frame per metric"""
+    keys = ['CustomerID', 'FacilityID', 'Date']
+    if 'OrderUnits' in df.columns:
+        customer_daily = df.groupby(keys, observed=True)['OrderUnits'].sum().reset_index(name='TotalUnits')
+    else:
+        customer_daily = df.groupby(keys, observed=True).size().reset_index(name='TotalItems')
+    unique_products_daily = df.groupby(keys, observed=True)['ProductID'].nunique().reset_index(name='UniqueProducts')
+    if 'Price' in df.columns:
+        df['OrderValue'] = df['OrderUnits'] * df['Price'] if 'OrderUnits' in df.columns else df['Price']
+        order_value_daily = df.groupby(keys, observed=True)['OrderValue'].sum().reset_index(name='TotalValue')
+        customer_daily = customer_daily.merge(order_value_daily, on=keys)
+    customer_daily = customer_daily.merge(unique_products_daily, on=keys)
+
+    frames = []
+    for col, metric in app.CUSTOMER_FORECAST_METRICS:
+        if col not in customer_daily.columns:
+            continue
+        frames.append(pd.DataFrame({
+            'item_id': (customer_daily['CustomerID'].astype(str) + '_' +
+                        customer_daily['FacilityID'].astype(str) + '_' + metric),
+            'timestamp': pd.to_datetime(customer_daily['Date']),
+            'target_value': customer_daily[col],
+            'customer_id': customer_daily['CustomerID'],
+            'facility_id': customer_daily['FacilityID'],
+            'metric_type': metric
+        }))
+    forecast_df = pd.concat(frames, ignore_index=True)
+    forecast_df['day_of_week'] = forecast_df['timestamp'].dt.dayofweek
+    forecast_df['month'] = forecast_df['timestamp'].dt.month
+    return forecast_df.sort_values(['item_id', 'timestamp']).reset_index(drop=True)
+
+
+def generate_orders(rows, customers, seed):
+    """Synthetic order lines with temporal features, as the handler holds them"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(0, customers, rows),
+        'FacilityID': rng.integers(0, 20, rows),
+        'ProductID': rng.integers(0, 2000, rows),
+        'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D'),
+        'OrderUnits': rng.integers(1, 24, rows),
+        'Price': np.round(rng.lognormal(2.0, 0.8, rows), 2)
+    })
+    return app.extract_temporal_features(frame)
+
+
+def time_builder(function, df, repeat):
+    """Best wall time of repeat runs and the last result"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.time()
+        result = function(df)
+        best = min(best, time.time() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the customer-level forecast builder")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 3_000_000], help="Order lines per run")
+    parser.add_argument("--customers", type=int, default=5_000, help="Distinct customers")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per builder (best time is reported)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    report = {'timestamp': datetime.now().isoformat(), 'customers': args.customers, 'results': []}
+    for rows in args.rows:
+        print(f"Generating {rows:,} order lines...")
+        df = generate_orders(rows, args.customers, args.seed)
+        columns = list(df.columns)
+
+        current_seconds, current = time_builder(app.prepare_customer_level_forecast_data, df, args.repeat)
+        unchanged = list(df.columns) == columns
+        # The previous builder adds OrderValue to its input, so it gets its own copy
+        previous_seconds, previous = time_builder(previous_customer_forecast_data, df.copy(), args.repeat)
+        pd.testing.assert_frame_equal(current, previous)
+
+        result = {
+            'rows': rows,
+            'forecast_rows': len(current),
+            'previous_seconds': round(previous_seconds, 3),
+            'current_seconds': round(current_seconds, 3),
+            'speedup': round(previous_seconds / current_seconds, 2),
+            'input_unchanged': unchanged,
+            'identical_output': True
+        }
+        report['results'].append(result)
+        print(f"{rows:>10,} rows: previous {previous_seconds:.2f}s, single pass {current_seconds:.2f}s "
+              f"({result['speedup']}x), {len(current):,} forecast rows, input unchanged: {unchanged}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Parallel Chunk Benchmark
+Times the chunked feature engineering paths with different numbers of
+worker processes on a synthetic order file and checks the results agree
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# The Lambda module creates boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, str(Path(__file__).parent.parent / "functions" / "enhanced_feature_engineering"))
+
+import app  # noqa: E402
+
+
+def generate_order_file(path, rows, customers, seed):
+    """Write a synthetic raw order file"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(0, customers, rows),
+        'FacilityID': rng.integers(0, 20, rows),
+        'ProductID': rng.integers(0, 2000, rows),
+        'CreateDate': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 24, rows)
+    })
+    frame.to_csv(path, index=False)
+
+
+def time_path(function, path, chunk_rows, workers):
+    """Run one chunked path with a fixed worker count"""
+    app.chunk_workers_setting = str(workers)
+    start = time.time()
+    result = function(path, chunk_rows)
+    return time.time() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parallel chunk execution")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Rows in the synthetic file")
+    parser.add_argument("--customers", type=int, default=500, help="Distinct customers")
+    parser.add_argument("--chunk-rows", type=int, default=100_000, help="Rows per chunk")
+    parser.add_argument("--workers", type=int, nargs="+", default=None,
+                        help="Worker counts to time (default: 1 up to the core count)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'orders.csv')
+        print(f"Generating {args.rows:,} rows...")
+        generate_order_file(path, args.rows, args.customers, args.seed)
+        file_mb = os.path.getsize(path) / (1024 * 1024)
+
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'rows': args.rows,
+            'file_size_mb': round(file_mb, 2),
+            'cores': cores,
+            'chunk_rows': args.chunk_rows,
+            'results': []
+        }
+        paths = [('split_large_file_and_process', app.split_large_file_and_process),
+                 ('process_large_file_in_chunks', app.process_large_file_in_chunks)]
+        for name, function in paths:
+            baseline_seconds, baseline = None, None
+            for workers in worker_counts:
+                elapsed, result = time_path(function, path, args.chunk_rows, workers)
+                if baseline is None:
+                    baseline_seconds, baseline = elapsed, result
+                    matches = True
+                else:
+                    try:
+                        pd.testing.assert_frame_equal(result, baseline, check_exact=False, rtol=1e-9)
+                        matches = True
+                    except AssertionError:
+                        matches = False
+                entry = {
+                    'path': name,
+                    'workers': workers,
+                    'seconds': round(elapsed, 2),
+                    'throughput_mb_s': round(file_mb / elapsed, 2),
+                    'speedup': round(baseline_seconds / elapsed, 2),
+                    'matches_serial': matches
+                }
+                report['results'].append(entry)
+                print(f"{name} workers={workers}: {elapsed:.1f}s ({entry['throughput_mb_s']} MB/s), "
+                      f"speedup {entry['speedup']}x, matches serial: {matches}")
+                del result
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
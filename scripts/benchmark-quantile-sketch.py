@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Quantile Sketch Benchmark
+Compares the per-series quantile sketch used by the chunked feature engineering
+path against exact medians and p10/p90 on a synthetic multi-million-row order file
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+from pathlib import Path
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# The Lambda module creates boto3 clients at import time
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+sys.path.insert(0, str(Path(__file__).parent.parent / "functions" / "enhanced_feature_engineering"))
+
+from app import (  # noqa: E402
+    SERIES_KEY_COLUMNS,
+    empty_quantile_sketch,
+    merge_quantile_sketches,
+    summarize_quantile_sketch,
+    sketch_quantiles
+)
+
+QUANTILES = (0.1, 0.5, 0.9)
+
+
+def generate_order_file(path, rows, series, seed):
+    """Write a synthetic order file mixing integer and heavy-tailed quantities"""
+    rng = np.random.default_rng(seed)
+    series_ids = rng.integers(0, series, rows)
+    # Half the series order whole units, the other half continuous amounts
+    continuous = series_ids % 2 == 1
+    quantity = np.where(continuous,
+                        np.round(rng.lognormal(2.0, 1.0, rows), 2),
+                        rng.integers(1, 24, rows))
+    frame = pd.DataFrame({
+        'CustomerID': series_ids // 1000,
+        'FacilityID': (series_ids // 100) % 10,
+        'ProductID': series_ids % 100,
+        'CreateDate': (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': quantity
+    })
+    frame.to_csv(path, index=False)
+
+
+def build_sketch(path, chunk_size, max_centroids):
+    """Fold the file into a sketch chunk by chunk"""
+    sketch = empty_quantile_sketch()
+    for chunk in pd.read_csv(path, chunksize=chunk_size):
+        sketch = merge_quantile_sketches(sketch, summarize_quantile_sketch(chunk, max_centroids),
+                                         max_centroids=max_centroids)
+    return sketch
+
+
+def measure_errors(path, estimates):
+    """Absolute value error and rank error of each estimate against exact quantiles"""
+    orders = pd.read_csv(path, usecols=SERIES_KEY_COLUMNS + ['OrderUnits'])
+    grouped = orders.groupby(SERIES_KEY_COLUMNS)['OrderUnits']
+    exact = grouped.quantile(list(QUANTILES)).unstack().reset_index()
+    merged = exact.merge(estimates, on=SERIES_KEY_COLUMNS, suffixes=('_exact', '_sketch'))
+
+    results = {}
+    lines = orders.merge(estimates, on=SERIES_KEY_COLUMNS)
+    for q in QUANTILES:
+        value_error = (merged[f'{q}_sketch'] - merged[f'{q}_exact']).abs()
+        relative_error = value_error / merged[f'{q}_exact'].abs().replace(0, np.nan)
+        # Rank error: fraction of lines below the estimate compared with q
+        below = (lines['OrderUnits'] < lines[q]).groupby([lines[c] for c in SERIES_KEY_COLUMNS]).mean()
+        at_or_below = (lines['OrderUnits'] <= lines[q]).groupby([lines[c] for c in SERIES_KEY_COLUMNS]).mean()
+        rank_error = np.maximum(below - q, 0) + np.maximum(q - at_or_below, 0)
+        results[f'p{int(q * 100)}'] = {
+            'max_abs_error': float(value_error.max()),
+            'mean_abs_error': float(value_error.mean()),
+            'max_relative_error': float(relative_error.max()),
+            'exact_match_fraction': float((value_error < 1e-9).mean()),
+            'max_rank_error': float(rank_error.max()),
+            'mean_rank_error': float(rank_error.mean())
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the per-series quantile sketch")
+    parser.add_argument("--rows", type=int, default=3_000_000, help="Rows in the synthetic file")
+    parser.add_argument("--series", type=int, default=20_000, help="Distinct customer/facility/product series")
+    parser.add_argument("--chunk-size", type=int, default=250_000, help="Rows per chunk")
+    parser.add_argument("--max-centroids", type=int, nargs="+", default=[32, 64, 100, 200],
+                        help="Sketch sizes to evaluate")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'orders.csv')
+        print(f"Generating {args.rows:,} rows over {args.series:,} series...")
+        generate_order_file(path, args.rows, args.series, args.seed)
+        file_mb = os.path.getsize(path) / (1024 * 1024)
+
+        report = {
+            'timestamp': datetime.now().isoformat(),
+            'rows': args.rows,
+            'series': args.series,
+            'file_size_mb': round(file_mb, 2),
+            'chunk_size': args.chunk_size,
+            'results': []
+        }
+        for max_centroids in args.max_centroids:
+            start = time.time()
+            sketch = build_sketch(path, args.chunk_size, max_centroids)
+            elapsed = time.time() - start
+            estimates = sketch_quantiles(sketch, QUANTILES)
+            centroids_per_series = sketch.groupby(SERIES_KEY_COLUMNS).size()
+            result = {
+                'max_centroids': max_centroids,
+                'build_seconds': round(elapsed, 2),
+                'throughput_mb_s': round(file_mb / elapsed, 2),
+                'centroids': int(len(sketch)),
+                'sketch_bytes': int(sketch.memory_usage(deep=True).sum()),
+                'max_centroids_per_series': int(centroids_per_series.max()),
+                'mean_centroids_per_series': round(float(centroids_per_series.mean()), 2),
+                'errors': measure_errors(path, estimates)
+            }
+            report['results'].append(result)
+            p50 = result['errors']['p50']
+            print(f"K={max_centroids:>4}: {result['centroids']:,} centroids "
+                  f"({result['sketch_bytes'] / 1024 / 1024:.1f} MB), built in {elapsed:.1f}s, "
+                  f"median max rank error {p50['max_rank_error']:.4f}, "
+                  f"exact medians {p50['exact_match_fraction'] * 100:.1f}%")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+        print(f"Report written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for the Arrow CSV engine
+
+Frames parsed with pyarrow's multi-threaded reader must match the pandas
+engine's frames, whole and chunked, from paths and streams.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    resolve_csv_engine,
+    resolve_read_plan,
+    read_orders,
+    concat_order_chunks,
+    scan_orders
+)
+
+
+def write_order_file(path, n_rows, seed=23):
+    """Write a raw order file with text IDs, missing values and stray text in the quantities"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1060, n_rows)
+    units = rng.integers(1, 30, n_rows).astype(object)
+    units[::97] = 'n/a'
+    units[::131] = None
+    names = np.array(['Product ' + str(p) for p in product_ids], dtype=object)
+    names[::53] = None
+    pd.DataFrame({
+        'Customer_ID': ['CUST' + str(c) for c in rng.integers(1, 9, n_rows)],
+        'FacilityID': rng.integers(100, 104, n_rows),
+        'ProductID': product_ids,
+        'ProductName': names,
+        'Notes': ['free text'] * n_rows,
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 120, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'Order Units': units
+    }).to_csv(path, index=False)
+
+
+class TestArrowCsvEngine(unittest.TestCase):
+    """The Arrow engine gives the pandas engine's typed frames"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        write_order_file(cls.path, 5000)
+        cls.plan = resolve_read_plan(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def read_with(self, engine, source, **read_kwargs):
+        with patch.object(app, 'csv_engine', engine):
+            result = read_orders(source, self.plan, **read_kwargs)
+            return list(result) if read_kwargs.get('chunksize') else result
+
+    def test_whole_read_matches_pandas(self):
+        """Categories, numeric IDs, NaN quantities and the index match"""
+        arrow = self.read_with('arrow', self.path)
+        expected = self.read_with('pandas', self.path)
+        pd.testing.assert_frame_equal(arrow, expected)
+        self.assertTrue(arrow['OrderUnits'].isna().any())
+        print("✓ Arrow whole-file read matches pandas")
+
+    def test_chunks_match_pandas(self):
+        """Chunks have pandas' sizes and row labels, also from a stream"""
+        expected = self.read_with('pandas', self.path, chunksize=700)
+        with open(self.path, 'rb') as handle:
+            stream = io.BufferedReader(io.BytesIO(handle.read()))
+        with patch.object(app, 'CSV_ARROW_BLOCK_BYTES', 16384):
+            for source in (self.path, stream):
+                chunks = self.read_with('arrow', source, chunksize=700)
+                self.assertEqual([len(chunk) for chunk in chunks], [len(chunk) for chunk in expected])
+                for chunk, want in zip(chunks, expected):
+                    pd.testing.assert_frame_equal(chunk, want)
+                # Concatenating widens the chunks' categories in place, so compare copies
+                pd.testing.assert_frame_equal(concat_order_chunks(chunks, ignore_index=True),
+                                              concat_order_chunks([want.copy() for want in expected], ignore_index=True),
+                                              check_categorical=False)
+        print("✓ Arrow chunks match pandas chunks")
+
+    def test_scan_matches_pandas(self):
+        """Scan consumers give the same results with either engine"""
+        consumers = ['temporal_frame', 'order_stats']
+        with patch.object(app, 'csv_engine', 'arrow'):
+            arrow = scan_orders(self.path, consumers, 900, self.plan)
+        with patch.object(app, 'csv_engine', 'pandas'):
+            expected = scan_orders(self.path, consumers, 900, self.plan)
+        pd.testing.assert_frame_equal(arrow['temporal_frame'], expected['temporal_frame'])
+        self.assertEqual(arrow['order_stats'], expected['order_stats'])
+        print("✓ Scans match across engines")
+
+    def test_header_only_file_and_fallback(self):
+        """Empty files give an empty chunk, and a missing pyarrow falls back to pandas"""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            handle.write('CustomerID,FacilityID,ProductID,CreateDate,OrderUnits\n')
+        try:
+            plan = resolve_read_plan(handle.name)
+            with patch.object(app, 'csv_engine', 'arrow'):
+                chunks = list(read_orders(handle.name, plan, chunksize=100))
+            self.assertEqual(len(chunks), 1)
+            self.assertTrue(chunks[0].empty)
+            self.assertIn('OrderUnits', chunks[0].columns)
+        finally:
+            os.remove(handle.name)
+
+        self.assertEqual(resolve_csv_engine('arrow'), 'arrow')
+        with patch.object(app, 'pyarrow', None):
+            self.assertEqual(resolve_csv_engine('arrow'), 'pandas')
+        self.assertEqual(resolve_csv_engine('pandas'), 'pandas')
+        print("✓ Header-only files and missing pyarrow are handled")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Equivalence tests for the cached calendar dimension
+
+The reference below is the original per-row implementation of the calendar
+columns in extract_temporal_features.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    get_us_holidays,
+    build_calendar_dimension,
+    calendar_features,
+    extract_temporal_features
+)
+
+
+def reference_temporal_features(df):
+    """Original lambda-based implementation (copied from the Lambda function)"""
+    df['OrderYear'] = df['CreateDate'].dt.year
+    df['OrderMonth'] = df['CreateDate'].dt.month
+    df['OrderDay'] = df['CreateDate'].dt.day
+    df['OrderDayOfWeek'] = df['CreateDate'].dt.dayofweek
+    df['OrderHour'] = df['CreateDate'].dt.hour
+    df['DayOfWeek_sin'] = np.sin(df['OrderDayOfWeek'] * (2 * np.pi / 7))
+    df['DayOfWeek_cos'] = np.cos(df['OrderDayOfWeek'] * (2 * np.pi / 7))
+    df['DayOfMonth_sin'] = np.sin((df['OrderDay'] - 1) * (2 * np.pi / 31))
+    df['DayOfMonth_cos'] = np.cos((df['OrderDay'] - 1) * (2 * np.pi / 31))
+    df['MonthOfYear_sin'] = np.sin((df['OrderMonth'] - 1) * (2 * np.pi / 12))
+    df['MonthOfYear_cos'] = np.cos((df['OrderMonth'] - 1) * (2 * np.pi / 12))
+    df['OrderQuarter'] = df['OrderMonth'].apply(lambda x: (x-1)//3 + 1)
+    df['IsWeekend'] = df['OrderDayOfWeek'].apply(lambda x: 1 if x >= 5 else 0)
+    all_holidays = {}
+    for year in df['OrderYear'].unique():
+        all_holidays.update(get_us_holidays(year))
+    df['Date'] = df['CreateDate'].dt.strftime('%Y-%m-%d')
+    df['IsHoliday'] = df['Date'].apply(lambda x: 1 if x in all_holidays else 0)
+    df['HolidayName'] = df['Date'].apply(lambda x: all_holidays.get(x, ''))
+    return df
+
+
+class TestCalendarDimension(unittest.TestCase):
+    """Calendar lookups must match the per-row implementation"""
+
+    def setUp(self):
+        app._calendar_cache.update({'first_day': None, 'last_day': None, 'table': None})
+
+    def test_matches_reference(self):
+        """Every original temporal column is unchanged"""
+        rng = np.random.default_rng(8)
+        dates = pd.Timestamp('2022-11-01') + pd.to_timedelta(rng.integers(0, 900 * 24, 5000), unit='h')
+        df = pd.DataFrame({'CreateDate': dates})
+
+        actual = extract_temporal_features(df.copy())
+        expected = reference_temporal_features(df.copy())
+        for col in expected.columns:
+            with self.subTest(column=col):
+                if pd.api.types.is_numeric_dtype(expected[col]):
+                    np.testing.assert_array_equal(actual[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float))
+                else:
+                    self.assertEqual(actual[col].tolist(), expected[col].tolist())
+        print("✓ Calendar dimension matches per-row temporal features")
+
+    def test_holiday_windows(self):
+        """Pre/post-holiday windows count days around each holiday, including across New Year"""
+        calendar = build_calendar_dimension(2024, 2024).set_index('Date')
+        self.assertEqual(calendar.loc['2024-07-03', 'DaysToHoliday'], 1)
+        self.assertEqual(calendar.loc['2024-07-03', 'IsPreHoliday'], 1)
+        self.assertEqual(calendar.loc['2024-07-04', 'IsPreHoliday'], 0)
+        self.assertEqual(calendar.loc['2024-07-07', 'DaysSinceHoliday'], 3)
+        self.assertEqual(calendar.loc['2024-07-07', 'IsPostHoliday'], 1)
+        self.assertEqual(calendar.loc['2024-07-08', 'IsPostHoliday'], 0)
+        self.assertEqual(calendar.loc['2024-12-31', 'DaysToHoliday'], 1)  # 2025 New Year's Day
+        self.assertEqual(len(calendar), 366)
+        print("✓ Holiday windows computed")
+
+    def test_unparsed_dates_and_cache_reuse(self):
+        """NaT rows get neutral values and the table is only rebuilt when the span grows"""
+        dates = pd.Series(pd.to_datetime(['2024-12-25', None, '2024-03-01']))
+        with patch.object(app, 'build_calendar_dimension', wraps=app.build_calendar_dimension) as build:
+            features = calendar_features(dates)
+            calendar_features(pd.Series(pd.to_datetime(['2024-06-01'])))
+            calendar_features(pd.Series(pd.to_datetime(['2025-01-02'])))
+        self.assertEqual(build.call_count, 2)
+        self.assertEqual(features['HolidayName'].tolist(), ['Christmas Day', '', ''])
+        self.assertEqual(features['IsHoliday'].tolist(), [1, 0, 0])
+        self.assertTrue(np.isnan(features['OrderYear'].iloc[1]))
+        self.assertEqual(app._calendar_cache['table']['OrderYear'].iloc[-1], 2025)
+        print("✓ Calendar cache reused across calls")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
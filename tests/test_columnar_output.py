@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for the columnar (Parquet) artifact output and the matching readers
+in the predictions and data validation functions.
+"""
+
+import unittest
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pandas as pd
+import numpy as np
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+FUNCTIONS_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+
+def load_function_module(function_name):
+    """Load a function's app.py under a unique module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'{function_name}_app', os.path.join(FUNCTIONS_BASE, function_name, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+feature_app = load_function_module('enhanced_feature_engineering')
+predictions_app = load_function_module('enhanced_predictions')
+validation_app = load_function_module('data_validation')
+
+
+class TestColumnarOutput(unittest.TestCase):
+    """Parquet artifacts keep their types end to end"""
+
+    def setUp(self):
+        self.lookup = pd.DataFrame({
+            'ProductID': ['00123', '00456', 'PROD7'],
+            'ProductName': ['Gloves', 'Gauze', None],
+            'CategoryName': ['PPE', 'Wound Care', 'General'],
+            'vendorName': ['Vendor A', 'Vendor B', 'Vendor C'],
+            'CustomerID': [1045, 1045, 1046],
+            'FacilityID': [6420, 6417, 6420],
+            'OrderCount': [3, 1, 7],
+            'FirstOrderDate': ['2024-01-02', '2024-02-03', '2024-03-04'],
+            'LastOrderDate': pd.to_datetime(['2024-05-01', '2024-06-01', '2024-07-01'])
+        })
+
+    def test_resolve_output_format(self):
+        """Unknown formats and missing pyarrow fall back to CSV"""
+        self.assertEqual(feature_app.resolve_output_format('parquet'), 'parquet')
+        self.assertEqual(feature_app.resolve_output_format('xlsx'), 'csv')
+        with patch.object(feature_app, 'pyarrow', None):
+            self.assertEqual(feature_app.resolve_output_format('parquet'), 'csv')
+        print("✓ Output format resolution")
+
+    def test_parquet_round_trip_keeps_types(self):
+        """IDs keep leading zeros and dates come back as datetimes"""
+        with tempfile.TemporaryDirectory() as workdir:
+            path = feature_app.write_output_artifact(self.lookup, os.path.join(workdir, 'lookup.parquet'), 'parquet')
+            result = pd.read_parquet(path)
+
+        self.assertEqual(result['ProductID'].tolist(), ['00123', '00456', 'PROD7'])
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(result['FirstOrderDate']))
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(result['LastOrderDate']))
+        self.assertTrue(pd.api.types.is_integer_dtype(result['CustomerID']))
+        self.assertTrue(pd.isna(result['ProductName'].iloc[2]))
+        print("✓ Parquet round trip keeps IDs and dates typed")
+
+    def test_mixed_object_ids_become_strings(self):
+        """Mixed int/str ID columns are written as strings instead of failing"""
+        frame = pd.DataFrame({'ProductID': [1, 'PROD2'], 'OrderCount': [1, 2]})
+        prepared = feature_app.prepare_columnar_frame(frame)
+        self.assertEqual(prepared['ProductID'].tolist(), ['1', 'PROD2'])
+
+    def test_save_output_artifact_uploads_parquet_key(self):
+        """Artifacts are uploaded under the format's extension"""
+        mock_s3 = MagicMock()
+        with patch.object(feature_app, 's3_client', mock_s3):
+            key = feature_app.save_output_artifact(self.lookup, 'customer_product_lookup', 'lookup',
+                                                   '2024-01-01-00-00-00', 'parquet', 'Customer product lookup')
+            empty_key = feature_app.save_output_artifact(pd.DataFrame(), 'product_lookup', 'lookup',
+                                                         '2024-01-01-00-00-00', 'parquet', 'Product lookup')
+
+        self.assertEqual(key, 'lookup/2024-01-01-00-00-00/customer_product_lookup.parquet')
+        self.assertIsNone(empty_key)
+        mock_s3.put_object.assert_called_once()
+        self.assertEqual(mock_s3.put_object.call_args[1]['Body'][:4], b'PAR1')
+        print("✓ Parquet artifact uploaded to lookup/<timestamp>/")
+
+    def test_predictions_reader_prefers_parquet(self):
+        """get_product_lookup_data reads Parquet lookups when present"""
+        with tempfile.TemporaryDirectory() as workdir:
+            parquet_path = os.path.join(workdir, 'source.parquet')
+            feature_app.write_output_artifact(self.lookup, parquet_path, 'parquet')
+
+            mock_s3 = MagicMock()
+            folder = 'lookup/2024-01-01-00-00-00/'
+
+            def list_objects(Bucket, Prefix, Delimiter=None):
+                if Prefix == 'lookup/':
+                    return {'CommonPrefixes': [{'Prefix': folder}]}
+                return {'Contents': [{'Key': f'{folder}product_lookup.parquet'},
+                                     {'Key': f'{folder}customer_product_lookup.parquet'}]}
+
+            def download(bucket, key, local_path):
+                self.assertTrue(key.endswith('.parquet'))
+                with open(parquet_path, 'rb') as src, open(local_path, 'wb') as dst:
+                    dst.write(src.read())
+
+            mock_s3.list_objects_v2.side_effect = list_objects
+            mock_s3.download_file.side_effect = download
+            with patch.object(predictions_app, 's3_client', mock_s3):
+                product_lookup, customer_product_lookup = predictions_app.get_product_lookup_data()
+
+        self.assertEqual(len(customer_product_lookup), 3)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(customer_product_lookup['FirstOrderDate']))
+        print("✓ Predictions reader loads Parquet lookups")
+
+    def test_validation_reads_parquet_body(self):
+        """The validation Lambda accepts Parquet artifacts"""
+        buffer = io.BytesIO()
+        feature_app.prepare_columnar_frame(self.lookup).to_parquet(buffer, index=False)
+        buffer.seek(0)
+        df = validation_app.read_artifact(buffer, 'processed/2024/product_features.parquet')
+        self.assertEqual(len(df), 3)
+
+        csv_body = io.StringIO(self.lookup.to_csv(index=False))
+        self.assertEqual(len(validation_app.read_artifact(csv_body, 'processed/2024/product_features.csv')), 3)
+        print("✓ Validation reads Parquet and CSV")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
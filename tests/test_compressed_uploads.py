@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Tests for gzip- and zstd-compressed order uploads
+
+A compressed upload must be parsed as a stream of its decompressed bytes and
+give the same frames and handler output as the plain CSV, in the feature
+engineering and the validation functions.
+"""
+
+import gzip
+import importlib.util
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import zstandard
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+FUNCTIONS_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+
+def load_function_module(function_name):
+    """Load a function's app.py under a unique module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'{function_name}_app', os.path.join(FUNCTIONS_BASE, function_name, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_function_module('enhanced_feature_engineering')
+validation_app = load_function_module('data_validation')
+notification_app = load_function_module('s3_notification_setup')
+
+
+def order_csv(n_rows, seed=31):
+    """Raw order file bytes in the upload format"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1050, n_rows)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 9, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 90, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    }).to_csv(index=False).encode('utf-8')
+
+
+def compress(data, compression, pieces=3):
+    """Compress data as several gzip members or zstd frames, as concatenated extracts are"""
+    bounds = np.linspace(0, len(data), pieces + 1).astype(int)
+    codec = gzip.compress if compression == 'gzip' else zstandard.ZstdCompressor().compress
+    return b''.join(codec(data[start:end]) for start, end in zip(bounds[:-1], bounds[1:]))
+
+
+class ObjectS3:
+    """In-memory stand-in for one raw object and the processed bucket"""
+
+    def __init__(self, data):
+        self.data = data
+        self.downloads = 0
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        start, end = (int(value) for value in Range.replace('bytes=', '').split('-'))
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def download_file(self, bucket, key, local_path):
+        self.downloads += 1
+        with open(local_path, 'wb') as handle:
+            handle.write(self.data)
+
+    def put_object(self, Bucket, Key, Body):
+        self.uploads[Key] = Body
+
+
+class TestCompressedUploads(unittest.TestCase):
+    """Compressed uploads parse like the plain CSV"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = order_csv(4000)
+        handle = tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False)
+        handle.write(cls.data)
+        handle.close()
+        cls.path = handle.name
+        cls.plan = app.resolve_read_plan(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_decompressed_reader_reads_and_seeks(self):
+        """Every member or frame is read, and seeks back and forward land on the same bytes"""
+        for compression in ('gzip', 'zstd'):
+            stream = app.open_decompressed(io.BytesIO(compress(self.data, compression)), compression)
+            self.assertEqual(stream.read(), self.data)
+            stream.seek(0)
+            self.assertEqual(stream.read(100), self.data[:100])
+            stream.seek(50000)
+            self.assertEqual(stream.read(1000), self.data[50000:51000])
+            stream.seek(20)
+            self.assertEqual(stream.read(10), self.data[20:30])
+            with self.assertRaises(io.UnsupportedOperation):
+                stream.seek(0, io.SEEK_END)
+            stream.close()
+        print("✓ Decompressed reader reads every frame and seeks")
+
+    def test_compression_detection_and_size_estimate(self):
+        """Suffixes and magic bytes pick the codec; the size comes from a compressed sample"""
+        self.assertEqual(app.upload_compression('raw/orders.csv.gz'), 'gzip')
+        self.assertEqual(app.upload_compression('raw/orders.CSV.ZST'), 'zstd')
+        self.assertIsNone(app.upload_compression('raw/orders.csv', io.BytesIO(self.data)))
+        self.assertEqual(app.upload_compression('raw/orders', io.BytesIO(compress(self.data, 'zstd'))), 'zstd')
+
+        large = order_csv(200000)
+        for compression in ('gzip', 'zstd'):
+            compressed = compress(large, compression, pieces=1)
+            stream = app.open_decompressed(io.BytesIO(compressed), compression)
+            self.assertEqual(app.estimate_decompressed_bytes(stream, len(compressed)), len(large))
+            estimate = app.estimate_decompressed_bytes(stream, len(compressed), sample_bytes=len(compressed) // 4)
+            self.assertLess(abs(estimate - len(large)) / len(large), 0.1)
+            self.assertEqual(stream.tell(), 0)
+        print("✓ Compression detected and decompressed size estimated")
+
+    def test_readers_match_plain_file(self):
+        """Whole, chunked and scanned reads of a compressed stream equal the plain file's, with either engine"""
+        for compression in ('gzip', 'zstd'):
+            for engine in ('pandas', 'arrow'):
+                stream = app.open_decompressed(io.BytesIO(compress(self.data, compression)), compression)
+                with patch.object(app, 'csv_engine', engine):
+                    self.assertEqual(app.resolve_read_plan(stream), self.plan)
+                    pd.testing.assert_frame_equal(app.read_orders(stream, self.plan),
+                                                  app.read_orders(self.path, self.plan))
+                    scanned = app.scan_orders(stream, ['temporal_frame', 'order_stats'], 700, self.plan)
+                    expected = app.scan_orders(self.path, ['temporal_frame', 'order_stats'], 700, self.plan)
+                stream.close()
+                pd.testing.assert_frame_equal(scanned['temporal_frame'], expected['temporal_frame'])
+                self.assertEqual(scanned['order_stats'], expected['order_stats'])
+        print("✓ Compressed streams read like the plain file")
+
+    def test_handler_processes_compressed_uploads(self):
+        """Downloaded and streamed compressed uploads run in one invocation and leave nothing in /tmp"""
+        for key, compression, mode in (('raw/orders.csv.gz', 'gzip', 'download'),
+                                       ('raw/orders.csv.zst', 'zstd', 'stream')):
+            data = compress(self.data, compression)
+            event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': key, 'size': len(data)}}}]}
+            with patch.object(app, 's3_client', ObjectS3(data)), \
+                    patch.object(app, 'input_mode', mode), \
+                    patch.object(app, 'idempotency_mode', 'off'), \
+                    patch.object(app, 'fanout_mode', 'lambda'), \
+                    patch.object(app, 'fanout_min_mb', 0), \
+                    patch.object(app, 'start_fanout') as start_fanout, \
+                    patch.object(app, 'save_lookup_tables_to_dynamodb'):
+                response = app.lambda_handler(event, None)
+            self.assertEqual(response['statusCode'], 200)
+            self.assertFalse(start_fanout.called)
+            self.assertFalse(os.path.exists(f'/tmp/{os.path.basename(key)}'))
+        print("✓ Handler processes gzip and zstd uploads")
+
+    def test_handler_output_matches_plain_upload(self):
+        """The compressed upload's outputs equal the plain upload's"""
+        bodies = {}
+        for key, data in (('raw/orders.csv', self.data), ('raw/orders.csv.gz', compress(self.data, 'gzip'))):
+            event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': key, 'size': len(data)}}}]}
+            with patch.object(app, 's3_client', ObjectS3(data)), \
+                    patch.object(app, 'input_mode', 'download'), \
+                    patch.object(app, 'idempotency_mode', 'off'), \
+                    patch.object(app, 'save_lookup_tables_to_dynamodb'):
+                bodies[key] = json.loads(app.lambda_handler(event, None)['body'])
+        for field in ('message', 'total_unique_products', 'total_customer_product_combinations'):
+            self.assertEqual(bodies['raw/orders.csv.gz'][field], bodies['raw/orders.csv'][field])
+        print("✓ Compressed upload outputs match the plain upload")
+
+    def test_validation_reads_compressed_artifacts(self):
+        """The validation Lambda decompresses gzip and zstd CSV bodies"""
+        for suffix, compression in (('.csv.gz', 'gzip'), ('.csv.zst', 'zstd')):
+            key = f'processed/2024/product_features{suffix}'
+            df = validation_app.read_artifact(io.BytesIO(compress(self.data, compression)), key)
+            self.assertEqual(len(df), 4000)
+            self.assertEqual(validation_app.artifact_base_key(key), 'processed/2024/product_features')
+        self.assertEqual(validation_app.artifact_base_key('processed/2024/product_features.csv'),
+                         'processed/2024/product_features')
+        print("✓ Validation reads compressed CSVs")
+
+    def test_triggers_cover_accepted_suffixes(self):
+        """Every compressed suffix the readers accept has a notification rule, without overlaps"""
+        suffixes = [suffix for _, suffix in notification_app.RAW_UPLOAD_TRIGGERS]
+        expected = ['.csv'] + ['.csv' + suffix for suffix in app.UPLOAD_COMPRESSION_SUFFIXES]
+        self.assertEqual(sorted(suffixes), sorted(expected))
+        self.assertEqual(set(validation_app.COMPRESSION_SUFFIXES), set(app.UPLOAD_COMPRESSION_SUFFIXES))
+        for suffix in suffixes:
+            self.assertEqual(app.upload_compression('raw/orders' + suffix) is None, suffix == '.csv')
+            # S3 rejects rules whose suffixes end with one another
+            self.assertFalse([other for other in suffixes if other != suffix and other.endswith(suffix)])
+        self.assertEqual(len({trigger_id for trigger_id, _ in notification_app.RAW_UPLOAD_TRIGGERS}), len(suffixes))
+        print("✓ Upload triggers match the accepted suffixes")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-pass customer-level forecast builder
+
+The builder must give exactly the rows of the previous per-metric builder
+(one groupby per metric, merged, one frame per metric, sorted by item_id and
+timestamp) and must leave the caller's frame unchanged.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+from app import (
+    prepare_customer_level_forecast_data,
+    customer_forecast_rows,
+    extract_temporal_features
+)
+
+
+def reference_customer_forecast(df):
+    """The per-metric builder the single pass replaces"""
+    df = df.copy()
+    keys = ['CustomerID', 'FacilityID', 'Date']
+    if 'OrderUnits' in df.columns:
+        daily = df.groupby(keys, observed=True)['OrderUnits'].sum().reset_index(name='TotalUnits')
+        metrics = [('TotalUnits', 'TOTAL_UNITS')]
+    else:
+        daily = df.groupby(keys, observed=True).size().reset_index(name='TotalItems')
+        metrics = [('TotalItems', 'TOTAL_ITEMS')]
+    metrics.append(('UniqueProducts', 'UNIQUE_PRODUCTS'))
+    if 'Price' in df.columns:
+        df['OrderValue'] = df['OrderUnits'] * df['Price'] if 'OrderUnits' in df.columns else df['Price']
+        daily = daily.merge(df.groupby(keys, observed=True)['OrderValue'].sum().reset_index(name='TotalValue'), on=keys)
+        metrics.append(('TotalValue', 'TOTAL_VALUE'))
+    daily = daily.merge(df.groupby(keys, observed=True)['ProductID'].nunique().reset_index(name='UniqueProducts'),
+                        on=keys)
+
+    frames = [pd.DataFrame({
+        'item_id': daily['CustomerID'].astype(str) + '_' + daily['FacilityID'].astype(str) + '_' + metric,
+        'timestamp': pd.to_datetime(daily['Date']),
+        'target_value': daily[col],
+        'customer_id': daily['CustomerID'],
+        'facility_id': daily['FacilityID'],
+        'metric_type': metric
+    }) for col, metric in metrics]
+    forecast = pd.concat(frames, ignore_index=True)
+    forecast['day_of_week'] = forecast['timestamp'].dt.dayofweek
+    forecast['month'] = forecast['timestamp'].dt.month
+    return forecast.sort_values(['item_id', 'timestamp']).reset_index(drop=True)
+
+
+def generate_orders(n_rows, seed=17):
+    """Order lines whose IDs sort differently as strings and as numbers"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 120, n_rows),
+        'FacilityID': rng.choice([1, 10, 100], n_rows),
+        'ProductID': rng.integers(1000, 1200, n_rows).astype(float),
+        'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 60, n_rows), unit='D'),
+        'OrderUnits': rng.integers(1, 30, n_rows).astype(float),
+        'Price': np.round(rng.lognormal(2.0, 0.7, n_rows), 2)
+    })
+    frame.loc[rng.integers(0, n_rows, 20), 'ProductID'] = np.nan
+    frame.loc[rng.integers(0, n_rows, 20), 'OrderUnits'] = np.nan
+    return extract_temporal_features(frame)
+
+
+class TestCustomerForecast(unittest.TestCase):
+    """Single-pass customer forecast rows match the per-metric builder"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = generate_orders(20000)
+
+    def test_matches_per_metric_builder(self):
+        """Same rows, order and dtypes with and without units, prices and categorical IDs"""
+        variants = {
+            'units and price': self.df,
+            'units only': self.df.drop(columns='Price'),
+            'price only': self.df.drop(columns='OrderUnits'),
+            'lines only': self.df.drop(columns=['OrderUnits', 'Price']),
+            'categorical ids': self.df.astype({'CustomerID': 'category', 'FacilityID': 'category'})
+        }
+        for name, frame in variants.items():
+            with self.subTest(variant=name):
+                pd.testing.assert_frame_equal(prepare_customer_level_forecast_data(frame),
+                                              reference_customer_forecast(frame))
+        print(f"✓ Single pass matches the per-metric builder for {len(variants)} column layouts")
+
+    def test_input_is_not_modified(self):
+        """The order value is aggregated without being added to the caller's frame"""
+        before = self.df.copy()
+        prepare_customer_level_forecast_data(self.df)
+        pd.testing.assert_frame_equal(self.df, before)
+        self.assertNotIn('OrderValue', self.df.columns)
+
+    def test_empty_daily_totals(self):
+        """No daily totals give an empty frame with the forecast columns"""
+        empty = reference_customer_forecast(self.df.head(0))
+        forecast = customer_forecast_rows(pd.DataFrame({
+            'CustomerID': pd.Series(dtype='int64'), 'FacilityID': pd.Series(dtype='int64'),
+            'Date': pd.Series(dtype='datetime64[ns]'), 'TotalUnits': pd.Series(dtype='float64'),
+            'UniqueProducts': pd.Series(dtype='int64')}))
+        self.assertEqual(len(forecast), 0)
+        self.assertEqual(list(forecast.columns), list(empty.columns))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
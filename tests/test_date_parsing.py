@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for CreateDate parsing by unique values with cached format detection
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    new_date_parse_state,
+    detect_date_format,
+    parse_create_dates,
+    extract_temporal_features
+)
+
+
+class TestDateParsing(unittest.TestCase):
+    """Unique-value parsing must agree with pandas row by row"""
+
+    def test_detects_common_formats(self):
+        """Sampled strings pick the matching format"""
+        self.assertEqual(detect_date_format(['2/8/25', '12/31/24']), '%m/%d/%y')
+        self.assertEqual(detect_date_format(['2/8/2025', '12/31/2024']), '%m/%d/%Y')
+        self.assertEqual(detect_date_format(['2025-02-08', '2024-12-31']), '%Y-%m-%d')
+        self.assertEqual(detect_date_format(['25/12/2024', '31/01/2025']), '%d/%m/%Y')
+        self.assertIsNone(detect_date_format([]))
+        print("✓ Date formats detected from samples")
+
+    def test_matches_pandas_on_repeated_strings(self):
+        """Mapping unique results back by code equals parsing every row"""
+        rng = np.random.default_rng(3)
+        days = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 400, 20000), unit='D')
+        values = pd.Series(days.strftime('%-m/%-d/%y'))
+        values[rng.integers(0, 20000, 50)] = np.nan
+
+        parsed = parse_create_dates(values)
+        expected = pd.to_datetime(values, format='%m/%d/%y')
+        pd.testing.assert_series_equal(parsed, expected, check_names=False)
+        print("✓ Unique-value parsing matches pandas")
+
+    def test_only_unique_strings_are_parsed(self):
+        """Each distinct string is parsed once"""
+        values = pd.Series(['2/8/25', '2/9/25', '2/8/25'] * 1000)
+        with patch.object(app, '_parse_unique_dates', wraps=app._parse_unique_dates) as parse_unique:
+            parse_create_dates(values)
+        self.assertEqual(len(parse_unique.call_args[0][0]), 2)
+
+    def test_format_is_detected_once_per_file(self):
+        """Later chunks reuse the cached format and still parse drifting strings"""
+        state = new_date_parse_state()
+        with patch.object(app, 'detect_date_format', wraps=app.detect_date_format) as detect:
+            first = parse_create_dates(pd.Series(['1/2/2024', '1/3/2024']), state)
+            second = parse_create_dates(pd.Series(['1/4/2024', '2024-01-05']), state)
+        self.assertEqual(detect.call_count, 1)
+        self.assertEqual(state['format'], '%m/%d/%Y')
+        self.assertEqual(first.tolist(), [pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-03')])
+        self.assertEqual(second.tolist(), [pd.Timestamp('2024-01-04'), pd.Timestamp('2024-01-05')])
+        print("✓ Format detected once and cached across chunks")
+
+    def test_unparseable_rows_are_reported(self):
+        """Bad strings become NaT and are counted with examples"""
+        state = new_date_parse_state()
+        parsed = parse_create_dates(pd.Series(['1/2/2024', 'not a date', None, 'not a date', '??']), state)
+        self.assertEqual(parsed.isna().sum(), 4)
+        self.assertEqual(state['unparseable_rows'], 3)
+        self.assertEqual(state['unparseable_examples'], ['not a date', '??'])
+        self.assertEqual(state['rows'], 5)
+        print("✓ Unparseable rows counted and reported")
+
+    def test_categorical_and_datetime_inputs(self):
+        """Categorical columns use their codes, datetimes pass through"""
+        values = pd.Series(['3/1/24', '3/2/24', '3/1/24'], dtype='category')
+        parsed = parse_create_dates(values)
+        self.assertEqual(parsed.tolist(), [pd.Timestamp('2024-03-01'), pd.Timestamp('2024-03-02'), pd.Timestamp('2024-03-01')])
+
+        already = pd.Series(pd.to_datetime(['2024-03-01']))
+        pd.testing.assert_series_equal(parse_create_dates(already), already)
+
+    def test_temporal_features_use_parser(self):
+        """extract_temporal_features parses string dates before deriving columns"""
+        df = pd.DataFrame({'CreateDate': ['7/4/24', '7/6/24']})
+        df = extract_temporal_features(df)
+        self.assertEqual(df['Date'].tolist(), ['2024-07-04', '2024-07-06'])
+        self.assertEqual(df['IsHoliday'].tolist(), [1, 0])
+        self.assertEqual(df['IsWeekend'].tolist(), [0, 1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
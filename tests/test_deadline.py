@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Tests for deadline-aware execution
+
+Stages must degrade in priority order when the invocation's remaining time
+runs short, and scans that cannot finish must resume from checkpoints in
+new invocations with the outputs of a single pass.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    Deadline,
+    plan_stage_deadline,
+    empty_incremental_state,
+    fold_orders_into_state,
+    build_outputs_from_state
+)
+
+
+class LambdaContext:
+    """Context with a fixed amount of time left"""
+
+    def __init__(self, remaining_ms, memory_mb=3008):
+        self.remaining_ms = remaining_ms
+        self.memory_limit_in_mb = str(memory_mb)
+        self.invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:feature-engineering'
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def write_order_file(path, n_rows, seed=41):
+    """Write a raw order file spread over a few months"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1030, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 10, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 100, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    })
+    frame.to_csv(path, index=False)
+    return frame
+
+
+class ResumeS3:
+    """In-memory stand-in for the S3 calls of a segmented run"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    class PreconditionFailed(Exception):
+        response = {'Error': {'Code': 'PreconditionFailed'}}
+
+    def __init__(self, uploads):
+        self.objects = dict(uploads)
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key]), 'ETag': '"etag"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        data = self.objects[Key]
+        if Range:
+            start, end = Range.split('=')[1].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': FakeBody(data)}
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if IfNoneMatch == '*' and Key in self.objects:
+            raise self.PreconditionFailed(Key)
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else bytes(Body)
+
+    def upload_file(self, local_path, bucket, key):
+        with open(local_path, 'rb') as handle:
+            self.objects[key] = handle.read()
+
+    def download_file(self, bucket, key, local_path):
+        with open(local_path, 'wb') as handle:
+            handle.write(self.objects[key])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class QueueLambda:
+    """Records asynchronous invocations instead of running them"""
+
+    def __init__(self):
+        self.queue = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.queue.append(json.loads(Payload))
+
+
+class TestDeadline(unittest.TestCase):
+    """Stages and scans follow the invocation's remaining time"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        cls.frame = write_order_file(cls.path, 4000)
+        cls.size = os.path.getsize(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_deadline_keeps_the_save_reserve(self):
+        """Time available is the remaining time less the reserve, unbounded without a context"""
+        deadline = Deadline(LambdaContext(90000), reserve_seconds=30)
+        self.assertEqual(deadline.remaining(), 90)
+        self.assertEqual(deadline.available(), 60)
+        self.assertTrue(deadline.allows(60))
+        self.assertFalse(deadline.allows(61))
+        self.assertEqual(deadline.reserve_for_save(app.DEADLINE_SAVE_SERIES_PER_S * 4),
+                         app.DEADLINE_SAVE_RESERVE_S + 4)
+
+        unbounded = Deadline(None)
+        self.assertIsNone(unbounded.remaining())
+        self.assertTrue(unbounded.allows(1e9))
+        self.assertTrue(Deadline(object()).allows(1e9))
+
+    def test_stages_degrade_in_priority_order(self):
+        """DeepAR goes first, then exact features, then forecasts; lookups stay"""
+        stages = {'features': 'exact', 'lookups': 'exact', 'forecasts': 'exact', 'deepar': 'exact'}
+        read_seconds = 10
+        full = app.projected_stage_seconds(stages, read_seconds)
+        plans = [plan_stage_deadline(stages, Deadline(LambdaContext(seconds * 1000), 0), read_seconds)
+                 for seconds in (full, full - 1, 22, 1)]
+
+        self.assertEqual(plans[0], stages)
+        self.assertEqual(plans[1], dict(stages, deepar='skipped'))
+        self.assertEqual(plans[2], dict(stages, deepar='skipped', features='approximate'))
+        self.assertEqual(plans[3], dict(stages, deepar='skipped', features='approximate', forecasts='skipped'))
+        self.assertEqual(stages['deepar'], 'exact')
+        print(f"✓ Stages degrade in order: {[plan['lookups'] for plan in plans]} lookups kept")
+
+    def test_handler_degrades_stages_when_time_is_short(self):
+        """With no time left the handler still writes features and lookups"""
+        objects = {}
+
+        class UploadS3:
+            def download_file(inner, bucket, key, local_path):
+                shutil.copy(self.path, local_path)
+
+            def put_object(inner, Bucket, Key, Body):
+                objects[Key] = Body
+
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': 'raw/late_orders.csv'}}}]}
+        with patch.object(app, 's3_client', UploadS3()), \
+                patch.object(app, 'idempotency_mode', 'off'), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb', return_value={}):
+            response = app.lambda_handler(event, LambdaContext(1))
+
+        body = json.loads(response['body'])
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(body['degraded_stages'], {'deepar': 'skipped', 'features': 'approximate',
+                                                   'forecasts': 'skipped'})
+        self.assertIn('product_features_location', body)
+        self.assertIn('customer_product_lookup_location', body)
+        self.assertNotIn('product_forecast_location', body)
+        self.assertNotIn('deepar_train_location', body)
+        self.assertFalse([key for key in objects if key.startswith(app.deepar_prefix)])
+        print(f"✓ Handler degraded {sorted(body['degraded_stages'])} under a tight deadline")
+
+    def test_scan_resumes_from_checkpoints(self):
+        """A scan past the deadline reads one segment per invocation and matches a single pass"""
+        with open(self.path, 'rb') as handle:
+            fake_s3 = ResumeS3({'raw/late_orders.csv': handle.read()})
+        fake_lambda = QueueLambda()
+        context = LambdaContext(1)
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                     'object': {'key': 'raw/late_orders.csv', 'size': self.size}}}]}
+        # Read factors this large make the planner scan even a small upload
+        with patch.object(app, 's3_client', fake_s3), \
+                patch.object(app, 'lambda_client', fake_lambda), \
+                patch.object(app, 'input_mode', 'stream'), \
+                patch.object(app, 'PLAN_READ_FACTOR', 1e6), \
+                patch.object(app, 'PLAN_CHUNKED_READ_FACTOR', 1e6), \
+                patch.object(app, 'DEADLINE_SEGMENT_BYTES', self.size // 3 + 1), \
+                patch.object(app, 'idempotency_mode', 'off'), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb', return_value={}):
+            responses = [app.lambda_handler(event, context)]
+            while fake_lambda.queue:
+                responses.append(app.lambda_handler(fake_lambda.queue.pop(0), context))
+
+        self.assertEqual([response['statusCode'] for response in responses], [202, 202, 200])
+        body = json.loads(responses[-1]['body'])
+        self.assertEqual(body['segments'], 3)
+        self.assertEqual(body['message'], f'Successfully processed {len(self.frame)} records')
+
+        state = empty_incremental_state()
+        fold_orders_into_state(self.path, state)
+        expected = build_outputs_from_state(state)[0]
+        features_key = body['product_features_location'].split('/', 3)[3]
+        features = pd.read_csv(pd.io.common.BytesIO(fake_s3.objects[features_key]))
+        self.assertEqual(len(features), len(expected))
+        self.assertEqual(features['TotalOrders'].sum(), expected['TotalOrders'].sum())
+        self.assertFalse([key for key in fake_s3.objects if key.startswith(app.resume_prefix)])
+        print(f"✓ Scan resumed over {body['segments']} invocations ({len(features)} product series)")
+
+    def test_replayed_steps_keep_their_checkpoint(self):
+        """Retries and duplicate deliveries of a step neither lose its checkpoint nor fork the run"""
+        with open(self.path, 'rb') as handle:
+            fake_s3 = ResumeS3({'raw/late_orders.csv': handle.read()})
+        fake_lambda = QueueLambda()
+        context = LambdaContext(1)
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                     'object': {'key': 'raw/late_orders.csv', 'size': self.size}}}]}
+        with patch.object(app, 's3_client', fake_s3), \
+                patch.object(app, 'lambda_client', fake_lambda), \
+                patch.object(app, 'input_mode', 'stream'), \
+                patch.object(app, 'PLAN_READ_FACTOR', 1e6), \
+                patch.object(app, 'PLAN_CHUNKED_READ_FACTOR', 1e6), \
+                patch.object(app, 'DEADLINE_SEGMENT_BYTES', self.size // 3 + 1), \
+                patch.object(app, 'idempotency_mode', 'off'), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb', return_value={}):
+            app.lambda_handler(event, context)
+            second = fake_lambda.queue.pop(0)
+            # The second step hands over, then is delivered again: its checkpoint is still there
+            self.assertEqual(app.lambda_handler(second, context)['statusCode'], 202)
+            self.assertTrue(all(key in fake_s3.objects for key in second['resume']['checkpoint'].values()))
+            replay = app.lambda_handler(second, context)
+            self.assertEqual(json.loads(replay['body'])['message'], 'Step already continued')
+            self.assertEqual(len(fake_lambda.queue), 1)
+
+            # The last step loads its checkpoint, then drops the one before it
+            last = fake_lambda.queue.pop(0)
+            self.assertEqual(app.lambda_handler(last, context)['statusCode'], 200)
+            self.assertFalse(fake_lambda.queue)
+        self.assertFalse([key for key in fake_s3.objects if key.startswith(app.resume_prefix)])
+        print("✓ Replayed resume steps are no-ops and keep the chain's checkpoints")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Tests for the DeepAR JSON Lines written by the pipeline
+
+Every line must be the dense, zero-filled daily series the notebook would
+train on, with the test channel holding the whole series and the train
+channel the series without its last prediction_length days.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import json
+import shutil
+import tempfile
+import os
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    deepar_lines,
+    new_deepar_encoders,
+    save_deepar_dataset,
+    prepare_product_forecast_data,
+    extract_temporal_features
+)
+
+
+def generate_orders(n_rows, seed=8):
+    """Order lines spread over a few months with gaps between order days"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 6, n_rows),
+        'FacilityID': rng.integers(100, 102, n_rows),
+        'ProductID': rng.integers(1000, 1012, n_rows),
+        'ProductCategory': rng.choice(['Gloves', 'Gauze', 'Syringes'], n_rows),
+        'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 100, n_rows), unit='D'),
+        'OrderUnits': rng.integers(1, 20, n_rows)
+    })
+
+
+def reference_instance(group, end_date, prediction_length):
+    """Dense series of one item the slow way: reindex to every day and fill zeros"""
+    series = group.set_index('timestamp')['target_value'].astype(float)
+    days = pd.date_range(series.index.min(), max(series.index.max(), end_date), freq='D')
+    target = series.groupby(level=0).sum().reindex(days, fill_value=0.0)
+    day_of_week = [day / 6 for day in days.dayofweek]
+    month = [(m - 1) / 11 for m in days.month]
+    test = {'start': days[0].strftime('%Y-%m-%d'), 'target': target.tolist(),
+            'dynamic_feat': [day_of_week, month], 'item_id': group['item_id'].iloc[0]}
+    train = dict(test, target=test['target'][:-prediction_length],
+                 dynamic_feat=[day_of_week[:-prediction_length], month[:-prediction_length]])
+    return train, test
+
+
+class TestDeepARDataset(unittest.TestCase):
+    """JSON Lines match the per-item reference and split like DeepAR expects"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.df = extract_temporal_features(generate_orders(4000))
+        cls.forecast = prepare_product_forecast_data(cls.df)
+        cls.end_date = cls.forecast['timestamp'].max()
+
+    def test_lines_match_reference_series(self):
+        """Dense targets, dynamic features and the train/test split match the reference"""
+        encoders = new_deepar_encoders()
+        train_lines, test_lines, skipped = deepar_lines(self.forecast, encoders, self.end_date)
+        groups = dict(list(self.forecast.groupby('item_id')))
+
+        self.assertEqual(len(train_lines) + skipped, len(groups))
+        self.assertGreater(len(train_lines), 0)
+        for train_line, test_line in zip(train_lines, test_lines):
+            train, test = json.loads(train_line), json.loads(test_line)
+            expected_train, expected_test = reference_instance(groups[test['item_id']], self.end_date, 14)
+            for actual, expected in ((train, expected_train), (test, expected_test)):
+                self.assertEqual(actual['start'], expected['start'])
+                self.assertEqual(actual['target'], expected['target'])
+                np.testing.assert_allclose(actual['dynamic_feat'], expected['dynamic_feat'])
+            self.assertEqual(train['cat'], test['cat'])
+            self.assertEqual(len(test['target']), len(test['dynamic_feat'][0]))
+        print(f"✓ {len(train_lines)} DeepAR series match the reference ({skipped} skipped)")
+
+    def test_short_items_are_skipped(self):
+        """Items with less than context + prediction days of history are left out"""
+        recent = self.forecast[self.forecast['timestamp'] >= self.end_date - pd.Timedelta(days=30)]
+        train_lines, _, skipped = deepar_lines(recent, new_deepar_encoders(), self.end_date)
+        self.assertEqual(train_lines, [])
+        self.assertEqual(skipped, recent['item_id'].nunique())
+
+        _, test_lines, _ = deepar_lines(self.forecast, new_deepar_encoders(), self.end_date,
+                                        prediction_length=7, context_length=7)
+        self.assertTrue(all(len(json.loads(line)['target']) >= 14 for line in test_lines))
+
+    def test_categories_are_encoded_consistently(self):
+        """Codes are consecutive and stay the same across the parts of a stream"""
+        encoders = new_deepar_encoders()
+        items = self.forecast['item_id'].drop_duplicates()
+        halves = [self.forecast[self.forecast['item_id'].isin(part)] for part in np.array_split(items, 2)]
+        lines = [json.loads(line) for half in halves for line in deepar_lines(half, encoders, self.end_date)[1]]
+
+        decoded = {col: {code: value for value, code in encoders[col].items()} for col in app.DEEPAR_CAT_COLUMNS}
+        heads = self.forecast.groupby('item_id').first()
+        for line in lines:
+            for col, code in zip(app.DEEPAR_CAT_COLUMNS, line['cat']):
+                self.assertEqual(decoded[col][code], str(heads.loc[line['item_id'], col]))
+        for col in app.DEEPAR_CAT_COLUMNS:
+            self.assertEqual(sorted(encoders[col].values()), list(range(len(encoders[col]))))
+
+    def test_handler_writes_deepar_channels(self):
+        """The handler uploads train, test and metadata next to the forecast data"""
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        orders = generate_orders(4000)
+        orders['CreateDate'] = orders['CreateDate'].dt.strftime('%m/%d/%Y')
+        orders.to_csv(handle.name, index=False)
+
+        class UploadS3:
+            objects = {}
+
+            def download_file(self, bucket, key, local_path):
+                shutil.copy(handle.name, local_path)
+
+            def put_object(self, Bucket, Key, Body):
+                self.objects[Key] = Body
+
+        fake_s3 = UploadS3()
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': 'raw/orders.csv'}}}]}
+        try:
+            with patch.object(app, 's3_client', fake_s3), \
+                    patch.object(app, 'save_lookup_tables_to_dynamodb'):
+                response = app.lambda_handler(event, None)
+        finally:
+            os.remove(handle.name)
+
+        body = json.loads(response['body'])
+        train_key = body['deepar_train_location'].split('/', 3)[3]
+        test_key = body['deepar_test_location'].split('/', 3)[3]
+        train = fake_s3.objects[train_key].decode().splitlines()
+        test = fake_s3.objects[test_key].decode().splitlines()
+        metadata = json.loads(fake_s3.objects[train_key.rsplit('/', 2)[0] + '/metadata.json'])
+
+        self.assertEqual(len(train), len(test))
+        self.assertEqual(metadata['series'], len(train))
+        self.assertEqual(metadata['cardinality'], [len(metadata['mappings'][col]) for col in app.DEEPAR_CAT_COLUMNS])
+        self.assertEqual(len(json.loads(test[0])['target']) - len(json.loads(train[0])['target']), 14)
+        print(f"✓ Handler wrote {len(train)} DeepAR series")
+
+    def test_empty_dataset_writes_nothing(self):
+        """Without a long enough item no objects are created"""
+        class RecordingS3:
+            objects = {}
+
+            def put_object(self, Bucket, Key, Body):
+                self.objects[Key] = Body
+
+        fake_s3 = RecordingS3()
+        with patch.object(app, 's3_client', fake_s3):
+            self.assertIsNone(save_deepar_dataset(iter([self.forecast.head(0)]), 'now'))
+        self.assertEqual(fake_s3.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Equivalence tests for the vectorized product demand pattern engine
+
+The reference implementation below is the original per-combination loop
+from the Lambda function. The vectorized engine must reproduce its output
+exactly (up to floating point rounding) for every series.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+from app import calculate_product_demand_patterns
+
+
+def reference_demand_patterns(df):
+    """Original iterrows-based implementation (copied from the Lambda function)
+
+    The trend is fitted against the order day rather than the original order
+    index.
+    """
+    if 'OrderUnits' in df.columns:
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'])['OrderUnits'].sum().reset_index(name='Quantity')
+    else:
+        product_daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date']).size().reset_index(name='Quantity')
+
+    product_cols = ['ProductID']
+    if 'ProductName' in df.columns:
+        product_cols.append('ProductName')
+    if 'CategoryName' in df.columns:
+        product_cols.append('CategoryName')
+    if 'VendorName' in df.columns:
+        product_cols.append('VendorName')
+
+    product_info = df[product_cols].drop_duplicates()
+    product_daily = product_daily.merge(product_info, on='ProductID', how='left')
+    unique_combinations = product_daily[['CustomerID', 'FacilityID', 'ProductID']].drop_duplicates()
+
+    product_features = []
+    for _, row in unique_combinations.iterrows():
+        group = product_daily[
+            (product_daily['CustomerID'] == row['CustomerID']) &
+            (product_daily['FacilityID'] == row['FacilityID']) &
+            (product_daily['ProductID'] == row['ProductID'])
+        ].sort_values('Date')
+        quantities = group['Quantity'].values
+        total_orders = len(quantities)
+        avg_quantity = np.mean(quantities)
+        std_quantity = np.std(quantities) if total_orders > 1 else 0
+        if total_orders > 1:
+            date_range = (pd.to_datetime(group['Date'].iloc[-1]) - pd.to_datetime(group['Date'].iloc[0])).days
+            avg_days_between_orders = date_range / (total_orders - 1)
+        else:
+            avg_days_between_orders = np.nan
+        order_days = (pd.to_datetime(group['Date']) - pd.to_datetime(group['Date'].iloc[0])).dt.days.to_numpy()
+        trend_slope = np.polyfit(order_days, quantities, 1)[0] if total_orders > 2 else 0
+        first_row = group.iloc[0]
+        product_features.append({
+            'CustomerID': row['CustomerID'],
+            'FacilityID': row['FacilityID'],
+            'ProductID': row['ProductID'],
+            'ProductName': first_row.get('ProductName', ''),
+            'CategoryName': first_row.get('CategoryName', ''),
+            'VendorName': first_row.get('VendorName', ''),
+            'TotalOrders': total_orders,
+            'AvgQuantity': avg_quantity,
+            'StdQuantity': std_quantity,
+            'MaxQuantity': np.max(quantities),
+            'MinQuantity': np.min(quantities),
+            'MedianQuantity': np.median(quantities),
+            'CoefficientOfVariation': std_quantity / avg_quantity if avg_quantity > 0 else 0,
+            'TrendSlope': trend_slope,
+            'AvgDaysBetweenOrders': avg_days_between_orders,
+            'FirstOrderDate': group['Date'].iloc[0],
+            'LastOrderDate': group['Date'].iloc[-1]
+        })
+    return pd.DataFrame(product_features)
+
+
+def generate_orders(n_rows, n_customers=5, n_facilities=3, n_products=40, seed=7):
+    """Generate random order lines with repeated days per series"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1000 + n_products, n_rows)
+    dates = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 120, n_rows), unit='D')
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 1 + n_customers, n_rows),
+        'FacilityID': rng.integers(100, 100 + n_facilities, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CategoryName': ['Category ' + str(p % 4) for p in product_ids],
+        'VendorName': ['Vendor ' + str(p % 7) for p in product_ids],
+        'CreateDate': dates,
+        'Date': dates.strftime('%Y-%m-%d'),
+        'OrderUnits': rng.integers(1, 20, n_rows).astype(float)
+    })
+
+
+class TestDemandPatternEngine(unittest.TestCase):
+    """Vectorized engine must match the original loop"""
+
+    def assert_frames_match(self, actual, expected):
+        # The reference loop predates the P10/P90 columns
+        expected = expected.drop(columns=['P10Quantity', 'P90Quantity'], errors='ignore')
+        self.assertEqual([col for col in actual.columns if col not in ('P10Quantity', 'P90Quantity')],
+                         list(expected.columns))
+        self.assertEqual(len(actual), len(expected))
+        for col in expected.columns:
+            with self.subTest(column=col):
+                if pd.api.types.is_float_dtype(expected[col]):
+                    np.testing.assert_allclose(actual[col].to_numpy(dtype=float),
+                                               expected[col].to_numpy(dtype=float),
+                                               rtol=1e-9, atol=1e-9, equal_nan=True)
+                else:
+                    self.assertEqual(actual[col].tolist(), expected[col].tolist())
+
+    def test_matches_reference_loop(self):
+        """All output columns match the original implementation"""
+        df = generate_orders(3000)
+        self.assert_frames_match(calculate_product_demand_patterns(df), reference_demand_patterns(df))
+        print("✓ Vectorized engine matches reference loop on 3000 rows")
+
+    def test_matches_reference_without_order_units(self):
+        """Counting order lines per day matches when OrderUnits is missing"""
+        df = generate_orders(800, seed=11).drop(columns=['OrderUnits'])
+        self.assert_frames_match(calculate_product_demand_patterns(df), reference_demand_patterns(df))
+        print("✓ Vectorized engine matches reference loop without OrderUnits")
+
+    def test_quantiles_match_numpy(self):
+        """P10/P90 daily quantities match np.quantile per series"""
+        df = generate_orders(2000, seed=21)
+        result = calculate_product_demand_patterns(df)
+        daily = df.groupby(['CustomerID', 'FacilityID', 'ProductID', 'Date'])['OrderUnits'].sum()
+        series = daily.groupby(level=[0, 1, 2])
+        np.testing.assert_allclose(result['P10Quantity'], series.quantile(0.1).to_numpy())
+        np.testing.assert_allclose(result['P90Quantity'], series.quantile(0.9).to_numpy())
+        print("✓ P10/P90 quantities match numpy")
+
+    def test_single_and_two_order_series(self):
+        """Short series use the same edge-case rules as the loop"""
+        df = generate_orders(6, n_customers=1, n_facilities=1, n_products=3, seed=3)
+        result = calculate_product_demand_patterns(df)
+        self.assert_frames_match(result, reference_demand_patterns(df))
+        self.assertTrue((result.loc[result['TotalOrders'] <= 2, 'TrendSlope'] == 0).all())
+        print("✓ Short series edge cases match")
+
+    def test_max_products_limits_series(self):
+        """max_products keeps the first series in key order"""
+        df = generate_orders(500)
+        full = calculate_product_demand_patterns(df)
+        limited = calculate_product_demand_patterns(df, max_products=10)
+        self.assertEqual(len(limited), 10)
+        self.assert_frames_match(limited, full.head(10))
+        print("✓ max_products limit respected")
+
+    def test_empty_input(self):
+        """Empty input yields an empty frame"""
+        df = generate_orders(10).iloc[0:0]
+        self.assertTrue(calculate_product_demand_patterns(df).empty)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
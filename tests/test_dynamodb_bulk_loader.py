@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Tests for the parallel DynamoDB bulk loader used for the lookup tables
+
+Items built column-wise must equal the items the original iterrows loop
+wrote, and throttled writes must be retried until every item lands.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import threading
+from unittest.mock import patch
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.stub import Stubber
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    build_product_items,
+    build_customer_product_items,
+    bulk_write_items,
+    save_lookup_tables_to_dynamodb
+)
+
+
+class InMemoryDynamoDB:
+    """Local stand-in for the DynamoDB client's batch_write_item
+
+    Every throttle_every-th request leaves its second half unprocessed, and
+    keys in fail_keys are never accepted, like a permanently throttled
+    partition.
+    """
+
+    def __init__(self, throttle_every=0, fail_keys=()):
+        self.items = {}
+        self.throttle_every = throttle_every
+        self.fail_keys = set(fail_keys)
+        self.requests = 0
+        self.threads = set()
+        self.lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        assert len(requests) <= 25
+        keys = [request['PutRequest']['Item']['product_id']['S'] for request in requests]
+        assert len(set(keys)) == len(keys), 'duplicate keys in one batch'
+        with self.lock:
+            self.requests += 1
+            self.threads.add(threading.get_ident())
+            throttled = self.throttle_every and self.requests % self.throttle_every == 0
+        accepted = requests[:len(requests) // 2] if throttled and len(requests) > 1 else requests
+        unprocessed = [request for request in requests if request not in accepted]
+        deserializer = TypeDeserializer()
+        for request in accepted:
+            item = {name: deserializer.deserialize(value) for name, value in request['PutRequest']['Item'].items()}
+            if item['product_id'] in self.fail_keys:
+                unprocessed.append(request)
+                continue
+            with self.lock:
+                self.items[item['product_id']] = item
+        return {'UnprocessedItems': {table_name: unprocessed} if unprocessed else {}}
+
+
+def reference_items(product_lookup, customer_product_lookup):
+    """Items exactly as the original iterrows writer built them"""
+    items = {}
+    for _, row in product_lookup.drop_duplicates(subset=['ProductID']).iterrows():
+        items.setdefault(str(row['ProductID']), {
+            'product_id': str(row['ProductID']),
+            'record_type': 'PRODUCT',
+            'product_name': str(row['ProductName']),
+            'category_name': str(row['CategoryName']),
+            'vendor_name': str(row['vendorName'])
+        })
+    for _, row in customer_product_lookup.drop_duplicates(subset=['CustomerID', 'FacilityID', 'ProductID']).iterrows():
+        customer_facility_key = f"{row['CustomerID']}#{row['FacilityID']}"
+        key = f"{row['ProductID']}#{customer_facility_key}"
+        items.setdefault(key, {
+            'product_id': key,
+            'customer_facility': customer_facility_key,
+            'record_type': 'CUSTOMER_PRODUCT',
+            'customer_id': str(row['CustomerID']),
+            'facility_id': str(row['FacilityID']),
+            'base_product_id': str(row['ProductID']),
+            'product_name': str(row['ProductName']),
+            'category_name': str(row['CategoryName']),
+            'vendor_name': str(row['vendorName']),
+            'order_count': int(row['OrderCount']),
+            'first_order_date': row['FirstOrderDate'].isoformat(),
+            'last_order_date': row['LastOrderDate'].isoformat()
+        })
+    return items
+
+
+def generate_lookups(n_products=300, n_relationships=4000, seed=12):
+    """Lookup frames shaped like create_product_lookup_table's output"""
+    rng = np.random.default_rng(seed)
+    product_ids = np.arange(1000, 1000 + n_products)
+    product_lookup = pd.DataFrame({
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CategoryName': ['Category ' + str(p % 6) for p in product_ids],
+        'vendorName': ['Vendor ' + str(p % 9) for p in product_ids]
+    })
+    relationship_products = rng.choice(product_ids, n_relationships)
+    first = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 200, n_relationships), unit='D')
+    customer_product_lookup = pd.DataFrame({
+        'ProductID': relationship_products,
+        'ProductName': ['Product ' + str(p) for p in relationship_products],
+        'CategoryName': ['Category ' + str(p % 6) for p in relationship_products],
+        'vendorName': ['Vendor ' + str(p % 9) for p in relationship_products],
+        'CustomerID': rng.integers(1, 60, n_relationships),
+        'FacilityID': rng.integers(100, 104, n_relationships),
+        'OrderCount': rng.integers(1, 50, n_relationships),
+        'FirstOrderDate': first,
+        'LastOrderDate': first + pd.to_timedelta(rng.integers(0, 3600 * 24 * 30, n_relationships), unit='s')
+    })
+    return product_lookup, customer_product_lookup
+
+
+class TestDynamoDBBulkLoader(unittest.TestCase):
+    """Bulk loader must write exactly the original items, surviving throttling"""
+
+    def test_items_match_original_writer(self):
+        """Column-wise items equal the iterrows items, duplicates removed"""
+        product_lookup, customer_product_lookup = generate_lookups()
+        items = build_product_items(product_lookup) + build_customer_product_items(customer_product_lookup)
+        expected = reference_items(product_lookup, customer_product_lookup)
+
+        self.assertEqual(len(items), len(expected))
+        self.assertEqual({item['product_id']: item for item in items}, expected)
+        self.assertIsInstance(items[-1]['order_count'], int)
+        print(f"✓ {len(items)} column-wise items match the original writer")
+
+    def test_unprocessed_items_are_retried(self):
+        """Throttled batches are retried until every item is written"""
+        table = InMemoryDynamoDB(throttle_every=3)
+        product_lookup, customer_product_lookup = generate_lookups()
+        items = build_customer_product_items(customer_product_lookup)
+        with patch.object(app, 'dynamodb_client', table), patch.object(app, 'DYNAMODB_BASE_BACKOFF', 0.001):
+            report = bulk_write_items('lookup', items, writers=4)
+
+        self.assertEqual(report['written'], len(items))
+        self.assertEqual(report['failed'], 0)
+        self.assertGreater(report['retries'], 0)
+        self.assertEqual(len(table.items), len(items))
+        self.assertEqual(report['segments'], 4)
+        self.assertGreater(len(table.threads), 1)
+        print(f"✓ {report['retries']} retries wrote all {report['written']} items "
+              f"({report['items_per_second']} items/s)")
+
+    def test_permanent_failures_are_reported(self):
+        """Items that never get processed are counted, not swallowed"""
+        product_lookup, customer_product_lookup = generate_lookups(n_products=50, n_relationships=10)
+        fail_keys = {'1003', '1017'}
+        table = InMemoryDynamoDB(fail_keys=fail_keys)
+        with patch.object(app, 'dynamodb_client', table), \
+                patch.object(app, 'DYNAMODB_BASE_BACKOFF', 0.001), \
+                patch.object(app, 'dynamodb_max_retries', 3):
+            report = save_lookup_tables_to_dynamodb(product_lookup, customer_product_lookup)
+
+        self.assertEqual(report['PRODUCT']['failed'], 2)
+        self.assertEqual(report['PRODUCT']['written'], 48)
+        self.assertEqual(report['PRODUCT']['retries'], 3)
+        self.assertEqual(report['CUSTOMER_PRODUCT']['failed'], 0)
+        self.assertFalse(fail_keys & set(table.items))
+        print("✓ Permanent write failures are reported")
+
+    def test_build_errors_are_reported(self):
+        """A lookup missing columns is reported instead of raising"""
+        table = InMemoryDynamoDB()
+        with patch.object(app, 'dynamodb_client', table):
+            report = save_lookup_tables_to_dynamodb(pd.DataFrame({'ProductID': [1]}), pd.DataFrame())
+        self.assertIn('error', report)
+        self.assertEqual(table.items, {})
+
+    def test_items_are_sent_in_wire_format(self):
+        """Workers call the shared low-level client with typed attribute values"""
+        client = boto3.client('dynamodb', region_name='us-east-1')
+        items = [{'product_id': '1001', 'record_type': 'PRODUCT', 'order_count': 7}]
+        expected = {'RequestItems': {'lookup': [{'PutRequest': {'Item': {
+            'product_id': {'S': '1001'}, 'record_type': {'S': 'PRODUCT'}, 'order_count': {'N': '7'}}}}]}}
+        with Stubber(client) as stubber, patch.object(app, 'dynamodb_client', client):
+            stubber.add_response('batch_write_item', {'UnprocessedItems': {}}, expected)
+            report = bulk_write_items('lookup', items, writers=2)
+        self.assertEqual(report['written'], 1)
+        print("✓ Items are serialised for the thread-safe client")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
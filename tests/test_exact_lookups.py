@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Tests for the exact streaming lookup builder
+
+Lookups built chunk by chunk on the large-file path must equal the lookups
+create_product_lookup_table builds from the whole frame: every relationship,
+its true order count and its first and last order dates.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import tempfile
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    scan_orders,
+    read_orders,
+    resolve_read_plan,
+    extract_temporal_features,
+    create_product_lookup_table,
+    create_minimal_lookup_from_file,
+    new_lookup_accumulator,
+    lookup_series_frame
+)
+
+
+def write_order_file(path, n_rows, seed=29):
+    """Write a raw order file with missing customers, quantities and dates"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(900, 1100, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 300, n_rows).astype(float),
+        'FacilityID': rng.integers(1, 12, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CategoryName': ['Category ' + str(p % 7) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 300, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 9, n_rows).astype(float)
+    })
+    frame.loc[rng.integers(0, n_rows, 50), 'OrderUnits'] = np.nan
+    frame.loc[rng.integers(0, n_rows, 20), 'CustomerID'] = np.nan
+    frame.loc[rng.integers(0, n_rows, 10), 'CreateDate'] = 'not a date'
+    frame['CustomerID'] = frame['CustomerID'].astype('Int64')
+    frame.to_csv(path, index=False)
+
+
+def normalized(frame, keys):
+    frame = app._plain_columns(frame.copy())
+    return frame.sort_values(keys, kind='mergesort').reset_index(drop=True)
+
+
+class TestExactLookups(unittest.TestCase):
+    """Streaming lookups equal the in-memory lookups"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        write_order_file(cls.path, 12000)
+        cls.read_plan = resolve_read_plan(cls.path)
+        df = extract_temporal_features(read_orders(cls.path, cls.read_plan))
+        cls.expected = create_product_lookup_table(df)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def assert_lookups_equal(self, actual):
+        product_lookup, customer_product_lookup = actual
+        expected_products, expected_relationships = self.expected
+        self.assertEqual(list(customer_product_lookup.columns), list(expected_relationships.columns))
+        pd.testing.assert_frame_equal(normalized(product_lookup, ['ProductID', 'ProductName']),
+                                      normalized(expected_products, ['ProductID', 'ProductName']),
+                                      check_dtype=False)
+        pd.testing.assert_frame_equal(normalized(customer_product_lookup, app.SERIES_KEY_COLUMNS),
+                                      normalized(expected_relationships, app.SERIES_KEY_COLUMNS),
+                                      check_dtype=False)
+
+    def test_scan_matches_in_memory_lookup(self):
+        """Serial and parallel scans give every relationship with its true count and dates"""
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                self.assert_lookups_equal(scan_orders(self.path, ['lookups'], 700, self.read_plan,
+                                                      workers=workers)['lookups'])
+        self.assert_lookups_equal(create_minimal_lookup_from_file(self.path, self.read_plan))
+        print(f"✓ Streaming lookups match {len(self.expected[1])} in-memory relationships")
+
+    def test_series_spanning_chunks_accumulate(self):
+        """Counts add up and dates widen when one series appears in many chunks"""
+        chunk = pd.DataFrame({
+            'CustomerID': pd.Categorical(['C1', 'C1', 'C2']),
+            'FacilityID': [1, 1, 1],
+            'ProductID': [7, 7, 7],
+            'CreateDate': pd.to_datetime(['2024-03-01', '2024-03-05', 'NaT']),
+            'OrderUnits': [1.0, np.nan, 2.0]
+        })
+        later = chunk.assign(CreateDate=pd.to_datetime(['2024-02-01', '2024-04-01', '2024-01-01']),
+                             CustomerID=pd.Categorical(['C2', 'C1', 'C3']), OrderUnits=[1.0, 3.0, 2.0])
+        partial = app._collect_lookup_chunk(app._collect_lookup_chunk(None, chunk), later)
+        series = lookup_series_frame(partial).set_index('CustomerID')
+
+        self.assertEqual(series.loc['C1', 'OrderCount'], 1 + 1)
+        self.assertEqual(series.loc['C1', 'FirstOrderDate'], pd.Timestamp('2024-03-01'))
+        self.assertEqual(series.loc['C1', 'LastOrderDate'], pd.Timestamp('2024-04-01'))
+        self.assertEqual(series.loc['C2', 'FirstOrderDate'], pd.Timestamp('2024-02-01'))
+        self.assertEqual(series.loc['C2', 'OrderCount'], 2)
+        self.assertEqual(list(series.index), ['C1', 'C2', 'C3'])
+
+    def test_key_fields_widen_with_the_dictionaries(self):
+        """Columns with more than 2**21 distinct IDs re-pack the stored keys instead of failing"""
+        n_products = (1 << 21) + 5
+        first = pd.DataFrame({
+            'CustomerID': [1, 1, 2],
+            'FacilityID': [10, 10, 10],
+            'ProductID': [5, 6, 5],
+            'CreateDate': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03']),
+            'OrderUnits': [1.0, 1.0, 1.0]
+        })
+        wide = pd.DataFrame({
+            'CustomerID': np.full(n_products, 2),
+            'FacilityID': np.full(n_products, 11),
+            'ProductID': np.arange(n_products),
+            'CreateDate': pd.Timestamp('2024-02-01'),
+            'OrderUnits': 1.0
+        })
+        partial = app._collect_lookup_chunk(app._collect_lookup_chunk(None, first), wide)
+        self.assertGreater(partial['bits'][2], 21)
+        self.assertTrue((np.diff(partial['keys']) > 0).all())
+
+        series = lookup_series_frame(partial)
+        self.assertEqual(len(series), n_products + 3)
+        earlier = series[series['FacilityID'] == 10].set_index(['CustomerID', 'ProductID'])
+        self.assertEqual(earlier.loc[(1, 6), 'LastOrderDate'], pd.Timestamp('2024-01-02'))
+        self.assertEqual(earlier.loc[(2, 5), 'OrderCount'], 1)
+        self.assertEqual(series['ProductID'].max(), n_products - 1)
+        print("✓ Lookup keys widen past 2**21 distinct IDs")
+
+    def test_empty_accumulator_keeps_schema(self):
+        """Without rows the lookups are empty instead of placeholders"""
+        product_lookup, customer_product_lookup = app._combine_lookup_partials([new_lookup_accumulator()])
+        self.assertTrue(customer_product_lookup.empty)
+        self.assertEqual(list(customer_product_lookup.columns), list(self.expected[1].columns))
+        self.assertTrue(product_lookup.empty)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
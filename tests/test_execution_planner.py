@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tests for the memory-budget execution planner
+
+The plan must follow the sampled row width, the series count and the
+function's memory rather than the raw file size.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    plan_execution,
+    available_memory_mb,
+    estimate_distinct_series,
+    resolve_read_plan
+)
+
+
+class LambdaContext:
+    def __init__(self, memory_mb):
+        self.memory_limit_in_mb = str(memory_mb)
+
+
+def write_order_file(path, n_rows, n_products=40, extra_columns=0, seed=23):
+    """Write a raw order file, optionally padded with wide text columns"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1000 + n_products, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 10, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 120, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    })
+    for index in range(extra_columns):
+        frame[f'Note{index}'] = 'x' * 40
+    frame.to_csv(path, index=False)
+    return frame
+
+
+class TestExecutionPlanner(unittest.TestCase):
+    """Plans follow the memory budget and the sampled data"""
+
+    def setUp(self):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        self.path = handle.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def plan(self, memory_mb, file_mb=None):
+        read_plan = resolve_read_plan(self.path)
+        file_mb = file_mb or app.get_file_size_mb(self.path)
+        return plan_execution(self.path, file_mb, read_plan, LambdaContext(memory_mb))
+
+    def test_small_upload_runs_exactly_in_memory(self):
+        """A file fully covered by the sample is planned from its real size"""
+        frame = write_order_file(self.path, 3000)
+        plan = self.plan(3008, file_mb=500)
+
+        self.assertEqual(plan['strategy'], 'in_memory')
+        self.assertEqual(plan['stages'], {'features': 'exact', 'lookups': 'exact', 'forecasts': 'exact'})
+        self.assertTrue(plan['estimates']['sample_complete'])
+        self.assertEqual(plan['estimates']['rows'], len(frame))
+        self.assertEqual(plan['estimates']['series'],
+                         len(frame.groupby(['CustomerID', 'FacilityID', 'ProductID'])))
+        print(f"✓ Small upload planned in memory ({plan['estimates']['bytes_per_row']} bytes per row)")
+
+    def test_memory_budget_picks_strategy(self):
+        """The same upload is read whole, read in chunks or scanned as memory shrinks"""
+        write_order_file(self.path, 60000)
+        with patch.object(app, 'PLAN_SAMPLE_BYTES', 256 * 1024):
+            roomy = self.plan(3008)
+            # Enough memory for 2.5 frames: a chunked read fits, a whole-file read does not
+            tight_mb = (2.5 * roomy['estimates']['frame_mb'] + app.PLAN_RUNTIME_MB) / app.PLAN_MEMORY_FRACTION
+            strategies = [roomy['strategy'], self.plan(int(tight_mb))['strategy'], self.plan(128)['strategy']]
+            large = self.plan(3008, file_mb=4000)
+
+        self.assertEqual(strategies, ['in_memory', 'chunked_read', 'scan'])
+        self.assertEqual(large['strategy'], 'scan')
+        self.assertEqual(large['stages']['forecasts'], 'partitioned')
+        self.assertGreater(large['estimates']['rows'], 50 * 60000)
+        self.assertTrue(app.PLAN_MIN_CHUNK_ROWS <= large['chunk_rows'] <= app.PLAN_MAX_CHUNK_ROWS)
+        print(f"✓ Strategies by memory: {strategies}")
+
+    def test_wide_rows_get_smaller_chunks(self):
+        """Chunks are sized in bytes, so wider rows give fewer rows per chunk"""
+        write_order_file(self.path, 20000)
+        with patch.object(app, 'PLAN_SAMPLE_BYTES', 256 * 1024):
+            narrow = self.plan(1024, file_mb=2000)
+            write_order_file(self.path, 20000, extra_columns=6)
+            wide = self.plan(1024, file_mb=2000)
+        self.assertGreater(wide['estimates']['bytes_per_row'], narrow['estimates']['bytes_per_row'])
+        self.assertLess(wide['chunk_rows'], narrow['chunk_rows'])
+
+    def test_memory_comes_from_context(self):
+        """The context's memory limit wins over the environment and the default"""
+        self.assertEqual(available_memory_mb(LambdaContext(512)), 512)
+        with patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': '1769'}):
+            self.assertEqual(available_memory_mb({}), 1769)
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(available_memory_mb(None), app.PLAN_DEFAULT_MEMORY_MB)
+
+    def test_distinct_series_estimate(self):
+        """Repeated series are counted, singletons are scaled to the file"""
+        self.assertEqual(estimate_distinct_series([5, 3, 2], 1000), 3)
+        self.assertEqual(estimate_distinct_series([1] * 100, 10000), 1000)
+        self.assertEqual(estimate_distinct_series([1] * 100, 100), 100)
+
+    def test_handler_scans_when_memory_is_tight(self):
+        """With little memory the handler takes the single-pass path"""
+        write_order_file(self.path, 40000)
+
+        class UploadOnlyS3:
+            def download_file(inner, bucket, key, local_path):
+                shutil.copy(self.path, local_path)
+
+            def put_object(inner, Bucket, Key, Body):
+                pass
+
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': 'raw/planned_orders.csv'}}}]}
+        with patch.object(app, 's3_client', UploadOnlyS3()), \
+                patch.object(app, 'PLAN_SAMPLE_BYTES', 128 * 1024), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb'), \
+                patch.object(app, 'scan_orders', wraps=app.scan_orders) as scan_orders:
+            response = app.lambda_handler(event, LambdaContext(128))
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(json.loads(response['body'])['message'], 'Successfully processed 40000 records')
+        self.assertEqual(list(scan_orders.call_args[0][1]),
+                         ['series_state', 'lookups', 'order_stats', 'product_info', 'forecast_spill'])
+        print("✓ Handler scans the upload under a tight memory budget")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
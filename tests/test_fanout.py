@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Tests for the fan-out map/reduce over byte ranges of an upload
+
+Byte ranges must split the order lines exactly, and merging the partial
+states of the map tasks must give the outputs of a single pass.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import tempfile
+from unittest.mock import patch
+
+import boto3
+from botocore.stub import Stubber
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    plan_byte_ranges,
+    open_order_range,
+    read_orders,
+    summarize_order_range,
+    run_fanout_locally,
+    empty_incremental_state,
+    fold_orders_into_state,
+    build_outputs_from_state
+)
+
+
+def write_order_file(path, n_rows, seed=12):
+    """Write a raw order file with product names that change over time"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1040, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 12, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': [f'Product {p} v{v}' for p, v in zip(product_ids, rng.integers(1, 3, n_rows))],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 120, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    })
+    frame.to_csv(path, index=False)
+    return frame
+
+
+def single_pass_outputs(path):
+    state = empty_incremental_state()
+    fold_orders_into_state(path, state)
+    return build_outputs_from_state(state)
+
+
+class FanoutS3:
+    """In-memory stand-in for the S3 calls of a fanned-out run"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    class PreconditionFailed(Exception):
+        response = {'Error': {'Code': 'PreconditionFailed'}}
+
+    def __init__(self, uploads):
+        self.objects = dict(uploads)
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[Key]), 'ETag': '"etag"'}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        data = self.objects[Key]
+        if Range:
+            start, end = Range.split('=')[1].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': FakeBody(data)}
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if IfNoneMatch == '*' and Key in self.objects:
+            raise self.PreconditionFailed(Key)
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else bytes(Body)
+
+    def upload_file(self, local_path, bucket, key):
+        with open(local_path, 'rb') as handle:
+            self.objects[key] = handle.read()
+
+    def download_file(self, bucket, key, local_path):
+        with open(local_path, 'wb') as handle:
+            handle.write(self.objects[key])
+
+    def list_objects_v2(self, Bucket, Prefix):
+        keys = [key for key in self.objects if key.startswith(Prefix)]
+        return {'KeyCount': len(keys), 'Contents': [{'Key': key} for key in keys]}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+class QueueLambda:
+    """Records asynchronous invocations instead of running them"""
+
+    def __init__(self):
+        self.queue = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.queue.append(json.loads(Payload))
+
+
+class TestFanout(unittest.TestCase):
+    """Map/reduce over byte ranges matches a single pass"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        cls.frame = write_order_file(cls.path, 5000)
+        cls.size = os.path.getsize(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def assert_outputs_equal(self, actual, expected):
+        """Same rows in each output frame (merged states list series in first-seen order)"""
+        for actual_frame, expected_frame in zip(actual, expected):
+            keys = [col for col in ['item_id', 'timestamp', 'CustomerID', 'FacilityID', 'ProductID']
+                    if col in expected_frame.columns]
+            actual_frame, expected_frame = (frame.sort_values(keys, kind='mergesort').reset_index(drop=True)
+                                            for frame in (actual_frame, expected_frame))
+            pd.testing.assert_frame_equal(actual_frame, expected_frame, check_exact=False, rtol=1e-9,
+                                          check_dtype=False, check_categorical=False)
+
+    def test_byte_ranges_split_lines_exactly(self):
+        """Every line is read by exactly one range, wherever the boundaries fall"""
+        with open(self.path, 'rb') as handle:
+            line_starts = np.cumsum([len(line) for line in handle.readlines()])
+        for ranges in (plan_byte_ranges(self.size, 7),
+                       [(0, int(line_starts[10])), (int(line_starts[10]), int(line_starts[10]) + 1),
+                        (int(line_starts[10]) + 1, self.size)]):
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], self.size)
+            parts = []
+            for start, end in ranges:
+                reader = open_order_range(self.path, start, end)
+                try:
+                    parts.append(read_orders(reader))
+                finally:
+                    reader.close()
+            combined = pd.concat(parts, ignore_index=True)
+            self.assertEqual(len(combined), len(self.frame))
+            self.assertEqual(combined['ProductDescription'].astype(str).tolist(), self.frame['ProductName'].tolist())
+        print(f"✓ Byte ranges split {len(self.frame)} lines exactly")
+
+    def test_empty_range_gives_empty_delta(self):
+        """A range inside one line yields no rows"""
+        delta = summarize_order_range(self.path, 100, 101)
+        self.assertEqual(delta['rows'], 0)
+        self.assertTrue(delta['series_state'].empty)
+
+    def test_local_driver_matches_single_pass(self):
+        """The process-pool driver gives the single-pass outputs"""
+        outputs, rows = run_fanout_locally(self.path, parts=5, workers=2, chunk_rows=700)
+        self.assertEqual(rows, len(self.frame))
+        self.assert_outputs_equal(outputs, single_pass_outputs(self.path))
+        print(f"✓ Local map/reduce over 5 ranges matches a single pass ({len(outputs[0])} series)")
+
+    def test_lambda_fanout_runs_map_and_reduce(self):
+        """The coordinator dispatches map tasks, the last one starts the reduce"""
+        with open(self.path, 'rb') as handle:
+            fake_s3 = FanoutS3({'raw/big_orders.csv': handle.read()})
+        fake_lambda = QueueLambda()
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                     'object': {'key': 'raw/big_orders.csv', 'size': self.size}}}]}
+        with patch.object(app, 's3_client', fake_s3), \
+                patch.object(app, 'lambda_client', fake_lambda), \
+                patch.object(app, 'fanout_mode', 'lambda'), \
+                patch.object(app, 'fanout_min_mb', 0), \
+                patch.object(app, 'FANOUT_PART_BYTES', self.size // 4 + 1), \
+                patch.object(app, 'idempotency_mode', 'off'), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb', return_value={}):
+            response = app.lambda_handler(event, None)
+            self.assertEqual(response['statusCode'], 202)
+            self.assertEqual([task['fanout']['role'] for task in fake_lambda.queue], ['map'] * 4)
+
+            results = []
+            while fake_lambda.queue:
+                results.append(app.lambda_handler(fake_lambda.queue.pop(0), None))
+
+        body = json.loads(results[-1]['body'])
+        self.assertEqual(len(results), 5)
+        self.assertEqual(body['message'], f'Successfully processed {len(self.frame)} records')
+        features_key = body['product_features_location'].split('/', 3)[3]
+        features = pd.read_csv(pd.io.common.BytesIO(fake_s3.objects[features_key]))
+        self.assertEqual(len(features), len(single_pass_outputs(self.path)[0]))
+        self.assertFalse([key for key in fake_s3.objects if key.endswith('.parquet')])
+        print(f"✓ Lambda fan-out wrote {len(features)} product features from 4 map tasks")
+
+    def test_reduce_claim_with_pinned_client(self):
+        """The conditional claim is valid for the pinned botocore, and a lost race returns False"""
+        requirements = os.path.join(os.path.dirname(app.__file__), 'requirements.txt')
+        with open(requirements) as handle:
+            pins = dict(line.strip().split('==') for line in handle if '==' in line)
+        self.assertGreaterEqual(tuple(int(part) for part in pins['botocore'].split('.')[:2]), (1, 35))
+        self.assertEqual(pins['boto3'], pins['botocore'])
+
+        client = boto3.client('s3', region_name='us-east-1')
+        task = {'run_id': 'run-1', 'index': 3}
+        expected = {'Bucket': 'processed', 'Key': f"{app.fanout_prefix}/run-1/reduce.json",
+                    'Body': json.dumps({'claimed_by': 3}), 'IfNoneMatch': '*'}
+        with Stubber(client) as stubber, \
+                patch.object(app, 's3_client', client), \
+                patch.object(app, 'processed_bucket', 'processed'):
+            # Stubber validates the parameters against the installed service model
+            stubber.add_response('put_object', {}, expected)
+            stubber.add_client_error('put_object', 'PreconditionFailed', http_status_code=412,
+                                     expected_params=expected)
+            self.assertTrue(app._claim_fanout_reduce(task))
+            self.assertFalse(app._claim_fanout_reduce(task))
+        print(f"✓ Reduce claim validated against botocore {pins['botocore']}")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
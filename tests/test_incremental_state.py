@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental delta ingestion with persisted per-series state
+
+Folding files one at a time into the saved state must give the same
+features, lookups and forecast series as folding all of them at once,
+rewriting only the partitions an upload touches, and a fold that loses the
+manifest swap to another invocation must be merged again rather than lost.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    empty_incremental_state,
+    fold_orders_into_state,
+    build_outputs_from_state,
+    summarize_orders,
+    fold_delta_into_state,
+    mark_state_published,
+    state_output_parts
+)
+
+
+class FakeS3:
+    """In-memory stand-in for the parts of the S3 client the state code uses"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.before_manifest_put = None
+
+    def upload_file(self, local_path, bucket, key):
+        with open(local_path, 'rb') as handle:
+            self.objects[key] = handle.read()
+
+    def download_file(self, bucket, key, local_path):
+        if key not in self.objects:
+            raise self.exceptions.NoSuchKey(key)
+        with open(local_path, 'wb') as handle:
+            handle.write(self.objects[key])
+
+    def etag(self, key):
+        return '"' + hashlib.md5(self.objects[key]).hexdigest() + '"'
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        if Key.endswith('manifest.json') and self.before_manifest_put:
+            hook, self.before_manifest_put = self.before_manifest_put, None
+            hook()
+        if (IfNoneMatch == '*' and Key in self.objects) or (IfMatch and (Key not in self.objects or
+                                                                         self.etag(Key) != IfMatch)):
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'PutObject')
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else Body
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': FakeBody(self.objects[Key]), 'ETag': self.etag(Key)}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def generate_order_file(path, n_rows, start_day, seed, with_names=True):
+    """Write a raw order file in the upload format"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1030, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 4, n_rows),
+        'FacilityID': rng.integers(100, 102, n_rows),
+        'ProductID': product_ids,
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(start_day, start_day + 30, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 15, n_rows)
+    })
+    if with_names:
+        frame['ProductDescription'] = ['Item ' + str(p) for p in product_ids]
+    frame.to_csv(path, index=False)
+    return frame
+
+
+def s3_event(key, etag):
+    return {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': key, 'eTag': etag, 'size': 1}}}]}
+
+
+class TestIncrementalState(unittest.TestCase):
+    """State folding must be exact and idempotent"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.paths = []
+        for index, (start_day, seed, names) in enumerate([(0, 1, True), (20, 2, False), (45, 3, True)]):
+            path = os.path.join(self.workdir, f'orders_{index}.csv')
+            generate_order_file(path, 1500, start_day, seed, with_names=names)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def assert_outputs_equal(self, actual, expected):
+        for actual_frame, expected_frame in zip(actual, expected):
+            pd.testing.assert_frame_equal(actual_frame.reset_index(drop=True), expected_frame.reset_index(drop=True),
+                                          check_dtype=False, check_exact=False, rtol=1e-9)
+
+    def assert_state_matches(self, manifest, expected):
+        """The published outputs of a state match the single-pass outputs, up to row order"""
+        sort_keys = [app.SERIES_KEY_COLUMNS, ['ProductID'], ['CustomerID', 'FacilityID', 'ProductID'],
+                     ['item_id', 'timestamp'], ['item_id', 'timestamp']]
+        for output, expected_frame, keys in zip(state_output_parts(manifest), expected, sort_keys):
+            actual_frame = output if isinstance(output, pd.DataFrame) else pd.concat(list(output))
+            pd.testing.assert_frame_equal(actual_frame.sort_values(keys).reset_index(drop=True),
+                                          expected_frame.sort_values(keys).reset_index(drop=True),
+                                          check_dtype=False, check_exact=False, rtol=1e-9)
+
+    def fold(self, path, key):
+        delta = summarize_orders(path, chunk_rows=700)
+        folded = fold_delta_into_state(delta, {'key': key, 'etag': key})
+        mark_state_published({'key': key, 'etag': key})
+        return folded
+
+    def single_pass_outputs(self, paths):
+        combined_path = os.path.join(self.workdir, 'combined.csv')
+        pd.concat([pd.read_csv(path) for path in paths]).to_csv(combined_path, index=False)
+        single = empty_incremental_state()
+        fold_orders_into_state(combined_path, single, chunk_rows=1000)
+        return build_outputs_from_state(single)
+
+    def test_incremental_folds_match_single_pass(self):
+        """Saving and reloading state between files gives the same outputs as one pass"""
+        fake_s3 = FakeS3()
+        with patch.object(app, 's3_client', fake_s3):
+            for index, path in enumerate(self.paths):
+                folded = self.fold(path, f'orders_{index}.csv')
+            manifest = json.loads(fake_s3.objects['state/manifest.json'])
+            self.assert_state_matches(manifest, self.single_pass_outputs(self.paths))
+
+        self.assertEqual(manifest['total_rows'], 4500)
+        self.assertEqual(len(manifest['sources']), 3)
+        self.assertTrue(all(source['published'] for source in manifest['sources']))
+        self.assertEqual(manifest['generation'], folded['manifest']['generation'])
+        self.assertEqual(manifest['series'], len(self.single_pass_outputs(self.paths)[0]))
+        print("✓ Incremental folds match a single pass over all files")
+
+    def test_only_touched_partitions_are_rewritten(self):
+        """An upload from one customer rewrites its partition and carries the others forward"""
+        one_customer = os.path.join(self.workdir, 'one_customer.csv')
+        orders = pd.read_csv(self.paths[2])
+        orders[orders['CustomerID'] == 2].to_csv(one_customer, index=False)
+
+        fake_s3 = FakeS3()
+        with patch.object(app, 's3_client', fake_s3):
+            before = self.fold(self.paths[0], 'orders_0.csv')['manifest']
+            after = self.fold(one_customer, 'one_customer.csv')['manifest']
+            self.assert_state_matches(after, self.single_pass_outputs([self.paths[0], one_customer]))
+
+        parts = app.partition_by_customer(pd.DataFrame({'CustomerID': [2]}), after['partitions'])
+        touched = str(next(index for index, part in enumerate(parts) if not part.empty))
+        self.assertGreater(len(before['partition_tables']), 1)
+        for index, entry in after['partition_tables'].items():
+            if index == touched:
+                self.assertNotEqual(entry['tables'], before['partition_tables'][index]['tables'])
+            else:
+                self.assertEqual(entry, before['partition_tables'][index])
+        # Replaced tables stay readable for invocations still using the previous manifest
+        retired = [entry['key'] for entry in after['retired']]
+        self.assertEqual(set(retired), set(before['partition_tables'][touched]['tables'].values()) |
+                         set(before['tables'].values()))
+        self.assertTrue(all(key in fake_s3.objects for key in retired))
+        print("✓ Only the partitions an upload touches are rewritten")
+
+    def test_concurrent_fold_is_merged_again(self):
+        """A fold whose manifest swap loses to another invocation re-merges into the winner's state"""
+        fake_s3 = FakeS3()
+        with patch.object(app, 's3_client', fake_s3):
+            self.fold(self.paths[0], 'orders_0.csv')
+            # Another invocation commits orders_2 between this fold's load and its swap
+            fake_s3.before_manifest_put = lambda: self.fold(self.paths[2], 'orders_2.csv')
+            self.fold(self.paths[1], 'orders_1.csv')
+            manifest = json.loads(fake_s3.objects['state/manifest.json'])
+            self.assert_state_matches(manifest, self.single_pass_outputs(self.paths))
+
+        self.assertEqual(manifest['total_rows'], 4500)
+        self.assertEqual([source['key'] for source in manifest['sources']],
+                         ['orders_0.csv', 'orders_2.csv', 'orders_1.csv'])
+        # The losing attempt's tables are gone; every table left is referenced or retired
+        referenced = {key for entry in manifest['partition_tables'].values() for key in entry['tables'].values()}
+        referenced |= set(manifest['tables'].values()) | {entry['key'] for entry in manifest['retired']}
+        self.assertEqual({key for key in fake_s3.objects if key.endswith('.parquet')}, referenced)
+        print("✓ Concurrent folds are merged again instead of overwritten")
+
+    def test_retired_tables_are_deleted_later(self):
+        """Tables replaced more than STATE_RETAIN_SECONDS ago are deleted by the next fold"""
+        fake_s3 = FakeS3()
+        with patch.object(app, 's3_client', fake_s3), patch.object(app, 'STATE_RETAIN_SECONDS', -1):
+            self.fold(self.paths[0], 'orders_0.csv')
+            first_retired = [entry['key'] for entry in self.fold(self.paths[1], 'orders_1.csv')['manifest']['retired']]
+            manifest = self.fold(self.paths[2], 'orders_2.csv')['manifest']
+
+        self.assertTrue(first_retired)
+        self.assertFalse(any(key in fake_s3.objects for key in first_retired))
+        self.assertFalse(set(first_retired) & {entry['key'] for entry in manifest['retired']})
+        print("✓ Retired state tables are deleted by a later fold")
+
+    def test_unpartitioned_snapshot_is_migrated(self):
+        """A snapshot written before partitioning is split on the next fold"""
+        fake_s3 = FakeS3()
+        with patch.object(app, 's3_client', fake_s3):
+            legacy = empty_incremental_state()
+            fold_orders_into_state(self.paths[0], legacy)
+            tables = app.write_state_tables(legacy, 'state/legacy')
+            fake_s3.put_object(Bucket='processed', Key='state/manifest.json', Body=json.dumps(
+                {'generation': 'legacy', 'tables': tables, 'sources': [{'key': 'orders_0.csv', 'etag': 'orders_0.csv'}],
+                 'total_rows': 1500}))
+            manifest = self.fold(self.paths[1], 'orders_1.csv')['manifest']
+            self.assert_state_matches(manifest, self.single_pass_outputs(self.paths[:2]))
+
+        self.assertEqual(manifest['total_rows'], 3000)
+        self.assertEqual({entry['key'] for entry in manifest['retired']} & set(tables.values()), set(tables.values()))
+        print("✓ Unpartitioned snapshots are migrated")
+
+    def test_product_names_survive_deltas_without_names(self):
+        """A later file without descriptions does not overwrite known product names"""
+        state = empty_incremental_state()
+        fold_orders_into_state(self.paths[0], state)
+        fold_orders_into_state(self.paths[1], state)
+        _, product_lookup, customer_product_lookup, _, _ = build_outputs_from_state(state)
+
+        self.assertTrue(product_lookup['ProductName'].str.startswith('Item ').all())
+        self.assertEqual(customer_product_lookup['OrderCount'].sum(), 3000)
+
+    def test_handler_folds_each_upload_once(self):
+        """The handler folds new uploads and skips redelivered events"""
+        fake_s3 = FakeS3()
+        sources = {f'raw/orders_{index}.csv': path for index, path in enumerate(self.paths[:2])}
+
+        def download(bucket, key, local_path):
+            if bucket == 'raw':
+                shutil.copy(sources[key], local_path)
+            else:
+                FakeS3.download_file(fake_s3, bucket, key, local_path)
+
+        fake_s3.download_file = download
+        with patch.object(app, 's3_client', fake_s3), \
+                patch.object(app, 'incremental_mode', True), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb'):
+            first = app.lambda_handler(s3_event('raw/orders_0.csv', 'a'), None)
+            second = app.lambda_handler(s3_event('raw/orders_1.csv', 'b'), None)
+            repeat = app.lambda_handler(s3_event('raw/orders_1.csv', 'b'), None)
+
+        self.assertEqual(first['statusCode'], 200)
+        self.assertEqual(json.loads(second['body'])['message'], 'Successfully processed 1500 records')
+        self.assertIn('already processed', json.loads(repeat['body'])['message'])
+
+        manifest = json.loads(fake_s3.objects['state/manifest.json'])
+        self.assertEqual(manifest['total_rows'], 3000)
+        self.assertEqual([source['key'] for source in manifest['sources']], list(sources))
+        print("✓ Handler folds each upload into the state exactly once")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
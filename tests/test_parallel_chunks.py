@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests for the process-based parallel chunk executor
+
+Partitioning by CustomerID means worker results are only concatenated, so
+the parallel paths must give exactly the serial results.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    partition_by_customer,
+    plan_chunk_workers,
+    split_large_file_and_process,
+    process_large_file_in_chunks
+)
+
+
+def write_order_file(path, n_rows, seed=31):
+    """Write a raw order file with string and integer customer IDs"""
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({
+        'Customer_ID': rng.integers(1, 40, n_rows),
+        'Facility ID': rng.integers(100, 104, n_rows),
+        'ProductID': rng.integers(1000, 1060, n_rows),
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 180, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    })
+    frame.to_csv(path, index=False)
+    return frame
+
+
+class TestParallelChunks(unittest.TestCase):
+    """Parallel chunk execution must match the serial path"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        write_order_file(cls.path, 6000)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_partitions_are_disjoint_and_complete(self):
+        """Each customer lands in exactly one partition, whatever the ID dtype"""
+        chunk = pd.DataFrame({'CustomerID': [1, 2, 3, 4, 5, 6, 7, 8] * 3})
+        parts = partition_by_customer(chunk, 3)
+        self.assertEqual(sum(len(part) for part in parts), len(chunk))
+        owners = {}
+        for index, part in enumerate(parts):
+            for customer in part['CustomerID'].unique():
+                self.assertNotIn(customer, owners)
+                owners[customer] = index
+
+        as_strings = partition_by_customer(chunk.astype(str), 3)
+        for index, part in enumerate(as_strings):
+            self.assertTrue(all(owners[int(customer)] == index for customer in part['CustomerID']))
+        print("✓ CustomerID partitions are disjoint and dtype independent")
+
+    def test_split_processing_matches_serial(self):
+        """Series features from worker processes equal the serial fold"""
+        with patch.object(app, 'chunk_workers_setting', '1'):
+            serial = split_large_file_and_process(self.path, max_chunk_rows=700)
+        with patch.object(app, 'chunk_workers_setting', '3'):
+            parallel = split_large_file_and_process(self.path, max_chunk_rows=700)
+
+        pd.testing.assert_frame_equal(parallel, serial, check_exact=False, rtol=1e-9)
+        print("✓ Parallel split processing matches serial result")
+
+    def test_chunked_frame_matches_serial(self):
+        """Parsed frames come back in the original row order"""
+        with patch.object(app, 'chunk_workers_setting', '1'):
+            serial = process_large_file_in_chunks(self.path, chunk_size=900)
+        with patch.object(app, 'chunk_workers_setting', '3'):
+            parallel = process_large_file_in_chunks(self.path, chunk_size=900)
+
+        pd.testing.assert_frame_equal(parallel, serial)
+        print("✓ Parallel chunked frame matches serial result")
+
+    def test_worker_plan_respects_memory(self):
+        """Worker count is capped by the function's memory size"""
+        with patch.object(app, 'chunk_workers_setting', 'auto'), \
+                patch.object(app.os, 'sched_getaffinity', return_value=set(range(6))), \
+                patch.dict(os.environ, {'AWS_LAMBDA_FUNCTION_MEMORY_SIZE': '3008'}):
+            self.assertEqual(plan_chunk_workers(30000), 6)
+            self.assertEqual(plan_chunk_workers(1000000), 1)
+        with patch.object(app, 'chunk_workers_setting', '4'):
+            self.assertEqual(plan_chunk_workers(30000), 4)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
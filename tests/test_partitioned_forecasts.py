@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tests for the partitioned forecast builders used for large uploads
+
+Forecast rows built partition by partition from the spilled daily rows must
+be exactly the rows the in-memory builders produce for the whole file.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    new_forecast_spill,
+    release_forecast_spill,
+    spill_forecast_frame,
+    iter_product_forecast_parts,
+    iter_customer_forecast_parts,
+    write_output_parts,
+    prepare_product_forecast_data,
+    prepare_customer_level_forecast_data,
+    summarize_product_info,
+    extract_temporal_features,
+    read_orders,
+    scan_orders
+)
+
+
+def write_order_file(path, n_rows, seed=31):
+    """Write a raw order file with a few missing quantities and products"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1030, n_rows).astype(float)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 15, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(int(p)) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 90, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows).astype(float)
+    })
+    frame.loc[rng.integers(0, n_rows, 25), 'OrderUnits'] = np.nan
+    frame.loc[rng.integers(0, n_rows, 10), 'ProductID'] = np.nan
+    frame['ProductID'] = frame['ProductID'].astype('Int64')
+    frame.to_csv(path, index=False)
+
+
+def concat_sorted(parts):
+    frame = pd.concat(list(parts), ignore_index=True)
+    return frame.sort_values(['item_id', 'timestamp'], kind='mergesort').reset_index(drop=True)
+
+
+class TestPartitionedForecasts(unittest.TestCase):
+    """Partitioned forecast data matches the in-memory builders"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        write_order_file(cls.path, 6000)
+        cls.df = extract_temporal_features(read_orders(cls.path))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def assert_matches_in_memory(self, product_parts, customer_parts):
+        product = concat_sorted(product_parts)
+        customer = concat_sorted(customer_parts)
+        expected_product = prepare_product_forecast_data(self.df)
+        expected_customer = prepare_customer_level_forecast_data(self.df)
+        for actual, expected in ((product, expected_product), (customer, expected_customer)):
+            self.assertEqual(list(actual.columns), list(expected.columns))
+            for col in expected.columns:
+                pd.testing.assert_series_equal(actual[col].astype(str), expected[col].astype(str))
+
+    def test_scan_partitions_match_in_memory_builders(self):
+        """Serial and parallel scans give the in-memory forecast rows"""
+        for workers in (1, 2):
+            spill = new_forecast_spill(5)
+            scan = scan_orders(self.path, {'forecast_spill': spill, 'product_info': None}, 700, workers=workers)
+            try:
+                self.assert_matches_in_memory(iter_product_forecast_parts(scan['forecast_spill'], scan['product_info']),
+                                              iter_customer_forecast_parts(scan['forecast_spill']))
+            finally:
+                release_forecast_spill(scan['forecast_spill'])
+            self.assertFalse(os.path.exists(spill['directory']))
+        print("✓ Partitioned forecast rows match the in-memory builders")
+
+    def test_items_stay_within_one_partition(self):
+        """Every item and every customer is written by exactly one partition"""
+        spill = spill_forecast_frame(self.df, 900, partitions=4)
+        try:
+            parts = list(iter_product_forecast_parts(spill, summarize_product_info(self.df)))
+            customer_parts = list(iter_customer_forecast_parts(spill))
+        finally:
+            release_forecast_spill(spill)
+
+        self.assertGreater(len(parts), 1)
+        seen = set()
+        for part in parts:
+            customers = set(part['customer_id'])
+            self.assertFalse(customers & seen)
+            seen |= customers
+            self.assertTrue(part['item_id'].is_monotonic_increasing)
+        self.assertEqual(sum(len(part) for part in customer_parts),
+                         len(prepare_customer_level_forecast_data(self.df)))
+        print(f"✓ {len(parts)} partitions with disjoint customers")
+
+    def test_parts_serialise_as_one_artifact(self):
+        """CSV parts concatenate to one CSV; Parquet parts become one file"""
+        spill = spill_forecast_frame(self.df, 1000, partitions=3)
+        try:
+            parts = list(iter_customer_forecast_parts(spill))
+        finally:
+            release_forecast_spill(spill)
+
+        buffer = io.BytesIO()
+        self.assertEqual(write_output_parts(iter(parts), buffer, 'csv'), sum(len(part) for part in parts))
+        self.assertEqual(buffer.getvalue(), pd.concat(parts, ignore_index=True).to_csv(index=False).encode())
+
+        buffer = io.BytesIO()
+        write_output_parts(iter(parts), buffer, 'parquet')
+        restored = pd.read_parquet(io.BytesIO(buffer.getvalue()))
+        self.assertEqual(len(restored), sum(len(part) for part in parts))
+        self.assertEqual(write_output_parts(iter([]), io.BytesIO(), 'csv'), 0)
+
+    def test_handler_writes_forecasts_for_scanned_uploads(self):
+        """Uploads too big for memory get real forecast data instead of placeholders"""
+        class UploadS3:
+            def __init__(self):
+                self.objects = {}
+
+            def download_file(inner, bucket, key, local_path):
+                shutil.copy(self.path, local_path)
+
+            def put_object(inner, Bucket, Key, Body):
+                inner.objects[Key] = Body
+
+        class LambdaContext:
+            memory_limit_in_mb = '128'
+
+        fake_s3 = UploadS3()
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': 'raw/big_orders.csv'}}}]}
+        with patch.object(app, 's3_client', fake_s3), \
+                patch.object(app, 'PLAN_SAMPLE_BYTES', 64 * 1024), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb'), \
+                patch.object(app, 'FORECAST_SPILL_ROOT', tempfile.mkdtemp()) as spill_root:
+            response = app.lambda_handler(event, LambdaContext())
+
+        self.assertEqual(response['statusCode'], 200)
+        body = json.loads(response['body'])
+        product_key = body['product_forecast_location'].split('/', 3)[3]
+        forecast = pd.read_csv(io.BytesIO(fake_s3.objects[product_key]))
+        self.assertNotIn('PLACEHOLDER', set(forecast['item_id']))
+        self.assertEqual(len(forecast), len(prepare_product_forecast_data(self.df)))
+        self.assertEqual(os.listdir(spill_root), [])
+        shutil.rmtree(spill_root)
+        print(f"✓ Scanned upload wrote {len(forecast)} product forecast rows")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
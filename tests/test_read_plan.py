@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-file read plan (column pruning, categorical IDs, name mapping)
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import tempfile
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+from app import (
+    resolve_read_plan,
+    read_orders,
+    concat_order_chunks
+)
+
+
+def write_orders(frame):
+    """Write a frame to a temporary CSV and return its path"""
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+        frame.to_csv(handle.name, index=False)
+        return handle.name
+
+
+class TestReadPlan(unittest.TestCase):
+    """Files are read once with pruned columns and compact dtypes"""
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        n_rows = 3000
+        product_ids = rng.integers(1000, 1050, n_rows)
+        self.frame = pd.DataFrame({
+            'Customer_ID': ['CUST' + str(c) for c in rng.integers(1, 6, n_rows)],
+            'FacilityID': rng.integers(100, 103, n_rows),
+            'ProductID': product_ids,
+            'ProductName': ['Product ' + str(p) for p in product_ids],
+            'Price': rng.random(n_rows),
+            'Notes': ['free text'] * n_rows,
+            'CreateDate': ['1/2/2024'] * n_rows,
+            'Order Units': rng.integers(1, 20, n_rows)
+        })
+        self.path = write_orders(self.frame)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_plan_prunes_and_renames(self):
+        """Unused columns are skipped and variant headers map to canonical names"""
+        plan = resolve_read_plan(self.path)
+        self.assertNotIn('Price', plan['usecols'])
+        self.assertNotIn('Notes', plan['usecols'])
+        self.assertEqual(plan['rename']['Customer_ID'], 'CustomerID')
+        self.assertEqual(plan['rename']['ProductName'], 'ProductDescription')
+        self.assertEqual(plan['rename']['Order Units'], 'OrderUnits')
+        print("✓ Read plan prunes and renames columns")
+
+    def test_read_orders_types(self):
+        """IDs and names are categorical, numeric IDs keep their values, quantities are float"""
+        df = read_orders(self.path)
+        self.assertEqual(sorted(df.columns), sorted(['CustomerID', 'FacilityID', 'ProductID', 'ProductDescription',
+                                                     'CreateDate', 'OrderUnits']))
+        for col in ('CustomerID', 'FacilityID', 'ProductID', 'ProductDescription'):
+            self.assertIsInstance(df[col].dtype, pd.CategoricalDtype)
+        self.assertEqual(df['ProductID'].tolist(), self.frame['ProductID'].tolist())
+        self.assertEqual(df['OrderUnits'].dtype, np.float64)
+
+        raw_bytes = pd.read_csv(self.path).memory_usage(deep=True).sum()
+        self.assertLess(df.memory_usage(deep=True).sum(), raw_bytes / 2)
+        print("✓ Orders read with categorical IDs and float quantities")
+
+    def test_chunks_concatenate_as_categorical(self):
+        """Chunked reads concatenate back to the single read"""
+        chunks = list(read_orders(self.path, chunksize=700))
+        combined = concat_order_chunks(chunks, ignore_index=True)
+        self.assertIsInstance(combined['CustomerID'].dtype, pd.CategoricalDtype)
+        pd.testing.assert_frame_equal(combined, read_orders(self.path), check_categorical=False)
+        print("✓ Chunked reads concatenate as categoricals")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Tests for the per-run performance manifest
+
+Every invocation that writes outputs must leave processed/<timestamp>/run_manifest.json
+with the chosen strategy and the time, rows and memory of each stage, and the
+validation function must not try to validate it.
+"""
+
+import importlib.util
+import io
+import json
+import os
+import unittest
+from contextlib import ExitStack
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+FUNCTIONS_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+
+def load_function_module(function_name):
+    """Load a function's app.py under a unique module name"""
+    spec = importlib.util.spec_from_file_location(
+        f'{function_name}_app', os.path.join(FUNCTIONS_BASE, function_name, 'app.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+app = load_function_module('enhanced_feature_engineering')
+validation_app = load_function_module('data_validation')
+
+
+def order_csv(n_rows, seed=41):
+    """Raw order file bytes in the upload format"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1040, n_rows)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 7, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 90, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    }).to_csv(index=False).encode('utf-8')
+
+
+class ObjectS3:
+    """In-memory stand-in for one raw object and the processed bucket"""
+
+    def __init__(self, data):
+        self.data = data
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Range is None:
+            return {'Body': io.BytesIO(self.data)}
+        start, end = (int(value) for value in Range.replace('bytes=', '').split('-'))
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def download_file(self, bucket, key, local_path):
+        with open(local_path, 'wb') as handle:
+            handle.write(self.data)
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.uploads[Key] = Body
+
+
+def dynamodb_report(product_lookup, customer_product_lookup):
+    return {'PRODUCT': {'written': len(product_lookup), 'failed': 0},
+            'CUSTOMER_PRODUCT': {'written': len(customer_product_lookup), 'failed': 0}}
+
+
+class TestRunManifest(unittest.TestCase):
+    """Handler runs write a manifest of their stages"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = order_csv(3000)
+
+    def run_handler(self, **patches):
+        s3 = ObjectS3(self.data)
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                     'object': {'key': 'raw/orders.csv', 'size': len(self.data)}}}]}
+        patches = dict({'s3_client': s3, 'input_mode': 'download', 'idempotency_mode': 'off',
+                        'fanout_mode': 'off'}, **patches)
+        with ExitStack() as stack:
+            for name, value in patches.items():
+                stack.enter_context(patch.object(app, name, value))
+            stack.enter_context(patch.object(app, 'save_lookup_tables_to_dynamodb', side_effect=dynamodb_report))
+            response = app.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+        manifests = {key: json.loads(body) for key, body in s3.uploads.items() if key.endswith(app.RUN_MANIFEST_NAME)}
+        return json.loads(response['body']), manifests
+
+    def test_in_memory_run_records_every_stage(self):
+        """Download, parse, features, lookups, forecasts, uploads and the DynamoDB write are measured"""
+        body, manifests = self.run_handler()
+        self.assertEqual(len(manifests), 1)
+        key, manifest = next(iter(manifests.items()))
+        self.assertTrue(key.startswith('processed/'))
+        self.assertTrue(body['run_manifest_location'].endswith(key))
+        self.assertEqual(manifest['strategy'], 'in_memory')
+        self.assertEqual(manifest['source']['key'], 'raw/orders.csv')
+
+        stages = {stage['stage']: stage for stage in manifest['stages']}
+        for name in ('download', 'plan', 'parse', 'temporal_features', 'demand_patterns', 'lookups',
+                     'forecast_prep', 'upload', 'upload:product_features', 'dynamodb_write'):
+            self.assertIn(name, stages)
+            self.assertGreaterEqual(stages[name]['wall_seconds'], 0)
+            self.assertGreaterEqual(stages[name]['cpu_seconds'], 0)
+        self.assertEqual(stages['parse']['rows_out'], 3000)
+        self.assertEqual(stages['temporal_features']['rows_in'], 3000)
+        self.assertEqual(stages['dynamodb_write']['rows_out'], stages['dynamodb_write']['rows_in'])
+        self.assertEqual(stages['upload:product_lookup']['rows_out'], body['total_unique_products'])
+        self.assertGreater(stages['parse']['peak_rss_mb'], 0)
+        self.assertGreaterEqual(manifest['wall_seconds'], stages['parse']['wall_seconds'])
+        print("✓ In-memory run records every stage")
+
+    def test_scan_run_and_tracemalloc(self):
+        """Scan runs record their strategy, and tracemalloc peaks are added when enabled"""
+        _, manifests = self.run_handler(PLAN_READ_FACTOR=1e9, PLAN_CHUNKED_READ_FACTOR=1e9,
+                                        run_manifest_tracemalloc=True)
+        manifest = next(iter(manifests.values()))
+        self.assertEqual(manifest['strategy'], 'scan')
+        stages = {stage['stage']: stage for stage in manifest['stages']}
+        self.assertEqual(stages['parse']['rows_out'], 3000)
+        self.assertIn('demand_patterns', stages)
+        self.assertIn('tracemalloc_peak_mb', stages['parse'])
+        self.assertNotIn('temporal_features', stages)
+        self.assertFalse(app.tracemalloc.is_tracing())
+        print("✓ Scan run manifest recorded with tracemalloc peaks")
+
+    def test_disabled_manifest_and_failed_stage(self):
+        """RUN_MANIFEST off writes nothing, and a stage that raises is still recorded as failed"""
+        body, manifests = self.run_handler(run_manifest_enabled=False)
+        self.assertEqual(manifests, {})
+        self.assertNotIn('run_manifest_location', body)
+
+        manifest = app.RunManifest()
+        with self.assertRaises(ValueError):
+            with manifest.stage('parse', 10):
+                raise ValueError('bad chunk')
+        self.assertTrue(manifest.to_dict()['stages'][0]['failed'])
+        print("✓ Disabled manifests and failed stages handled")
+
+    def test_validation_skips_manifest(self):
+        """The validation function only reads data artifacts"""
+        self.assertTrue(validation_app.is_data_artifact('processed/2024/product_features.csv'))
+        self.assertTrue(validation_app.is_data_artifact('processed/2024/product_features.csv.gz'))
+        self.assertTrue(validation_app.is_data_artifact('processed/2024/product_features.parquet'))
+        self.assertFalse(validation_app.is_data_artifact(f'processed/2024/{app.RUN_MANIFEST_NAME}'))
+
+        event = {'Records': [{'s3': {'bucket': {'name': 'processed'},
+                                     'object': {'key': f'processed/2024/{app.RUN_MANIFEST_NAME}'}}}]}
+        with patch.object(validation_app, 's3_client') as s3:
+            response = validation_app.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+        self.assertFalse(s3.get_object.called)
+        print("✓ Validation skips the run manifest")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
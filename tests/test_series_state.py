@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests for the mergeable per-series accumulator used by the chunked path
+
+Folding chunk states together must give exactly the features that a single
+in-memory pass over the whole file produces, however the rows are split.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import tempfile
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+from app import (
+    summarize_series_chunk,
+    merge_series_states,
+    finalize_series_state,
+    empty_series_state,
+    summarize_quantile_sketch,
+    merge_quantile_sketches,
+    empty_quantile_sketch,
+    sketch_quantiles,
+    calculate_product_demand_patterns_simple,
+    split_large_file_and_process
+)
+
+
+def generate_orders(n_rows, seed=5):
+    """Generate random order lines spread over many series and days"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 6, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': rng.integers(1000, 1080, n_rows),
+        'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 200, n_rows), unit='D'),
+        'OrderUnits': rng.integers(1, 25, n_rows).astype(float)
+    })
+
+
+class TestSeriesState(unittest.TestCase):
+    """Accumulator merge must be exact"""
+
+    def assert_features_equal(self, actual, expected):
+        self.assertEqual(list(actual.columns), list(expected.columns))
+        self.assertEqual(len(actual), len(expected))
+        for col in expected.columns:
+            with self.subTest(column=col):
+                if pd.api.types.is_float_dtype(expected[col]):
+                    np.testing.assert_allclose(actual[col].to_numpy(), expected[col].to_numpy(),
+                                               rtol=1e-9, atol=1e-12)
+                else:
+                    self.assertEqual(actual[col].tolist(), expected[col].tolist())
+
+    def test_chunk_fold_matches_full_pass(self):
+        """Folding shuffled chunks equals the in-memory simplified pass"""
+        df = generate_orders(12000)
+        expected = calculate_product_demand_patterns_simple(df)
+
+        shuffled = df.sample(frac=1.0, random_state=3)
+        state = empty_series_state()
+        sketch = empty_quantile_sketch()
+        for start in range(0, len(shuffled), 1700):
+            chunk = shuffled.iloc[start:start + 1700]
+            state = merge_series_states(state, summarize_series_chunk(chunk))
+            sketch = merge_quantile_sketches(sketch, summarize_quantile_sketch(chunk))
+
+        self.assert_features_equal(finalize_series_state(state, sketch), expected)
+        print("✓ Chunked accumulator matches full pass")
+
+    def test_statistics_match_pandas(self):
+        """Accumulated statistics agree with a direct pandas groupby"""
+        df = generate_orders(5000, seed=9)
+        features = calculate_product_demand_patterns_simple(df)
+        grouped = df.groupby(['CustomerID', 'FacilityID', 'ProductID'])['OrderUnits']
+
+        np.testing.assert_allclose(features['AvgQuantity'], grouped.mean().to_numpy())
+        np.testing.assert_allclose(features['StdQuantity'], grouped.std().fillna(0).to_numpy(), atol=1e-12)
+        np.testing.assert_array_equal(features['TotalOrders'], grouped.count().to_numpy())
+        print("✓ Accumulated statistics match pandas groupby")
+
+    def test_trend_slope_uses_order_days(self):
+        """Slope is the least-squares fit of quantity against order day"""
+        df = pd.DataFrame({
+            'CustomerID': [1] * 4,
+            'FacilityID': [10] * 4,
+            'ProductID': ['PROD001'] * 4,
+            'CreateDate': pd.to_datetime(['2024-01-01', '2024-01-03', '2024-01-07', '2024-01-09']),
+            'OrderUnits': [2.0, 4.0, 8.0, 10.0]
+        })
+        features = calculate_product_demand_patterns_simple(df)
+        self.assertAlmostEqual(features['TrendSlope'].iloc[0], 1.0)
+
+        # Same answer when the two halves arrive in separate chunks
+        state = merge_series_states(summarize_series_chunk(df.iloc[[3, 0]]), summarize_series_chunk(df.iloc[[1, 2]]))
+        self.assertAlmostEqual(finalize_series_state(state)['TrendSlope'].iloc[0], 1.0)
+        print("✓ Trend slope is mergeable")
+
+    def test_quantile_sketch_exact_for_integer_quantities(self):
+        """Sketches of low-cardinality quantities give exact quantiles after merging"""
+        df = generate_orders(9000, seed=17)
+        sketch = empty_quantile_sketch()
+        for start in range(0, len(df), 2000):
+            sketch = merge_quantile_sketches(sketch, summarize_quantile_sketch(df.iloc[start:start + 2000]))
+
+        estimates = sketch_quantiles(sketch, (0.1, 0.5, 0.9))
+        grouped = df.groupby(['CustomerID', 'FacilityID', 'ProductID'])['OrderUnits']
+        for q in (0.1, 0.5, 0.9):
+            with self.subTest(quantile=q):
+                np.testing.assert_allclose(estimates[q], grouped.quantile(q).to_numpy())
+
+        features = calculate_product_demand_patterns_simple(df)
+        np.testing.assert_allclose(features['MedianQuantity'], grouped.median().to_numpy())
+        print("✓ Quantile sketch exact for integer quantities")
+
+    def test_quantile_sketch_is_bounded(self):
+        """Continuous quantities are compressed to the centroid limit with small rank error"""
+        rng = np.random.default_rng(23)
+        df = generate_orders(20000, seed=23)
+        df['OrderUnits'] = rng.lognormal(2.0, 1.0, len(df))
+        sketch = empty_quantile_sketch()
+        for start in range(0, len(df), 4000):
+            chunk_sketch = summarize_quantile_sketch(df.iloc[start:start + 4000], max_centroids=20)
+            sketch = merge_quantile_sketches(sketch, chunk_sketch, max_centroids=20)
+
+        sizes = sketch.groupby(['CustomerID', 'FacilityID', 'ProductID']).size()
+        self.assertLessEqual(sizes.max(), 20)
+
+        medians = sketch_quantiles(sketch, (0.5,))
+        lines = df.merge(medians, on=['CustomerID', 'FacilityID', 'ProductID'])
+        below = (lines['OrderUnits'] < lines[0.5]).groupby([lines['CustomerID'], lines['FacilityID'], lines['ProductID']]).mean()
+        self.assertLess((below - 0.5).abs().max(), 0.1)
+        print(f"✓ Sketch bounded at {sizes.max()} centroids, max median rank error {(below - 0.5).abs().max():.3f}")
+
+    def test_split_file_processing(self):
+        """The >100 MB path on disk gives the same features as an in-memory pass"""
+        df = generate_orders(4000, seed=13)
+        raw = df.copy()
+        raw['CreateDate'] = raw['CreateDate'].dt.strftime('%m/%d/%Y')
+
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as handle:
+            raw.to_csv(handle.name, index=False)
+            path = handle.name
+        try:
+            result = split_large_file_and_process(path, max_chunk_rows=900)
+        finally:
+            os.remove(path)
+
+        self.assert_features_equal(result, calculate_product_demand_patterns_simple(df))
+        print("✓ Split file processing matches in-memory features")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-pass chunk reader and its consumers
+
+A scan must read and parse the upload exactly once and give every consumer
+the same answer it would get from its own pass over the file.
+"""
+
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    scan_orders,
+    resolve_read_plan,
+    split_large_file_and_process
+)
+
+
+def write_order_file(path, n_rows, seed=19):
+    """Write a raw order file with names, categories and a few missing quantities"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1040, n_rows)
+    frame = pd.DataFrame({
+        'CustomerID': rng.integers(1, 12, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CategoryName': ['Category ' + str(p % 5) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 150, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows).astype(float)
+    })
+    frame.loc[rng.integers(0, n_rows, 40), 'OrderUnits'] = np.nan
+    frame.to_csv(path, index=False)
+    return frame
+
+
+class TestSinglePassReader(unittest.TestCase):
+    """Every consumer is fed from one read of the file"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        cls.frame = write_order_file(cls.path, 5000)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_file_is_read_once_for_all_consumers(self):
+        """Features, lookups and statistics come from a single read"""
+        read_plan = resolve_read_plan(self.path)
+        with patch.object(app, 'read_orders', wraps=app.read_orders) as read_orders, \
+                patch.object(app, 'parse_create_dates', wraps=app.parse_create_dates) as parse_dates:
+            results = scan_orders(self.path, ['series_state', 'lookups', 'order_stats'], 800, read_plan)
+
+        self.assertEqual(read_orders.call_count, 1)
+        self.assertEqual(parse_dates.call_count, 7)  # once per chunk
+        self.assertEqual(set(results), {'series_state', 'lookups', 'order_stats'})
+        print("✓ One read and one date parse per chunk for three consumers")
+
+    def test_consumers_match_separate_passes(self):
+        """Each consumer's result equals its stand-alone pass"""
+        results = scan_orders(self.path, ['series_state', 'lookups', 'order_stats'], 800)
+
+        expected = split_large_file_and_process(self.path, max_chunk_rows=800)
+        actual = app.finalize_scanned_series(results['series_state'])
+        pd.testing.assert_frame_equal(actual, expected)
+
+        product_lookup, _ = results['lookups']
+        self.assertEqual(sorted(product_lookup['ProductID']), sorted(self.frame['ProductID'].unique()))
+
+        stats = results['order_stats']
+        self.assertEqual(stats['rows'], len(self.frame))
+        self.assertEqual(stats['null_counts']['OrderUnits'], int(self.frame['OrderUnits'].isna().sum()))
+        self.assertEqual(stats['first_date'], pd.to_datetime(self.frame['CreateDate']).min())
+        self.assertEqual(stats['last_date'], pd.to_datetime(self.frame['CreateDate']).max())
+        print("✓ Consumers match their separate passes")
+
+    def test_parallel_scan_matches_serial(self):
+        """Worker partials combine to the serial results"""
+        consumers = ['series_state', 'order_stats', 'daily_series']
+        serial = scan_orders(self.path, consumers, 700)
+        parallel = scan_orders(self.path, consumers, 700, workers=3)
+
+        for position in (0, 1):
+            pd.testing.assert_frame_equal(parallel['series_state'][position].sort_values(
+                                              list(parallel['series_state'][position].columns)).reset_index(drop=True),
+                                          serial['series_state'][position].sort_values(
+                                              list(serial['series_state'][position].columns)).reset_index(drop=True),
+                                          check_exact=False, rtol=1e-9)
+        self.assertEqual(parallel['order_stats'], serial['order_stats'])
+        pd.testing.assert_frame_equal(parallel['daily_series'], serial['daily_series'])
+        print("✓ Parallel scan matches serial scan")
+
+    def test_handler_reads_large_file_once(self):
+        """The >100 MB handler path reads the upload once and reports its row count"""
+        class UploadOnlyS3:
+            def download_file(self, bucket, key, local_path):
+                shutil.copy(TestSinglePassReader.path, local_path)
+
+            def put_object(self, Bucket, Key, Body):
+                pass
+
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': {'key': 'raw/big_orders.csv'}}}]}
+        with patch.object(app, 's3_client', UploadOnlyS3()), \
+                patch.object(app, 'get_file_size_mb', return_value=150.0), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb'), \
+                patch.object(app, 'read_orders', wraps=app.read_orders) as read_orders:
+            response = app.lambda_handler(event, None)
+
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual(read_orders.call_count, 1)
+        body = json.loads(response['body'])
+        self.assertEqual(body['message'], f'Successfully processed {len(self.frame)} records')
+        self.assertEqual(body['total_unique_products'], self.frame['ProductID'].nunique())
+        print("✓ Handler reads a very large upload once")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
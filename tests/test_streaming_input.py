@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Tests for parsing uploads straight from S3 byte ranges
+
+A streamed upload must give exactly the same frames and handler output as
+the same file downloaded to /tmp.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    S3RangeReader,
+    open_s3_input,
+    should_stream_input,
+    resolve_read_plan,
+    read_orders,
+    scan_orders
+)
+
+
+class RangeS3:
+    """In-memory stand-in answering ranged get_object calls for one object"""
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+        self.downloads = 0
+        self.uploads = {}
+
+    def get_object(self, Bucket, Key, Range=None):
+        start, end = (int(value) for value in Range.replace('bytes=', '').split('-'))
+        self.ranges.append((start, end))
+        return {'Body': FakeBody(self.data[start:end + 1])}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.data)}
+
+    def download_file(self, bucket, key, local_path):
+        self.downloads += 1
+        with open(local_path, 'wb') as handle:
+            handle.write(self.data)
+
+    def put_object(self, Bucket, Key, Body):
+        self.uploads[Key] = Body
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def write_order_file(path, n_rows, seed=8):
+    """Write a raw order file in the upload format"""
+    rng = np.random.default_rng(seed)
+    product_ids = rng.integers(1000, 1050, n_rows)
+    pd.DataFrame({
+        'CustomerID': rng.integers(1, 9, n_rows),
+        'FacilityID': rng.integers(100, 103, n_rows),
+        'ProductID': product_ids,
+        'ProductName': ['Product ' + str(p) for p in product_ids],
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 90, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 30, n_rows)
+    }).to_csv(path, index=False)
+
+
+class TestStreamingInput(unittest.TestCase):
+    """Streamed parsing must match parsing the downloaded file"""
+
+    @classmethod
+    def setUpClass(cls):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        handle.close()
+        cls.path = handle.name
+        write_order_file(cls.path, 4000)
+        with open(cls.path, 'rb') as source:
+            cls.data = source.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def test_range_reader_returns_object_bytes(self):
+        """Reads across part boundaries and seeks give the object's bytes"""
+        fake_s3 = RangeS3(self.data)
+        with patch.object(app, 's3_client', fake_s3):
+            reader = io.BufferedReader(S3RangeReader('raw', 'orders.csv', len(self.data),
+                                                     part_bytes=4096, prefetch_parts=3), buffer_size=1000)
+            self.assertEqual(reader.read(), self.data)
+            reader.seek(10000)
+            self.assertEqual(reader.read(5000), self.data[10000:15000])
+            reader.close()
+
+        parts = -(-len(self.data) // 4096)
+        self.assertTrue(all(end - start < 4096 for start, end in fake_s3.ranges))
+        self.assertEqual(sorted(set(fake_s3.ranges))[-1][1], len(self.data) - 1)
+        self.assertGreaterEqual(len(fake_s3.ranges), parts)
+        print(f"✓ Range reader matches object bytes over {parts} parts")
+
+    def test_release_closes_streams_and_warns_on_files(self):
+        """Releasing closes any stream and warns when a staged file cannot be removed"""
+        fake_s3 = RangeS3(self.data)
+        with patch.object(app, 's3_client', fake_s3), self.assertLogs(app.logger, 'INFO') as logs:
+            stream = io.BufferedReader(S3RangeReader('raw', 'orders.csv', len(self.data), part_bytes=4096))
+            stream.read(100)
+            app.release_order_input(stream)
+            other = io.BufferedReader(io.BytesIO(self.data))
+            app.release_order_input(other)
+            app.release_order_input(os.path.join(tempfile.gettempdir(), 'already-removed.csv'))
+
+        self.assertTrue(stream.closed and other.closed)
+        self.assertTrue(any('range requests' in line for line in logs.output))
+        self.assertTrue(any(line.startswith('WARNING') and 'already-removed.csv' in line for line in logs.output))
+        print("✓ Order inputs are released without hiding failures")
+
+    def test_streamed_frames_match_downloaded_file(self):
+        """Whole and chunked reads from the stream equal reads from disk"""
+        fake_s3 = RangeS3(self.data)
+        with patch.object(app, 's3_client', fake_s3), patch.object(app, 'STREAM_PART_BYTES', 8192):
+            stream = open_s3_input('raw', 'orders.csv', len(self.data))
+            plan = resolve_read_plan(stream)
+            self.assertEqual(plan, resolve_read_plan(self.path))
+            pd.testing.assert_frame_equal(read_orders(stream, plan), read_orders(self.path, plan))
+
+            streamed = scan_orders(stream, ['temporal_frame', 'order_stats'], 700, plan)
+            expected = scan_orders(self.path, ['temporal_frame', 'order_stats'], 700, plan)
+            stream.close()
+
+        pd.testing.assert_frame_equal(streamed['temporal_frame'], expected['temporal_frame'])
+        self.assertEqual(streamed['order_stats'], expected['order_stats'])
+        print("✓ Streamed frames match the downloaded file")
+
+    def test_auto_mode_streams_large_uploads(self):
+        """Auto mode streams above the threshold and when /tmp is too small"""
+        mb = 1024 * 1024
+        with patch.object(app, 'input_mode', 'auto'), patch.object(app, 'stream_threshold_mb', 50):
+            self.assertFalse(should_stream_input(10 * mb))
+            self.assertTrue(should_stream_input(80 * mb))
+            self.assertFalse(should_stream_input(None))
+            with patch.object(app.shutil, 'disk_usage', return_value=shutil._ntuple_diskusage(512 * mb, 500 * mb, 12 * mb)):
+                self.assertTrue(should_stream_input(10 * mb))
+        with patch.object(app, 'input_mode', 'download'):
+            self.assertFalse(should_stream_input(800 * mb))
+        print("✓ Auto mode picks streaming for large uploads")
+
+    def test_handler_streams_without_download(self):
+        """The handler gives the same response from a stream as from /tmp"""
+        event = {'Records': [{'s3': {'bucket': {'name': 'raw'},
+                                     'object': {'key': 'raw/orders.csv', 'size': len(self.data)}}}]}
+        responses = {}
+        for mode in ('download', 'stream'):
+            fake_s3 = RangeS3(self.data)
+            with patch.object(app, 's3_client', fake_s3), \
+                    patch.object(app, 'input_mode', mode), \
+                    patch.object(app, 'STREAM_PART_BYTES', 16384), \
+                    patch.object(app, 'save_lookup_tables_to_dynamodb'):
+                responses[mode] = app.lambda_handler(event, None)
+            self.assertEqual(fake_s3.downloads, 1 if mode == 'download' else 0)
+
+        self.assertEqual(responses['stream']['statusCode'], 200)
+        stream_body = json.loads(responses['stream']['body'])
+        download_body = json.loads(responses['download']['body'])
+        for field in ('message', 'total_unique_products', 'total_customer_product_combinations'):
+            self.assertEqual(stream_body[field], download_body[field])
+        print("✓ Handler processes a streamed upload without staging it")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests for the in-memory multipart artifact writer and concurrent saves
+
+Artifacts streamed to S3 must be byte-for-byte the files the old /tmp path
+uploaded, and all artifacts must upload at the same time.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import time
+import threading
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    S3MultipartWriter,
+    write_output_artifact,
+    save_output_artifacts
+)
+
+
+class MultipartS3:
+    """Thread-safe in-memory stand-in for put_object and multipart uploads"""
+
+    def __init__(self, delay=0.0, fail_part=None):
+        self.delay = delay
+        self.fail_part = fail_part
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def _enter(self):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+
+    def put_object(self, Bucket, Key, Body):
+        self._enter()
+        self.objects[Key] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f'upload-{len(self.uploads)}'
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._enter()
+        if PartNumber == self.fail_part:
+            raise IOError('part upload failed')
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'etag-{PartNumber}'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads[UploadId]
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts), numbers
+        self.objects[Key] = b''.join(parts[number] for number in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+
+
+def generate_artifact(n_rows, seed=2):
+    """A lookup-like frame with text, numbers and dates"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 500, n_rows),
+        'ProductID': ['PROD' + str(p) for p in rng.integers(1000, 9000, n_rows)],
+        'OrderCount': rng.integers(1, 100, n_rows),
+        'LastOrderDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 300, n_rows), unit='D')
+    })
+
+
+class TestStreamingUpload(unittest.TestCase):
+    """Streamed artifacts equal the files they replace"""
+
+    def test_small_artifact_uses_single_put(self):
+        """Artifacts below one part skip the multipart protocol"""
+        fake_s3 = MultipartS3()
+        frame = generate_artifact(50)
+        with patch.object(app, 's3_client', fake_s3):
+            writer = S3MultipartWriter('processed', 'lookup/a.csv', part_bytes=1024 * 1024)
+            write_output_artifact(frame, writer, 'csv')
+            writer.close()
+
+        self.assertEqual(fake_s3.objects['lookup/a.csv'], frame.to_csv(index=False).encode())
+        self.assertEqual(fake_s3.uploads, {})
+        print("✓ Small artifact uploaded with one put_object")
+
+    def test_multipart_parts_reassemble_artifact(self):
+        """Parts of a large CSV and Parquet artifact reassemble to the serialised bytes"""
+        fake_s3 = MultipartS3()
+        frame = generate_artifact(40000)
+        with patch.object(app, 's3_client', fake_s3):
+            csv_writer = S3MultipartWriter('processed', 'lookup/a.csv', part_bytes=64 * 1024)
+            write_output_artifact(frame, csv_writer, 'csv')
+            csv_writer.close()
+            parquet_writer = S3MultipartWriter('processed', 'lookup/a.parquet', part_bytes=64 * 1024)
+            write_output_artifact(frame, parquet_writer, 'parquet')
+            parquet_writer.close()
+
+        self.assertEqual(fake_s3.objects['lookup/a.csv'], frame.to_csv(index=False).encode())
+        self.assertGreater(csv_writer.parts_uploaded, 10)
+        restored = pd.read_parquet(io.BytesIO(fake_s3.objects['lookup/a.parquet']))
+        pd.testing.assert_frame_equal(restored, app.prepare_columnar_frame(frame), check_dtype=False)
+        print(f"✓ {csv_writer.parts_uploaded} CSV parts reassemble to the artifact")
+
+    def test_failed_part_aborts_upload(self):
+        """A failed part aborts the multipart upload and raises"""
+        fake_s3 = MultipartS3(fail_part=2)
+        with patch.object(app, 's3_client', fake_s3), patch.object(app, 'UPLOAD_PART_BYTES', 64 * 1024):
+            with self.assertRaises(IOError):
+                app.upload_output_artifact(generate_artifact(20000), 'product_lookup', 'lookup',
+                                           '2024-01-01-00-00-00', 'csv', 'Product lookup')
+        self.assertEqual(len(fake_s3.aborted), 1)
+        self.assertEqual(fake_s3.objects, {})
+        print("✓ Failed part aborts the upload")
+
+    def test_artifacts_upload_concurrently_with_report(self):
+        """All artifacts are in flight together and each gets a throughput report"""
+        fake_s3 = MultipartS3(delay=0.2)
+        artifacts = [(generate_artifact(200, seed=index), f'artifact_{index}', 'processed', f'Artifact {index}')
+                     for index in range(5)]
+        artifacts.append((pd.DataFrame(), 'empty', 'processed', 'Empty artifact'))
+
+        start = time.time()
+        with patch.object(app, 's3_client', fake_s3):
+            keys, report = save_output_artifacts(artifacts, '2024-01-01-00-00-00', 'csv')
+        elapsed = time.time() - start
+
+        self.assertEqual(fake_s3.max_active, 5)
+        self.assertLess(elapsed, 5 * 0.2)
+        self.assertIsNone(keys['empty'])
+        self.assertEqual(keys['artifact_3'], 'processed/2024-01-01-00-00-00/artifact_3.csv')
+        self.assertEqual(len(report), 5)
+        for entry in report:
+            self.assertEqual(entry['bytes'], len(fake_s3.objects[entry['key']]))
+            self.assertGreater(entry['mb_per_second'], 0)
+        print(f"✓ 5 artifacts uploaded concurrently in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
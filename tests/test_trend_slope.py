@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for the grouped trend slopes
+
+The least-squares slope from per-series sums must equal np.polyfit against
+the order day, and both it and the sampled Theil-Sen slope must give the
+same answer however the order lines are split into chunks.
+"""
+
+import itertools
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import (
+    ols_trend_slope,
+    trend_day_offsets,
+    summarize_series_chunk,
+    merge_series_states,
+    finalize_series_state,
+    summarize_trend_sample,
+    merge_trend_samples,
+    theil_sen_slopes,
+    calculate_product_demand_patterns,
+    calculate_product_demand_patterns_simple
+)
+
+
+def generate_orders(n_rows, n_products=30, seed=4):
+    """Order lines whose quantities drift upwards over a few months"""
+    rng = np.random.default_rng(seed)
+    days = rng.integers(0, 150, n_rows)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 4, n_rows),
+        'FacilityID': rng.integers(100, 102, n_rows),
+        'ProductID': rng.integers(1000, 1000 + n_products, n_rows),
+        'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(days, unit='D'),
+        'OrderUnits': (5 + 0.1 * days + rng.normal(0, 2, n_rows)).round(1)
+    })
+
+
+def reference_theil_sen(x, y):
+    """Median slope over every pair of points on different days"""
+    slopes = [(y[j] - y[i]) / (x[j] - x[i])
+              for i, j in itertools.combinations(range(len(x)), 2) if x[j] != x[i]]
+    return float(np.median(slopes)) if slopes else 0.0
+
+
+class TestTrendSlope(unittest.TestCase):
+    """Grouped slopes match per-series fits and merge across chunks"""
+
+    def test_ols_matches_polyfit_on_order_days(self):
+        """Slopes from the regression sums equal np.polyfit per series"""
+        df = generate_orders(3000)
+        features = finalize_series_state(summarize_series_chunk(df))
+        x = trend_day_offsets(df['CreateDate'])
+
+        for _, row in features.head(25).iterrows():
+            mask = ((df['CustomerID'] == row['CustomerID']) & (df['FacilityID'] == row['FacilityID']) &
+                    (df['ProductID'] == row['ProductID'])).to_numpy()
+            expected = np.polyfit(x[mask], df['OrderUnits'].to_numpy()[mask], 1)[0]
+            self.assertAlmostEqual(row['TrendSlope'], expected, places=9)
+        print("✓ Grouped least-squares slopes match np.polyfit")
+
+    def test_ols_degenerate_groups(self):
+        """Single points and single days give a zero slope"""
+        slope = ols_trend_slope([1, 3, 2], [9000.0, 27000.0, 18001.0], [4.0, 6.0, 3.0],
+                                [36000.0, 54000.0, 27002.0], [8.1e7, 2.43e8, 162018001.0])
+        np.testing.assert_allclose(slope, [0.0, 0.0, 1.0])
+
+    def test_chunked_slopes_match_single_pass(self):
+        """Folding chunk states and samples gives the single-pass slopes"""
+        df = generate_orders(4000, seed=9)
+        single = finalize_series_state(summarize_series_chunk(df), trend_sample=summarize_trend_sample(df))
+
+        chunks = np.array_split(df.sample(frac=1, random_state=3), 7)
+        state = merge_series_states(*[summarize_series_chunk(chunk) for chunk in chunks])
+        sample = merge_trend_samples(*[summarize_trend_sample(chunk) for chunk in chunks])
+        chunked = finalize_series_state(state, trend_sample=sample)
+
+        np.testing.assert_allclose(chunked['TrendSlope'], single['TrendSlope'], rtol=1e-9, atol=1e-12)
+        pd.testing.assert_frame_equal(sample, summarize_trend_sample(df))
+        print("✓ Chunked slopes match a single pass")
+
+    def test_theil_sen_is_exact_for_small_series(self):
+        """Series within the sample size get the exact Theil-Sen slope"""
+        df = generate_orders(400, n_products=40, seed=2)
+        slopes = theil_sen_slopes(summarize_trend_sample(df, sample_size=50))
+        x = trend_day_offsets(df['CreateDate'])
+
+        for _, row in slopes.iterrows():
+            mask = ((df['CustomerID'] == row['CustomerID']) & (df['FacilityID'] == row['FacilityID']) &
+                    (df['ProductID'] == row['ProductID'])).to_numpy()
+            self.assertLessEqual(mask.sum(), 50)
+            expected = reference_theil_sen(x[mask], df['OrderUnits'].to_numpy()[mask])
+            self.assertAlmostEqual(row['TrendSlope'], expected, places=9)
+        print(f"✓ Theil-Sen slopes exact for {len(slopes)} series")
+
+    def test_theil_sen_resists_outliers(self):
+        """A few huge orders move the least-squares slope but not Theil-Sen"""
+        days = np.arange(60)
+        quantity = 10 + 0.5 * days
+        quantity[[50, 55, 58]] = 900
+        df = pd.DataFrame({
+            'CustomerID': 1, 'FacilityID': 10, 'ProductID': 'PROD001',
+            'CreateDate': pd.Timestamp('2024-01-01') + pd.to_timedelta(days, unit='D'),
+            'OrderUnits': quantity
+        })
+
+        ols = calculate_product_demand_patterns_simple(df)['TrendSlope'].iloc[0]
+        with patch.object(app, 'trend_method', 'theil_sen'):
+            robust = calculate_product_demand_patterns_simple(df)['TrendSlope'].iloc[0]
+            daily = calculate_product_demand_patterns(df.assign(Date=df['CreateDate'].dt.date))['TrendSlope'].iloc[0]
+        self.assertGreater(ols, 3)
+        self.assertAlmostEqual(robust, 0.5, delta=0.05)
+        self.assertAlmostEqual(daily, 0.5, delta=0.05)
+        print(f"✓ Theil-Sen slope {robust:.2f} vs least squares {ols:.2f}")
+
+    def test_scan_uses_theil_sen_samples(self):
+        """The chunked file path carries the trend sample through the scan"""
+        df = generate_orders(3000, seed=6)
+        with patch.object(app, 'trend_method', 'theil_sen'):
+            partial = None
+            for chunk in np.array_split(df, 5):
+                partial = app._fold_series_chunk(partial, chunk)
+            features = app.finalize_scanned_series(partial)
+        expected = theil_sen_slopes(summarize_trend_sample(df))
+        np.testing.assert_allclose(features['TrendSlope'], expected['TrendSlope'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
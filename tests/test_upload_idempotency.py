@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Tests for skipping uploads whose content was already processed
+
+A re-upload with the same fingerprint must return the outputs of the first
+run without downloading or processing the file again.
+"""
+
+import io
+import unittest
+import pandas as pd
+import numpy as np
+import sys
+import os
+import json
+import tempfile
+from unittest.mock import patch
+
+# Add the function directory to the path
+sys.path.append('functions/enhanced_feature_engineering')
+import app
+from app import upload_fingerprint
+
+
+class RegistryS3:
+    """In-memory stand-in for the S3 calls of a feature-engineering run"""
+
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, uploads):
+        self.uploads = uploads
+        self.objects = {}
+        self.downloads = []
+
+    def download_file(self, bucket, key, local_path):
+        self.downloads.append(key)
+        with open(local_path, 'wb') as handle:
+            handle.write(self.uploads[key])
+
+    def head_object(self, Bucket, Key):
+        return {'ETag': '"head-etag"', 'ContentLength': len(self.uploads[Key])}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {'Body': FakeBody(self.objects[Key])}
+
+
+class FakeBody:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self):
+        return self.data
+
+
+def order_bytes(n_rows, seed):
+    """CSV bytes of a raw order extract"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'CustomerID': rng.integers(1, 5, n_rows),
+        'FacilityID': rng.integers(100, 102, n_rows),
+        'ProductID': rng.integers(1000, 1020, n_rows),
+        'CreateDate': (pd.Timestamp('2024-01-01') +
+                       pd.to_timedelta(rng.integers(0, 60, n_rows), unit='D')).strftime('%m/%d/%Y'),
+        'OrderUnits': rng.integers(1, 10, n_rows)
+    }).to_csv(index=False).encode()
+
+
+def s3_event(key, etag=None, size=None):
+    s3_object = {'key': key}
+    if etag is not None:
+        s3_object.update({'eTag': etag, 'size': size})
+    return {'Records': [{'s3': {'bucket': {'name': 'raw'}, 'object': s3_object}}]}
+
+
+class TestUploadIdempotency(unittest.TestCase):
+    """Duplicate content short-circuits to the registered outputs"""
+
+    def setUp(self):
+        extract = order_bytes(600, seed=1)
+        self.fake_s3 = RegistryS3({
+            'raw/monday.csv': extract,
+            'raw/monday_again.csv': extract,
+            'raw/tuesday.csv': order_bytes(600, seed=2)
+        })
+
+    def run_handler(self, event, mode='etag', dynamodb_report=None):
+        with patch.object(app, 's3_client', self.fake_s3), \
+                patch.object(app, 'idempotency_mode', mode), \
+                patch.object(app, 'input_mode', 'download'), \
+                patch.object(app, 'save_lookup_tables_to_dynamodb', return_value=dynamodb_report or {}):
+            response = app.lambda_handler(event, None)
+        self.assertEqual(response['statusCode'], 200)
+        return json.loads(response['body'])
+
+    def test_same_etag_returns_existing_outputs(self):
+        """A re-upload under another key reuses the first run's output locations"""
+        first = self.run_handler(s3_event('raw/monday.csv', '"abc"', 100))
+        second = self.run_handler(s3_event('raw/monday_again.csv', '"abc"', 100))
+
+        self.assertEqual(self.fake_s3.downloads, ['raw/monday.csv'])
+        self.assertEqual(second['duplicate_of'], 'raw/monday.csv')
+        self.assertIn('already processed', second['message'])
+        self.assertEqual(second['product_features_location'], first['product_features_location'])
+        self.assertEqual(second['total_unique_products'], first['total_unique_products'])
+        print("✓ Duplicate ETag returns the existing outputs without downloading")
+
+    def test_different_content_is_processed(self):
+        """A new ETag or size processes the upload"""
+        self.run_handler(s3_event('raw/monday.csv', '"abc"', 100))
+        third = self.run_handler(s3_event('raw/tuesday.csv', '"def"', 100))
+        fourth = self.run_handler(s3_event('raw/tuesday.csv', '"abc"', 101))
+
+        self.assertNotIn('duplicate_of', third)
+        self.assertNotIn('duplicate_of', fourth)
+        self.assertEqual(len(self.fake_s3.downloads), 3)
+
+    def test_content_mode_hashes_bytes(self):
+        """Content fingerprints match identical bytes whatever their ETag"""
+        self.run_handler(s3_event('raw/monday.csv', '"one"', 100), mode='content')
+        repeat = self.run_handler(s3_event('raw/monday_again.csv', '"two"', 100), mode='content')
+        other = self.run_handler(s3_event('raw/tuesday.csv', '"one"', 100), mode='content')
+
+        self.assertEqual(repeat['duplicate_of'], 'raw/monday.csv')
+        self.assertNotIn('duplicate_of', other)
+        print("✓ Content mode matches identical bytes")
+
+    def test_stream_and_file_hash_alike(self):
+        """Hashing a downloaded file or an S3 stream gives the same fingerprint"""
+        data = self.fake_s3.uploads['raw/monday.csv']
+        with tempfile.NamedTemporaryFile(suffix='.csv', delete=False) as handle:
+            handle.write(data)
+        try:
+            with patch.object(app, 'idempotency_mode', 'content'):
+                from_file = upload_fingerprint('raw', 'raw/monday.csv', {}, handle.name)
+                stream = io.BufferedReader(io.BytesIO(data))
+                stream.read(10)
+                from_stream = upload_fingerprint('raw', 'raw/monday.csv', {}, stream)
+                self.assertEqual(stream.tell(), 0)
+        finally:
+            os.remove(handle.name)
+        self.assertEqual(from_file, from_stream)
+
+    def test_missing_etag_uses_head_request(self):
+        """Events without an ETag fall back to a HEAD request"""
+        with patch.object(app, 's3_client', self.fake_s3), patch.object(app, 'idempotency_mode', 'etag'):
+            fingerprint = upload_fingerprint('raw', 'raw/monday.csv', {'key': 'raw/monday.csv'})
+        self.assertEqual(fingerprint, f"etag:head-etag:{len(self.fake_s3.uploads['raw/monday.csv'])}")
+
+    def test_failed_dynamodb_writes_are_not_registered(self):
+        """Runs with DynamoDB failures stay retryable by re-uploading"""
+        failed = {'PRODUCT': {'written': 1, 'failed': 2}}
+        self.run_handler(s3_event('raw/monday.csv', '"abc"', 100), dynamodb_report=failed)
+        repeat = self.run_handler(s3_event('raw/monday.csv', '"abc"', 100))
+        self.assertNotIn('duplicate_of', repeat)
+        self.assertEqual(len(self.fake_s3.downloads), 2)
+
+    def test_failed_scan_is_not_registered(self):
+        """A scan that fails leaves empty outputs, which must not be reused for re-uploads"""
+        with patch.object(app, 'PLAN_READ_FACTOR', 1e9), \
+                patch.object(app, 'PLAN_CHUNKED_READ_FACTOR', 1e9), \
+                patch.object(app, 'scan_orders', side_effect=OSError('connection reset')):
+            failed = self.run_handler(s3_event('raw/monday.csv', '"abc"', 100))
+        self.assertIn('connection reset', failed['processing_error'])
+        self.assertFalse(any(key.startswith('registry/') for key in self.fake_s3.objects))
+
+        repeat = self.run_handler(s3_event('raw/monday.csv', '"abc"', 100))
+        self.assertNotIn('duplicate_of', repeat)
+        self.assertEqual(len(self.fake_s3.downloads), 2)
+        print("✓ Failed scans stay retryable by re-uploading")
+
+    def test_off_mode_processes_every_upload(self):
+        """Idempotency can be switched off"""
+        self.run_handler(s3_event('raw/monday.csv', '"abc"', 100), mode='off')
+        repeat = self.run_handler(s3_event('raw/monday.csv', '"abc"', 100), mode='off')
+        self.assertNotIn('duplicate_of', repeat)
+        self.assertFalse(any(key.startswith('registry/') for key in self.fake_s3.objects))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)